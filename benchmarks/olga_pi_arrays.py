@@ -0,0 +1,151 @@
+"""
+Per-sequence latency of the OLGA Pi_V / Pi_J arrays, per-allele loop vs
+stacked tables.
+
+The per-allele reference is the original OLGA loop (one alignment and one
+Pi array per allele of the usage mask), restored here by overriding the
+stacked compute_Pi_* methods. Both paths are timed on the same productive
+CDR3s drawn from each model, and their Pgens are checked to agree.
+
+Usage
+-----
+    python -m benchmarks.olga_pi_arrays [n_seqs] [seed]   # from the repository root
+"""
+import sys
+import copy
+import timeit
+import numpy as np
+from tcrdist import pgen
+from tcrdist.olga import generation_probability, sequence_generation
+
+
+class PerAlleleVDJ(generation_probability.GenerationProbabilityVDJ):
+    """GenerationProbabilityVDJ building Pi_V and Pi_J_given_D allele by allele"""
+
+    def compute_Pi_V(self, CDR3_seq, V_usage_mask):
+        Pi_V = np.zeros((4, len(CDR3_seq)*3))
+        alignment_lengths = []
+        for V_in in V_usage_mask:
+            cutV_gen_seg = self.cutV_genomic_CDR3_segs[V_in]
+            current_alignment_length = self.max_nt_to_aa_alignment_left(CDR3_seq, cutV_gen_seg)
+            alignment_lengths += [current_alignment_length]
+            current_Pi_V = np.zeros((4, len(CDR3_seq)*3))
+            if current_alignment_length > 0:
+                current_Pi_V[:, :current_alignment_length] = self.PVdelV_nt_pos_vec[V_in][:, :current_alignment_length]
+                for pos in range(1, current_alignment_length, 3):
+                    current_Pi_V[:, pos] = self.PVdelV_2nd_nt_pos_per_aa_vec[V_in][CDR3_seq[pos//3]][:, pos]
+                Pi_V[:, :current_alignment_length] += current_Pi_V[:, :current_alignment_length]
+        return Pi_V, max(alignment_lengths)
+
+    def compute_Pi_J_given_D(self, CDR3_seq, J_usage_mask):
+        num_D_genes = self.PD_given_J.shape[0]
+        Pi_J_given_D = [np.zeros((4, len(CDR3_seq)*3)) for i in range(num_D_genes)]
+        alignment_lengths = []
+        for J_in in J_usage_mask:
+            cutJ_gen_seg = self.cutJ_genomic_CDR3_segs[J_in]
+            current_alignment_length = self.max_nt_to_aa_alignment_right(CDR3_seq, cutJ_gen_seg)
+            alignment_lengths += [current_alignment_length]
+            current_Pi_J = np.zeros((4, len(CDR3_seq)*3))
+            if current_alignment_length > 0:
+                current_Pi_J[:, -current_alignment_length:] = self.PJdelJ_nt_pos_vec[J_in][:, -current_alignment_length:]
+                for pos in range(-2, -current_alignment_length-1, -3):
+                    current_Pi_J[:, pos] = self.PJdelJ_2nd_nt_pos_per_aa_vec[J_in][CDR3_seq[pos//3]][:, pos]
+            for D_in, pd_given_j in enumerate(self.PD_given_J[:, J_in]):
+                Pi_J_given_D[D_in][:, -current_alignment_length:] += pd_given_j*current_Pi_J[:, -current_alignment_length:]
+        return Pi_J_given_D, max(alignment_lengths)
+
+
+class PerAlleleVJ(generation_probability.GenerationProbabilityVJ):
+    """GenerationProbabilityVJ building Pi_J and Pi_V_given_J allele by allele"""
+
+    def compute_Pi_V_given_J(self, CDR3_seq, V_usage_mask, J_usage_mask):
+        Pi_V_given_J = [np.zeros((4, len(CDR3_seq)*3)) for i in J_usage_mask]
+        alignment_lengths = []
+        for V_in in V_usage_mask:
+            cutV_gen_seg = self.cutV_genomic_CDR3_segs[V_in]
+            current_alignment_length = self.max_nt_to_aa_alignment_left(CDR3_seq, cutV_gen_seg)
+            alignment_lengths += [current_alignment_length]
+            current_Pi_V = np.zeros((4, len(CDR3_seq)*3))
+            if current_alignment_length > 0:
+                current_Pi_V[:, :current_alignment_length] = self.PVdelV_nt_pos_vec[V_in][:, :current_alignment_length]
+                for pos in range(1, current_alignment_length, 3):
+                    current_Pi_V[:, pos] = self.PVdelV_2nd_nt_pos_per_aa_vec[V_in][CDR3_seq[pos//3]][:, pos]
+                for j, J_in in enumerate(J_usage_mask):
+                    Pi_V_given_J[j][:, :current_alignment_length] += self.PVJ[V_in, J_in]*current_Pi_V[:, :current_alignment_length]
+        return Pi_V_given_J, max(alignment_lengths)
+
+    def compute_Pi_J(self, CDR3_seq, J_usage_mask):
+        Pi_J = []
+        r_J_usage_mask = []
+        for J_in in J_usage_mask:
+            cutJ_gen_seg = self.cutJ_genomic_CDR3_segs[J_in]
+            current_alignment_length = self.max_nt_to_aa_alignment_right(CDR3_seq, cutJ_gen_seg)
+            current_Pi_J = np.zeros((4, len(CDR3_seq)*3))
+            if current_alignment_length > 0:
+                current_Pi_J[:, -current_alignment_length:] = self.PJdelJ_nt_pos_vec[J_in][:, -current_alignment_length:]
+                for pos in range(-2, -current_alignment_length-1, -3):
+                    current_Pi_J[:, pos] = self.PJdelJ_2nd_nt_pos_per_aa_vec[J_in][CDR3_seq[pos//3]][:, pos]
+                if np.sum(current_Pi_J) > 0:
+                    Pi_J.append(current_Pi_J)
+                    r_J_usage_mask.append(J_in)
+        return Pi_J, r_J_usage_mask
+
+
+models = [('human_T_beta', 'VDJ', PerAlleleVDJ, sequence_generation.SequenceGenerationVDJ),
+          ('human_T_alpha', 'VJ', PerAlleleVJ, sequence_generation.SequenceGenerationVJ)]
+
+
+def _pi_arrays(m, recomb_type):
+    """the Pi_V / Pi_J part of compute_CDR3_pgen, with the default usage masks"""
+    if recomb_type == 'VDJ':
+        return lambda s: (m.compute_Pi_V(s, m.d_V_usage_mask),
+                          m.compute_Pi_J_given_D(s, m.d_J_usage_mask))
+    def f(s):
+        Pi_J, r_J_usage_mask = m.compute_Pi_J(s, m.d_J_usage_mask)
+        return Pi_J, m.compute_Pi_V_given_J(s, m.d_V_usage_mask, r_J_usage_mask)
+    return f
+
+
+def _ms_per_seq(f, cdr3s, repeat = 3):
+    """best of repeat passes over cdr3s, in ms per sequence"""
+    t = min(timeit.repeat(lambda: [f(s) for s in cdr3s], number = 1, repeat = repeat))
+    return 1000 * t / len(cdr3s)
+
+
+def benchmark(chain_folder, recomb_type, per_allele_class, seq_gen_class, n = 100, seed = 1):
+    """
+    Time the per-allele and stacked Pi arrays and Pgen of n CDR3s.
+
+    Returns
+    -------
+    timings : dict
+        ms per sequence, keyed by ('pi' | 'pgen', 'per_allele' | 'stacked').
+    """
+    olga_model = pgen.OlgaModel(chain_folder = chain_folder, recomb_type = recomb_type)
+    stacked = olga_model.pgen_model
+    per_allele = copy.copy(stacked)
+    per_allele.__class__ = per_allele_class
+    seq_gen = seq_gen_class(olga_model.generative_model, olga_model.genomic_data)
+    cdr3s = [x[1] for x in seq_gen.gen_rnd_prod_CDR3_batch(n, seed = seed)]
+
+    expected = [per_allele.compute_aa_CDR3_pgen(s) for s in cdr3s]
+    observed = [stacked.compute_aa_CDR3_pgen(s) for s in cdr3s]
+    assert np.allclose(observed, expected, rtol = 1e-9, atol = 0)
+
+    timings = {}
+    for name, m in [('per_allele', per_allele), ('stacked', stacked)]:
+        timings[('pi', name)] = _ms_per_seq(_pi_arrays(m, recomb_type), cdr3s)
+        timings[('pgen', name)] = _ms_per_seq(m.compute_aa_CDR3_pgen, cdr3s)
+    return timings
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    print('ms per sequence, default usage masks, {} CDR3s (per-allele -> stacked)'.format(n))
+    for chain_folder, recomb_type, per_allele_class, seq_gen_class in models:
+        t = benchmark(chain_folder, recomb_type, per_allele_class, seq_gen_class, n = n, seed = seed)
+        print('  {:<14} Pi arrays {:6.2f} -> {:5.2f}   Pgen {:6.1f} -> {:5.1f}'.format(
+            chain_folder,
+            t[('pi', 'per_allele')], t[('pi', 'stacked')],
+            t[('pgen', 'per_allele')], t[('pgen', 'stacked')]))
@@ -10,27 +10,69 @@ logging.basicConfig(filename='tcrdist.log',
 logger = logging.getLogger('__init__.py')
 logger.debug('Beginning package imports')
 
-#from . import processing
-from .hello import *
-from .processing import processNT, computeProbs, samplerProb
-from .tcr_sampler import alpha_cdr3_protseq_probability, beta_cdr3_protseq_probability
-from . import util # changed from utils to util to match tcrdist
-from . import plotting
-from .objects import TCRClone, TCRChain
-from . import datasets
-from . import distances
+import importlib
+import importlib.util
+import sys
+import types
+
+# Submodules are imported when first used (_LazyPackage.__getattr__ below),
+# so `import tcrdist` does not pay for matplotlib, seaborn, numba,
+# statsmodels or the reference db parsing unless they are needed.
+_lazy_attributes = {
+    'say_hello' : 'hello',
+    'processNT' : 'processing',
+    'computeProbs' : 'processing',
+    'samplerProb' : 'processing',
+    'alpha_cdr3_protseq_probability' : 'tcr_sampler',
+    'beta_cdr3_protseq_probability' : 'tcr_sampler',
+    'TCRClone' : 'objects',
+    'TCRChain' : 'objects',
+    'ParasailMatch' : 'sail',
+    'dna_reverse_complement' : 'sail',
+    'install_blast_to_externals' : 'setup_blast',
+    'SequencePair' : 'pairwise',
+    'apply_pairwise_distance' : 'pairwise',
+    'apply_pairwise_distance_multiprocessing' : 'pairwise',
+    'apply_pw_distance_metric_w_multiprocessing' : 'pairwise',
+    'distance_wrapper_old' : 'pairwise',
+    'flatten' : 'pairwise',
+    'function_factory' : 'pairwise',
+    'get_chunked_pwdist_indices' : 'pairwise',
+    'get_k_random_amino_acid_of_length_n' : 'pairwise',
+    'get_pwdist_indices' : 'pairwise',
+    'get_random_amino_acid' : 'pairwise',
+    'hm_metric' : 'pairwise',
+    'nw_metric' : 'pairwise',
+    'select_unique_sequences' : 'pairwise',
+    'tcrdist_cdr1_metric' : 'pairwise',
+    'tcrdist_cdr3_metric' : 'pairwise',
+    'unpack_dd_to_kkv' : 'pairwise',
+    'unpack_pooled_dd_to_kkv' : 'pairwise',
+}
+
+# the gene table itself is a LazyDict, built on first lookup
 from .all_genes import all_genes
-from .sail import *
-from .setup_blast import install_blast_to_externals
-from . import setup_db
-from . import install_test_files
-#from .test_resources import adaptive100
-from .pairwise import *
-from . import mappers
-from . import vis_tools
-from . import repertoire_db
-from . import stats
 
+class _LazyPackage(types.ModuleType):
+    """
+    Class of the tcrdist module: resolves the former re-exports and the
+    submodules on first attribute access (a module level __getattr__ needs
+    python 3.7)
+    """
+    def __getattr__(self, name):
+        if name in _lazy_attributes:
+            value = getattr(importlib.import_module('.' + _lazy_attributes[name], __name__), name)
+        elif not name.startswith('_') and importlib.util.find_spec('.' + name, __name__) is not None:
+            value = importlib.import_module('.' + name, __name__)
+        else:
+            raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_attributes) | set(__all__))
+
+sys.modules[__name__].__class__ = _LazyPackage
 
 # from . import embedding  (ImportError: libgfortran.so.1 on linux but not on windows, environmental diff?)
 
@@ -1,5 +1,4 @@
 import os.path as op
-import pandas as pd
 import logging
 
 from .amino_acids import amino_acids
@@ -7,171 +6,202 @@ from .blosum import blosum
 from .paths import path_to_db, db_file
 from . import translation
 from .objects import TCR_Gene
+from .db_cache import LazyDict
+from . import gene_snapshot
 
 logger = logging.getLogger('all_genes.py')
 
 gap_character = '.'
 
-all_genes = {}
-
 db_file = op.join(path_to_db, db_file)
 
 assert op.exists(db_file)
 
-dbDf = pd.read_csv(db_file, delimiter='\t')
-
-for rowi, row in dbDf.iterrows():
-    try:
-        g = TCR_Gene( row )
-    except:
-        print(row)
-        raise
-    if g.organism not in all_genes:
-        all_genes[g.organism] = {} # map from id to TCR_Gene objects
-    all_genes[g.organism][g.id] = g
-
-
-
-
-#####  WHAT IS THE CODE BELOW THIS POINT DOING??? 
-
-for organism, genes in list(all_genes.items()):
-
-    for ab in 'AB':
-        org_merged_loopseqs = {}
-        for id, g in list(genes.items()):
-            if g.chain == ab and g.region == 'V':
-                loopseqs = g.cdrs[:-1] ## exclude CDR3 Nterm
-                org_merged_loopseqs[id] = ' '.join( loopseqs )
-
-        all_loopseq_nbrs = {}
-        all_loopseq_nbrs_mm1 = {}
-        for id1, seq1 in list(org_merged_loopseqs.items()):
-            g1 = genes[id1]
-            cpos = g1.cdr_columns[-1][0] - 1 #0-indexed
-            alseq1 = g1.alseq
-            minlen = cpos+1
-            assert len(alseq1) >= minlen
-            if alseq1[cpos] != 'C':
-                logger.error('funny cpos: %s %s %s', id1, alseq1, g1.cdrs[-1])
-
-            all_loopseq_nbrs[id1] = []
-            all_loopseq_nbrs_mm1[id1] = []
-            for id2, seq2 in list(org_merged_loopseqs.items()):
-                g2 = genes[id2]
-                alseq2 = g2.alseq
-                assert len(alseq2) >= minlen
-                assert len(seq1) == len(seq2)
-                if seq1 == seq2:
-                    all_loopseq_nbrs[id1].append( id2 )
-                    all_loopseq_nbrs_mm1[id1].append( id2 )
-                    continue
-
-                ## count mismatches between these two, maybe count as an "_mm1" nbr
-                loop_mismatches = 0
-                loop_mismatches_cdrx = 0
-                loop_mismatch_seqs =[]
-                spaces=0
-                for a, b in zip( seq1, seq2):
-                    if a==' ':
-                        spaces+=1
+def _build_all_genes(db_path = db_file):
+    """
+    Parse a reference db file into TCR_Gene objects and assign the V and J
+    loop sequence representatives (rep, mm1_rep). This is the slow path run
+    once by gene_snapshot.compile_snapshot.
+
+    Parameters
+    ----------
+    db_path : string
+        path to the db file, by default paths.db_file
+
+    Returns
+    -------
+    all_genes : dict
+        maps organism to a dict from gene id to TCR_Gene
+    """
+    import pandas as pd
+    all_genes = {}
+
+    dbDf = pd.read_csv(db_path, delimiter='\t')
+
+    for rowi, row in dbDf.iterrows():
+        try:
+            g = TCR_Gene( row )
+        except:
+            print(row)
+            raise
+        if g.organism not in all_genes:
+            all_genes[g.organism] = {} # map from id to TCR_Gene objects
+        all_genes[g.organism][g.id] = g
+
+    #####  WHAT IS THE CODE BELOW THIS POINT DOING??? 
+
+    for organism, genes in list(all_genes.items()):
+
+        for ab in 'AB':
+            org_merged_loopseqs = {}
+            for id, g in list(genes.items()):
+                if g.chain == ab and g.region == 'V':
+                    loopseqs = g.cdrs[:-1] ## exclude CDR3 Nterm
+                    org_merged_loopseqs[id] = ' '.join( loopseqs )
+
+            all_loopseq_nbrs = {}
+            all_loopseq_nbrs_mm1 = {}
+            for id1, seq1 in list(org_merged_loopseqs.items()):
+                g1 = genes[id1]
+                cpos = g1.cdr_columns[-1][0] - 1 #0-indexed
+                alseq1 = g1.alseq
+                minlen = cpos+1
+                assert len(alseq1) >= minlen
+                if alseq1[cpos] != 'C':
+                    logger.error('funny cpos: %s %s %s', id1, alseq1, g1.cdrs[-1])
+
+                all_loopseq_nbrs[id1] = []
+                all_loopseq_nbrs_mm1[id1] = []
+                for id2, seq2 in list(org_merged_loopseqs.items()):
+                    g2 = genes[id2]
+                    alseq2 = g2.alseq
+                    assert len(alseq2) >= minlen
+                    assert len(seq1) == len(seq2)
+                    if seq1 == seq2:
+                        all_loopseq_nbrs[id1].append( id2 )
+                        all_loopseq_nbrs_mm1[id1].append( id2 )
                         continue
-                    if a!= b:
-                        if a in '*.' or b in '*.':
-                            loop_mismatches += 10
-                            break
-                        else:
-                            assert a in amino_acids and b in amino_acids
-                            if spaces<=1:
-                                loop_mismatches += 1
-                                loop_mismatch_seqs.append( ( a, b ) )
-                            else:
-                                assert spaces==2
-                                loop_mismatches_cdrx += 1
-                            if loop_mismatches>1:
-                                break
-                if loop_mismatches <=1:
-                    all_mismatches = 0
-                    for a, b in zip( alseq1[:cpos+2], alseq2[:cpos+2]):
+
+                    ## count mismatches between these two, maybe count as an "_mm1" nbr
+                    loop_mismatches = 0
+                    loop_mismatches_cdrx = 0
+                    loop_mismatch_seqs =[]
+                    spaces=0
+                    for a, b in zip( seq1, seq2):
+                        if a==' ':
+                            spaces+=1
+                            continue
                         if a!= b:
                             if a in '*.' or b in '*.':
-                                all_mismatches += 10
+                                loop_mismatches += 10
+                                break
                             else:
                                 assert a in amino_acids and b in amino_acids
-                                all_mismatches += 1
-                    #dist = tcr_distances.blosum_sequence_distance( seq1, seq2, gap_penalty=10 )
-                    if loop_mismatches<=1 and loop_mismatches + loop_mismatches_cdrx <= 2 and all_mismatches<=10:
-                        if loop_mismatches == 1:
-                            blscore= blosum[(loop_mismatch_seqs[0][0], loop_mismatch_seqs[0][1])]
-                        else:
-                            blscore = 100
-                        if blscore>=1:
-                            all_loopseq_nbrs_mm1[id1].append( id2 )
-                            if loop_mismatches>0:
-                                mmstring = ','.join(['%s/%s'%(x[0], x[1]) for x in loop_mismatch_seqs])
-                                gene1 = id1[:id1.index('*')]
-                                gene2 = id2[:id2.index('*')]
-                                if gene1 != gene2:
-                                    logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
-                                        loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq1)
-                                    logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
-                                        loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq2)
-
-
-        for id in all_loopseq_nbrs:
-            rep = min( all_loopseq_nbrs[id] )
-            assert org_merged_loopseqs[id] == org_merged_loopseqs[ rep ]
-            genes[id].rep = rep
-            logger.debug('vrep %s %15s %15s %s'%(organism, id, rep, org_merged_loopseqs[id]))
-
-
-        ## merge mm1 nbrs to guarantee transitivity
-        while True:
-            new_nbrs = False
-            for id1 in all_loopseq_nbrs_mm1:
-                new_id1_nbrs = False
-                for id2 in all_loopseq_nbrs_mm1[id1]:
-                    for id3 in all_loopseq_nbrs_mm1[id2]:
-                        if id3 not in all_loopseq_nbrs_mm1[id1]:
-                            all_loopseq_nbrs_mm1[id1].append( id3 )
-                            logger.debug('new_nbr: %s %s %s %s %s', id1, '<--->', id2, '<--->', id3)
-                            new_id1_nbrs = True
+                                if spaces<=1:
+                                    loop_mismatches += 1
+                                    loop_mismatch_seqs.append( ( a, b ) )
+                                else:
+                                    assert spaces==2
+                                    loop_mismatches_cdrx += 1
+                                if loop_mismatches>1:
+                                    break
+                    if loop_mismatches <=1:
+                        all_mismatches = 0
+                        for a, b in zip( alseq1[:cpos+2], alseq2[:cpos+2]):
+                            if a!= b:
+                                if a in '*.' or b in '*.':
+                                    all_mismatches += 10
+                                else:
+                                    assert a in amino_acids and b in amino_acids
+                                    all_mismatches += 1
+                        #dist = tcr_distances.blosum_sequence_distance( seq1, seq2, gap_penalty=10 )
+                        if loop_mismatches<=1 and loop_mismatches + loop_mismatches_cdrx <= 2 and all_mismatches<=10:
+                            if loop_mismatches == 1:
+                                blscore= blosum[(loop_mismatch_seqs[0][0], loop_mismatch_seqs[0][1])]
+                            else:
+                                blscore = 100
+                            if blscore>=1:
+                                all_loopseq_nbrs_mm1[id1].append( id2 )
+                                if loop_mismatches>0:
+                                    mmstring = ','.join(['%s/%s'%(x[0], x[1]) for x in loop_mismatch_seqs])
+                                    gene1 = id1[:id1.index('*')]
+                                    gene2 = id2[:id2.index('*')]
+                                    if gene1 != gene2:
+                                        logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
+                                            loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq1)
+                                        logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
+                                            loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq2)
+
+
+            for id in all_loopseq_nbrs:
+                rep = min( all_loopseq_nbrs[id] )
+                assert org_merged_loopseqs[id] == org_merged_loopseqs[ rep ]
+                genes[id].rep = rep
+                logger.debug('vrep %s %15s %15s %s'%(organism, id, rep, org_merged_loopseqs[id]))
+
+
+            ## merge mm1 nbrs to guarantee transitivity
+            while True:
+                new_nbrs = False
+                for id1 in all_loopseq_nbrs_mm1:
+                    new_id1_nbrs = False
+                    for id2 in all_loopseq_nbrs_mm1[id1]:
+                        for id3 in all_loopseq_nbrs_mm1[id2]:
+                            if id3 not in all_loopseq_nbrs_mm1[id1]:
+                                all_loopseq_nbrs_mm1[id1].append( id3 )
+                                logger.debug('new_nbr: %s %s %s %s %s', id1, '<--->', id2, '<--->', id3)
+                                new_id1_nbrs = True
+                                break
+                        if new_id1_nbrs:
                             break
                     if new_id1_nbrs:
-                        break
-                if new_id1_nbrs:
-                    new_nbrs = True
-            logger.debug('new_nbrs: %s, %s, %s', ab, organism, new_nbrs)
-            if not new_nbrs:
-                break
-
-        for id in all_loopseq_nbrs_mm1:
-            rep = min( all_loopseq_nbrs_mm1[id] )
-            genes[id].mm1_rep = rep
-            logger.debug('mm1vrep %s %15s %15s %s'%(organism, id, rep, org_merged_loopseqs[id]))
-
-
-    ## setup Jseq reps
-    for ab in 'AB':
-        jloopseqs = {}
-        for id, g in list(genes.items()):
-            if g.chain == ab and g.region == 'J':
-                num = len( g.cdrs[0].replace( gap_character, '' ) )
-                jloopseq = g.protseq[:num+3] ## go all the way up to and including the GXG
-                jloopseqs[id] = jloopseq
-        all_jloopseq_nbrs = {}
-        for id1, seq1 in list(jloopseqs.items()):
-            all_jloopseq_nbrs[id1] = []
-            for id2, seq2 in list(jloopseqs.items()):
-                if seq1 == seq2:
-                    all_jloopseq_nbrs[id1].append( id2 )
-        for id in all_jloopseq_nbrs:
-            rep = min( all_jloopseq_nbrs[id] )
-            genes[id].rep = rep
-            genes[id].mm1_rep = rep # just so we have an mm1_rep field defined...
-            assert jloopseqs[id] == jloopseqs[ rep ]
-            logger.debug('jrep %s %15s %15s %15s'%(organism, id, rep, jloopseqs[id]))
-
+                        new_nbrs = True
+                logger.debug('new_nbrs: %s, %s, %s', ab, organism, new_nbrs)
+                if not new_nbrs:
+                    break
+
+            for id in all_loopseq_nbrs_mm1:
+                rep = min( all_loopseq_nbrs_mm1[id] )
+                genes[id].mm1_rep = rep
+                logger.debug('mm1vrep %s %15s %15s %s'%(organism, id, rep, org_merged_loopseqs[id]))
+
+
+        ## setup Jseq reps
+        for ab in 'AB':
+            jloopseqs = {}
+            for id, g in list(genes.items()):
+                if g.chain == ab and g.region == 'J':
+                    num = len( g.cdrs[0].replace( gap_character, '' ) )
+                    jloopseq = g.protseq[:num+3] ## go all the way up to and including the GXG
+                    jloopseqs[id] = jloopseq
+            all_jloopseq_nbrs = {}
+            for id1, seq1 in list(jloopseqs.items()):
+                all_jloopseq_nbrs[id1] = []
+                for id2, seq2 in list(jloopseqs.items()):
+                    if seq1 == seq2:
+                        all_jloopseq_nbrs[id1].append( id2 )
+            for id in all_jloopseq_nbrs:
+                rep = min( all_jloopseq_nbrs[id] )
+                genes[id].rep = rep
+                genes[id].mm1_rep = rep # just so we have an mm1_rep field defined...
+                assert jloopseqs[id] == jloopseqs[ rep ]
+                logger.debug('jrep %s %15s %15s %15s'%(organism, id, rep, jloopseqs[id]))
+
+    return all_genes
+
+def _load_all_genes():
+    all_genes = {}
+    for row in gene_snapshot.gene_rows( op.basename(db_file) ):
+        g = TCR_Gene( row )
+        if row['rep']:
+            g.rep = row['rep']
+        if row['mm1_rep']:
+            g.mm1_rep = row['mm1_rep']
+        all_genes.setdefault( g.organism, {} )[g.id] = g
+    return all_genes
+
+## built on first access from the compiled db snapshot (see gene_snapshot)
+all_genes = LazyDict( _load_all_genes )
 
 
 def get_cdr3_and_j_match_counts( organism, ab, qseq, j_gene, min_min_j_matchlen = 3,
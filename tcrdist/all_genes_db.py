@@ -1,5 +1,4 @@
 import os.path as op
-import pandas as pd
 import logging
 
 from .amino_acids import amino_acids
@@ -7,6 +6,7 @@ from .blosum import blosum
 from .paths import path_to_db
 from . import translation
 from .objects import TCR_Gene
+from . import gene_snapshot
 
 logger = logging.getLogger('all_genes.py')
 
@@ -15,13 +15,10 @@ gap_character = '.'
 def all_genes_db(db_file = "gammadelta_db.tsv"):
     all_genes = {}
 
-    db_file = op.join(path_to_db, db_file)
+    assert op.exists(op.join(path_to_db, db_file))
 
-    assert op.exists(db_file)
-
-    dbDf = pd.read_csv(db_file, delimiter='\t')
-
-    for rowi, row in dbDf.iterrows():
+    # rows come from the compiled snapshot of the db (parsed and translated once)
+    for row in gene_snapshot.gene_rows(db_file):
         try:
             g = TCR_Gene( row )
         except:
@@ -3,6 +3,8 @@ import tempfile
 import logging
 import os
 import os.path as op
+import shutil
+import subprocess
 
 from .paths import path_to_db, path_to_blast_executables
 from .all_genes import all_genes
@@ -81,13 +83,123 @@ def get_blast_nucseq_database( organism, chain, region ):
     return fastafile
 
 
+def iter_blast_reports( blastfile ):
+    """
+    Stream a (multi-query) blastall report, yielding ( query_id, lines ) for
+    each query in the order they appear in the file
+
+    Parameters
+    ----------
+    blastfile : string
+        path of the report
+
+    Yields
+    ------
+    query_id : string
+    lines : list
+        the report lines of query_id, starting with its 'Query=' line
+    """
+    query_id, lines = None, []
+    with open( blastfile, 'r' ) as data:
+        for line in data:
+            if is_new_query_id_line( line ):
+                if query_id is not None:
+                    yield query_id, lines
+                query_id, lines = line.split()[1], []
+            if query_id is not None:
+                lines.append( line )
+    if query_id is not None:
+        yield query_id, lines
+
+def _run_blastall( fastafile, dbfile ):
+    """start blastall on fastafile, with the settings of parse_unpaired_dna_sequence_blastn"""
+    blastall_exe = path_to_blast_executables+'/blastall'
+    assert op.exists( blastall_exe )
+    cmd = [ blastall_exe, '-F', 'F', '-p', 'blastn', '-i', fastafile, '-d', dbfile,
+            '-v', '100', '-b', '1', '-o', fastafile+'.blast' ]
+    logger.debug('blast cmd: %s', ' '.join(cmd))
+    return subprocess.Popen( cmd )
+
+def blast_batch( organism, ab, blast_seqs, processes = 1, nocleanup = False ):
+    """
+    BLAST many sequences of one chain against the V and J databases with one
+    blastall run per region (per shard), instead of one per sequence and
+    region as parse_unpaired_dna_sequence_blastn() does
+
+    Parameters
+    ----------
+    organism : string
+        'human' or 'mouse'
+    ab : string
+        chain, 'A' or 'B'
+    blast_seqs : list
+        nucleotide sequences
+    processes : int
+        the queries are split into this many shards, BLASTed concurrently
+    nocleanup : bool
+        keep the FASTA and report files in ./tmp
+
+    Returns
+    -------
+    blast_hits : list
+        one entry per sequence, None for sequences of length <= 20 (which
+        parse_unpaired_dna_sequence_blastn() does not BLAST), otherwise
+        {'V': ( hits, hits_scores ), 'J': ( hits, hits_scores )} with hits
+        and hits_scores as returned by parse_blast_alignments() and
+        get_all_hits_with_evalues_and_scores() for the sequence alone (a
+        region is missing if the report has no entry for the sequence). Pass
+        an entry to parse_unpaired_dna_sequence_blastn( blast_hits = ).
+    """
+    evalue_threshold = 1e-1
+    identity_threshold = 20
+    blast_hits = [ None ] * len( blast_seqs )
+    queries = [ ( 'q{}'.format(i), seq ) for i, seq in enumerate( blast_seqs ) if len( seq ) > 20 ]
+    for query_id, seq in queries:
+        blast_hits[ int( query_id[1:] ) ] = {}
+    if not queries:
+        return blast_hits
+    nshards = max( 1, min( processes, len( queries ) ) )
+    shards = [ queries[i::nshards] for i in range( nshards ) ]
+
+    if not op.exists('./tmp'):
+        os.mkdir('./tmp')
+    tmpdir = tempfile.mkdtemp( prefix='blastbatch', dir='./tmp' )
+    try:
+        fastafiles = []
+        for i, shard in enumerate( shards ):
+            fastafile = op.join( tmpdir, 'shard{}.fa'.format(i) )
+            with open( fastafile, 'w' ) as out:
+                for query_id, seq in shard:
+                    out.write('>{}\n{}\n'.format( query_id, seq ) )
+            fastafiles.append( fastafile )
+
+        for vj in 'VJ':
+            dbfile = get_blast_nucseq_database( organism, ab, vj ) # also ensures that it exists
+            assert op.exists(dbfile)
+            jobs = [ _run_blastall( fastafile, dbfile ) for fastafile in fastafiles ]
+            for job in jobs:
+                if job.wait() != 0:
+                    raise RuntimeError('blastall failed with exit code {}'.format( job.returncode ))
+            for fastafile in fastafiles:
+                for query_id, lines in iter_blast_reports( fastafile+'.blast' ):
+                    i = int( query_id[1:] )
+                    hits = parse_blast_alignment_lines( lines, evalue_threshold, identity_threshold )
+                    hits_scores = get_all_hits_with_evalues_and_scores_lines( lines )
+                    blast_hits[i][vj] = ( hits, hits_scores )
+    finally:
+        if not nocleanup:
+            shutil.rmtree( tmpdir, ignore_errors = True )
+    return blast_hits
+
 def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
                                         nocleanup, hide_nucseq,
                                         extended_cdr3,
                                         use_parasail = False,
                                         try_parasail = True,
                                         return_all_good_hits = False,
-                                        max_bit_score_delta_for_good_hits = 50 ):
+                                        max_bit_score_delta_for_good_hits = 50,
+                                        prefilter_k = None,
+                                        blast_hits = None ):
     """
     This is draft post-hoc documentation based on my reading of the function. It may not be correct.
 
@@ -105,6 +217,8 @@ def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
     :param extended_cdr3: bolean ()
     :param return_all_good_hits: boolean ()
     :param max_bit_score_delta_for_good_hits: int ()
+    :param blast_hits: dict (this sequence's entry of blast_batch(); if given, blastall is not run)
+    :param prefilter_k: int (k-mer length of the parasail candidate gene prefilter, see sail.GeneAssigner; None aligns all genes)
 
     :return genes: ?
     :return evalues: ?
@@ -118,10 +232,12 @@ def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
         #print(">>>> parse_unpaired_dna_sequence_blastn(use_parasail = F)")
         #print(">>>> USING THE ORIGINAL BLAST IMPLEMENTATION") # REMOVE AFTER TESTS
 
-        if not op.exists('./tmp'):
-            os.mkdir('./tmp')
-        handle, blast_tmpfile = tempfile.mkstemp(suffix='.fa', prefix='blasttmp', dir='./tmp')
-        os.close(handle)
+        blast_tmpfile = None
+        if blast_hits is None:
+            if not op.exists('./tmp'):
+                os.mkdir('./tmp')
+            handle, blast_tmpfile = tempfile.mkstemp(suffix='.fa', prefix='blasttmp', dir='./tmp')
+            os.close(handle)
 
         genes =  ( 'UNK', 'UNK', [100, 0], 'UNK', 'UNK', [100, 0], '-' )
 
@@ -137,32 +253,38 @@ def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
             status.append('short_{}_blast_seq_{}'.format(ab, len(blast_seq)))
         else:
 
-            out = open(blast_tmpfile, 'w')
-            out.write('>tmp\n%s\n'%blast_seq)
-            out.close()
+            if blast_hits is None:
+                out = open(blast_tmpfile, 'w')
+                out.write('>tmp\n%s\n'%blast_seq)
+                out.close()
 
             ## now blast against V and J
             top_hits = []
             for ivj, vj in enumerate('VJ'):
-                dbfile = get_blast_nucseq_database( organism, ab, vj ) # also ensures that it exists
-                assert op.exists(dbfile)
-                blastall_exe = path_to_blast_executables+'/blastall'
-                assert op.exists( blastall_exe )
-                cmd = '%s -F F -p blastn -i %s -d %s -v 100 -b 1 -o %s.blast'\
-                      %( blastall_exe, blast_tmpfile, dbfile, blast_tmpfile )
-                logger.debug('blast cmd: %s', cmd)
-                os.system(cmd)
-                if vj == "V":
-                    os.system("cp " + blast_tmpfile+'.blast' + " " + blast_tmpfile+'.blast.inspectV') # DEBUG ONLY
-
-                logger.debug('blast: %s, %s, %s', info, ab, vj)
-                logger.debug(''.join( open(blast_tmpfile+'.blast', 'r').readlines()))
-
-                ## try parsing the results
-                evalue_threshold = 1e-1
-                identity_threshold = 20
-                hits = parse_blast_alignments( blast_tmpfile+'.blast', evalue_threshold, identity_threshold )
-                hits_scores = get_all_hits_with_evalues_and_scores( blast_tmpfile+'.blast' ) ## id,bitscore,evalue
+                if blast_hits is not None:
+                    ## already BLASTed by blast_batch()
+                    ## a query missing from the report had no hits
+                    hits, hits_scores = blast_hits.get( vj, ( {}, [] ) )
+                else:
+                    dbfile = get_blast_nucseq_database( organism, ab, vj ) # also ensures that it exists
+                    assert op.exists(dbfile)
+                    blastall_exe = path_to_blast_executables+'/blastall'
+                    assert op.exists( blastall_exe )
+                    cmd = '%s -F F -p blastn -i %s -d %s -v 100 -b 1 -o %s.blast'\
+                          %( blastall_exe, blast_tmpfile, dbfile, blast_tmpfile )
+                    logger.debug('blast cmd: %s', cmd)
+                    os.system(cmd)
+                    if vj == "V":
+                        os.system("cp " + blast_tmpfile+'.blast' + " " + blast_tmpfile+'.blast.inspectV') # DEBUG ONLY
+
+                    logger.debug('blast: %s, %s, %s', info, ab, vj)
+                    logger.debug(''.join( open(blast_tmpfile+'.blast', 'r').readlines()))
+
+                    ## try parsing the results
+                    evalue_threshold = 1e-1
+                    identity_threshold = 20
+                    hits = parse_blast_alignments( blast_tmpfile+'.blast', evalue_threshold, identity_threshold )
+                    hits_scores = get_all_hits_with_evalues_and_scores( blast_tmpfile+'.blast' ) ## id,bitscore,evalue
                 #print(hits_scores)
                 ##############
                 if hits and hits[ list(hits.keys())[0]]:
@@ -217,11 +339,11 @@ def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
             #   {"hits":{'tmp': ParasailMatch.instance] , "hits_scores"=[(),()..()] }
             #    sr['hits']["tmp"] - detailed ParasailMatch instance with information about best hit
             #    sr['hits_scores'] - ranked (id, score, evalue) tupes
-            sr = sail._get_hit_parasail(vj = vj,
-                                        all_genes = all_genes,
-                                        organism = organism,
+            sr = sail.get_gene_assigner(organism = organism,
                                         ab = ab,
-                                        blast_seq = blast_seq)
+                                        vj = vj,
+                                        all_genes = all_genes,
+                                        k = prefilter_k).get_hit(blast_seq)
 
             # append ParasailMatch instance for top scoring hit
             s_top_hits.append(sr['hits']["tmp"])
@@ -422,7 +544,7 @@ def parse_unpaired_dna_sequence_blastn( organism, ab, blast_seq, info,
                     if len(cdr3aa) < 5:
                         status.append('cdr3{}_len_too_short'.format(ab))
 
-    if not nocleanup:
+    if not nocleanup and not use_parasail and blast_tmpfile is not None:
         files = glob(blast_tmpfile+'*')
         for file in files:
             os.remove( file )
@@ -603,11 +725,17 @@ class BlastMatch:
 
 def parse_blast_alignments( blastfile, evalue_threshold, identity_threshold ):
     ## THIS WILL NOT WORK FOR PSIBLAST
+    with open( blastfile, 'r' ) as data:
+        return parse_blast_alignment_lines( data, evalue_threshold, identity_threshold )
 
-    data = open( blastfile, 'r' )
+def parse_blast_alignment_lines( lines, evalue_threshold, identity_threshold ):
+    """parse_blast_alignments() of an iterable of report lines (e.g. one query of a batch report)"""
+    lines = iter( lines )
+    def readline():
+        return next( lines, '' )
 
-    line = data.readline()
-    while line and not is_new_query_id_line( line ): line = data.readline()
+    line = readline()
+    while line and not is_new_query_id_line( line ): line = readline()
 
     hits = {}
     while line:
@@ -617,8 +745,8 @@ def parse_blast_alignments( blastfile, evalue_threshold, identity_threshold ):
         hits[ query_id ] = []
 
         ## read to the start of the alignments
-        line = data.readline()
-        while line and not is_new_hit_id_line( line ) and not is_new_query_id_line( line ): line = data.readline()
+        line = readline()
+        while line and not is_new_hit_id_line( line ) and not is_new_query_id_line( line ): line = readline()
 
         if not is_new_hit_id_line( line ): continue ## no hits
 
@@ -628,20 +756,20 @@ def parse_blast_alignments( blastfile, evalue_threshold, identity_threshold ):
             hit_id = line.split()[0][1:]
 
             ## read to the first match for this hit
-            while line and not is_new_match_line( line ): line = data.readline()
+            while line and not is_new_match_line( line ): line = readline()
 
             while line:
                 assert is_new_match_line( line )
 
                 hitlines = [ line ]
 
-                line = data.readline()
+                line = readline()
                 while line and \
                         not is_new_match_line( line ) and \
                         not is_new_hit_id_line( line ) and \
                         not is_new_query_id_line( line ):
                     hitlines.append( line )
-                    line = data.readline()
+                    line = readline()
 
                 ## now in a new match
                 m = BlastMatch( hitlines, query_id, hit_id )
@@ -654,7 +782,6 @@ def parse_blast_alignments( blastfile, evalue_threshold, identity_threshold ):
         if not is_new_query_id_line( line ):
             assert not line
             break
-    data.close()
     #THIS BLOCK IS FOR THE PURPOSES OF RECOVERING THE INFORMATION IN HITS
     #if len(hits['tmp']) > 1:
     #   print(blastfile)
@@ -668,10 +795,15 @@ def parse_blast_alignments( blastfile, evalue_threshold, identity_threshold ):
 
 ## should be just a single query sequence
 def get_all_hits_with_evalues_and_scores( blastfile ):
+    with open( blastfile, 'r' ) as lines:
+        return get_all_hits_with_evalues_and_scores_lines( lines )
+
+def get_all_hits_with_evalues_and_scores_lines( lines ):
+    """get_all_hits_with_evalues_and_scores() of an iterable of report lines for a single query"""
     query = ''
     in_hits = False
     hits = []
-    for line in open( blastfile, 'r'):
+    for line in lines:
         if line.startswith('Query='):
             assert not query
             query= line.split()[1]
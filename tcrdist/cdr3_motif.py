@@ -8,6 +8,7 @@ from .paths import path_to_current_db_files
 from .all_genes import all_genes
 from . import util
 from . import find_cdr3_motifs_in_tcrdist2
+from . import nextgen_store
 from . import setup_db
 
 class TCRMotif():
@@ -103,6 +104,12 @@ class TCRMotif():
           designates a dot pattern, probably used in regex. e.g., '.'
     pseudocount : float
           e.g., 0.0
+    engine : string
+          'bitset' (default) counts motif matches with motif_index.MotifIndex,
+          'regex' with re.search over every sequence as in tcrdist1
+    processes : int
+          number of processes searching the motifs, default 1. The motifs do
+          not depend on it.
 
 
     Notes
@@ -207,6 +214,8 @@ class TCRMotif():
         self.X                        = '[A-Z]'
         self.dot                      = '.'
         self.pseudocount              = 0.0
+        self.engine                   = 'bitset'
+        self.processes                = 1
 
         # set params to param dict which will be used as **kwargs
         self.params= {}
@@ -293,7 +302,8 @@ class TCRMotif():
                         "constant_seed", "force_random_len", "verbose",
                         "nofilter", "very_verbose", "test_random",
                         "hacking", "unmask", "use_groups", "begin",
-                        "end", "X", "dot", "pseudocount"]
+                        "end", "X", "dot", "pseudocount", "engine",
+                        "processes"]
         full_params = self.__dict__
 
         self.params =  {k:full_params[k] for k in param_keys}
@@ -339,7 +349,9 @@ class TCRMotif():
         Returns
         -------
         ng_tcrs : dict
-            dict (chain) of dict(v_gene) of dicts (j_gene) pointing to list of tuples
+            dict (chain) of dict(v_gene) of dicts (j_gene) pointing to
+            sequences of tuples (nextgen_store.NextgenSeqs, read-only views
+            of the memory mapped next-gen store)
 
         Raises
         ------
@@ -369,34 +381,8 @@ class TCRMotif():
             if not os.path.isfile(ng_logfile):
                 raise OSError('find_cdr3_motifs.py: missing next-gen chains file {}'.format(ng_logfile))
 
-            counter=0
-            num_chains=0
-            ab_chains = {}
-
-            for line in open(ng_logfile,'r'):
-                counter+=1
-                l = line[:-1].split('\t')
-                if counter==1:
-                    assert l==['v_reps','j_reps','cdr3','cdr3_nucseq']
-                    continue
-                #if not counter%1000000:#Log(`counter`+' '+`num_chains`+' '+ng_logfile)
-                if max_ng_lines and counter > max_ng_lines:
-                    break
-                v_reps = set( ( util.get_mm1_rep(x,organism) for x in l[0].split(',') ) )
-                j_reps = l[1].split(',')
-                cdr3, cdr3_nucseq = l[2:4]
-
-                ## now add to the different places
-                for v_rep in v_reps:
-                    for j_rep in j_reps:
-                        if v_rep not in ab_chains: ab_chains[v_rep] = {}
-                        if j_rep not in ab_chains[v_rep]: ab_chains[v_rep][j_rep] = []
-                        ab_chains[v_rep][j_rep].append( (cdr3, cdr3_nucseq ))
-
-
-                num_chains += 1
-
-                ng_tcrs[ab] = ab_chains
+            ## compiled once into a memory mapped store, see nextgen_store
+            ng_tcrs[ab] = nextgen_store.load_store(ng_logfile, organism).tcrs(max_ng_lines)
         self.ng_tcrs = ng_tcrs
         return ng_tcrs
 
@@ -4,20 +4,13 @@ import os.path as op
 from .amino_acids import amino_acids
 from .blosum import blosum
 from .paths import path_to_db
+from .db_cache import LazyDict, load_cached
 
 logger = logging.getLogger('cdr3s_human.py')
 
 ## these are indexed by organism
 ## these are potentially used outside this python file #########################
-pb_cdrs = {}
-all_align_fasta = {}
-all_fasta = {}
-all_num_genome_j_positions_in_loop = {}
-all_loopseq_representative = {}
-all_loopseq_representative_mm1 = {}
-all_jseq_representative = {}
-all_core_positions = {}
-all_merged_loopseqs = {}
+## (LazyDicts built on first access by _build_tables, see the end of this section)
 
 gap_character = '.'
 
@@ -98,300 +91,343 @@ for line in all_funny_jseq.split('\n'):
 
 
 
-for organism in [ 'mouse', 'human' ]:
+def _build_tables():
+    """
+    Parse the imgt fasta files and derive the loop, core position and
+    representative gene tables
+
+    Returns
+    -------
+    tables : dict
+        maps each table name ('pb_cdrs', 'all_fasta', ...) to a dict indexed by organism
+    """
+    pb_cdrs = {}
+    all_align_fasta = {}
+    all_fasta = {}
+    all_num_genome_j_positions_in_loop = {}
+    all_loopseq_representative = {}
+    all_loopseq_representative_mm1 = {}
+    all_jseq_representative = {}
+    all_core_positions = {}
+    all_merged_loopseqs = {}
+
+    for organism in [ 'mouse', 'human' ]:
+
+        ## read the TR-V alignments
+        align_file = op.join(fasta_dir, 'imgt_{}_TR_protein_sequences_with_gaps.fasta'.format(organism))
+        logger.debug(align_file)
+        #print(align_file)
+        assert op.exists(align_file)
+        align_fasta = {}
+        tr_prefixes = ['TRBV', 'TRAV']
+        for line in open( align_file, 'r'):
+            if line[0] == '>':
+                id = line.split('|')[1]
+                if id[:4] in tr_prefixes: assert id not in align_fasta
+                align_fasta[id] = ''
+            else:
+                align_fasta[id] += line.split()[0]
+
+        for id in align_fasta:
+            if id[3] == 'V' and id[:4] in tr_prefixes:
+                cpos = alseq_C_pos[organism][id[2]]
+                if len(align_fasta[id])<cpos:
+                    logger.error('short alseq: %s %s %s %s', organism, id, cpos, len(align_fasta[id]))
+                    align_fasta[id] += gap_character*(cpos - len(align_fasta[id]))
+
+                if align_fasta[id][cpos-1] != 'C':
+                    logger.error('bad cpos: %s %s', id, align_fasta[id][cpos-1])
+
+        fastafile = op.join(fasta_dir, 'imgt_{}_TR_protein_sequences.fasta'.format(organism ))
+        assert op.exists(fastafile)
+
+        ## read the fasta file
+        fasta = {}
+        tr_prefixes = ['TRBV', 'TRBJ', 'TRAV', 'TRAJ']
+        for line in open( fastafile, 'r'):
+            if line[0] == '>':
+                id = line.split('|')[1]
+                if id[:4] in tr_prefixes: assert id not in fasta
+                fasta[id] = ''
+            else:
+                fasta[id] += line.split()[0]
+
+        ##
+
+        if True: ## setup num_genome_j_positions_in_loop
+            all_num_genome_j_positions_in_loop[organism] = {}
+            for ab in 'AB':
+                all_num_genome_j_positions_in_loop[organism][ab] = {}
+                ids = sorted([ x for x in align_fasta if x[2] == ab and x[3] == 'J' ]) ## TRxV ids
+                L = max( len(align_fasta[x]) for x in ids )
+
+                default_suffixlen = default_num_positions_after_GXG[ organism ][ab]
+                for id in ids:
+                    suffixlen = default_suffixlen
+                    alseq = align_fasta[id]
+                    if '*' in alseq:
+                        all_num_genome_j_positions_in_loop[organism][ab][id] = len(alseq) - suffixlen - 5
+                        continue
+                    if not ( alseq[-suffixlen-1] == 'G' and alseq[-suffixlen-3] == 'G'):
+                        suffixlen = 0
+                        for word in funny_jseq[organism][ab]:
+                            if word in alseq:
+                                assert not suffixlen
+                                suffixlen = len(alseq) - alseq.find(word) - len(word)
+                    assert suffixlen
+                    starred = False
+                    num_spaces = L - len(alseq)
+                    if suffixlen != default_suffixlen or alseq[-suffixlen-1] != 'G' or alseq[-suffixlen-3] != 'G':
+                        starred = True
+                        num_spaces += ( suffixlen - default_suffixlen )
+                    ## there are 2 residues between the loop and the GXG
+                    all_num_genome_j_positions_in_loop[organism][ab][id] = len(alseq) - suffixlen - 5
+                    logger.debug('%s %-20s %s%s   %s' % (organism, id, ' '*num_spaces, alseq, '**********'*starred))
 
-    ## read the TR-V alignments
-    align_file = op.join(fasta_dir, 'imgt_{}_TR_protein_sequences_with_gaps.fasta'.format(organism))
-    logger.debug(align_file)
-    #print(align_file)
-    assert op.exists(align_file)
-    align_fasta = {}
-    tr_prefixes = ['TRBV', 'TRAV']
-    for line in open( align_file, 'r'):
-        if line[0] == '>':
-            id = line.split('|')[1]
-            if id[:4] in tr_prefixes: assert id not in align_fasta
-            align_fasta[id] = ''
-        else:
-            align_fasta[id] += line.split()[0]
-
-    for id in align_fasta:
-        if id[3] == 'V' and id[:4] in tr_prefixes:
-            cpos = alseq_C_pos[organism][id[2]]
-            if len(align_fasta[id])<cpos:
-                logger.error('short alseq: %s %s %s %s', organism, id, cpos, len(align_fasta[id]))
-                align_fasta[id] += gap_character*(cpos - len(align_fasta[id]))
-
-            if align_fasta[id][cpos-1] != 'C':
-                logger.error('bad cpos: %s %s', id, align_fasta[id][cpos-1])
-
-    fastafile = op.join(fasta_dir, 'imgt_{}_TR_protein_sequences.fasta'.format(organism ))
-    assert op.exists(fastafile)
-
-    ## read the fasta file
-    fasta = {}
-    tr_prefixes = ['TRBV', 'TRBJ', 'TRAV', 'TRAJ']
-    for line in open( fastafile, 'r'):
-        if line[0] == '>':
-            id = line.split('|')[1]
-            if id[:4] in tr_prefixes: assert id not in fasta
-            fasta[id] = ''
-        else:
-            fasta[id] += line.split()[0]
+        if True: ## show alignment columns in plain text ################################### and debugging
+            col_len = 15000000
+            for ab in 'AB':
+                cpos = alseq_C_pos[organism][ab] - 1 ## 0-indexed
+                L = cpos+2
+                ids = sorted([ x for x in align_fasta if x[2] == ab and x[3] == 'V' and len(align_fasta[x])>=L ]) ## TRxV ids
 
-    ##
+                for pos in range(L):
+                    cdrtag = '|'
+                    for start, stop in pb_cdr_positions[organism][ab]:
+                        if pos+1>=start and pos+1<=stop:
+                            cdrtag = '+'
+                    col = ''.join( [align_fasta[x][pos] for x in ids[:col_len] ] )
+                    if pos == cpos:
+                        assert col.count('C') > (95*len(col))/100
+                    logger.debug('%s TR%sV %s %4d %s'%(organism, ab, cdrtag, pos+1, col))
 
-    if True: ## setup num_genome_j_positions_in_loop
-        all_num_genome_j_positions_in_loop[organism] = {}
-        for ab in 'AB':
-            all_num_genome_j_positions_in_loop[organism][ab] = {}
-            ids = sorted([ x for x in align_fasta if x[2] == ab and x[3] == 'J' ]) ## TRxV ids
-            L = max( len(align_fasta[x]) for x in ids )
-
-            default_suffixlen = default_num_positions_after_GXG[ organism ][ab]
-            for id in ids:
-                suffixlen = default_suffixlen
-                alseq = align_fasta[id]
-                if '*' in alseq:
-                    all_num_genome_j_positions_in_loop[organism][ab][id] = len(alseq) - suffixlen - 5
-                    continue
-                if not ( alseq[-suffixlen-1] == 'G' and alseq[-suffixlen-3] == 'G'):
-                    suffixlen = 0
-                    for word in funny_jseq[organism][ab]:
-                        if word in alseq:
-                            assert not suffixlen
-                            suffixlen = len(alseq) - alseq.find(word) - len(word)
-                assert suffixlen
-                starred = False
-                num_spaces = L - len(alseq)
-                if suffixlen != default_suffixlen or alseq[-suffixlen-1] != 'G' or alseq[-suffixlen-3] != 'G':
-                    starred = True
-                    num_spaces += ( suffixlen - default_suffixlen )
-                ## there are 2 residues between the loop and the GXG
-                all_num_genome_j_positions_in_loop[organism][ab][id] = len(alseq) - suffixlen - 5
-                logger.debug('%s %-20s %s%s   %s' % (organism, id, ' '*num_spaces, alseq, '**********'*starred))
-
-    if True: ## show alignment columns in plain text ################################### and debugging
-        col_len = 15000000
-        for ab in 'AB':
-            cpos = alseq_C_pos[organism][ab] - 1 ## 0-indexed
-            L = cpos+2
-            ids = sorted([ x for x in align_fasta if x[2] == ab and x[3] == 'V' and len(align_fasta[x])>=L ]) ## TRxV ids
-
-            for pos in range(L):
-                cdrtag = '|'
-                for start, stop in pb_cdr_positions[organism][ab]:
-                    if pos+1>=start and pos+1<=stop:
-                        cdrtag = '+'
-                col = ''.join( [align_fasta[x][pos] for x in ids[:col_len] ] )
-                if pos == cpos:
-                    assert col.count('C') > (95*len(col))/100
-                logger.debug('%s TR%sV %s %4d %s'%(organism, ab, cdrtag, pos+1, col))
-
-
-
-
-    pb_cdrs[organism] = {}
-    for id, alseq in align_fasta.items():
-        if id.startswith('TRBV') or id.startswith('TRAV'):
-            pb_cdrs[organism][id] = []
-            # cdr1 = align_fasta[id][pb_cdr_positions[0][0]-1 : pb_cdr_positions[0][1] ]
-            # cdr2 = align_fasta[id][pb_cdr_positions[1][0]-1 : pb_cdr_positions[1][1] ]
-            # cdrX = align_fasta[id][pb_cdr_positions[2][0]-1 : pb_cdr_positions[2][1] ]
-            #print '%-15s %s %s %s'%(id,cdr1,cdr2,cdrX)
-            for start, stop in pb_cdr_positions[organism][id[2]]:
-                assert stop<=len(alseq)
-                pos1 = start-1
-                pos2 = stop-1
-                alseq_loop = alseq[pos1:pos2+1]
-                numgaps = alseq[:pos1].count(gap_character)
-                loop_start = pos1-numgaps
-                loop_stop = loop_start + len(alseq_loop) - 1 - alseq_loop.count(gap_character)
-                a = ''.join( alseq_loop.split(gap_character) )
-                b = fasta[id][loop_start:loop_stop+1]
-                #print id, alseq_loop, b, loop_start, loop_stop#, cdr1, cdr2, cdrX
-                pb_cdrs[organism][id].append( ( b, loop_start, loop_stop ) ) ## 0-indexed start and stop, inclusive
-                assert a == b
-
-
-    ## setup reps
-    all_loopseq_representative[organism] = {}
-    all_loopseq_representative_mm1[organism] = {}
-    all_merged_loopseqs[ organism ] = {}
-
-    for ab in 'AB':
-        org_merged_loopseqs = {}
+
+
+
+        pb_cdrs[organism] = {}
         for id, alseq in align_fasta.items():
-            if id[2] == ab and id[3] == 'V':
-                loopseqs = []
-                for start, stop in pb_cdr_positions[organism][ab]: ## start,stop are 1-indexed
+            if id.startswith('TRBV') or id.startswith('TRAV'):
+                pb_cdrs[organism][id] = []
+                # cdr1 = align_fasta[id][pb_cdr_positions[0][0]-1 : pb_cdr_positions[0][1] ]
+                # cdr2 = align_fasta[id][pb_cdr_positions[1][0]-1 : pb_cdr_positions[1][1] ]
+                # cdrX = align_fasta[id][pb_cdr_positions[2][0]-1 : pb_cdr_positions[2][1] ]
+                #print '%-15s %s %s %s'%(id,cdr1,cdr2,cdrX)
+                for start, stop in pb_cdr_positions[organism][id[2]]:
+                    assert stop<=len(alseq)
                     pos1 = start-1
                     pos2 = stop-1
                     alseq_loop = alseq[pos1:pos2+1]
-                    loopseqs.append( alseq_loop )
-                org_merged_loopseqs[id] = ' '.join( loopseqs )
-        all_loopseq_nbrs = {}
-        all_loopseq_nbrs_mm1 = {}
-        for id1, seq1 in org_merged_loopseqs.items():
-            cpos = alseq_C_pos[organism][ab] - 1 ## 0-indexed
-            alseq1 = align_fasta[id1]
-            minlen = cpos+1
-            if len(alseq1)<minlen:
-                alseq1 = align_fasta[id1] + 'X'*( minlen-len(alseq1))
-                logger.debug('short_align: %s %s %s %s', id1, len(alseq1), minlen, alseq1)
-
-            all_loopseq_nbrs[id1] = []
-            all_loopseq_nbrs_mm1[id1] = []
-            for id2, seq2 in org_merged_loopseqs.items():
-                alseq2 = align_fasta[id2]
-                if len(alseq2)<minlen:
-                    alseq2 = align_fasta[id2] + 'X'*( minlen-len(alseq2))
-                assert len(seq1) == len(seq2)
-                if seq1 == seq2:
-                    all_loopseq_nbrs[id1].append( id2 )
-                    all_loopseq_nbrs_mm1[id1].append( id2 )
-                    continue
-
-                ## count mismatches between these two, maybe count as an "_mm1" nbr
-                loop_mismatches = 0
-                loop_mismatches_cdrx = 0
-                loop_mismatch_seqs =[]
-                spaces=0
-                for a, b in zip( seq1, seq2):
-                    if a==' ':
-                        spaces+=1
+                    numgaps = alseq[:pos1].count(gap_character)
+                    loop_start = pos1-numgaps
+                    loop_stop = loop_start + len(alseq_loop) - 1 - alseq_loop.count(gap_character)
+                    a = ''.join( alseq_loop.split(gap_character) )
+                    b = fasta[id][loop_start:loop_stop+1]
+                    #print id, alseq_loop, b, loop_start, loop_stop#, cdr1, cdr2, cdrX
+                    pb_cdrs[organism][id].append( ( b, loop_start, loop_stop ) ) ## 0-indexed start and stop, inclusive
+                    assert a == b
+
+
+        ## setup reps
+        all_loopseq_representative[organism] = {}
+        all_loopseq_representative_mm1[organism] = {}
+        all_merged_loopseqs[ organism ] = {}
+
+        for ab in 'AB':
+            org_merged_loopseqs = {}
+            for id, alseq in align_fasta.items():
+                if id[2] == ab and id[3] == 'V':
+                    loopseqs = []
+                    for start, stop in pb_cdr_positions[organism][ab]: ## start,stop are 1-indexed
+                        pos1 = start-1
+                        pos2 = stop-1
+                        alseq_loop = alseq[pos1:pos2+1]
+                        loopseqs.append( alseq_loop )
+                    org_merged_loopseqs[id] = ' '.join( loopseqs )
+            all_loopseq_nbrs = {}
+            all_loopseq_nbrs_mm1 = {}
+            for id1, seq1 in org_merged_loopseqs.items():
+                cpos = alseq_C_pos[organism][ab] - 1 ## 0-indexed
+                alseq1 = align_fasta[id1]
+                minlen = cpos+1
+                if len(alseq1)<minlen:
+                    alseq1 = align_fasta[id1] + 'X'*( minlen-len(alseq1))
+                    logger.debug('short_align: %s %s %s %s', id1, len(alseq1), minlen, alseq1)
+
+                all_loopseq_nbrs[id1] = []
+                all_loopseq_nbrs_mm1[id1] = []
+                for id2, seq2 in org_merged_loopseqs.items():
+                    alseq2 = align_fasta[id2]
+                    if len(alseq2)<minlen:
+                        alseq2 = align_fasta[id2] + 'X'*( minlen-len(alseq2))
+                    assert len(seq1) == len(seq2)
+                    if seq1 == seq2:
+                        all_loopseq_nbrs[id1].append( id2 )
+                        all_loopseq_nbrs_mm1[id1].append( id2 )
                         continue
-                    if a!= b:
-                        if a in '*.' or b in '*.':
-                            loop_mismatches += 10
-                            break
-                        else:
-                            assert a in amino_acids and b in amino_acids
-                            if spaces<=1:
-                                loop_mismatches += 1
-                                loop_mismatch_seqs.append( ( a, b ) )
-                            else:
-                                assert spaces==2
-                                loop_mismatches_cdrx += 1
-                            if loop_mismatches>1:
-                                break
-                if loop_mismatches <=1:
-                    all_mismatches = 0
-                    for a, b in zip( alseq1[:cpos+2], alseq2[:cpos+2]):
+
+                    ## count mismatches between these two, maybe count as an "_mm1" nbr
+                    loop_mismatches = 0
+                    loop_mismatches_cdrx = 0
+                    loop_mismatch_seqs =[]
+                    spaces=0
+                    for a, b in zip( seq1, seq2):
+                        if a==' ':
+                            spaces+=1
+                            continue
                         if a!= b:
                             if a in '*.' or b in '*.':
-                                all_mismatches += 10
+                                loop_mismatches += 10
+                                break
                             else:
                                 assert a in amino_acids and b in amino_acids
-                                all_mismatches += 1
-                    #dist = tcr_distances.blosum_sequence_distance( seq1, seq2, gap_penalty=10 )
-                    if loop_mismatches<=1 and loop_mismatches + loop_mismatches_cdrx <= 2 and all_mismatches<=10:
-                        if loop_mismatches == 1:
-                            blscore= blosum[(loop_mismatch_seqs[0][0], loop_mismatch_seqs[0][1])]
-                        else:
-                            blscore = 100
-                        if blscore>=1:
-                            all_loopseq_nbrs_mm1[id1].append( id2 )
-                            if loop_mismatches>0:
-                                mmstring = ','.join(['%s/%s'%(x[0], x[1]) for x in loop_mismatch_seqs])
-                                gene1 = id1[:id1.index('*')]
-                                gene2 = id2[:id2.index('*')]
-                                if gene1 != gene2:
-                                    logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
-                                        loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq1)
-                                    logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
-                                        loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq2)
-
-
-        for id in all_loopseq_nbrs:
-            all_loopseq_representative[organism][id] = min( all_loopseq_nbrs[id] )
-            assert org_merged_loopseqs[id] == org_merged_loopseqs[ all_loopseq_representative[organism][id] ]
-            logger.debug('vrep %s %15s %15s %s'%(organism, id, all_loopseq_representative[organism][id],
-                                              org_merged_loopseqs[id]))
-            all_merged_loopseqs[ organism ][ id ] = org_merged_loopseqs[id][:]
-
-
-        ## merge mm1 nbrs to guarantee transitivity
-        while True:
-            new_nbrs = False
-            for id1 in all_loopseq_nbrs_mm1:
-                new_id1_nbrs = False
-                for id2 in all_loopseq_nbrs_mm1[id1]:
-                    for id3 in all_loopseq_nbrs_mm1[id2]:
-                        if id3 not in all_loopseq_nbrs_mm1[id1]:
-                            all_loopseq_nbrs_mm1[id1].append( id3 )
-                            logger.debug('new_nbr: %s %s %s', id1, id2, id3)
-                            new_id1_nbrs = True
+                                if spaces<=1:
+                                    loop_mismatches += 1
+                                    loop_mismatch_seqs.append( ( a, b ) )
+                                else:
+                                    assert spaces==2
+                                    loop_mismatches_cdrx += 1
+                                if loop_mismatches>1:
+                                    break
+                    if loop_mismatches <=1:
+                        all_mismatches = 0
+                        for a, b in zip( alseq1[:cpos+2], alseq2[:cpos+2]):
+                            if a!= b:
+                                if a in '*.' or b in '*.':
+                                    all_mismatches += 10
+                                else:
+                                    assert a in amino_acids and b in amino_acids
+                                    all_mismatches += 1
+                        #dist = tcr_distances.blosum_sequence_distance( seq1, seq2, gap_penalty=10 )
+                        if loop_mismatches<=1 and loop_mismatches + loop_mismatches_cdrx <= 2 and all_mismatches<=10:
+                            if loop_mismatches == 1:
+                                blscore= blosum[(loop_mismatch_seqs[0][0], loop_mismatch_seqs[0][1])]
+                            else:
+                                blscore = 100
+                            if blscore>=1:
+                                all_loopseq_nbrs_mm1[id1].append( id2 )
+                                if loop_mismatches>0:
+                                    mmstring = ','.join(['%s/%s'%(x[0], x[1]) for x in loop_mismatch_seqs])
+                                    gene1 = id1[:id1.index('*')]
+                                    gene2 = id2[:id2.index('*')]
+                                    if gene1 != gene2:
+                                        logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
+                                            loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq1)
+                                        logger.error('v_mismatches: %s %s %s %s %s %s %s %s %s', organism, mmstring, blscore, id1, id2,\
+                                            loop_mismatches, loop_mismatches_cdrx, all_mismatches, seq2)
+
+
+            for id in all_loopseq_nbrs:
+                all_loopseq_representative[organism][id] = min( all_loopseq_nbrs[id] )
+                assert org_merged_loopseqs[id] == org_merged_loopseqs[ all_loopseq_representative[organism][id] ]
+                logger.debug('vrep %s %15s %15s %s'%(organism, id, all_loopseq_representative[organism][id],
+                                                  org_merged_loopseqs[id]))
+                all_merged_loopseqs[ organism ][ id ] = org_merged_loopseqs[id][:]
+
+
+            ## merge mm1 nbrs to guarantee transitivity
+            while True:
+                new_nbrs = False
+                for id1 in all_loopseq_nbrs_mm1:
+                    new_id1_nbrs = False
+                    for id2 in all_loopseq_nbrs_mm1[id1]:
+                        for id3 in all_loopseq_nbrs_mm1[id2]:
+                            if id3 not in all_loopseq_nbrs_mm1[id1]:
+                                all_loopseq_nbrs_mm1[id1].append( id3 )
+                                logger.debug('new_nbr: %s %s %s', id1, id2, id3)
+                                new_id1_nbrs = True
+                                break
+                        if new_id1_nbrs:
                             break
                     if new_id1_nbrs:
-                        break
-                if new_id1_nbrs:
-                    new_nbrs = True
-            logger.debug('new_nbrs: %s %s %s', ab, organism, new_nbrs)
-            if not new_nbrs:
-                break
-
-        for id in all_loopseq_nbrs_mm1:
-            all_loopseq_representative_mm1[organism][id] = min( all_loopseq_nbrs_mm1[id] )
-            logger.debug('mm1vrep %s %15s %15s %s'%(organism, id, all_loopseq_representative_mm1[organism][id],
-                                                 org_merged_loopseqs[id]))
-
-
-    ## setup Jseq reps
-    all_jseq_representative[organism] = {}
-
-    for ab in 'AB':
-        jloopseqs = {}
-        for id, jseq in fasta.items():
-            if id[2] == ab and id[3] == 'J':
-                num = all_num_genome_j_positions_in_loop[organism][ab][id]
-                jloopseq = jseq[:num+5] ## go all the way up to and including the GXG
-                jloopseqs[id] = jloopseq
-        all_jloopseq_nbrs = {}
-        for id1, seq1 in jloopseqs.items():
-            all_jloopseq_nbrs[id1] = []
-            for id2, seq2 in jloopseqs.items():
-                #assert len(seq1) == len(seq2)
-                if seq1 == seq2:
-                    all_jloopseq_nbrs[id1].append( id2 )
-        for id in all_jloopseq_nbrs:
-            all_jseq_representative[organism][id] = min( all_jloopseq_nbrs[id] )
-            assert jloopseqs[id] == jloopseqs[ all_jseq_representative[organism][id] ]
-            logger.debug('jrep %s %15s %15s %15s'%(organism, id, all_jseq_representative[organism][id],
-                                                jloopseqs[id]))
-
-    ## setup core positions
-    all_core_positions[ organism ] = {}
-    for id, alseq in align_fasta.items():
-        if id[2] in 'AB' and id[3] == 'V':
-            ab = id[2]
-            poslist = []
-            poslist_seq = ''
-            align_pos_mapping = {}
-            for i in range(1, len(alseq)+1):
-                if i in extra_alignment_columns[organism][ab]:continue
-                last_mapped_pos = 0
-                if align_pos_mapping: last_mapped_pos = max( align_pos_mapping.keys() )
-                align_pos_mapping[ last_mapped_pos + 1 ] = i
-                logger.debug('align_pos_mapping: %s %s %s %s', organism, ab, last_mapped_pos+1, i)
-
-            for generic_align_pos1 in core_positions_generic_1indexed:
-                align_pos = align_pos_mapping[ generic_align_pos1 ] - 1 ## now 0-indexed, shifted for extra columns
-                numgaps = alseq[:align_pos].count(gap_character)
-                if alseq[align_pos] in amino_acids:
-                    poslist.append( align_pos - numgaps )
-                else:
-                    poslist.append( -1 )
-                poslist_seq += alseq[ align_pos ]
-
-            logger.debug('core_poslist_seq: %s %s %s', organism, poslist_seq, id)
-
-            all_core_positions[organism][id] = poslist
-
-    all_align_fasta[ organism ] = align_fasta
-    all_fasta[ organism ] = fasta
-
-    #exit()
+                        new_nbrs = True
+                logger.debug('new_nbrs: %s %s %s', ab, organism, new_nbrs)
+                if not new_nbrs:
+                    break
+
+            for id in all_loopseq_nbrs_mm1:
+                all_loopseq_representative_mm1[organism][id] = min( all_loopseq_nbrs_mm1[id] )
+                logger.debug('mm1vrep %s %15s %15s %s'%(organism, id, all_loopseq_representative_mm1[organism][id],
+                                                     org_merged_loopseqs[id]))
+
+
+        ## setup Jseq reps
+        all_jseq_representative[organism] = {}
+
+        for ab in 'AB':
+            jloopseqs = {}
+            for id, jseq in fasta.items():
+                if id[2] == ab and id[3] == 'J':
+                    num = all_num_genome_j_positions_in_loop[organism][ab][id]
+                    jloopseq = jseq[:num+5] ## go all the way up to and including the GXG
+                    jloopseqs[id] = jloopseq
+            all_jloopseq_nbrs = {}
+            for id1, seq1 in jloopseqs.items():
+                all_jloopseq_nbrs[id1] = []
+                for id2, seq2 in jloopseqs.items():
+                    #assert len(seq1) == len(seq2)
+                    if seq1 == seq2:
+                        all_jloopseq_nbrs[id1].append( id2 )
+            for id in all_jloopseq_nbrs:
+                all_jseq_representative[organism][id] = min( all_jloopseq_nbrs[id] )
+                assert jloopseqs[id] == jloopseqs[ all_jseq_representative[organism][id] ]
+                logger.debug('jrep %s %15s %15s %15s'%(organism, id, all_jseq_representative[organism][id],
+                                                    jloopseqs[id]))
+
+        ## setup core positions
+        all_core_positions[ organism ] = {}
+        for id, alseq in align_fasta.items():
+            if id[2] in 'AB' and id[3] == 'V':
+                ab = id[2]
+                poslist = []
+                poslist_seq = ''
+                align_pos_mapping = {}
+                for i in range(1, len(alseq)+1):
+                    if i in extra_alignment_columns[organism][ab]:continue
+                    last_mapped_pos = 0
+                    if align_pos_mapping: last_mapped_pos = max( align_pos_mapping.keys() )
+                    align_pos_mapping[ last_mapped_pos + 1 ] = i
+                    logger.debug('align_pos_mapping: %s %s %s %s', organism, ab, last_mapped_pos+1, i)
+
+                for generic_align_pos1 in core_positions_generic_1indexed:
+                    align_pos = align_pos_mapping[ generic_align_pos1 ] - 1 ## now 0-indexed, shifted for extra columns
+                    numgaps = alseq[:align_pos].count(gap_character)
+                    if alseq[align_pos] in amino_acids:
+                        poslist.append( align_pos - numgaps )
+                    else:
+                        poslist.append( -1 )
+                    poslist_seq += alseq[ align_pos ]
+
+                logger.debug('core_poslist_seq: %s %s %s', organism, poslist_seq, id)
+
+                all_core_positions[organism][id] = poslist
+
+        all_align_fasta[ organism ] = align_fasta
+        all_fasta[ organism ] = fasta
+
+    return dict( pb_cdrs = pb_cdrs,
+                 all_align_fasta = all_align_fasta,
+                 all_fasta = all_fasta,
+                 all_num_genome_j_positions_in_loop = all_num_genome_j_positions_in_loop,
+                 all_loopseq_representative = all_loopseq_representative,
+                 all_loopseq_representative_mm1 = all_loopseq_representative_mm1,
+                 all_jseq_representative = all_jseq_representative,
+                 all_core_positions = all_core_positions,
+                 all_merged_loopseqs = all_merged_loopseqs )
+
+_tables = LazyDict( lambda : load_cached( 'cdr3s_human',
+                                          [ op.join(fasta_dir, 'imgt_{}_TR_protein_sequences{}.fasta'.format(organism, x))
+                                            for organism in [ 'mouse', 'human' ] for x in [ '', '_with_gaps' ] ],
+                                          _build_tables ) )
+
+pb_cdrs = LazyDict( lambda : _tables['pb_cdrs'] )
+all_align_fasta = LazyDict( lambda : _tables['all_align_fasta'] )
+all_fasta = LazyDict( lambda : _tables['all_fasta'] )
+all_num_genome_j_positions_in_loop = LazyDict( lambda : _tables['all_num_genome_j_positions_in_loop'] )
+all_loopseq_representative = LazyDict( lambda : _tables['all_loopseq_representative'] )
+all_loopseq_representative_mm1 = LazyDict( lambda : _tables['all_loopseq_representative_mm1'] )
+all_jseq_representative = LazyDict( lambda : _tables['all_jseq_representative'] )
+all_core_positions = LazyDict( lambda : _tables['all_core_positions'] )
+all_merged_loopseqs = LazyDict( lambda : _tables['all_merged_loopseqs'] )
 
 
 ## return a list of tuples, each tuple is start and stop positions (0-indexed) of the loop
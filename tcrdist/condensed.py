@@ -0,0 +1,266 @@
+"""
+Condensed (upper triangle) storage of symmetric pairwise distance matrices
+
+A TCRrep created with storage = "condensed" keeps every *_aa_pw attribute and
+paired_tcrdist as a CondensedMatrix: the vector form used by
+scipy.spatial.distance.pdist/squareform, stored in the smallest integer type
+that holds the distances (uint16 for typical tcrdist values), with a
+lightweight matrix view for row access and indexing. A 50,000 clone matrix
+then takes 2.5 GB instead of 20 GB per region.
+
+"""
+import numpy as np
+import scipy.spatial
+
+# Number of vector elements processed at a time by weighted_sum()
+_CHUNK = 2 ** 24
+
+
+def condensed_index(i, j, n):
+    """
+    Position of square matrix element (i, j), i < j, in the condensed vector
+
+    Parameters
+    ----------
+    i : int or np.ndarray
+    j : int or np.ndarray
+    n : int
+        number of rows of the square matrix
+
+    Returns
+    -------
+    k : int or np.ndarray
+    """
+    return n * i - (i * (i + 1)) // 2 + (j - i - 1)
+
+
+def n_from_condensed(m):
+    """
+    Number of rows of the square matrix with a condensed vector of length m
+    """
+    n = int(np.ceil(np.sqrt(2 * m)))
+    if n * (n - 1) // 2 != m:
+        raise ValueError("{} is not the length of a condensed distance vector".format(m))
+    return n
+
+
+def _integral_dtype(lo, hi):
+    for dtype in [np.uint16, np.int16, np.int32, np.int64]:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return np.float64
+
+
+def compact(vec):
+    """
+    Cast a condensed distance vector to the smallest integer type that
+    holds its values exactly (uint16 for typical tcrdist values). Vectors
+    with non integral values are returned unchanged.
+
+    Parameters
+    ----------
+    vec : np.ndarray
+
+    Returns
+    -------
+    vec : np.ndarray
+    """
+    vec = np.asarray(vec)
+    if len(vec) == 0:
+        return vec.astype(np.uint16)
+    if not np.issubdtype(vec.dtype, np.integer):
+        if not np.all(np.isfinite(vec)) or not np.all(vec == np.round(vec)):
+            return vec
+    dtype = _integral_dtype(vec.min(), vec.max())
+    if dtype == vec.dtype:
+        return vec
+    return vec.astype(dtype)
+
+
+class CondensedMatrix:
+    """
+    Read-only square matrix view of a condensed distance vector
+
+    Attributes
+    ----------
+    vec : np.ndarray
+        condensed vector of length n*(n - 1) / 2 (as returned by
+        scipy.spatial.distance.pdist)
+    n : int
+        number of rows and columns
+    shape : tuple
+        (n, n)
+    dtype : np.dtype
+        dtype of vec
+
+    Examples
+    --------
+    >>> cm = CondensedMatrix([1, 2, 3])
+    >>> cm[0]
+    array([0, 1, 2], dtype=uint16)
+    >>> cm[1, 2]
+    3
+    >>> cm.toarray()
+    array([[0, 1, 2],
+           [1, 0, 3],
+           [2, 3, 0]], dtype=uint16)
+    """
+    ndim = 2
+
+    def __init__(self, vec, n = None, compact_dtype = True):
+        vec = np.asarray(vec)
+        if vec.ndim != 1:
+            raise ValueError("CondensedMatrix requires a 1D condensed vector, use from_square()")
+        self.vec = compact(vec) if compact_dtype else vec
+        self.n = n_from_condensed(len(vec)) if n is None else n
+
+    @classmethod
+    def from_square(cls, x, compact_dtype = True):
+        """
+        CondensedMatrix from a square symmetric matrix
+        """
+        vec = scipy.spatial.distance.squareform(np.asarray(x), force = 'tovector', checks = False)
+        return cls(vec, n = np.asarray(x).shape[0], compact_dtype = compact_dtype)
+
+    @property
+    def shape(self):
+        return (self.n, self.n)
+
+    @property
+    def dtype(self):
+        return self.vec.dtype
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return 'CondensedMatrix(n={}, dtype={})'.format(self.n, self.dtype)
+
+    def _gather(self, rows, cols):
+        """
+        matrix values for broadcastable integer index arrays rows, cols
+        """
+        rows, cols = np.broadcast_arrays(rows, cols)
+        i = np.minimum(rows, cols)
+        j = np.maximum(rows, cols)
+        out = np.zeros(rows.shape, dtype = self.vec.dtype)
+        off = i != j
+        out[off] = self.vec[condensed_index(i[off], j[off], self.n)]
+        return out
+
+    def _index(self, ix):
+        """
+        returns (index array, is_scalar, is_outer) for one axis
+        """
+        if isinstance(ix, slice):
+            return np.arange(self.n)[ix], False, True
+        arr = np.asarray(ix)
+        if arr.dtype == bool:
+            arr = np.nonzero(arr)[0]
+        if not np.issubdtype(arr.dtype, np.integer):
+            raise IndexError("CondensedMatrix indices must be integers, slices or boolean arrays")
+        arr = np.where(arr < 0, arr + self.n, arr)
+        if np.any((arr < 0) | (arr >= self.n)):
+            raise IndexError("index out of bounds for CondensedMatrix with n = {}".format(self.n))
+        return arr, arr.ndim == 0, False
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        if len(key) != 2:
+            raise IndexError("CondensedMatrix supports two indices")
+        rows, row_scalar, row_outer = self._index(key[0])
+        cols, col_scalar, col_outer = self._index(key[1])
+        if row_outer or col_outer:
+            out = self._gather(np.atleast_1d(rows)[:, None], np.atleast_1d(cols)[None, :])
+            if row_scalar:
+                out = out[0]
+            elif col_scalar:
+                out = out[:, 0]
+            return out
+        out = self._gather(rows, cols)
+        if out.ndim == 0:
+            return out[()]
+        return out
+
+    def row(self, i):
+        """
+        Distances from clone i to every clone (including 0 for itself)
+        """
+        return self[i]
+
+    def toarray(self):
+        """
+        Square np.ndarray (allocates n x n)
+        """
+        return scipy.spatial.distance.squareform(self.vec, checks = False)
+
+    def __array__(self, dtype = None, copy = None):
+        x = self.toarray()
+        if dtype is not None:
+            x = x.astype(dtype)
+        return x
+
+    def astype(self, dtype):
+        return CondensedMatrix(self.vec.astype(dtype), n = self.n, compact_dtype = False)
+
+    def copy(self):
+        return CondensedMatrix(self.vec.copy(), n = self.n, compact_dtype = False)
+
+    def __add__(self, other):
+        if isinstance(other, CondensedMatrix):
+            return weighted_sum([self, other], [1, 1])
+        return np.asarray(self) + other
+
+    __radd__ = __add__
+
+    def max(self):
+        return self.vec.max() if len(self.vec) > 0 else 0
+
+    def min(self):
+        return min(0, self.vec.min()) if len(self.vec) > 0 else 0
+
+
+def weighted_sum(matrices, weights):
+    """
+    Weighted sum of CondensedMatrix instances, accumulated chunk by chunk so
+    that no full size float64 temporary is allocated.
+
+    Parameters
+    ----------
+    matrices : list
+        list of CondensedMatrix of the same shape
+    weights : list
+        list of numeric weights
+
+    Returns
+    -------
+    total : CondensedMatrix
+        stored in the smallest integer type that holds the sum when all
+        inputs and weights are integral, float64 otherwise
+    """
+    n = matrices[0].n
+    m = len(matrices[0].vec)
+    for x in matrices:
+        if x.n != n:
+            raise ValueError("CondensedMatrix shapes differ: {} and {}".format(x.shape, matrices[0].shape))
+    integral = all(np.issubdtype(x.dtype, np.integer) for x in matrices) and \
+        all(float(w).is_integer() for w in weights)
+    if integral:
+        lo = sum(min(w * x.min(), w * x.max()) for x, w in zip(matrices, weights))
+        hi = sum(max(w * x.min(), w * x.max()) for x, w in zip(matrices, weights))
+        dtype = _integral_dtype(min(lo, 0), hi)
+        acc_dtype = np.int64
+        weights = [int(w) for w in weights]
+    else:
+        dtype = np.float64
+        acc_dtype = np.float64
+    total = np.zeros(m, dtype = dtype)
+    for s in range(0, m, _CHUNK):
+        e = min(m, s + _CHUNK)
+        acc = np.zeros(e - s, dtype = acc_dtype)
+        for x, w in zip(matrices, weights):
+            acc += x.vec[s:e].astype(acc_dtype) * w
+        total[s:e] = acc
+    return CondensedMatrix(total, n = n, compact_dtype = False)
@@ -0,0 +1,185 @@
+"""
+Lazily built, disk cached reference tables
+
+The gene tables of all_genes, cdr3s_human and tcr_rearrangement are derived
+from the files under db/ by code that takes seconds to run (pandas parsing,
+quadratic loop-sequence neighbor scans, globbing the probs files). They used
+to be built when the package was imported. Here they are built on first
+access instead, and the result is pickled under paths.path_to_user_cache()
+($TCRDIST_CACHE_DIR, $XDG_CACHE_HOME/tcrdist or ~/.cache/tcrdist) so later
+processes only unpickle it.
+
+Cache files are keyed on CACHE_VERSION, the package version and the path,
+size and mtime of every source file, including the module that builds the
+table and objects.py (the tables hold pickled TCR_Gene instances), so
+editing the db or the code invalidates them.
+
+"""
+import collections.abc
+import hashlib
+import logging
+import os
+import os.path as op
+import pickle
+import sys
+import tempfile
+
+from .paths import path_to_user_cache
+from .version import __version__
+
+logger = logging.getLogger('db_cache.py')
+
+# bump when the pickled tables change in a way their source files do not show
+CACHE_VERSION = 1
+
+# modules defining the classes pickled in the tables
+_pickled_class_modules = [op.join(op.dirname(op.abspath(__file__)), 'objects.py')]
+
+
+def cache_dir():
+    """
+    Returns
+    -------
+    path : string
+        directory holding the pickled reference tables
+    """
+    return path_to_user_cache('db')
+
+
+def cache_key(name, sources):
+    """
+    Name of the cache file for the table name built from the files sources
+    """
+    h = hashlib.sha1()
+    h.update(repr((name, CACHE_VERSION, __version__)).encode())
+    for path in sorted(sources):
+        st = os.stat(path)
+        h.update(repr((op.abspath(path), st.st_size, st.st_mtime_ns)).encode())
+    return '{}-{}.pickle'.format(name, h.hexdigest())
+
+
+def _dump_atomic(path, obj):
+    """
+    pickle to a temporary file in the cache directory then rename, so
+    concurrent processes never see a partially written file
+    """
+    fd, tmp = tempfile.mkstemp(dir = op.dirname(path), suffix = '.pickle.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(obj, fh, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except:
+        if op.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_cached(name, sources, build, use_cache = True):
+    """
+    build(), or its pickled result from a previous process
+
+    Parameters
+    ----------
+    name : string
+        table name, the prefix of the cache file
+    sources : list
+        files the table is derived from; the module defining build and
+        objects.py are added
+    build : callable
+        computes the table, called without arguments
+    use_cache : bool
+        if False the table is always built and never written
+
+    Returns
+    -------
+    table : object
+        whatever build() returns
+    """
+    if not use_cache:
+        return build()
+    sources = list(sources) + [sys.modules[build.__module__].__file__] + _pickled_class_modules
+    path = op.join(cache_dir(), cache_key(name, sources))
+    if op.exists(path):
+        try:
+            with open(path, 'rb') as fh:
+                return pickle.load(fh)
+        except Exception as e:
+            logger.warning('ignoring unreadable cache file {}: {}'.format(path, e))
+    table = build()
+    try:
+        os.makedirs(op.dirname(path), exist_ok = True)
+        _dump_atomic(path, table)
+    except OSError as e:
+        logger.warning('unable to write cache file {}: {}'.format(path, e))
+    return table
+
+
+def clear_db_cache():
+    """
+    Remove the pickled reference tables (they are rebuilt on next use)
+    """
+    d = cache_dir()
+    if op.isdir(d):
+        for fn in os.listdir(d):
+            if fn.endswith('.pickle'):
+                os.remove(op.join(d, fn))
+
+
+class LazyDict(collections.abc.MutableMapping):
+    """
+    dict whose contents are computed by loader() on first access
+
+    Module level tables are LazyDict instances so that
+    `from .all_genes import all_genes` costs nothing until a gene is looked
+    up.
+
+    Examples
+    --------
+    >>> d = LazyDict(lambda : {'a': 1})
+    >>> d.loaded
+    False
+    >>> d['a']
+    1
+    >>> d.loaded
+    True
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = self._loader()
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __reduce__(self):
+        # pickles (e.g. to multiprocessing workers) as the plain dict
+        return (dict, (dict(self.data),))
+
+    def __repr__(self):
+        if self._data is None:
+            return 'LazyDict(<not loaded>)'
+        return 'LazyDict({!r})'.format(self._data)
@@ -0,0 +1,220 @@
+"""
+Hash based deduplication of cells into clones
+
+TCRrep.deduplicate used cell_df.groupby(index_cols)['count'].sum(), which
+for a dozen string columns and millions of rows builds large intermediate
+objects per column. Here each index column is factorized once into integer
+codes, the codes of a row are combined into a single int64 key (mixed radix,
+recompressed whenever the radix would overflow, so distinct rows never
+share a key) and the counts are summed with a hash table over the keys.
+Rows with a null in any index column are dropped, as groupby does, and
+counted in the same pass.
+
+The result equals the groupby result: one row per distinct combination of
+index_cols values, in sorted order, followed by the summed count.
+
+deduplicate_chunks() does the same for input that does not fit in memory,
+such as pd.read_csv(..., chunksize = n) or preprocess_adaptive.iter_immunoseq().
+
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+_INT64_MAX = np.iinfo(np.int64).max
+
+# Rows of cell_df dropped by deduplicate() because an index column is null:
+# rows is the number of such rows, count the sum of their counts and
+# null_counts a pd.Series with the number of nulls in each index column.
+Incomplete = namedtuple('Incomplete', ['rows', 'count', 'null_counts'])
+
+
+def group_keys(cell_df, index_cols):
+    """
+    One int64 key per row of cell_df such that two complete rows have the
+    same key if and only if they have the same index_cols values, and keys
+    sort as the rows do
+
+    Parameters
+    ----------
+    cell_df : pd.DataFrame
+    index_cols : list
+
+    Returns
+    -------
+    keys : np.ndarray
+        int64 keys of the rows with no null index column
+    complete : np.ndarray
+        boolean mask of those rows
+    null_counts : pd.Series
+        number of null values in each index column
+    """
+    codes, uniques, complete, null_counts = _factorize_columns(cell_df, index_cols)
+    return _combine_codes(codes, [len(u) for u in uniques]), complete, null_counts
+
+
+def _factorize_columns(cell_df, index_cols):
+    """
+    sorted codes and uniques of each index column, restricted to the
+    complete rows; codes are kept in the smallest integer type that holds
+    them
+    """
+    codes = []
+    uniques = []
+    complete = np.ones(cell_df.shape[0], dtype = bool)
+    null_counts = pd.Series(0, index = index_cols, dtype = np.int64)
+    for col in index_cols:
+        c, u = _factorize_sorted(cell_df[col])
+        isnull = c < 0
+        null_counts[col] = isnull.sum()
+        complete &= ~isnull
+        codes.append(c.astype(np.min_scalar_type(-max(len(u), 1))))
+        uniques.append(u)
+    if not complete.all():
+        codes = [c[complete] for c in codes]
+    return codes, uniques, complete, null_counts
+
+
+def _factorize_sorted(values):
+    """
+    pd.factorize(values, sort = True): nulls get code -1 and codes order as
+    the values do. The uniques of string columns, the common case, are
+    sorted as numpy unicode, much faster than the object comparisons of the
+    pandas sort.
+    """
+    c, u = pd.factorize(values)
+    u = np.asarray(u)
+    if u.dtype != object or pd.api.types.infer_dtype(u, skipna = False) != 'string':
+        return pd.factorize(values, sort = True)
+    order = np.argsort(u.astype(str), kind = 'stable')
+    rank = np.empty(len(order), dtype = np.intp)
+    rank[order] = np.arange(len(order))
+    return np.where(c < 0, -1, rank.take(c)), u[order]
+
+
+def _combine_codes(codes, sizes):
+    """mixed radix int64 keys of the rows of codes"""
+    keys = np.zeros(len(codes[0]) if codes else 0, dtype = np.int64)
+    radix = 1
+    for c, size in zip(codes, sizes):
+        if radix * size > _INT64_MAX:
+            # densify the key so far, keeping its order
+            keys, u = pd.factorize(keys, sort = True)
+            keys = keys.astype(np.int64)
+            radix = len(u)
+        keys = keys * size + c
+        radix *= size
+    return keys
+
+
+def deduplicate(cell_df, index_cols):
+    """
+    Groups identical cells into clones, summing their counts
+
+    Parameters
+    ----------
+    cell_df : pd.DataFrame
+        must have a column 'count'
+    index_cols : list
+        columns that together identify a clone
+
+    Returns
+    -------
+    clones : pd.DataFrame
+        index_cols and count, one row per distinct complete combination of
+        index_cols values, sorted by them
+    incomplete : Incomplete
+        the rows dropped because of null index_cols values
+
+    Examples
+    --------
+    >>> df = pd.DataFrame({'cdr3_a_aa' : ['CAF', 'CAF', 'CAG', 'CAG'],
+    ...                    'v_a_gene' : ['TRAV1*01', 'TRAV1*01', None, 'TRAV2*01'],
+    ...                    'count' : [1, 2, 1, 1]})
+    >>> clones, incomplete = deduplicate(df, ['cdr3_a_aa', 'v_a_gene'])
+    >>> clones.values.tolist()
+    [['CAF', 'TRAV1*01', 3], ['CAG', 'TRAV2*01', 1]]
+    >>> incomplete.rows, incomplete.count
+    (1, 1)
+    """
+    index_cols = list(index_cols)
+    codes, uniques, complete, null_counts = _factorize_columns(cell_df, index_cols)
+    keys = _combine_codes(codes, [len(u) for u in uniques])
+    counts = cell_df['count'].values
+    incomplete = Incomplete(rows = int((~complete).sum()),
+                            count = _nansum(counts[~complete]),
+                            null_counts = null_counts)
+
+    # hash group-by: group ids in order of first appearance
+    groups, group_keys = pd.factorize(keys)
+    first = np.empty(len(group_keys), dtype = np.int64)
+    first[groups[::-1]] = np.arange(len(groups) - 1, -1, -1)
+    summed = np.bincount(groups, weights = _fill_nan(counts[complete]), minlength = len(group_keys))
+    if np.issubdtype(counts.dtype, np.integer) or counts.dtype == bool:
+        summed = np.rint(summed).astype(np.int64)
+
+    order = np.argsort(group_keys, kind = 'stable')
+    rows = first[order]
+    clones = pd.DataFrame({col : u.take(c[rows]) for col, c, u in zip(index_cols, codes, uniques)},
+                          columns = index_cols)
+    clones['count'] = summed[order]
+    return clones, incomplete
+
+
+def deduplicate_chunks(chunks, index_cols):
+    """
+    deduplicate() of the concatenation of chunks, holding only the clones
+    found so far and one chunk in memory
+
+    Parameters
+    ----------
+    chunks : iterable
+        DataFrames with the index_cols and count columns
+    index_cols : list
+
+    Returns
+    -------
+    clones : pd.DataFrame
+    incomplete : Incomplete
+    """
+    index_cols = list(index_cols)
+    clones = None
+    pending = []
+    pending_rows = 0
+    rows, count, null_counts = 0, 0, pd.Series(0, index = index_cols, dtype = np.int64)
+    for chunk in chunks:
+        partial, incomplete = deduplicate(chunk[index_cols + ['count']], index_cols)
+        rows += incomplete.rows
+        count += incomplete.count
+        null_counts += incomplete.null_counts
+        pending.append(partial)
+        pending_rows += partial.shape[0]
+        # merge once the partial results outgrow the clones merged so far,
+        # so each clone is re-aggregated O(log(chunks)) times
+        if clones is None or pending_rows >= clones.shape[0]:
+            clones = _merge(clones, pending, index_cols)
+            pending, pending_rows = [], 0
+    if pending or clones is None:
+        clones = _merge(clones, pending, index_cols)
+    return clones, Incomplete(rows = rows, count = count, null_counts = null_counts)
+
+
+def _merge(clones, partials, index_cols):
+    frames = ([] if clones is None else [clones]) + partials
+    if not frames:
+        return pd.DataFrame(columns = index_cols + ['count'])
+    if len(frames) == 1:
+        return frames[0]
+    return deduplicate(pd.concat(frames, ignore_index = True), index_cols)[0]
+
+
+def _fill_nan(x):
+    """counts as float64 with nan as 0, the weights of np.bincount"""
+    x = np.asarray(x, dtype = np.float64)
+    return np.where(np.isnan(x), 0., x)
+
+
+def _nansum(x):
+    s = np.nansum(x)
+    return s.item() if hasattr(s, 'item') else s
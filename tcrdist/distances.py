@@ -203,7 +203,7 @@ def nearestNeighborDistance(chains, tcr, referenceTCRs, neighborPctile=10, neigh
     neighborTopN = int(neighborTopN)
 
     """Minimum is 1 neighbor and max is all neighbors"""
-    neighborTopN = min(max(1, neighborTopN), len(neighborTopN))
+    neighborTopN = min(max(1, neighborTopN), len(referenceTCRs))
 
     tcrID = getTCRID(tcr, chains)
    
@@ -1,7 +1,7 @@
 import os
 import sys
-import re
 import random
+import multiprocessing
 import pandas as pd
 
 from .paths import path_to_current_db_files
@@ -11,6 +11,7 @@ from .all_genes import all_genes
 from . import tcr_sampler
 from .amino_acids import amino_acids
 from .all_genes import all_genes
+from .motif_index import MotifIndex, RegexMotifIndex, popcount
 
 def find_cdr3_motif(
             clones_file             = "/Users/kmayerbl/PycharmProjects/tcrdist2/tcrdist2to3/mouse_pairseqs_v1_parsed_seqs_probs_mq20_clones.tsv",
@@ -45,14 +46,32 @@ def find_cdr3_motif(
             end                      = '$',
             X                        = '[A-Z]',
             dot                      = '.',
-            pseudocount              = 0.0):
+            pseudocount              = 0.0,
+            engine                   = 'bitset',
+            processes                = 1):
     """
     find_cdr3_motif preserves the behavior of the motif finder in TCRdist v1.
 
-    It is computationally expensive and may take up to 10 minutes to an hour to complete.
+    Candidate motifs are counted in the epitope, random and next-gen
+    sequences with a motif_index.MotifIndex (engine = 'bitset'), which
+    encodes each set of sequences once as position/residue-group bitsets,
+    or by running re.search over every sequence as TCRdist v1 did
+    (engine = 'regex', which may take 10 minutes to an hour to complete).
+    Both engines give the same motifs.
+
+    With processes > 1 the extensions of every (epitope, chain, seed motif)
+    are explored in a multiprocessing.Pool first, see _explore_seed_motifs();
+    the motifs are the same as with processes = 1.
 
     """
 
+    if engine == 'bitset':
+        make_index = lambda seqs : MotifIndex(seqs, begin = begin, end = end)
+    elif engine == 'regex':
+        make_index = RegexMotifIndex
+    else:
+        raise ValueError("engine must be 'bitset' or 'regex'")
+
     if constant_seed:
         random.seed(1)
     assert big, "big must be True to Match tcrdist v1 behavior"
@@ -77,26 +96,340 @@ def find_cdr3_motif(
     if hacking:
         groups = {'E':'E','F':'F',begin:begin}
 
+    search_params = dict( groups = groups, begin = begin, end = end, X = X, dot = dot,
+                          min_count = min_count, min_expected = min_expected,
+                          max_motif_len = max_motif_len,
+                          chi_squared_threshold = chi_squared_threshold,
+                          chi_squared_threshold_for_seeds = chi_squared_threshold_for_seeds,
+                          min_chi_squared_increase = min_chi_squared_increase,
+                          min_extended_count_ratio = min_extended_count_ratio,
+                          pseudocount = pseudocount, very_verbose = very_verbose )
+
+    output_strings = [] # KMB - THIS IS FOR PANDAS OUTPUT
+    output_lists = []
+
+    ## sample the background sequences of every epitope and chain before any
+    ## motif search, in the same order, so that the random state does not
+    ## depend on processes
+    units = []
+    for epitope in epitopes:
+        #if epitope != 'NP': continue
+
+        for ab in chains:
+            if verbose:
+                pass
+                #Log(epitope+' '+ab)
+
+            tcrs = all_tcrs[epitope]
+
+            seqs = []
+            seqinfos = []
+            random_seqs = []
+            ng_seqs = [] ## nextgen
+
+            for ( va, ja, vb, jb, cdr3a, cdr3b, cdr3a_masked, cdr3b_masked, va_rep, ja_rep, vb_rep, jb_rep ) \
+                in all_tcrs[epitope]:
+                if ab=='A':
+                    v_gene, j_gene, cdr3_masked, v_rep, j_rep = va, ja, cdr3a_masked, va_rep, ja_rep
+                else:
+                    v_gene, j_gene, cdr3_masked, v_rep, j_rep = vb, jb, cdr3b_masked, vb_rep, jb_rep
+
+                seqs.append( cdr3_masked )
+                seqinfos.append( (v_rep,j_rep ) )
+
+                if force_random_len:
+                    force_aa_length = len(cdr3_masked)
+                else:
+                    force_aa_length = 0
+
+                samples = tcr_sampler.sample_tcr_sequences( organism, nsamples+use_fake_seqs, v_gene, j_gene,
+                                                            force_aa_length = force_aa_length,
+                                                            in_frame_only = True, no_stop_codons = True,
+                                                            max_tries = 10000000, include_annotation = True )
+
+                assert unmask ## deleted the relevant code
+                for nucseq,protseq,anno in samples:
+                    random_seqs.append( protseq )
+
+                ## now add some nextgen seqs
+                if v_rep in ng_tcrs[ab] and j_rep in ng_tcrs[ab][v_rep]:
+                    ngl = ng_tcrs[ab][v_rep][j_rep]
+                    for (cdr3,cdr3_nucseq) in random.sample( ngl, min(nsamples,len(ngl)) ):
+                        ng_seqs.append( cdr3 )
 
-    def extend_motif( oldmotif, oldshowmotif, old_chi_squared, seqs, seq_indices, random_seqs, random_seq_indices,
-                      ng_segs, ng_seq_indices, all_good_motifs, all_seen, my_max_motif_len, best_motifs ):
+            if verbose:
+                pass
+                #Log( '{} {} nseqs {} nrand {} nnextgen {}'\
+                     #.format( epitope,ab,len(seqs),len(random_seqs),len(ng_seqs)))
+
+            assert len(random_seqs) == nsamples * len(seqs)
+
+            search = _MotifSearch( make_index( seqs ), make_index( random_seqs ), make_index( ng_seqs ),
+                                   epitope = epitope, ab = ab, **search_params )
+            units.append( ( epitope, ab, seqs, seqinfos, search ) )
+
+    if processes > 1:
+        _explore_seed_motifs( [ search for ( epitope, ab, seqs, seqinfos, search ) in units ], processes )
+
+    for ( epitope, ab, seqs, seqinfos, search ) in units:
+        seq_index = search.seq_index
+
+        all_good_motifs = search.find_motifs()
+
+        if verbose:
+            pass
+            #Log( '{} {} ngood {}'.format( epitope,ab,len(all_good_motifs)))
+
+        ## now we kill redundant guys
+        seen = []
+
+        for ( chi_squared, nfixed, count, negexpected, neg_ng_expected, motif, showmotif ) in all_good_motifs:
+            expected = -1*negexpected
+            ng_expected = -1*neg_ng_expected
+            bits = seq_index.matches( motif )
+            indices = seq_index.indices( bits )
+            assert len(indices)==count
+
+            ## check if we're redundant
+            redundant = False
+            max_coverage = 0
+            max_cover = 0
+            for iold, (old_bits,old_expected) in enumerate(seen):
+                nseen = popcount( bits & old_bits )
+                my_coverage = float(nseen)/count
+                their_coverage = float(nseen)/popcount(old_bits)
+                if my_coverage > max_coverage:
+                    max_coverage = my_coverage
+                    max_cover = iold
+                if my_coverage >= max_overlap and their_coverage >= max_overlap:
+                    ## give us a pass if their expected was above threshold while ours is below:
+                    if max(expected,ng_expected) < max_useful_expected and old_expected > max_useful_expected:
+                        pass
+                    else:
+                        redundant = True
+                        break
+            if redundant and not nofilter:
+                #print 'redundant:',showmotif,epitope,ab
+                continue
+            seen.append( ( bits, max(expected,ng_expected) ) )
+
+            v_counts = {}
+            j_counts = {}
+            for i in indices:
+                v_rep,j_rep = seqinfos[i]
+                v_counts[v_rep] = v_counts.get(v_rep,0)+1
+                j_counts[j_rep] = j_counts.get(j_rep,0)+1
+            vl = [(y,x) for x,y in v_counts.items()]
+            jl = [(y,x) for x,y in j_counts.items()]
+            vl.sort() ; vl.reverse()
+            jl.sort() ; jl.reverse()
+            vtags = ','.join( ['{}:{}'.format(y,x) for x,y in vl ][:3] )
+            jtags = ','.join( ['{}:{}'.format(y,x) for x,y in jl ][:3] )
+
+
+            print('MOTIF\t{:4d}\t{:9.4f}\t{:9.4f}\t{:8.1f}\t{:2d}\t{:15s}\t{:4d}\t{:4d}\t{:3d}\t{:4s}\t{}\t{}\t{}\t{}'\
+                .format( count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
+                         max_cover+1, int(100*max_coverage),
+                         epitope, ab, len(seqs), vtags, jtags ))
+
+            sys.stdout.flush()
+
+            string_to_output = 'MOTIF\t{:4d}\t{:9.4f}\t{:9.4f}\t{:8.1f}\t{:2d}\t{:15s}\t{:4d}\t{:4d}\t{:3d}\t{:4s}\t{}\t{}\t{}\t{}'\
+                .format( count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
+                         max_cover+1, int(100*max_coverage),
+                         epitope, ab, len(seqs), vtags, jtags)
+
+            list_to_output = ['MOTIF', count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
+                     max_cover+1, int(100*max_coverage),
+                     epitope, ab, len(seqs), vtags, jtags]
+
+
+            output_strings.append(string_to_output)
+            output_lists.append(list_to_output)
+            
+    cnames = ["file_type","count", "expect_random","expect_nextgen", "chi_squared", "nfixed","showmotif", "num", "othernum", "overlap", "ep", "ab", "nseqs", "v_rep_counts", "j_rep_counts"]
+    #column_names =['MOTIF','count', 'expected', 'ng_expected', 'chi_squared', 'nfixed', 'motif', 'len_seen', 'max_cover', 'max_coverage', 'epitope', 'chain', 'len_seqs','vtags','jtags']
+    return pd.DataFrame(output_lists, columns = cnames )
+
+
+def _add_counts(x, n):
+    ## x + 1 + ... + 1 (n times), as the per sequence increments of tcrdist v1
+    if float(x).is_integer():
+        return x + n
+    for _ in range(n):
+        x += 1
+    return x
+
+
+class _MotifSearch:
+    """
+    The search of find_cdr3_motif() for the motifs of one epitope and chain
+
+    Parameters
+    ----------
+    seq_index : motif_index.MotifIndex or RegexMotifIndex
+        epitope specific CDR3s
+    random_index : motif_index.MotifIndex or RegexMotifIndex
+        CDR3s sampled by tcr_sampler with the same V and J genes
+    ng_index : motif_index.MotifIndex or RegexMotifIndex
+        next-gen CDR3s with the same V and J genes
+
+    Notes
+    -----
+    The search extends each seed motif recursively, skipping motifs already
+    seen (all_seen) and motifs that match the same sequences as a better one
+    (best_motifs). Both depend on the motifs explored before, so the seeds
+    are searched one after the other. The expensive part, counting the
+    candidate extensions of a motif in the three sets of sequences, does
+    not: extensions() memoizes it in self.cache, which workers can fill
+    ahead of the search (see _explore_seed_motifs).
+    """
+    def __init__(self, seq_index, random_index, ng_index, groups, begin, end, X, dot,
+                 min_count, min_expected, max_motif_len, chi_squared_threshold,
+                 chi_squared_threshold_for_seeds, min_chi_squared_increase,
+                 min_extended_count_ratio, pseudocount, very_verbose, epitope, ab):
+        self.seq_index = seq_index
+        self.random_index = random_index
+        self.ng_index = ng_index
+        self.groups = groups
+        self.begin = begin
+        self.end = end
+        self.X = X
+        self.dot = dot
+        self.min_count = min_count
+        self.min_expected = min_expected
+        self.max_motif_len = max_motif_len
+        self.chi_squared_threshold = chi_squared_threshold
+        self.chi_squared_threshold_for_seeds = chi_squared_threshold_for_seeds
+        self.min_chi_squared_increase = min_chi_squared_increase
+        self.min_extended_count_ratio = min_extended_count_ratio
+        self.pseudocount = pseudocount
+        self.very_verbose = very_verbose
+        self.epitope = epitope
+        self.ab = ab
+        self.random_ratio = float( random_index.n ) / seq_index.n
+        self.ng_ratio = float( ng_index.n ) / seq_index.n
+        self.cache = {}
+        self._seed_motifs = None
+
+    def _score(self, motif, count, bits = ( None, None, None ) ):
+        """expected, ng_expected and chi_squared of motif, matching count sequences"""
+        seq_bits, random_seq_bits, ng_seq_bits = bits
+        random_count = _add_counts( self.pseudocount, popcount( self.random_index.matches( motif, random_seq_bits ) ) )
+        ng_count = _add_counts( self.pseudocount, popcount( self.ng_index.matches( motif, ng_seq_bits ) ) )
+        expected = float(random_count)/self.random_ratio
+        ng_expected = float(ng_count)/self.ng_ratio
+
+        expected_for_chi_squared = max( max( self.min_expected, expected ), ng_expected )
+        chi_squared = (count-expected_for_chi_squared)**2/expected_for_chi_squared
+        return expected, ng_expected, chi_squared
+
+    def seed_motifs(self):
         """
-        Recursive function invoked by find_cdr3_motif(). It update variable lists in place.
+        two residue motifs with chi_squared above chi_squared_threshold_for_seeds,
+        in decreasing order of chi_squared
+        """
+        if self._seed_motifs is not None:
+            return self._seed_motifs
+        groups, begin, end, X, dot = self.groups, self.begin, self.end, self.X, self.dot
+
+        ## find the seed motifs
+        seed_motifs = []
+
+        #print ('\n'+ab+'seq: ').join(seqs)
+        if self.very_verbose:
+            print ( 'numseqs:',self.seq_index.n,'numrandseqs:',self.random_index.n)
+
+        for a in groups:
+            if a== end: continue
+            for b in groups:
+                if b == begin: continue
+                if a==begin or b==end:
+                    maxsep = 7
+                else:
+                    maxsep = 5
+                for sep in range(maxsep+1):
+                    motif = [ groups[a] ]+ [X]*sep + [groups[b]]
+                    showmotif = [a]+[dot]*sep+[b]
+
+                    ## get counts for motif in random and true seqs
+                    count = popcount( self.seq_index.matches( motif ) )
+                    if count<self.min_count: continue
+                    expected, ng_expected, chi_squared = self._score( motif, count )
+
+                    if count and count >= self.min_count and count > 2*expected and count>2*ng_expected:
+
+                        if chi_squared > self.chi_squared_threshold_for_seeds:
+                            if self.very_verbose:
+                                print( 'newseed:',''.join(showmotif),chi_squared,expected,ng_expected)
+                                sys.stdout.flush()
+                            motif_len = 2
+                            info_tuple = ( chi_squared, motif_len, count, -1*expected, -1*ng_expected, motif, showmotif )
+
+                            seed_motifs.append( info_tuple )
+
+        seed_motifs.sort()
+        seed_motifs.reverse()
+        self._seed_motifs = seed_motifs
+        return seed_motifs
+
+    def find_motifs(self):
+        """
+        all good motifs of the search from every seed motif, in decreasing
+        order
+        """
+        all_good_motifs = []
+        all_seen = {}
+        best_motifs = {}
+        for info_tuple in self.seed_motifs():
+            self.extend_seed_motif( info_tuple, all_good_motifs, all_seen, best_motifs, self.very_verbose )
+
+        all_good_motifs.sort()
+        all_good_motifs.reverse()
+        return all_good_motifs
 
+    def extend_seed_motif(self, info_tuple, all_good_motifs, all_seen, best_motifs, very_verbose):
+        ( chi_squared, motif_len, count, negexpected, neg_ng_expected, motif, showmotif ) = info_tuple
+
+        #print 'seed:',chi_squared,''.join(showmotif),negexpected
+
+        ## start recursive function call
+        bits = ( self.seq_index.matches( motif ),
+                 self.random_index.matches( motif ),
+                 self.ng_index.matches( motif ) )
+        motif_len = len(showmotif) - showmotif.count('.')
+        assert motif_len == 2 #duh
+
+        if chi_squared > self.chi_squared_threshold:
+            all_good_motifs.append( ( chi_squared, 2, count, negexpected, neg_ng_expected, motif, showmotif ) )
+
+        if motif_len not in all_seen: all_seen[motif_len] = set()
+        all_seen[motif_len].add( ''.join(showmotif))
+
+        self.extend_motif( motif, showmotif, chi_squared, bits,
+                           all_good_motifs, all_seen, best_motifs, very_verbose )
+
+    def extensions(self, oldmotif, oldshowmotif, old_chi_squared, bits):
         """
-        #global chi_squared_threshold
+        the motifs extending oldmotif by one residue or anchor that pass the
+        count and chi_squared thresholds, in the order they are generated
 
-        old_count = len(seq_indices)
+        bits are the bitsets of the sequences of seq_index, random_index and
+        ng_index matching oldmotif.
+        """
+        key = ( tuple(oldmotif), old_chi_squared ) + bits
+        if key in self.cache:
+            return self.cache[key]
+        groups, begin, end, X, dot = self.groups, self.begin, self.end, self.X, self.dot
+        seq_bits = bits[0]
+
+        old_count = popcount(seq_bits)
 
         normal_pad = 3
         term_pad = 4
 
-        ## sort them in order of chisq
         extensions = []
 
-        random_ratio = float( len(random_seqs) ) / len(seqs)
-        ng_ratio = float( len(ng_seqs) ) / len(seqs)
-
         for c in groups:
             if c==begin or c==end:
                 pad = term_pad
@@ -120,333 +453,125 @@ def find_cdr3_motif(
                     motif = motif[:-1]
                     showmotif = showmotif[:-1]
 
-                prog = re.compile(''.join(motif))
-                count=0
-                for ii in seq_indices:
-                    if prog.search(seqs[ii]):
-                        count += 1
-                if count<min_count or count < min_extended_count_ratio * old_count:
+                count = popcount( self.seq_index.matches( motif, seq_bits ) )
+                if count<self.min_count or count < self.min_extended_count_ratio * old_count:
                     continue
 
-                best_possible_chi_squared = (count-min_expected)**2/min_expected
-                if best_possible_chi_squared < old_chi_squared+min_chi_squared_increase:
+                best_possible_chi_squared = (count-self.min_expected)**2/self.min_expected
+                if best_possible_chi_squared < old_chi_squared+self.min_chi_squared_increase:
                     continue
 
-                random_count=pseudocount
-                for ii in random_seq_indices:
-                    if prog.search(random_seqs[ii]):
-                        random_count += 1
-                ng_count=pseudocount
-                for ii in ng_seq_indices:
-                    if prog.search(ng_seqs[ii]):
-                        ng_count += 1
-                expected = float(random_count)/random_ratio
-                ng_expected = float(ng_count)/ng_ratio
-
-                expected_for_chi_squared = max( max( min_expected, expected ), ng_expected )
-                chi_squared = (count-expected_for_chi_squared)**2/expected_for_chi_squared
+                expected, ng_expected, chi_squared = self._score( motif, count, bits )
 
                 if count and count > 2*expected and count > 2*ng_expected and \
-                   chi_squared > old_chi_squared+min_chi_squared_increase:
+                   chi_squared > old_chi_squared+self.min_chi_squared_increase:
                     motif_len = len(showmotif) - showmotif.count('.')
 
-                    if motif_len in all_seen and ''.join(showmotif) in all_seen[motif_len]:
-                        if very_verbose:
-                            print('repeat',motif_len,''.join(showmotif))
-                        continue
-
-                    if motif_len not in all_seen: all_seen[motif_len] = set()
-                    all_seen[motif_len].add( ''.join(showmotif))
-
                     ### what we will eventually add to all_good_motifs
                     info_tuple = ( chi_squared, motif_len, count, -1*expected, -1*ng_expected, motif, showmotif )
 
-                    extensions.append( ( info_tuple, prog ) )
+                    extensions.append( info_tuple )
+
+        self.cache[key] = extensions
+        return extensions
+
+    def extend_motif(self, oldmotif, oldshowmotif, old_chi_squared, bits,
+                     all_good_motifs, all_seen, best_motifs, very_verbose):
+        """
+        Recursive function invoked by find_cdr3_motif(). It update variable lists in place.
+
+        """
+        seq_bits, random_seq_bits, ng_seq_bits = bits
+
+        ## sort them in order of chisq
+        extensions = []
+
+        for info_tuple in self.extensions( oldmotif, oldshowmotif, old_chi_squared, bits ):
+            ( chi_squared, motif_len, count, negexpected, neg_ng_expected, motif, showmotif ) = info_tuple
+
+            if motif_len in all_seen and ''.join(showmotif) in all_seen[motif_len]:
+                if very_verbose:
+                    print('repeat',motif_len,''.join(showmotif))
+                continue
+
+            if motif_len not in all_seen: all_seen[motif_len] = set()
+            all_seen[motif_len].add( ''.join(showmotif))
+
+            extensions.append( info_tuple )
 
         extensions.sort()
         extensions.reverse() ## do them in decreasing order of chi_squared
 
-        for ( info_tuple, prog ) in extensions:
+        for info_tuple in extensions:
             ( chi_squared, motif_len, count, negexpected, neg_ng_expected, motif, showmotif ) = info_tuple
 
             ## do we really want to pursue this guy?
-            new_seq_indices = []
-            for ii in seq_indices:
-                if prog.search(seqs[ii]):
-                    new_seq_indices.append(ii)
-            new_seq_indices = tuple( new_seq_indices )
+            ## (the bitset identifies the set of matched sequences)
+            new_seq_bits = self.seq_index.matches( motif, seq_bits )
 
             if count not in best_motifs: best_motifs[count] = {}
 
-            best_chi_squared = best_motifs[count].get(new_seq_indices,0)
+            best_chi_squared = best_motifs[count].get(new_seq_bits,0)
 
             if chi_squared<best_chi_squared:
                 if very_verbose:
                     print( 'worse motif:',chi_squared,best_chi_squared,''.join(showmotif))
                 continue
 
-            best_motifs[count][new_seq_indices] = chi_squared
+            best_motifs[count][new_seq_bits] = chi_squared
 
 
             if very_verbose:
                 print( 'NEW {:3d} {:5.2f} {:5.2f} {:8.1f} {:15s} {:6d} {:4s} {}'\
                     .format( count, -1*negexpected, -1*neg_ng_expected,
                              chi_squared, ''.join(showmotif), len(all_seen[motif_len]),
-                             epitope, ab ))
+                             self.epitope, self.ab ))
                 sys.stdout.flush()
 
 
             all_good_motifs.append( info_tuple )
 
-            if motif_len < my_max_motif_len:
-
-                new_random_seq_indices = []
-                for ii in random_seq_indices:
-                    if prog.search(random_seqs[ii]):
-                        new_random_seq_indices.append(ii)
-
-                new_ng_seq_indices = []
-                for ii in ng_seq_indices:
-                    if prog.search(ng_seqs[ii]):
-                        new_ng_seq_indices.append(ii)
-
-                extend_motif( motif, showmotif, chi_squared, seqs, new_seq_indices,
-                              random_seqs, new_random_seq_indices, ng_seqs, new_ng_seq_indices,
-                              all_good_motifs, all_seen, my_max_motif_len, best_motifs )
-
-    output_strings = [] # KMB - THIS IS FOR PANDAS OUTPUT
-    output_lists = []
-    for epitope in epitopes:
-        #if epitope != 'NP': continue
-
-        for ab in chains:
-            if verbose:
-                pass
-                #Log(epitope+' '+ab)
+            if motif_len < self.max_motif_len:
 
-            tcrs = all_tcrs[epitope]
+                new_bits = ( new_seq_bits,
+                             self.random_index.matches( motif, random_seq_bits ),
+                             self.ng_index.matches( motif, ng_seq_bits ) )
 
-            seqs = []
-            seqinfos = []
-            random_seqs = []
-            ng_seqs = [] ## nextgen
+                self.extend_motif( motif, showmotif, chi_squared, new_bits,
+                                   all_good_motifs, all_seen, best_motifs, very_verbose )
 
-            for ( va, ja, vb, jb, cdr3a, cdr3b, cdr3a_masked, cdr3b_masked, va_rep, ja_rep, vb_rep, jb_rep ) \
-                in all_tcrs[epitope]:
-                if ab=='A':
-                    v_gene, j_gene, cdr3_masked, v_rep, j_rep = va, ja, cdr3a_masked, va_rep, ja_rep
-                else:
-                    v_gene, j_gene, cdr3_masked, v_rep, j_rep = vb, jb, cdr3b_masked, vb_rep, jb_rep
-
-                seqs.append( cdr3_masked )
-                seqinfos.append( (v_rep,j_rep ) )
 
-                if force_random_len:
-                    force_aa_length = len(cdr3_masked)
-                else:
-                    force_aa_length = 0
-
-                samples = tcr_sampler.sample_tcr_sequences( organism, nsamples+use_fake_seqs, v_gene, j_gene,
-                                                            force_aa_length = force_aa_length,
-                                                            in_frame_only = True, no_stop_codons = True,
-                                                            max_tries = 10000000, include_annotation = True )
-
-                assert unmask ## deleted the relevant code
-                for nucseq,protseq,anno in samples:
-                    random_seqs.append( protseq )
-
-                ## now add some nextgen seqs
-                if v_rep in ng_tcrs[ab] and j_rep in ng_tcrs[ab][v_rep]:
-                    ngl = ng_tcrs[ab][v_rep][j_rep]
-                    for (cdr3,cdr3_nucseq) in random.sample( ngl, min(nsamples,len(ngl)) ):
-                        ng_seqs.append( cdr3 )
-
-            if verbose:
-                pass
-                #Log( '{} {} nseqs {} nrand {} nnextgen {}'\
-                     #.format( epitope,ab,len(seqs),len(random_seqs),len(ng_seqs)))
-
-            assert len(random_seqs) == nsamples * len(seqs)
-
-            random_ratio = float( len(random_seqs) ) / len(seqs)
-            ng_ratio = float( len(ng_seqs) ) / len(seqs)
-
-            all_good_motifs = []
-            all_seen = {}
-            best_motifs = {}
-
-            ## find the seed motifs
-            seed_motifs = []
-
-            #print ('\n'+ab+'seq: ').join(seqs)
-            if very_verbose:
-                print ( 'numseqs:',len(seqs),'numrandseqs:',len(random_seqs))
-
-            for a in groups:
-                if a== end: continue
-                for b in groups:
-                    if b == begin: continue
-                    if a==begin or b==end:
-                        maxsep = 7
-                    else:
-                        maxsep = 5
-                    for sep in range(maxsep+1):
-                        motif = [ groups[a] ]+ [X]*sep + [groups[b]]
-                        showmotif = [a]+[dot]*sep+[b]
-
-                        ## get counts for motif in random and true seqs
-                        prog = re.compile(''.join(motif))
-                        count=0
-                        for seq in seqs:
-                            if prog.search(seq):
-                                count += 1
-                        if count<min_count: continue
-                        random_count=pseudocount
-                        for seq in random_seqs:
-                            if prog.search(seq):
-                                random_count += 1
-                        ng_count=pseudocount
-                        for seq in ng_seqs:
-                            if prog.search(seq):
-                                ng_count += 1
-                        expected = float(random_count)/random_ratio
-                        ng_expected = float(ng_count)/ng_ratio
-
-                        expected_for_chi_squared = max( max( min_expected, expected ), ng_expected )
-                        chi_squared = (count-expected_for_chi_squared)**2/expected_for_chi_squared
-
-                        if count and count >= min_count and count > 2*expected and count>2*ng_expected:
-
-                            if chi_squared > chi_squared_threshold_for_seeds:
-                                if very_verbose:
-                                    print( 'newseed:',''.join(showmotif),chi_squared,expected,ng_expected)
-                                    sys.stdout.flush()
-                                motif_len = 2
-                                info_tuple = ( chi_squared, motif_len, count, -1*expected, -1*ng_expected, motif, showmotif )
-
-                                seed_motifs.append( ( info_tuple, prog ) )
-
-            seed_motifs.sort()
-            seed_motifs.reverse()
-
-            if verbose:
-                pass
-                #Log( '{} {} nseeds {}'.format( epitope,ab,len(seed_motifs)))
-
-            for ( info_tuple, prog ) in seed_motifs:
-                ( chi_squared, motif_len, count, negexpected, neg_ng_expected, motif, showmotif ) = info_tuple
-
-                #print 'seed:',chi_squared,''.join(showmotif),negexpected
-
-                ## start recursive function call
-                seq_indices = []
-                for ii,seq in enumerate(seqs):
-                    if prog.search(seq):
-                        seq_indices.append(ii)
-                random_seq_indices = []
-                for ii,seq in enumerate(random_seqs):
-                    if prog.search(seq):
-                        random_seq_indices.append(ii)
-                ng_seq_indices = []
-                for ii,seq in enumerate(ng_seqs):
-                    if prog.search(seq):
-                        ng_seq_indices.append(ii)
-                motif_len = len(showmotif) - showmotif.count('.')
-                assert motif_len == 2 #duh
-
-                if chi_squared > chi_squared_threshold:
-                    all_good_motifs.append( ( chi_squared, 2, count, negexpected, neg_ng_expected, motif, showmotif ) )
-
-                if motif_len not in all_seen: all_seen[motif_len] = set()
-                all_seen[motif_len].add( ''.join(showmotif))
-
-                extend_motif( motif, showmotif, chi_squared, seqs, seq_indices,
-                              random_seqs, random_seq_indices, ng_seqs, ng_seq_indices,
-                              all_good_motifs, all_seen, max_motif_len,
-                              best_motifs )
-
-
-
-            all_good_motifs.sort()
-            all_good_motifs.reverse()
-
-            if verbose:
-                pass
-                #Log( '{} {} ngood {}'.format( epitope,ab,len(all_good_motifs)))
-
-            ## now we kill redundant guys
-            seen = []
-
-            for ( chi_squared, nfixed, count, negexpected, neg_ng_expected, motif, showmotif ) in all_good_motifs:
-                expected = -1*negexpected
-                ng_expected = -1*neg_ng_expected
-                prog = re.compile(''.join(motif))
-                indices = []
-                for ii,seq in enumerate(seqs):
-                    if prog.search(seq):
-                        indices.append( ii )
-                assert len(indices)==count
-
-                ## check if we're redundant
-                redundant = False
-                max_coverage = 0
-                max_cover = 0
-                for iold, (old_indices,old_expected) in enumerate(seen):
-                    nseen = 0
-                    for i in indices:
-                        if i in old_indices:
-                            nseen += 1
-                    my_coverage = float(nseen)/count
-                    their_coverage = float(nseen)/len(old_indices)
-                    if my_coverage > max_coverage:
-                        max_coverage = my_coverage
-                        max_cover = iold
-                    if my_coverage >= max_overlap and their_coverage >= max_overlap:
-                        ## give us a pass if their expected was above threshold while ours is below:
-                        if max(expected,ng_expected) < max_useful_expected and old_expected > max_useful_expected:
-                            pass
-                        else:
-                            redundant = True
-                            break
-                if redundant and not nofilter:
-                    #print 'redundant:',showmotif,epitope,ab
-                    continue
-                seen.append( ( set(indices), max(expected,ng_expected) ) )
-
-                v_counts = {}
-                j_counts = {}
-                for i in indices:
-                    v_rep,j_rep = seqinfos[i]
-                    v_counts[v_rep] = v_counts.get(v_rep,0)+1
-                    j_counts[j_rep] = j_counts.get(j_rep,0)+1
-                vl = [(y,x) for x,y in v_counts.items()]
-                jl = [(y,x) for x,y in j_counts.items()]
-                vl.sort() ; vl.reverse()
-                jl.sort() ; jl.reverse()
-                vtags = ','.join( ['{}:{}'.format(y,x) for x,y in vl ][:3] )
-                jtags = ','.join( ['{}:{}'.format(y,x) for x,y in jl ][:3] )
-
-
-                print('MOTIF\t{:4d}\t{:9.4f}\t{:9.4f}\t{:8.1f}\t{:2d}\t{:15s}\t{:4d}\t{:4d}\t{:3d}\t{:4s}\t{}\t{}\t{}\t{}'\
-                    .format( count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
-                             max_cover+1, int(100*max_coverage),
-                             epitope, ab, len(seqs), vtags, jtags ))
+def _explore_seed_motifs(searches, processes):
+    """
+    Fills the extensions() caches of searches in a multiprocessing.Pool
+
+    Each worker extends one seed motif of one search on its own, with
+    fresh all_seen and best_motifs, and returns the extensions() it
+    computed. Those are the same whatever the order of the seeds, so
+    _MotifSearch.find_motifs() afterwards replays the search in the
+    serial order, with the same pruning, mostly from the cache. The
+    searches, with their indexes of the sequences, are sent to each worker
+    once, when it starts.
+    """
+    tasks = [ ( i, j ) for i, search in enumerate(searches) for j in range(len(search.seed_motifs())) ]
+    if not tasks:
+        return
+    with multiprocessing.Pool(processes, initializer = _init_seed_worker, initargs = (searches,)) as pool:
+        for i, cache in pool.imap_unordered(_explore_seed_job, tasks):
+            searches[i].cache.update(cache)
 
-                sys.stdout.flush()
 
-                string_to_output = 'MOTIF\t{:4d}\t{:9.4f}\t{:9.4f}\t{:8.1f}\t{:2d}\t{:15s}\t{:4d}\t{:4d}\t{:3d}\t{:4s}\t{}\t{}\t{}\t{}'\
-                    .format( count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
-                             max_cover+1, int(100*max_coverage),
-                             epitope, ab, len(seqs), vtags, jtags)
+_worker_searches = None
 
-                list_to_output = ['MOTIF', count, expected, ng_expected, chi_squared, nfixed, ''.join(showmotif), len(seen),
-                         max_cover+1, int(100*max_coverage),
-                         epitope, ab, len(seqs), vtags, jtags]
+def _init_seed_worker(searches):
+    global _worker_searches
+    _worker_searches = searches
 
 
-                output_strings.append(string_to_output)
-                output_lists.append(list_to_output)
-                
-    cnames = ["file_type","count", "expect_random","expect_nextgen", "chi_squared", "nfixed","showmotif", "num", "othernum", "overlap", "ep", "ab", "nseqs", "v_rep_counts", "j_rep_counts"]
-    #column_names =['MOTIF','count', 'expected', 'ng_expected', 'chi_squared', 'nfixed', 'motif', 'len_seen', 'max_cover', 'max_coverage', 'epitope', 'chain', 'len_seqs','vtags','jtags']
-    return pd.DataFrame(output_lists, columns = cnames )
+def _explore_seed_job(task):
+    """extensions computed extending one seed motif, for multiprocessing.Pool"""
+    i, j = task
+    search = _worker_searches[i]
+    search.cache = {}
+    search.extend_seed_motif( search.seed_motifs()[j], [], {}, {}, False )
+    return i, search.cache
@@ -0,0 +1,197 @@
+"""
+Compiled binary snapshot of the reference gene db
+
+all_genes.py, all_genes_db.all_genes_db and repertoire_db.RefGeneSet used to
+parse alphabeta_db.tsv / gammadelta_db.tsv with pandas, build one gene object
+per row with iterrows, translate every nucleotide sequence and (all_genes.py)
+scan all pairs of V genes for loop sequence representatives, every time.
+
+compile_snapshot() does this once per db file and writes the result as a
+structured .npy array (one fixed width string field per column) that
+load_snapshot() opens via memory map. The snapshot holds the db columns plus
+the translated protseq and the V/J loop representatives rep and mm1_rep
+computed by all_genes.py, so the gene objects are rebuilt from plain strings.
+
+Snapshots live in the gene_db/ subdirectory of paths.path_to_user_cache()
+($TCRDIST_CACHE_DIR, $XDG_CACHE_HOME/tcrdist or ~/.cache/tcrdist). The file
+name holds SNAPSHOT_VERSION and a checksum of the db file, the package version
+and the modules deriving the snapshot rows, so a changed db, snapshot layout
+or derivation code is compiled afresh. If the snapshot can not be written
+(e.g. a read-only cache directory) it is kept in memory only.
+
+"""
+import hashlib
+import logging
+import os
+import os.path as op
+import tempfile
+
+import numpy as np
+
+from .paths import path_to_db, path_to_user_cache
+from .version import __version__
+
+logger = logging.getLogger('gene_snapshot.py')
+
+# bump when the fields or their meaning change
+SNAPSHOT_VERSION = 1
+
+fields = ['id', 'organism', 'chain', 'region', 'nucseq', 'frame', 'aligned_protseq',
+          'cdr_columns', 'cdrs', 'protseq', 'rep', 'mm1_rep']
+
+# modules whose code derives the snapshot rows (see _records)
+_builder_modules = ['all_genes.py', 'gene_snapshot.py', 'objects.py', 'translation.py']
+
+_snapshots = {}
+
+
+def snapshot_dir():
+    """
+    Returns
+    -------
+    path : string
+        directory holding the compiled snapshots
+    """
+    return path_to_user_cache('gene_db')
+
+
+def snapshot_path(db_file = "alphabeta_db.tsv"):
+    """
+    Path of the snapshot of db_file (a file name in path_to_db)
+    """
+    from .v_region_cache import _db_checksum
+    package_dir = op.dirname(op.abspath(__file__))
+    h = hashlib.sha1(repr((_db_checksum(op.join(path_to_db, db_file)), __version__)).encode())
+    for module in _builder_modules:
+        h.update(_db_checksum(op.join(package_dir, module)).encode())
+    return op.join(snapshot_dir(), '{}.v{}.{}.npy'.format(db_file, SNAPSHOT_VERSION, h.hexdigest()[:16]))
+
+
+def _records(db_file):
+    """
+    one tuple of strings per db row, in db order
+    """
+    import pandas as pd
+    from .all_genes import _build_all_genes
+    db_path = op.join(path_to_db, db_file)
+    genes = _build_all_genes(db_path)
+    db_df = pd.read_csv(db_path, delimiter = '\t')
+    records = []
+    for row in db_df.itertuples(index = False):
+        g = genes[row.organism][row.id]
+        cdr_columns = '' if pd.isnull(row.cdr_columns) else row.cdr_columns
+        cdrs = '' if pd.isnull(row.cdrs) else row.cdrs
+        records.append((row.id, row.organism, row.chain, row.region, row.nucseq, str(row.frame),
+                        row.aligned_protseq, cdr_columns, cdrs, g.protseq,
+                        getattr(g, 'rep', ''), getattr(g, 'mm1_rep', '')))
+    return records
+
+
+def _build_snapshot(db_file):
+    """
+    the snapshot of db_file as an in memory structured array
+    """
+    records = _records(db_file)
+    widths = [max(1, max(len(r[i]) for r in records)) for i in range(len(fields))]
+    return np.array(records, dtype = [(f, 'U{}'.format(w)) for f, w in zip(fields, widths)])
+
+
+def compile_snapshot(db_file = "alphabeta_db.tsv", path = None, arr = None):
+    """
+    Parse db_file and write its snapshot
+
+    Parameters
+    ----------
+    db_file : string
+        "alphabeta_db.tsv" or "gammadelta_db.tsv"
+    path : string
+        output file, by default snapshot_path(db_file)
+    arr : np.ndarray
+        the snapshot if already built
+
+    Returns
+    -------
+    path : string
+
+    Raises
+    ------
+    OSError
+        if the snapshot can not be written
+    """
+    if path is None:
+        path = snapshot_path(db_file)
+    if arr is None:
+        arr = _build_snapshot(db_file)
+    os.makedirs(op.dirname(path), exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = op.dirname(path), suffix = '.npy.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            np.save(fh, arr)
+        os.replace(tmp, path)
+    except:
+        if op.exists(tmp):
+            os.remove(tmp)
+        raise
+    logger.info('compiled {} genes of {} to {}'.format(len(arr), db_file, path))
+    return path
+
+
+def load_snapshot(db_file = "alphabeta_db.tsv"):
+    """
+    Memory mapped snapshot of db_file, compiled first if needed
+
+    Parameters
+    ----------
+    db_file : string
+        "alphabeta_db.tsv" or "gammadelta_db.tsv"
+
+    Returns
+    -------
+    snapshot : np.ndarray
+        structured array with one string field per name in fields, in
+        memory rather than memory mapped if it could not be written
+    """
+    path = snapshot_path(db_file)
+    if path not in _snapshots:
+        if op.exists(path):
+            _snapshots[path] = np.load(path, mmap_mode = 'r')
+        else:
+            arr = _build_snapshot(db_file)
+            try:
+                compile_snapshot(db_file, path, arr)
+                arr = np.load(path, mmap_mode = 'r')
+            except OSError as e:
+                logger.warning('gene db snapshot could not be cached in {}: {}'.format(op.dirname(path), e))
+            _snapshots[path] = arr
+    return _snapshots[path]
+
+
+def gene_rows(db_file = "alphabeta_db.tsv"):
+    """
+    Rows of db_file as dicts, usable in place of the pandas rows the gene
+    classes (objects.TCR_Gene, repertoire_db.TCRGene) are constructed from.
+    Missing cdrs and cdr_columns are None, frame is an int, and protseq,
+    rep and mm1_rep are added (rep and mm1_rep are '' for genes without a
+    representative, such as D genes).
+
+    Parameters
+    ----------
+    db_file : string
+        "alphabeta_db.tsv" or "gammadelta_db.tsv"
+
+    Returns
+    -------
+    rows : list
+        list of dicts
+    """
+    snapshot = load_snapshot(db_file)
+    columns = [snapshot[f].tolist() for f in fields]
+    rows = []
+    for values in zip(*columns):
+        row = dict(zip(fields, values))
+        row['frame'] = int(row['frame'])
+        for f in ['cdr_columns', 'cdrs']:
+            if not row[f]:
+                row[f] = None
+        rows.append(row)
+    return rows
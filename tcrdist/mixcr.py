@@ -1,10 +1,18 @@
 import sys
 import re
+import os
+import glob
+import multiprocessing
 import pandas as pd 
 import numpy as np
 from tcrdist import repertoire_db
 import warnings
 
+# the columns of mixcr exportAlignments (.result.txt) and exportClones
+# (.clns.txt) output used by mixcr_to_tcrdist2
+_seqs_columns = ['allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore', 'nSeqCDR3','aaSeqCDR3']
+_clones_columns = ['cloneId', 'cloneCount'] + _seqs_columns
+
 
 def mixcr_to_tcrdist2(chain:str, 
                       organism:str, 
@@ -80,41 +88,110 @@ def mixcr_to_tcrdist2(chain:str,
         raise KeyError ("chain must be 'alpha','beta','gamma', or 'delta'")
     
     if seqs_fn is not None:
-        seqs_df   = pd.read_csv(seqs_fn, "\t")
-        seqs_df   = seqs_df[['allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore', 'nSeqCDR3','aaSeqCDR3']].copy()
-        for k in ['allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore']:
-            # cleanup see function defintioins above (take only the top hit and convert allele *00 to *01)
-            seqs_df[k] = seqs_df[k].apply(_take_top_mixcr_gene_hit).\
-                apply(_allele_00_to_01).\
-                apply(_change_TRAVDV_to_TRAVdashDV)
-
-        seqs_df   = seqs_df.rename(columns = {  'allVHitsWithScore' : gene_names[chain][0],                    
-                                                'allDHitsWithScore' : gene_names[chain][1], 
-                                                'allJHitsWithScore' : gene_names[chain][2],
-                                                'nSeqCDR3'          : gene_names[chain][3],
-                                                'aaSeqCDR3'         : gene_names[chain][4]})
-        df = seqs_df.copy()
-
+        df = pd.read_csv(seqs_fn, sep = "\t", usecols = _seqs_columns).reindex(columns = _seqs_columns)
     elif clones_fn is not None:
-        clones_df = pd.read_csv(clones_fn, "\t")
-        clones_df = clones_df[['cloneId', 'cloneCount','allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore', 'nSeqCDR3','aaSeqCDR3']].copy()
-        for k in ['allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore']:
-            # cleanup see function defintioins above (take only the top hit and convert allele *00 to *01)
-            clones_df[k] = clones_df[k].apply(_take_top_mixcr_gene_hit).\
-                apply(_allele_00_to_01).\
-                apply(_change_TRAVDV_to_TRAVdashDV)
-
-        clones_df = clones_df.rename(columns = {    'cloneId'           : "clone_id",
-                                                    'cloneCount'        : "count",
-                                                    'allVHitsWithScore' : gene_names[chain][0],                    
-                                                    'allDHitsWithScore' : gene_names[chain][1], 
-                                                    'allJHitsWithScore' : gene_names[chain][2],
-                                                    'nSeqCDR3'          : gene_names[chain][3],
-                                                    'aaSeqCDR3'         : gene_names[chain][4]})
-        df = clones_df.copy()
+        df = pd.read_csv(clones_fn, sep = "\t", usecols = _clones_columns).reindex(columns = _clones_columns)
+
+    for k in ['allVHitsWithScore','allDHitsWithScore', 'allJHitsWithScore']:
+        # cleanup see function defintioins below (take only the top hit and convert allele *00 to *01)
+        df[k] = _clean_mixcr_gene_hits(df[k])
+
+    df = df.rename(columns = {  'cloneId'           : "clone_id",
+                                'cloneCount'        : "count",
+                                'allVHitsWithScore' : gene_names[chain][0],
+                                'allDHitsWithScore' : gene_names[chain][1],
+                                'allJHitsWithScore' : gene_names[chain][2],
+                                'nSeqCDR3'          : gene_names[chain][3],
+                                'aaSeqCDR3'         : gene_names[chain][4]})
     
     return(df)
 
+def mixcr_dir_to_tcrdist2(paths,
+                          chain:str,
+                          organism:str,
+                          subjects = None,
+                          processes:int = 1,
+                          parquet_dir:str = None):
+    """
+    Converts many mixcr clones files (.clns.txt) with mixcr_to_tcrdist2,
+    one file per worker process, into one DataFrame with a subject column
+
+    Parameters
+    ----------
+    paths : str or list
+        a directory, whose *.clns.txt files are converted in sorted order,
+        or a list of clones files
+    chain : str
+        'alpha', 'beta', 'gamma', or 'delta'
+    organism : str
+        'human' or 'mouse"
+    subjects : list or None
+        subject of each file, by default the file name without .clns.txt
+    processes : int
+        number of files converted concurrently
+    parquet_dir : str or None
+        if given, the clones of each file are written to
+        parquet_dir/<subject>.parquet instead of being returned, so that
+        memory use is bounded by the largest file. Requires pyarrow or
+        fastparquet.
+
+    Returns
+    -------
+    df : pd.DataFrame or list
+        the concatenated clones (the columns of mixcr_to_tcrdist2 followed
+        by "subject"), or the list of Parquet files written if parquet_dir
+        is given. pd.read_parquet(parquet_dir) reads them back as one
+        DataFrame.
+
+    Example
+    -------
+
+    .. code-block:: python
+
+        from tcrdist import mixcr
+
+        df = mixcr.mixcr_dir_to_tcrdist2('mixcr_output/',
+                                         chain = "delta",
+                                         organism = "human",
+                                         processes = 8)
+        df = mixcr.remove_entries_with_invalid_vgene(df,
+                                                     chain = "delta",
+                                                     organism = "human")
+    """
+    if isinstance(paths, str):
+        paths = sorted(glob.glob(os.path.join(paths, '*.clns.txt')))
+    if len(paths) == 0:
+        raise ValueError ("no mixcr clones files to convert")
+    if subjects is None:
+        subjects = [re.sub(r'\.clns\.txt$', '', os.path.basename(fn)) for fn in paths]
+    if len(subjects) != len(paths):
+        raise ValueError ("subjects must name each of the paths")
+    outputs = [None] * len(paths)
+    if parquet_dir is not None:
+        os.makedirs(parquet_dir, exist_ok = True)
+        outputs = [os.path.join(parquet_dir, f"{s}.parquet") for s in subjects]
+
+    jobs = [(chain, organism, fn, s, o) for fn, s, o in zip(paths, subjects, outputs)]
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(_mixcr_clones_job, jobs, chunksize = 1)
+    else:
+        results = [_mixcr_clones_job(job) for job in jobs]
+
+    if parquet_dir is not None:
+        return results
+    return pd.concat(results, ignore_index = True)
+
+def _mixcr_clones_job(args):
+    """mixcr_to_tcrdist2 of one clones file, for multiprocessing.Pool.map"""
+    chain, organism, clones_fn, subject, output = args
+    df = mixcr_to_tcrdist2(chain = chain, organism = organism, clones_fn = clones_fn)
+    df['subject'] = subject
+    if output is None:
+        return df
+    df.to_parquet(output, index = False)
+    return output
+
 def remove_entries_with_invalid_vgene(df, chain:str,organism:str):
     """
     Uses _validate_gene_names to remove cells, or clones rows that lack a valid v_gene name
@@ -177,7 +254,8 @@ def remove_entries_with_invalid_cdr3(df, chain:str):
    
     cdr3_x_aa = chain_names[chain]
     print(cdr3_x_aa)
-    v = df[cdr3_x_aa].apply(lambda x : _valid_cdr3(x))
+    # _valid_cdr3 of each value
+    v = df[cdr3_x_aa].astype(object).str.match('^[ACDEFGHIKLMNPQRSTVWY]*$').fillna(False).astype(bool)
 
     n_invalid_cdr3 = df[v == False].shape[0]
     invalid_names =df[v == False][cdr3_x_aa].unique()
@@ -271,6 +349,35 @@ def _take_top_mixcr_gene_hit(s):
         top_hit = np.NaN   
     return(top_hit)
 
+def _clean_mixcr_gene_hits(series):
+    """
+    _take_top_mixcr_gene_hit, _allele_00_to_01 and _change_TRAVDV_to_TRAVdashDV
+    of every value of series, with pandas string methods
+
+    Parameters
+    ----------
+    series : pd.Series
+        mixcr allVHitsWithScore, allDHitsWithScore or allJHitsWithScore column
+
+    Returns
+    -------
+    genes : pd.Series
+        object series, NaN where series holds no string
+
+    Examples
+    --------
+    >>> _clean_mixcr_gene_hits(pd.Series(['TRAV29DV5*00(45),TRDV2*00(40)', np.NaN])).tolist()
+    ['TRAV29/DV5*01', nan]
+    """
+    # each distinct value is converted once (NaN gets code -1);
+    # an all missing column is read as float, which has no .str
+    codes, uniques = pd.factorize(series.astype(object))
+    genes = pd.Series(uniques, dtype = object).str.extract(r'^([^,(]*)', expand = False)
+    genes = genes.str.replace("*00", "*01", regex = False)
+    genes = genes.str.replace(r'^(TRAV[0-9]+(?:-[1-2])?)(DV)', r'\1/\2', regex = True)
+    genes = np.append(genes.values.astype(object), np.NaN)
+    return pd.Series(genes[codes], index = series.index, name = series.name)
+
 
 def _validate_gene_names(series, chain:str, organism:str):
     """
@@ -306,27 +413,34 @@ def _validate_gene_names(series, chain:str, organism:str):
         raise KeyError("chain must be 'alpha','beta','gamma', or 'delta'")
 
 
-    if chain in ['gamma','delta']:
-        # Lookup appropriate gammadelta_db
-        all_genes = repertoire_db.RefGeneSet(db_file = "gammadelta_db.tsv").all_genes
-        # Lookup appropriate organism
-        all_genes= all_genes[organism]
-        if chain == 'gamma':
-            all_genes = [x for x in all_genes if all_genes[x].chain =='A']
-        if chain == 'delta':
-            all_genes = [x for x in all_genes if all_genes[x].chain =='B']
-    
-    if chain in ['alpha','beta']:
-        # Lookup appropriate alphabeta_db
-        all_genes = repertoire_db.RefGeneSet(db_file = "alphabeta_db.tsv").all_genes
+    valid = series.isin(_valid_gene_names(chain = chain, organism = organism))
+    return(valid)
+
+
+# (organism, chain) -> frozenset of reference gene names
+_valid_gene_name_sets = {}
+
+def _valid_gene_names(chain:str, organism:str):
+    """
+    The names of the reference genes of chain ('alpha','beta','gamma', or
+    'delta') and organism, computed once per process
+
+    Returns
+    -------
+    names : frozenset
+    """
+    key = (organism, chain)
+    if key not in _valid_gene_name_sets:
+        if chain in ['gamma','delta']:
+            # Lookup appropriate gammadelta_db
+            all_genes = repertoire_db.get_ref_gene_set(db_file = "gammadelta_db.tsv").all_genes
+        else:
+            # Lookup appropriate alphabeta_db
+            all_genes = repertoire_db.get_ref_gene_set(db_file = "alphabeta_db.tsv").all_genes
         # Lookup appropriate organism
         all_genes = all_genes[organism]
-        if chain == 'alpha':
-            all_genes = [x for x in all_genes if all_genes[x].chain =='A']
-        if chain == 'beta':
-            all_genes = [x for x in all_genes if all_genes[x].chain =='B']
-    
-    
-    valid = series.apply(lambda x : x in all_genes )
-    return(valid)
+        # gamma and delta genes are stored as chains A and B
+        ab = 'A' if chain in ['alpha','gamma'] else 'B'
+        _valid_gene_name_sets[key] = frozenset(x for x in all_genes if all_genes[x].chain == ab)
+    return _valid_gene_name_sets[key]
 
@@ -0,0 +1,206 @@
+"""
+Bitset indexes of CDR3 sequences for counting motif matches
+
+find_cdr3_motifs_in_tcrdist2.find_cdr3_motif() scores candidate motifs
+such as ['^', '[A-Z]', 'G', '[DE]'] (the tokens of a regular expression,
+each matching one residue or anchoring the match) by the number of
+epitope, random and next-gen CDR3s they match. It used to compile each
+candidate and run re.search over every sequence of the three sets.
+
+MotifIndex encodes a set of sequences once as one bitset (a python int,
+bit i for sequence i) per (residue class, position) pair, with positions
+counted from the start and from the end of the sequence. The sequences
+matching a motif are then the AND over its tokens of the bitsets at the
+token positions: positions from the start for '^' anchored motifs, from the
+end for '$' anchored ones, and the OR over every offset of the sequences
+otherwise. A count is a popcount. Bitsets are built lazily, per residue
+class and position actually used, with numpy.
+
+RegexMotifIndex has the same interface and runs re.search over the
+sequences, as the original code did.
+
+"""
+import re
+
+import numpy as np
+
+try:
+    _popcount = int.bit_count
+except AttributeError: # python < 3.10
+    def _popcount(x):
+        return bin(x).count('1')
+
+
+def popcount(bits):
+    """
+    Number of sequences in the bitset bits
+    """
+    return _popcount(bits)
+
+
+class RegexMotifIndex:
+    """
+    Sequences searched with re.search, one sequence at a time
+
+    Parameters
+    ----------
+    seqs : list
+        strings, sequence i is bit i of the bitsets
+    """
+    def __init__(self, seqs, begin = '^', end = '$'):
+        self.seqs = list(seqs)
+        self.n = len(self.seqs)
+        self.all = (1 << self.n) - 1
+
+    def matches(self, motif, within = None):
+        """
+        Bitset of the sequences matched by motif
+
+        Parameters
+        ----------
+        motif : list
+            regular expression tokens, joined to the pattern
+        within : int or None
+            bitset of the sequences to search, all by default
+
+        Returns
+        -------
+        bits : int
+        """
+        prog = re.compile(''.join(motif))
+        bits = 0
+        for i in (range(self.n) if within is None else self.indices(within)):
+            if prog.search(self.seqs[i]):
+                bits |= 1 << i
+        return bits
+
+    def indices(self, bits):
+        """
+        Indices of the sequences of the bitset bits, in increasing order
+        """
+        return _indices(bits, self.n)
+
+
+class MotifIndex(RegexMotifIndex):
+    """
+    Sequences encoded as position / residue class bitsets
+
+    Motif tokens must be the anchors begin and end or match exactly one
+    character: a character, a character class such as '[KR]' or '[A-Z]',
+    or '.'.
+
+    Parameters
+    ----------
+    seqs : list
+        strings, sequence i is bit i of the bitsets
+    begin : str
+        token anchoring a motif at the start of the sequence
+    end : str
+        token anchoring a motif at the end of the sequence
+
+    Examples
+    --------
+    >>> index = MotifIndex(['CASSF', 'CAGSF', 'CSF'])
+    >>> index.indices(index.matches(['^', 'C', '[A-Z]', '[GS]']))
+    [0, 1]
+    >>> popcount(index.matches(['S', 'F', '$']))
+    3
+    """
+    def __init__(self, seqs, begin = '^', end = '$'):
+        super().__init__(seqs)
+        self.begin = begin
+        self.end = end
+        self.lengths = np.array([len(s) for s in self.seqs], dtype = np.int64)
+        self.maxlen = int(self.lengths.max()) if self.n else 0
+        # code points, padded with 0 past the end of each sequence
+        width = max(self.maxlen, 1)
+        self._fwd = np.array(self.seqs, dtype = 'U{}'.format(width)).\
+            view(np.uint32).reshape(self.n, width)[:, :self.maxlen]
+        back = self.lengths[:, None] - 1 - np.arange(self.maxlen)[None, :]
+        self._rev = np.where(back >= 0, np.take_along_axis(self._fwd, np.maximum(back, 0), axis = 1), 0)
+        self._alphabet = [chr(c) for c in np.unique(self._fwd) if c != 0]
+        self._classes = {}
+        self._bitsets = {}
+
+    def matches(self, motif, within = None):
+        bits = self._matches(list(motif))
+        if within is not None:
+            bits &= within
+        return bits
+
+    def _matches(self, tokens):
+        residues = [k for k, token in enumerate(tokens) if token not in (self.begin, self.end)]
+        core = [tokens[k] for k in residues]
+        begins = [k for k, token in enumerate(tokens) if token == self.begin]
+        ends = [k for k, token in enumerate(tokens) if token == self.end]
+        if residues and ((begins and begins[-1] > residues[0]) or (ends and ends[0] < residues[-1])):
+            # a begin anchor after a residue or an end anchor before one never matches
+            return 0
+        anchored_begin, anchored_end = bool(begins), bool(ends)
+        L = len(core)
+        if L > self.maxlen:
+            return 0
+
+        if anchored_begin:
+            bits = self._length(L) if anchored_end else self.all
+            for k, token in enumerate(core):
+                bits &= self._bitset(token, k, False)
+            return bits
+        if anchored_end:
+            bits = self.all
+            for k, token in enumerate(core):
+                bits &= self._bitset(token, L - 1 - k, True)
+            return bits
+        bits = 0
+        for offset in range(self.maxlen - L + 1):
+            b = self.all
+            for k, token in enumerate(core):
+                b &= self._bitset(token, offset + k, False)
+                if not b:
+                    break
+            bits |= b
+        return bits
+
+    def _length(self, L):
+        key = ('len', L)
+        if key not in self._bitsets:
+            self._bitsets[key] = _to_bitset(self.lengths == L)
+        return self._bitsets[key]
+
+    def _bitset(self, token, position, from_end):
+        """sequences with a residue matching token at position"""
+        key = (token, position, from_end)
+        if key not in self._bitsets:
+            if position >= self.maxlen:
+                self._bitsets[key] = 0
+            else:
+                column = (self._rev if from_end else self._fwd)[:, position]
+                self._bitsets[key] = _to_bitset(np.isin(column, self._class_codes(token)))
+        return self._bitsets[key]
+
+    def _class_codes(self, token):
+        """code points of the residues of the sequences that token matches"""
+        if token not in self._classes:
+            if not (re.fullmatch(r'\[\^?[^\[\]]+\]', token) or token == '.' or
+                    (len(token) == 1 and re.escape(token) == token)):
+                raise ValueError("MotifIndex can not match motif token {!r}, use RegexMotifIndex".format(token))
+            prog = re.compile(token)
+            self._classes[token] = np.array([ord(c) for c in self._alphabet if prog.fullmatch(c)],
+                                            dtype = np.uint32)
+        return self._classes[token]
+
+
+def _to_bitset(mask):
+    """python int with bit i set where mask[i]"""
+    # little endian bits within each byte, reversed by hand as packbits
+    # only has bitorder from numpy 1.17
+    padded = np.zeros(-(-len(mask) // 8) * 8, dtype = bool)
+    padded[:len(mask)] = mask
+    return int.from_bytes(np.packbits(padded.reshape(-1, 8)[:, ::-1]).tobytes(), 'little')
+
+
+def _indices(bits, n):
+    if not bits:
+        return []
+    packed = np.frombuffer(bits.to_bytes((n + 7) // 8, 'little'), dtype = np.uint8)
+    return np.flatnonzero(np.unpackbits(packed).reshape(-1, 8)[:, ::-1]).tolist()
@@ -0,0 +1,328 @@
+"""
+Memory mapped store of the next-gen background TCR chains
+
+TCRMotif.generate_ng_tcrs and rmf._generate_read_motif_ng_tcrs_dict read
+new_nextgen_chains_{organism}_{chain}.tsv (millions of lines) on every call,
+mapping the V genes of every line to their mm1 representatives with
+util.get_mm1_rep and collecting (cdr3, cdr3_nucseq) tuples in a dict (v_rep)
+of dicts (j_rep) of lists.
+
+compile_store() does this once per file, with pandas, and writes a directory
+of .npy arrays:
+
+    cdr3_chars, cdr3_offsets        the CDR3s of all lines, packed as ascii
+    nucseq_chars, nucseq_offsets    bytes, line i is chars[offsets[i]:offsets[i + 1]]
+    entry_line                      line of each (v_rep, j_rep) entry, by group
+                                    then in file order
+    group_offsets                   entries of group g are
+                                    entry_line[group_offsets[g]:group_offsets[g + 1]]
+
+plus store.json with the (v_rep, j_rep) of each group. load_store() memory
+maps it, so it opens in milliseconds and processes using the same store
+share one copy of it in the page cache. NextgenStore.tcrs() returns the
+usual nested dict, with sequence views (NextgenSeqs) in place of the lists.
+
+Stores live in the nextgen/ subdirectory of paths.path_to_user_cache()
+($TCRDIST_CACHE_DIR, $XDG_CACHE_HOME/tcrdist or ~/.cache/tcrdist), keyed on
+STORE_VERSION, the package version, the organism and the path, size and
+mtime of the next-gen file. If the store can not be written (e.g. a read-only
+cache directory) load_store() keeps the arrays in memory instead.
+
+"""
+import collections.abc
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .paths import path_to_user_cache
+from .version import __version__
+
+logger = logging.getLogger('nextgen_store.py')
+
+# bump when the arrays or their meaning change
+STORE_VERSION = 1
+
+_arrays = ['cdr3_chars', 'cdr3_offsets', 'nucseq_chars', 'nucseq_offsets', 'entry_line', 'group_offsets']
+
+_columns = ['v_reps', 'j_reps', 'cdr3', 'cdr3_nucseq']
+
+_stores = {}
+
+
+def store_dir():
+    """
+    Returns
+    -------
+    path : string
+        directory holding the compiled next-gen stores
+    """
+    return path_to_user_cache('nextgen')
+
+
+def store_path(ng_logfile, organism):
+    """
+    Path of the store of the next-gen file ng_logfile
+    """
+    st = os.stat(ng_logfile)
+    h = hashlib.sha1(repr((STORE_VERSION, __version__, organism, op.abspath(ng_logfile),
+                           st.st_size, st.st_mtime_ns)).encode())
+    return op.join(store_dir(), '{}.{}.v{}.{}'.format(op.basename(ng_logfile), organism,
+                                                      STORE_VERSION, h.hexdigest()[:16]))
+
+
+def _pack(strings):
+    """ascii bytes of strings, concatenated, and the offsets of each string"""
+    offsets = np.zeros(len(strings) + 1, dtype = np.int64)
+    np.cumsum(strings.str.len().values, out = offsets[1:])
+    chars = np.frombuffer(''.join(strings).encode('ascii'), dtype = np.uint8)
+    return chars, offsets
+
+
+def _build_store(ng_logfile, organism):
+    """
+    the arrays and store.json contents of the store of ng_logfile, in memory
+    """
+    from . import util
+    df = pd.read_csv(ng_logfile, sep = '\t', dtype = str, keep_default_na = False, quoting = 3)
+    assert list(df.columns) == _columns
+
+    # groups of each distinct (v_reps, j_reps) pair of fields; the V genes
+    # of a line map to a set of reps, J reps repeated on a line are kept
+    combo_codes, combos = pd.factorize(df['v_reps'] + '\t' + df['j_reps'])
+    group_ids = {}
+    combo_groups = []
+    for combo in combos:
+        v_field, j_field = combo.split('\t')
+        v_reps = set( util.get_mm1_rep(x, organism) for x in v_field.split(',') )
+        combo_groups.append([group_ids.setdefault((v_rep, j_rep), len(group_ids))
+                             for v_rep in v_reps for j_rep in j_field.split(',')])
+
+    # one entry per (line, group), in line order
+    sizes = np.array([len(g) for g in combo_groups], dtype = np.int64)
+    flat = np.array([gid for g in combo_groups for gid in g], dtype = np.int64)
+    combo_starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    line_sizes = sizes[combo_codes] if len(combo_codes) else np.zeros(0, dtype = np.int64)
+    lines = np.repeat(np.arange(len(df), dtype = np.int64), line_sizes)
+    line_starts = np.concatenate([[0], np.cumsum(line_sizes)[:-1]]).astype(np.int64)
+    within = np.arange(len(lines), dtype = np.int64) - np.repeat(line_starts, line_sizes)
+    entry_group = flat[combo_starts[combo_codes[lines]] + within] if len(lines) else lines
+
+    # groups sorted by (v_rep, j_rep), entries by group then line
+    keys = sorted(group_ids)
+    rank = np.empty(len(keys), dtype = np.int64)
+    rank[[group_ids[k] for k in keys]] = np.arange(len(keys))
+    entry_group = rank[entry_group]
+    order = np.argsort(entry_group, kind = 'stable')
+    group_offsets = np.zeros(len(keys) + 1, dtype = np.int64)
+    np.cumsum(np.bincount(entry_group, minlength = len(keys)), out = group_offsets[1:])
+
+    arrays = {'entry_line' : lines[order], 'group_offsets' : group_offsets}
+    arrays['cdr3_chars'], arrays['cdr3_offsets'] = _pack(df['cdr3'])
+    arrays['nucseq_chars'], arrays['nucseq_offsets'] = _pack(df['cdr3_nucseq'])
+    meta = {'organism' : organism,
+            'source' : op.abspath(ng_logfile),
+            'n_lines' : len(df),
+            'groups' : [list(k) for k in keys]}
+    return arrays, meta
+
+
+def compile_store(ng_logfile, organism, path = None):
+    """
+    Parse a next-gen chains file and write its store
+
+    Parameters
+    ----------
+    ng_logfile : string
+        tab separated file with columns v_reps, j_reps, cdr3, cdr3_nucseq
+    organism : string
+        "mouse" or "human", for the mm1 representatives of the V genes
+    path : string
+        output directory, by default store_path(ng_logfile, organism)
+
+    Returns
+    -------
+    path : string
+
+    Raises
+    ------
+    OSError
+        if the store can not be written
+    """
+    if path is None:
+        path = store_path(ng_logfile, organism)
+    arrays, meta = _build_store(ng_logfile, organism)
+    _write_store(path, arrays, meta)
+    logger.info('compiled {} next-gen chains of {} to {}'.format(meta['n_lines'], ng_logfile, path))
+    return path
+
+
+def _write_store(path, arrays, meta):
+    """
+    write to a temporary directory then rename, so concurrent processes
+    never see a partial store
+    """
+    os.makedirs(op.dirname(path), exist_ok = True)
+    tmp = tempfile.mkdtemp(dir = op.dirname(path), suffix = '.tmp')
+    try:
+        for k in _arrays:
+            np.save(op.join(tmp, k + '.npy'), arrays[k])
+        with open(op.join(tmp, 'store.json'), 'w') as fh:
+            json.dump(meta, fh)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            if not op.exists(op.join(path, 'store.json')):
+                raise
+            # compiled meanwhile by another process
+            shutil.rmtree(tmp)
+    except:
+        if op.exists(tmp):
+            shutil.rmtree(tmp)
+        raise
+
+
+def load_store(ng_logfile, organism):
+    """
+    Memory mapped store of a next-gen chains file, compiled first if needed
+
+    Parameters
+    ----------
+    ng_logfile : string
+        tab separated file with columns v_reps, j_reps, cdr3, cdr3_nucseq
+    organism : string
+        "mouse" or "human"
+
+    Returns
+    -------
+    store : NextgenStore
+        memory mapped, or in memory if the store could not be written
+    """
+    path = store_path(ng_logfile, organism)
+    if path not in _stores:
+        if op.exists(op.join(path, 'store.json')):
+            _stores[path] = NextgenStore(path)
+        else:
+            arrays, meta = _build_store(ng_logfile, organism)
+            try:
+                _write_store(path, arrays, meta)
+                logger.info('compiled {} next-gen chains of {} to {}'.format(meta['n_lines'], ng_logfile, path))
+                _stores[path] = NextgenStore(path)
+            except OSError as e:
+                logger.warning('next-gen store could not be cached in {}: {}'.format(op.dirname(path), e))
+                _stores[path] = NextgenStore(path, arrays, meta)
+    return _stores[path]
+
+
+class NextgenStore:
+    """
+    Next-gen chains written by compile_store(), memory mapped
+
+    Parameters
+    ----------
+    path : string
+        directory written by compile_store()
+    arrays : dict
+        the arrays, if not read from path (see load_store)
+    meta : dict
+        the store.json contents, if not read from path
+    """
+    def __init__(self, path, arrays = None, meta = None):
+        self.path = path
+        self.mapped = arrays is None
+        if meta is None:
+            with open(op.join(path, 'store.json')) as fh:
+                meta = json.load(fh)
+        self.meta = meta
+        self.organism = meta['organism']
+        self.n_lines = meta['n_lines']
+        self.groups = [tuple(k) for k in meta['groups']]
+        for k in _arrays:
+            setattr(self, k, np.load(op.join(path, k + '.npy'), mmap_mode = 'r') if arrays is None else arrays[k])
+
+    def __reduce__(self):
+        # workers map the same files instead of receiving a copy
+        if self.mapped:
+            return (_reopen, (self.path,))
+        return (NextgenStore, (self.path, {k : getattr(self, k) for k in _arrays}, self.meta))
+
+    def num_chains(self, max_ng_lines = None):
+        """
+        Number of chains read with max_ng_lines: as in tcrdist1 the header
+        is line 1 and only lines up to max_ng_lines are read
+        """
+        if max_ng_lines:
+            return max(0, min(self.n_lines, max_ng_lines - 1))
+        return self.n_lines
+
+    def seqs(self, group, max_ng_lines = None):
+        """
+        (cdr3, cdr3_nucseq) of the chains of group, an index into self.groups
+        """
+        entries = self.entry_line[self.group_offsets[group]:self.group_offsets[group + 1]]
+        if max_ng_lines:
+            entries = entries[:np.searchsorted(entries, self.num_chains(max_ng_lines))]
+        return NextgenSeqs(self, entries)
+
+    def tcrs(self, max_ng_lines = None):
+        """
+        The chains as a dict (v_rep) of dicts (j_rep) of NextgenSeqs
+
+        Parameters
+        ----------
+        max_ng_lines : int
+            number of lines of the next-gen file to consider, all if None or 0
+
+        Returns
+        -------
+        ab_chains : dict
+        """
+        ab_chains = {}
+        for group, (v_rep, j_rep) in enumerate(self.groups):
+            seqs = self.seqs(group, max_ng_lines)
+            if len(seqs):
+                ab_chains.setdefault(v_rep, {})[j_rep] = seqs
+        return ab_chains
+
+
+def _reopen(path):
+    if path not in _stores:
+        _stores[path] = NextgenStore(path)
+    return _stores[path]
+
+
+class NextgenSeqs(collections.abc.Sequence):
+    """
+    Read-only view of the (cdr3, cdr3_nucseq) tuples of some lines of a
+    NextgenStore, usable in place of a list (iteration, len, indexing,
+    random.sample)
+    """
+    def __init__(self, store, lines):
+        self.store = store
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return NextgenSeqs(self.store, self.lines[i])
+        return self._tuple(int(self.lines[i]))
+
+    def __iter__(self):
+        for line in self.lines.tolist():
+            yield self._tuple(line)
+
+    def _tuple(self, line):
+        s = self.store
+        return (s.cdr3_chars[s.cdr3_offsets[line]:s.cdr3_offsets[line + 1]].tobytes().decode('ascii'),
+                s.nucseq_chars[s.nucseq_offsets[line]:s.nucseq_offsets[line + 1]].tobytes().decode('ascii'))
+
+    def __repr__(self):
+        return 'NextgenSeqs({} chains)'.format(len(self))
@@ -1,5 +1,4 @@
 import numpy as np
-import pandas as pd
 import logging
 logger = logging.getLogger('objects.py')
 from . import translation
@@ -15,8 +14,10 @@ class DotDict(dict):
     def __setattr__(self, key, value):
         self[key] = value
     def __str__(self):
+        import pandas as pd
         return pd.Series(self).to_string()
     def to_series(self):
+        import pandas as pd
         return pd.Series(self)
     def to_list(self):
         return(list(self))
@@ -66,6 +67,7 @@ class TCR_Gene:
         self.region = l['region']
         self.nucseq = l['nucseq']
         self.alseq = l['aligned_protseq']
+        import pandas as pd
         if pd.isnull(l['cdrs']):
             self.cdrs = []
             self.cdr_columns = []
@@ -76,7 +78,10 @@ class TCR_Gene:
         frame = l['frame']
         assert frame in [1, 2, 3]
         self.nucseq_offset = frame - 1 ## 0, 1 or 2 (0-indexed for python)
-        self.protseq = translation.get_translation( self.nucseq, frame )[0]
+        if 'protseq' in l: ## precomputed by gene_snapshot
+            self.protseq = l['protseq']
+        else:
+            self.protseq = translation.get_translation( self.nucseq, frame )[0]
         assert self.protseq == self.alseq.replace(self.gap_character, '')
         # sanity check
         if self.cdrs:
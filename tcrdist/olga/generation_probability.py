@@ -69,6 +69,12 @@ import re
 from .utils import nt2codon_rep
 from .preprocess_generative_model_and_data import PreprocessedParametersVDJ, PreprocessedParametersVJ
 
+_nt2code = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+
+def _nt_codes(ntseq):
+    """Code nucleotides A, C, G, T -> 0, 1, 2, 3 and anything else -> 4."""
+    return [_nt2code.get(nt, 4) for nt in ntseq]
+
 class GenerationProbability(object):
     """Class used to define Pgen functions and sequence formatting.
 
@@ -136,6 +142,12 @@ class GenerationProbability(object):
     max_nt_to_aa_alignment_right(CDR3_seq, ntseq)
         Find maximum match between CDR3_seq and ntseq from the right.
 
+    max_nt_to_aa_alignments(CDR3_seq, usage_mask, side)
+        Maximum matches between CDR3_seq and every allele of usage_mask.
+
+    genomic_Pi_stack(CDR3_seq, usage_mask, side)
+        Per allele Pi arrays of the V or J genomic contributions.
+
     """
     def __init__(self):
         """Initialize class GenerationProbability.
@@ -153,6 +165,9 @@ class GenerationProbability(object):
         self.d_J_usage_mask = None
         self.J_mask_mapping = None
 
+        self._alignment_tables = None
+        self._genomic_stacks = {}
+
     def compute_regex_CDR3_template_pgen(self, regex_seq, V_usage_mask_in = None, J_usage_mask_in = None, print_warnings = True, raise_overload_warning = True):
         """Compute Pgen for all seqs consistent with regular expression regex_seq.
 
@@ -702,6 +717,218 @@ class GenerationProbability(object):
                 break
         return max_alignment
 
+    # Stacked (vectorized) alignment/matching methods
+    def _get_alignment_tables(self):
+        """Lookup tables of the codons and codon fragments of each 'amino acid'.
+
+        Nucleotides are coded A, C, G, T -> 0, 1, 2, 3, and anything else
+        (including positions past the end of a genomic segment) -> 4. A codon
+        xyz is coded 25*x + 5*y + z.
+
+        Returns
+        -------
+        aa_index : dict
+            Index of each 'amino acid' symbol in the tables.
+        codon_ok : ndarray
+            (n_aa, 125) bool, codon is in codons_dict[aa]
+        left_ok : tuple of ndarrays
+            (n_aa, 5) and (n_aa, 25) bool, the 1 and 2 nt prefix is in
+            sub_codons_left[aa]
+        right_ok : tuple of ndarrays
+            (n_aa, 5) and (n_aa, 25) bool, the 1 and 2 nt suffix is in
+            sub_codons_right[aa]
+
+        """
+        if getattr(self, '_alignment_tables', None) is None:
+            aa_index = {aa: i for i, aa in enumerate(self.codons_dict)}
+            n_aa = len(aa_index)
+            codon_ok = np.zeros((n_aa, 125), dtype = bool)
+            left_ok = (np.zeros((n_aa, 5), dtype = bool), np.zeros((n_aa, 25), dtype = bool))
+            right_ok = (np.zeros((n_aa, 5), dtype = bool), np.zeros((n_aa, 25), dtype = bool))
+            for aa, i in aa_index.items():
+                for codon in self.codons_dict[aa]:
+                    c = _nt_codes(codon)
+                    codon_ok[i, 25*c[0] + 5*c[1] + c[2]] = True
+                for frag in self.sub_codons_left[aa]:
+                    c = _nt_codes(frag)
+                    left_ok[len(c) - 1][i, c[0] if len(c) == 1 else 5*c[0] + c[1]] = True
+                for frag in self.sub_codons_right[aa]:
+                    c = _nt_codes(frag)
+                    right_ok[len(c) - 1][i, c[0] if len(c) == 1 else 5*c[0] + c[1]] = True
+            self._alignment_tables = (aa_index, codon_ok, left_ok, right_ok)
+        return self._alignment_tables
+
+    def _get_genomic_stack(self, side):
+        """Per allele tables of the V (side = 'left') or J (side = 'right') loci.
+
+        The genomic segments and the PVdelV (or PJdelJ) Pi arrays of all
+        alleles are stacked into arrays padded to a common width. V arrays are
+        aligned on the left (the conserved C), J arrays on the right (the
+        conserved F/W), so that position p of a CDR3 is column p of the V
+        stack and column W - 3L + p of the J stack.
+
+        Returns
+        -------
+        codons : ndarray
+            (n_alleles, W//3 + 2) codon codes of each genomic segment, read
+            5' to 3' for V and 3' to 5' (in codon units) for J. The last
+            column is past the end of every segment.
+        first_nt : ndarray
+            (n_alleles, W//3 + 2) code of the first nt of each codon (V) or of
+            the last nt (J).
+        two_nt : ndarray
+            (n_alleles, W//3 + 2) code of the first two (V) or last two (J) nts
+            of each codon.
+        nt_pos_vec : ndarray
+            (n_alleles, 4, W) stacked PVdelV_nt_pos_vec (or PJdelJ_nt_pos_vec).
+        second_nt_pos_per_aa_vec : ndarray
+            (n_alleles, n_aa, W, 4) stacked PVdelV_2nd_nt_pos_per_aa_vec (or
+            PJdelJ_2nd_nt_pos_per_aa_vec), indexed by 'amino acid' index.
+
+        """
+        if getattr(self, '_genomic_stacks', None) is None:
+            self._genomic_stacks = {}
+        if side not in self._genomic_stacks:
+            aa_index = self._get_alignment_tables()[0]
+            if side == 'left':
+                segs = self.cutV_genomic_CDR3_segs
+                nt_pos_vecs = self.PVdelV_nt_pos_vec
+                second_nt_pos_vecs = self.PVdelV_2nd_nt_pos_per_aa_vec
+            else:
+                segs = self.cutJ_genomic_CDR3_segs
+                nt_pos_vecs = self.PJdelJ_nt_pos_vec
+                second_nt_pos_vecs = self.PJdelJ_2nd_nt_pos_per_aa_vec
+            W = max([len(seg) for seg in segs] + [0])
+            n_codons = W//3 + 2
+            nts = np.full((len(segs), 3*n_codons), 4, dtype = np.int64)
+            nt_pos_vec = np.zeros((len(segs), 4, W))
+            second_nt_pos_per_aa_vec = np.zeros((len(segs), len(aa_index), W, 4))
+            for i, seg in enumerate(segs):
+                n = len(seg)
+                if n == 0:
+                    continue
+                if side == 'left':
+                    nts[i, :n] = _nt_codes(seg)
+                    cols = slice(0, n)
+                else:
+                    # reversed so that codon k holds nts n-3k-3..n-3k, last nt first
+                    nts[i, :n] = _nt_codes(seg[::-1])
+                    cols = slice(W - n, W)
+                if len(nt_pos_vecs[i]) > 0:
+                    nt_pos_vec[i][:, cols] = nt_pos_vecs[i]
+                for aa, vec in second_nt_pos_vecs[i].items():
+                    second_nt_pos_per_aa_vec[i, aa_index[aa], cols] = vec.T
+            nts = nts.reshape(len(segs), n_codons, 3)
+            if side == 'left':
+                codons = 25*nts[:, :, 0] + 5*nts[:, :, 1] + nts[:, :, 2]
+                first_nt = nts[:, :, 0]
+                two_nt = 5*nts[:, :, 0] + nts[:, :, 1]
+            else:
+                codons = 25*nts[:, :, 2] + 5*nts[:, :, 1] + nts[:, :, 0]
+                first_nt = nts[:, :, 0]
+                two_nt = 5*nts[:, :, 1] + nts[:, :, 0]
+            self._genomic_stacks[side] = (codons, first_nt, two_nt, nt_pos_vec, second_nt_pos_per_aa_vec)
+        return self._genomic_stacks[side]
+
+    def _check_usage_mask(self, usage_mask, side):
+        """Usage mask as an index array, without indices out of range."""
+        n_alleles = len(self.cutV_genomic_CDR3_segs if side == 'left' else self.cutJ_genomic_CDR3_segs)
+        usage_mask = np.asarray(usage_mask, dtype = np.int64).reshape(-1)
+        in_range = (usage_mask >= -n_alleles) & (usage_mask < n_alleles)
+        for i in range(np.sum(~in_range)):
+            print('Check provided %s usage mask. Contains indicies out of allowed range.' % ('V' if side == 'left' else 'J'))
+        return usage_mask[in_range]
+
+    def max_nt_to_aa_alignments(self, CDR3_seq, usage_mask, side):
+        """Maximum matches between CDR3_seq and every allele of usage_mask.
+
+        Vectorized max_nt_to_aa_alignment_left (side = 'left', V alleles) or
+        max_nt_to_aa_alignment_right (side = 'right', J alleles) over the
+        genomic segments of all alleles in usage_mask.
+
+        Parameters
+        ----------
+        CDR3_seq : str
+            CDR3 sequence composed of 'amino acids' (single character symbols
+            each corresponding to a collection of codons as given by codons_dict).
+        usage_mask : list
+            Indices of the V (or J) alleles to be aligned.
+        side : str
+            'left' or 'right'
+
+        Returns
+        -------
+        max_alignments : ndarray
+            Maximum length (in nucleotides) of the genomic sequence of each
+            allele that matches the CDR3 'amino acid' sequence.
+
+        """
+        aa_index, codon_ok, left_ok, right_ok = self._get_alignment_tables()
+        codons, first_nt, two_nt = self._get_genomic_stack(side)[:3]
+        L = len(CDR3_seq)
+        aa = np.array([aa_index[a] for a in (CDR3_seq if side == 'left' else CDR3_seq[::-1])], dtype = np.int64)
+        #codons past the end of the stack read the last (empty) column
+        last = codons.shape[1] - 1
+        matched = codon_ok[aa[None, :], codons[usage_mask[:, None], np.minimum(np.arange(L), last)[None, :]]]
+        n_matched = np.where(np.all(matched, axis = 1), L, np.argmin(matched, axis = 1))
+        sub_ok = left_ok if side == 'left' else right_ok
+        next_aa = aa[np.minimum(n_matched, L - 1)]
+        next_codon = np.minimum(n_matched, last)
+        one = sub_ok[0][next_aa, first_nt[usage_mask, next_codon]]
+        two = one & sub_ok[1][next_aa, two_nt[usage_mask, next_codon]]
+        partial = np.where(n_matched < L, one.astype(np.int64) + two, 0)
+        return 3*n_matched + partial
+
+    def genomic_Pi_stack(self, CDR3_seq, usage_mask, side):
+        """Per allele Pi arrays of the V or J genomic contributions.
+
+        For every allele of usage_mask, the (4, 3L) array current_Pi_V (side =
+        'left') or current_Pi_J (side = 'right') that the allele contributes
+        to Pi_V (or Pi_J), built from the stacked PVdelV (or PJdelJ) tables.
+
+        Parameters
+        ----------
+        CDR3_seq : str
+            CDR3 sequence composed of 'amino acids' (single character symbols
+            each corresponding to a collection of codons as given by codons_dict).
+        usage_mask : list
+            Indices of the V (or J) alleles to be considered.
+        side : str
+            'left' or 'right'
+
+        Returns
+        -------
+        Pi_stack : ndarray
+            (len(usage_mask), 4, 3L) array of the per allele Pi arrays.
+        max_alignments : ndarray
+            Maximum alignment of the CDR3_seq to each allele.
+
+        """
+        aa_index = self._get_alignment_tables()[0]
+        nt_pos_vec, second_nt_pos_per_aa_vec = self._get_genomic_stack(side)[3:]
+        max_alignments = self.max_nt_to_aa_alignments(CDR3_seq, usage_mask, side)
+        n = 3*len(CDR3_seq)
+        W = nt_pos_vec.shape[2]
+        #CDR3 positions pos covered by the stack are columns pos + offset
+        if side == 'left':
+            pos = np.arange(min(n, W))
+            offset = 0
+        else:
+            pos = np.arange(max(n - W, 0), n)
+            offset = W - n
+        aa = np.array([aa_index[a] for a in CDR3_seq], dtype = np.int64)
+        Pi_stack = np.zeros((len(usage_mask), 4, n))
+        Pi_stack[:, :, pos] = nt_pos_vec[usage_mask[:, None], :, pos[None, :] + offset].transpose(0, 2, 1)
+        #for middle nt use the 'amino acid' specific table
+        mid = pos[pos % 3 == 1]
+        Pi_stack[:, :, mid] = second_nt_pos_per_aa_vec[usage_mask[:, None], aa[None, mid//3], mid[None, :] + offset].transpose(0, 2, 1)
+        if side == 'left':
+            aligned = np.arange(n)[None, :] < max_alignments[:, None]
+        else:
+            aligned = np.arange(n)[None, :] >= n - max_alignments[:, None]
+        Pi_stack *= aligned[:, None, :]
+        return Pi_stack, max_alignments
+
 #%%
 class GenerationProbabilityVDJ(GenerationProbability, PreprocessedParametersVDJ):
     """Class used to compute the Pgen of CDR3 sequences from a  VDJ model.
@@ -946,26 +1173,12 @@ class GenerationProbabilityVDJ(GenerationProbability, PreprocessedParametersVDJ)
         #Note, the cutV_genomic_CDR3_segs INCLUDE the palindromic insertions and thus are max_palindrome nts longer than the template.
         #furthermore, the genomic sequence should be pruned to start at the conserved C
 
-        Pi_V = np.zeros((4, len(CDR3_seq)*3)) #Holds the aggregate weight for each nt possiblity and position
-        alignment_lengths = []
-        for V_in in V_usage_mask:
-            try:
-                cutV_gen_seg = self.cutV_genomic_CDR3_segs[V_in]
-            except IndexError:
-                print('Check provided V usage mask. Contains indicies out of allowed range.')
-                continue
-            current_alignment_length = self.max_nt_to_aa_alignment_left(CDR3_seq, cutV_gen_seg)
-            alignment_lengths += [current_alignment_length]
-            current_Pi_V = np.zeros((4, len(CDR3_seq)*3))
+        #The per allele arrays current_Pi_V (zero past each alignment) are built at once from the stacked tables
+        V_usage_mask = self._check_usage_mask(V_usage_mask, 'left')
+        Pi_V_stack, alignment_lengths = self.genomic_Pi_stack(CDR3_seq, V_usage_mask, 'left')
+        Pi_V = Pi_V_stack.sum(axis = 0) #Holds the aggregate weight for each nt possiblity and position
 
-            if current_alignment_length > 0:
-                #For first and last nt in a codon use PVdelV_nt_pos_vec
-                current_Pi_V[:, :current_alignment_length] = self.PVdelV_nt_pos_vec[V_in][:, :current_alignment_length]
-                for pos in range(1, current_alignment_length, 3): #for middle nt use PVdelV_2nd_nt_pos_per_aa_vec
-                    current_Pi_V[:, pos] = self.PVdelV_2nd_nt_pos_per_aa_vec[V_in][CDR3_seq[pos//3]][:, pos]
-                Pi_V[:, :current_alignment_length] += current_Pi_V[:, :current_alignment_length]
-
-        return Pi_V, max(alignment_lengths)
+        return Pi_V, int(alignment_lengths.max())
 
     #Include VD insertions (Rvd and PinsVD) to get the total contribution from the left (5') side. Return Pi_L
     def compute_Pi_L(self, CDR3_seq, Pi_V, max_V_align):
@@ -1134,29 +1347,13 @@ class GenerationProbabilityVDJ(GenerationProbability, PreprocessedParametersVDJ)
 
         #Note, the cutJ_genomic_CDR3_segs INCLUDE the palindromic insertions and thus are max_palindrome nts longer than the template.
         #furthermore, the genomic sequence should be pruned to start at a conserved region on the J side
-        num_D_genes = self.PD_given_J.shape[0]
-        Pi_J_given_D = [np.zeros((4, len(CDR3_seq)*3)) for i in range(num_D_genes)] #Holds the aggregate weight for each nt possiblity and position
-        alignment_lengths = []
-        for J_in in J_usage_mask:
-            try:
-                cutJ_gen_seg = self.cutJ_genomic_CDR3_segs[J_in]
-            except IndexError:
-                print('Check provided V usage mask. Contains indicies out of allowed range.')
-                continue
-            current_alignment_length = self.max_nt_to_aa_alignment_right(CDR3_seq, cutJ_gen_seg)
-            alignment_lengths += [current_alignment_length]
-            current_Pi_J = np.zeros((4, len(CDR3_seq)*3))
+        #The per allele arrays current_Pi_J (zero before each alignment) are built at once from the stacked tables
+        J_usage_mask = self._check_usage_mask(J_usage_mask, 'right')
+        Pi_J_stack, alignment_lengths = self.genomic_Pi_stack(CDR3_seq, J_usage_mask, 'right')
+        #Holds the aggregate weight for each nt possiblity and position
+        Pi_J_given_D = list(np.tensordot(self.PD_given_J[:, J_usage_mask], Pi_J_stack, axes = (1, 0)))
 
-            if current_alignment_length > 0:
-                #For first and last nt in a codon use PJdelJ_nt_pos_vec
-                current_Pi_J[:, -current_alignment_length:] = self.PJdelJ_nt_pos_vec[J_in][:, -current_alignment_length:]
-                for pos in range(-2, -current_alignment_length-1, -3): #for middle nt use PJdelJ_2nd_nt_pos_per_aa_vec
-                    current_Pi_J[:, pos] = self.PJdelJ_2nd_nt_pos_per_aa_vec[J_in][CDR3_seq[pos//3]][:, pos]
-
-            for D_in, pd_given_j in enumerate(self.PD_given_J[:, J_in]):
-                Pi_J_given_D[D_in][:, -current_alignment_length:] += pd_given_j*current_Pi_J[:, -current_alignment_length:]
-
-        return Pi_J_given_D, max(alignment_lengths)
+        return Pi_J_given_D, int(alignment_lengths.max())
 
     #Include DJ insertions (Rdj and PinsDJ), return Pi_JinsDJ_given_D
     def compute_Pi_JinsDJ_given_D(self, CDR3_seq, Pi_J_given_D, max_J_align):
@@ -1723,27 +1920,14 @@ class GenerationProbabilityVJ(GenerationProbability, PreprocessedParametersVJ):
         #Note, the cutV_genomic_CDR3_segs INCLUDE the palindromic insertions and thus are max_palindrome nts longer than the template.
         #furthermore, the genomic sequence should be pruned to start at the conserved C
 
-        Pi_V_given_J = [np.zeros((4, len(CDR3_seq)*3)) for i in J_usage_mask] #Holds the aggregate weight for each nt possiblity and position
-        alignment_lengths = []
-        for V_in in V_usage_mask:
-            try:
-                cutV_gen_seg = self.cutV_genomic_CDR3_segs[V_in]
-            except IndexError:
-                print('Check provided V usage mask. Contains indicies out of allowed range.')
-                continue
-            current_alignment_length = self.max_nt_to_aa_alignment_left(CDR3_seq, cutV_gen_seg)
-            alignment_lengths += [current_alignment_length]
-            current_Pi_V = np.zeros((4, len(CDR3_seq)*3))
+        #The per allele arrays current_Pi_V (zero past each alignment) are built at once from the stacked tables
+        V_usage_mask = self._check_usage_mask(V_usage_mask, 'left')
+        Pi_V_stack, alignment_lengths = self.genomic_Pi_stack(CDR3_seq, V_usage_mask, 'left')
+        #Holds the aggregate weight for each nt possiblity and position
+        PVJ = self.PVJ[np.ix_(V_usage_mask, np.asarray(J_usage_mask, dtype = np.int64))]
+        Pi_V_given_J = list(np.tensordot(PVJ, Pi_V_stack, axes = (0, 0)))
 
-            if current_alignment_length > 0:
-                #For first and last nt in a codon use PVdelV_nt_pos_vec
-                current_Pi_V[:, :current_alignment_length] = self.PVdelV_nt_pos_vec[V_in][:, :current_alignment_length]
-                for pos in range(1, current_alignment_length, 3): #for middle nt use PVdelV_2nd_nt_pos_per_aa_vec
-                    current_Pi_V[:, pos] = self.PVdelV_2nd_nt_pos_per_aa_vec[V_in][CDR3_seq[pos//3]][:, pos]
-                for j, J_in in enumerate(J_usage_mask):
-                    Pi_V_given_J[j][:, :current_alignment_length] += self.PVJ[V_in, J_in]*current_Pi_V[:, :current_alignment_length]
-
-        return Pi_V_given_J, max(alignment_lengths)
+        return Pi_V_given_J, int(alignment_lengths.max())
 
     #Include insertions (R and PinsVJ) to get the total contribution from the the V and insertions conditioned on J identity. Return Pi_V_insVJ_given_J
     def compute_Pi_V_insVJ_given_J(self, CDR3_seq, Pi_V_given_J, max_V_align):
@@ -1911,25 +2095,11 @@ class GenerationProbabilityVJ(GenerationProbability, PreprocessedParametersVJ):
         #Note, the cutJ_genomic_CDR3_segs INCLUDE the palindromic insertions and thus are max_palindrome nts longer than the template.
         #furthermore, the genomic sequence should be pruned to start at a conserved region on the J side
 
-        Pi_J = [] #Holds the aggregate weight for each nt possiblity and position
-        r_J_usage_mask = []
-        for j, J_in in enumerate(J_usage_mask):
-            try:
-                cutJ_gen_seg = self.cutJ_genomic_CDR3_segs[J_in]
-            except IndexError:
-                print('Check provided J usage mask. Contains indicies out of allowed range.')
-                continue
-            current_alignment_length = self.max_nt_to_aa_alignment_right(CDR3_seq, cutJ_gen_seg)
-            #alignment_lengths += [current_alignment_length]
-            current_Pi_J = np.zeros((4, len(CDR3_seq)*3))
-
-            if current_alignment_length > 0:
-                #For first and last nt in a codon use PJdelJ_nt_pos_vec
-                current_Pi_J[:, -current_alignment_length:] = self.PJdelJ_nt_pos_vec[J_in][:, -current_alignment_length:]
-                for pos in range(-2, -current_alignment_length-1, -3): #for middle nt use PJdelJ_2nd_nt_pos_per_aa_vec
-                    current_Pi_J[:, pos] = self.PJdelJ_2nd_nt_pos_per_aa_vec[J_in][CDR3_seq[pos//3]][:, pos]
-                if np.sum(current_Pi_J) > 0:
-                    Pi_J.append(current_Pi_J)
-                    r_J_usage_mask.append(J_in)
+        #The per allele arrays current_Pi_J (zero before each alignment) are built at once from the stacked tables
+        J_usage_mask = self._check_usage_mask(J_usage_mask, 'right')
+        Pi_J_stack, alignment_lengths = self.genomic_Pi_stack(CDR3_seq, J_usage_mask, 'right')
+        contributes = Pi_J_stack.sum(axis = (1, 2)) > 0
+        Pi_J = list(Pi_J_stack[contributes]) #Holds the aggregate weight for each nt possiblity and position
+        r_J_usage_mask = [int(J_in) for J_in in J_usage_mask[contributes]]
 
         return Pi_J, r_J_usage_mask
@@ -62,8 +62,17 @@ Example
 >>> seq_gen_model.gen_rnd_prod_CDR3()
 ('TGTGCCAGCTGGACAGGGGGCAACTACGAGCAGTACTTC', 'CASWTGGNYEQYF', 55, 13)
 
+Many sequences are generated at once, for instance for null distributions,
+with gen_rnd_prod_CDR3_batch, which draws the recombination events of a whole
+batch with a numpy.random.RandomState and only assembles the strings of
+productive sequences:
+
+>>> seq_gen_model.gen_rnd_prod_CDR3_batch(2, seed = 1)
+[('TGTGCCAGCTGGGCTCGCAATCAGCCCCAGCATTTT', 'CASWARNQPQHF', 34, 4), ('TGTGCCAGCAGTGAAGCCAAACACAAGTACGAGCAGTACTTC', 'CASSEAKHKYEQYF', 58, 13)]
+
 @author: zacharysethna
 """
+import multiprocessing
 import numpy as np
 from .utils import nt2aa, calc_steady_state_dist
 
@@ -248,6 +257,69 @@ class SequenceGenerationVDJ(object):
             if '*' not in aaseq and aaseq[0]=='C' and aaseq[-1] in conserved_J_residues:
                 return ntseq, aaseq, recomb_events['V'], recomb_events['J']
 
+    def gen_rnd_prod_CDR3_batch(self, n, seed = None, conserved_J_residues = 'FVW', processes = 1):
+        """Generate n productive CDR3 seqs from Monte Carlo draws of the model.
+
+        Same distribution as n calls of gen_rnd_prod_CDR3, but the
+        recombination events of a whole batch are drawn at once and the
+        deletion, frame and stop codon filters are array operations.
+
+        Parameters
+        ----------
+        n : int
+            Number of productive sequences to generate.
+        seed : int or None, optional
+            Seed of the numpy.random.RandomState. The same seed (and number
+            of processes) gives the same sequences.
+        conserved_J_residues : str, optional
+            Conserved amino acid residues defining the CDR3 on the J side (normally
+            F, V, and/or W)
+        processes : int, optional
+            Number of worker processes, each generating an equal share of the
+            sequences from its own stream, seeded from seed.
+
+        Returns
+        -------
+        seqs : list of tuples
+            n tuples (ntseq, aaseq, V_choice, J_choice) as returned by
+            gen_rnd_prod_CDR3
+
+        """
+        return _gen_batch(self, n, seed, conserved_J_residues, processes)
+
+    def _draw_productive(self, n, rng, conserved_J_residues):
+        """Draw n recombination events and return the productive CDR3s among them."""
+        V = _searchsorted(self.CPV, rng.random_sample(n))
+        DJ_choice = _searchsorted(self.CPDJ, rng.random_sample(n))
+        D = DJ_choice//self.num_J_genes
+        J = DJ_choice % self.num_J_genes
+        delV = _searchsorted_rows(self.given_V_CPdelV, V, rng.random_sample(n))
+        delJ = _searchsorted_rows(self.given_J_CPdelJ, J, rng.random_sample(n))
+        delDldelDr_choice = _searchsorted_rows(self.given_D_CPdelDldelDr, D, rng.random_sample(n))
+        delDl = delDldelDr_choice//self.num_delDr_poss
+        delDr = delDldelDr_choice % self.num_delDr_poss
+        insVD = _searchsorted(self.CinsVD, rng.random_sample(n))
+        insDJ = _searchsorted(self.CinsDJ, rng.random_sample(n))
+
+        V_segs, lenV = _segment_table(self, 'cutV_genomic_CDR3_segs')
+        D_segs, lenD = _segment_table(self, 'cutD_genomic_CDR3_segs')
+        J_segs, lenJ = _segment_table(self, 'cutJ_genomic_CDR3_segs')
+
+        #Same checks as gen_rnd_prod_CDR3: V not fully deleted, D and J not over deleted, in frame
+        ok = (lenV[V] > delV) & (lenD[D] >= delDl + delDr) & (lenJ[J] >= delJ)
+        ok &= (lenV[V] - delV + lenD[D] - delDl - delDr + lenJ[J] - delJ + insVD + insDJ) % 3 == 0
+        V, D, J, delV, delDl, delDr, delJ, insVD, insDJ = [x[ok] for x in (V, D, J, delV, delDl, delDr, delJ, insVD, insDJ)]
+
+        insVD_seqs = _rnd_ins_seqs(insVD, self.C_Rvd, self.C_first_nt_bias_insVD, rng)
+        insDJ_seqs = _rnd_ins_seqs(insDJ, self.C_Rdj, self.C_first_nt_bias_insDJ, rng, reverse = True) #have to reverse the DJ seq
+        zero = np.zeros(len(V), dtype = np.int64)
+        pieces = [(V_segs[V], zero, lenV[V] - delV),
+                  (insVD_seqs, zero, insVD),
+                  (D_segs[D], delDl, lenD[D] - delDl - delDr),
+                  (insDJ_seqs, insDJ_seqs.shape[1] - insDJ, insDJ),
+                  (J_segs[J], delJ, lenJ[J] - delJ)]
+        return _assemble_productive(pieces, V, J, conserved_J_residues)
+
     def choose_random_recomb_events(self):
         """Sample the genomic model for VDJ recombination events.
 
@@ -427,6 +499,60 @@ class SequenceGenerationVJ(object):
             if '*' not in aaseq and aaseq[0]=='C' and aaseq[-1] in conserved_J_residues:
                 return ntseq, aaseq, recomb_events['V'], recomb_events['J']
 
+    def gen_rnd_prod_CDR3_batch(self, n, seed = None, conserved_J_residues = 'FVW', processes = 1):
+        """Generate n productive CDR3 seqs from Monte Carlo draws of the model.
+
+        Same distribution as n calls of gen_rnd_prod_CDR3, but the
+        recombination events of a whole batch are drawn at once and the
+        deletion, frame and stop codon filters are array operations.
+
+        Parameters
+        ----------
+        n : int
+            Number of productive sequences to generate.
+        seed : int or None, optional
+            Seed of the numpy.random.RandomState. The same seed (and number
+            of processes) gives the same sequences.
+        conserved_J_residues : str, optional
+            Conserved amino acid residues defining the CDR3 on the J side (normally
+            F, V, and/or W)
+        processes : int, optional
+            Number of worker processes, each generating an equal share of the
+            sequences from its own stream, seeded from seed.
+
+        Returns
+        -------
+        seqs : list of tuples
+            n tuples (ntseq, aaseq, V_choice, J_choice) as returned by
+            gen_rnd_prod_CDR3
+
+        """
+        return _gen_batch(self, n, seed, conserved_J_residues, processes)
+
+    def _draw_productive(self, n, rng, conserved_J_residues):
+        """Draw n recombination events and return the productive CDR3s among them."""
+        VJ_choice = _searchsorted(self.CPVJ, rng.random_sample(n))
+        V = VJ_choice//self.num_J_genes
+        J = VJ_choice % self.num_J_genes
+        delV = _searchsorted_rows(self.given_V_CPdelV, V, rng.random_sample(n))
+        delJ = _searchsorted_rows(self.given_J_CPdelJ, J, rng.random_sample(n))
+        insVJ = _searchsorted(self.CPinsVJ, rng.random_sample(n))
+
+        V_segs, lenV = _segment_table(self, 'cutV_genomic_CDR3_segs')
+        J_segs, lenJ = _segment_table(self, 'cutJ_genomic_CDR3_segs')
+
+        #Same checks as gen_rnd_prod_CDR3: V not fully deleted, J not over deleted, in frame
+        ok = (lenV[V] > delV) & (lenJ[J] >= delJ)
+        ok &= (lenV[V] - delV + lenJ[J] - delJ + insVJ) % 3 == 0
+        V, J, delV, delJ, insVJ = [x[ok] for x in (V, J, delV, delJ, insVJ)]
+
+        insVJ_seqs = _rnd_ins_seqs(insVJ, self.C_Rvj, self.C_first_nt_bias_insVJ, rng)
+        zero = np.zeros(len(V), dtype = np.int64)
+        pieces = [(V_segs[V], zero, lenV[V] - delV),
+                  (insVJ_seqs, zero, insVJ),
+                  (J_segs[J], delJ, lenJ[J] - delJ)]
+        return _assemble_productive(pieces, V, J, conserved_J_residues)
+
     def choose_random_recomb_events(self):
         """Sample the genomic model for VDJ recombination events.
 
@@ -447,7 +573,7 @@ class SequenceGenerationVJ(object):
 
         #For 2D arrays make sure to take advantage of a mod expansion to find indicies
         VJ_choice = self.CPVJ.searchsorted(np.random.random())
-        recomb_events['V'] = VJ_choice
+        recomb_events['V'] = VJ_choice//self.num_J_genes
         recomb_events['J'] = VJ_choice % self.num_J_genes
 
 
@@ -506,3 +632,129 @@ def rnd_ins_seq(ins_len, C_R, CP_first_nt):
         ins_len += -1
 
     return seq
+
+#%% Batch (vectorized) generation
+#Number of recombination events drawn at a time by gen_rnd_prod_CDR3_batch
+_BATCH_DRAWS = 20000
+
+_nt_bytes = np.frombuffer(b'ACGT', dtype = np.uint8)
+_aa_dict = np.frombuffer(b'KQE*TPASRRG*ILVLNHDYTPASSRGCILVFKQE*TPASRRGWMLVLNHDYTPASSRGCILVF', dtype = np.uint8)
+#ASCII -> nt number as in nt2aa (A, C, G, T, upper or lower case), 4 for anything else
+_ascii2num = np.full(256, 4, dtype = np.int64)
+for _i, _nt in enumerate('ACGT'):
+    _ascii2num[ord(_nt)] = _i
+    _ascii2num[ord(_nt.lower())] = _i
+
+def _searchsorted(C, u):
+    """C.searchsorted(u) for an array of uniform draws u"""
+    return np.minimum(C.searchsorted(u), len(C) - 1)
+
+def _searchsorted_rows(C, rows, u):
+    """C[rows[i], :].searchsorted(u[i]) for every i"""
+    #rows of cumulative distributions lie in [0, 1], shifted by 2*row they form one sorted array
+    shift = 2.0*np.arange(C.shape[0])
+    flat = (C + shift[:, None]).ravel()
+    return np.minimum(flat.searchsorted(u + shift[rows]) - rows*C.shape[1], C.shape[1] - 1)
+
+def _segment_table(seq_gen_model, attr):
+    """Genomic segments as a zero padded (n_segs, max_len) ASCII array, and their lengths"""
+    cache = seq_gen_model.__dict__.setdefault('_segment_tables', {})
+    if attr not in cache:
+        segs = getattr(seq_gen_model, attr)
+        lengths = np.array([len(seg) for seg in segs], dtype = np.int64)
+        table = np.zeros((len(segs), max(lengths.max(initial = 0), 1)), dtype = np.uint8)
+        for i, seg in enumerate(segs):
+            table[i, :len(seg)] = np.frombuffer(seg.encode(), dtype = np.uint8)
+        cache[attr] = (table, lengths)
+    return cache[attr]
+
+def _rnd_ins_seqs(ins_lens, C_R, CP_first_nt, rng, reverse = False):
+    """Vectorized rnd_ins_seq: (len(ins_lens), max(ins_lens)) ASCII array of insertion seqs
+
+    Row i holds its insertion in its first ins_lens[i] columns, or reversed in
+    its last ins_lens[i] columns if reverse.
+    """
+    max_len = int(ins_lens.max(initial = 0))
+    nts = np.zeros((len(ins_lens), max_len), dtype = np.int64)
+    if max_len == 0:
+        return nts.astype(np.uint8)
+    u = rng.random_sample((len(ins_lens), max_len))
+    nts[:, 0] = _searchsorted(CP_first_nt, u[:, 0])
+    #only extend the rows with insertions longer than pos (longest first)
+    order = np.argsort(-ins_lens, kind = 'stable')
+    n_longer = np.searchsorted(-ins_lens[order], -np.arange(max_len), side = 'left')
+    nts, u = nts[order], u[order]
+    for pos in range(1, max_len):
+        k = n_longer[pos]
+        nts[:k, pos] = _searchsorted_rows(C_R, nts[:k, pos - 1], u[:k, pos])
+    nts[order] = nts.copy()
+    seqs = _nt_bytes[nts]
+    if reverse:
+        #column max_len - ins_len + k holds nt ins_len - 1 - k, i.e. column c holds nt max_len - 1 - c
+        cols = np.arange(max_len)[None, :]
+        seqs = np.where(cols >= max_len - ins_lens[:, None], seqs[:, ::-1], 0).astype(np.uint8)
+    return seqs
+
+def _assemble_productive(pieces, V, J, conserved_J_residues):
+    """Concatenate pieces into CDR3s, translate, and keep the productive ones.
+
+    Parameters
+    ----------
+    pieces : list of tuples
+        (seqs, start, length): piece i of CDR3 k is
+        seqs[k, start[k]:start[k] + length[k]]
+
+    Returns
+    -------
+    seqs : list of tuples
+        (ntseq, aaseq, V_choice, J_choice) of the productive CDR3s
+    """
+    if len(V) == 0:
+        return []
+    lengths = np.sum([length for _, _, length in pieces], axis = 0)
+    max_len = int(lengths.max(initial = 0))
+    max_len += -max_len % 3
+    #side by side pieces, then the kept columns of each row are moved to the left
+    joined = np.concatenate([seqs for seqs, _, _ in pieces], axis = 1)
+    keep = np.concatenate([(np.arange(seqs.shape[1])[None, :] >= start[:, None]) &
+                           (np.arange(seqs.shape[1])[None, :] < (start + length)[:, None])
+                           for seqs, start, length in pieces], axis = 1)
+    rows, cols = np.nonzero(keep)
+    ntseqs = np.zeros((len(V), max_len), dtype = np.uint8)
+    ntseqs[rows, (np.cumsum(keep, axis = 1) - 1)[rows, cols]] = joined[rows, cols]
+
+    #Translate, codons past the end of a CDR3 are padding
+    nums = _ascii2num[ntseqs].reshape(len(V), -1, 3)
+    valid = np.all(nums < 4, axis = 2)
+    aaseqs = np.where(valid, _aa_dict[np.minimum(nums[:, :, 0] + 4*nums[:, :, 1] + 16*nums[:, :, 2], 63)], 0).astype(np.uint8)
+    n_aa = lengths//3
+    in_cdr3 = np.arange(aaseqs.shape[1])[None, :] < n_aa[:, None]
+    rows = np.arange(len(V))
+    productive = ~np.any(in_cdr3 & ((aaseqs == ord('*')) | ~valid), axis = 1)
+    productive &= aaseqs[:, 0] == ord('C')
+    productive &= np.isin(aaseqs[rows, n_aa - 1], np.frombuffer(conserved_J_residues.encode(), dtype = np.uint8))
+
+    ntseqs = ntseqs[productive].view('S%d' % max_len).ravel().astype(str)
+    aaseqs = np.where(in_cdr3, aaseqs, 0)[productive].view('S%d' % aaseqs.shape[1]).ravel().astype(str)
+    return list(zip(ntseqs.tolist(), aaseqs.tolist(), V[productive].tolist(), J[productive].tolist()))
+
+def _gen_batch(seq_gen_model, n, seed, conserved_J_residues, processes):
+    """gen_rnd_prod_CDR3_batch for SequenceGenerationVDJ and SequenceGenerationVJ"""
+    if processes > 1:
+        #one seed per process, drawn from seed (RandomState, as numpy < 1.17
+        #has no SeedSequence.spawn)
+        seeds = np.random.RandomState(seed).randint(2**32, size = processes, dtype = np.int64)
+        shares = [n//processes + (i < n % processes) for i in range(processes)]
+        args = [(seq_gen_model, share, int(child), conserved_J_residues, 1)
+                for share, child in zip(shares, seeds)]
+        with multiprocessing.Pool(processes = processes) as pool:
+            shards = pool.starmap(_gen_batch, args)
+        return [x for shard in shards for x in shard]
+
+    #batches of a fixed number of draws, so that the first m of n sequences
+    #are the m sequences generated with the same seed
+    rng = np.random.RandomState(seed)
+    seqs = []
+    while len(seqs) < n:
+        seqs.extend(seq_gen_model._draw_productive(_BATCH_DRAWS, rng, conserved_J_residues))
+    return seqs[:n]
@@ -0,0 +1,559 @@
+"""
+Vectorized NumPy engine for the legacy tcrdist metrics.
+
+The functions in pairwise.py (tcrdist_cdr3_metric, tcrdist_cdr1_metric) score
+one pair of strings at a time with dictionary lookups into
+DistanceParams.distance_matrix. Here all sequences are encoded once into
+integer arrays and whole blocks of pairs are scored at once against a small
+lookup table built from the same DistanceParams, so results are identical to
+the per-pair metrics.
+
+tcrdist_cdr3_pw() is the core function, it returns the same condensed vector
+that pwseqdist.apply_pairwise_sq() returns for pairwise.tcrdist_cdr3_metric.
+
+"""
+import numpy as np
+
+from .amino_acids import amino_acids
+from .objects import DistanceParams
+
+gap_character = '.'
+stop_character = '*'
+alphabet = amino_acids + [gap_character, stop_character]
+_aa_to_code = {aa: i for i, aa in enumerate(alphabet)}
+
+# Upper limit on the number of elements in a single (rows x cols) block
+_BLOCK_ELEMENTS = 2 ** 22
+
+
+def distance_table(params = None, gap_penalty = None):
+    """
+    Lookup table version of params.distance_matrix
+
+    Parameters
+    ----------
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    gap_penalty : int or None
+        penalty for aligning a gap or stop character against any other
+        character, as in tcr_distances.blosum_character_distance. When None
+        the gap and stop rows and columns are left at 0 (CDR3s are never
+        gapped).
+
+    Returns
+    -------
+    table : np.ndarray
+        (22 x 22) float64 array indexed by the codes of `alphabet`
+    """
+    if params is None:
+        params = DistanceParams()
+    n = len(alphabet)
+    table = np.zeros((n, n), dtype = np.float64)
+    for a in amino_acids:
+        for b in amino_acids:
+            table[_aa_to_code[a], _aa_to_code[b]] = params.distance_matrix[(a, b)]
+    if gap_penalty is not None:
+        for c in [gap_character, stop_character]:
+            g = _aa_to_code[c]
+            table[g, :] = gap_penalty
+            table[:, g] = gap_penalty
+            table[g, g] = 0
+    return table
+
+
+def encode_sequences(sequences):
+    """
+    Encode strings into a padded integer array
+
+    Parameters
+    ----------
+    sequences : list
+        list of strings containing amino acid letters (or the gap and stop
+        characters)
+
+    Returns
+    -------
+    codes : np.ndarray
+        (N x max_len) int8 array, sequences are left aligned and padded with 0
+    rev_codes : np.ndarray
+        (N x max_len) int8 array of the reversed sequences (right aligned
+        positions, i.e. rev_codes[:, k] is seq[-1-k])
+    lens : np.ndarray
+        (N, ) int64 array of sequence lengths
+    """
+    sequences = list(sequences)
+    lens = np.array([len(s) for s in sequences], dtype = np.int64)
+    max_len = int(lens.max()) if len(lens) > 0 else 0
+    codes = np.zeros((len(sequences), max_len), dtype = np.int8)
+    rev_codes = np.zeros((len(sequences), max_len), dtype = np.int8)
+    for i, s in enumerate(sequences):
+        try:
+            c = [_aa_to_code[aa] for aa in s]
+        except KeyError as e:
+            raise ValueError("pairwise_numpy: unrecognized character {} in sequence {}".format(e, s))
+        codes[i, :len(c)] = c
+        rev_codes[i, :len(c)] = c[::-1]
+    return codes, rev_codes, lens
+
+
+def _check_cdr3(codes, lens, params):
+    """
+    Mirror the assertions of tcr_distances.weighted_cdr3_distance and the
+    amino acid only keys of params.distance_matrix
+    """
+    if len(lens) == 0:
+        return
+    min_len = 5 if params.trim_cdr3s else 1
+    if lens.min() <= min_len:
+        raise ValueError("tcrdist_cdr3 requires CDR3s longer than {} "
+                         "residues".format(min_len))
+    in_seq = np.arange(codes.shape[1])[None, :] < lens[:, None]
+    if np.any((codes >= len(amino_acids)) & in_seq):
+        raise ValueError("tcrdist_cdr3 requires CDR3s of amino acid letters only")
+
+
+def _pair_terms(table_flat, table_t_flat, a_col, b_col, a_is_short):
+    """
+    distance_matrix[(short[k], long[k])] for every pair of broadcast a_col,
+    b_col
+    """
+    n = len(alphabet)
+    idx = a_col.astype(np.int64) * n + b_col.astype(np.int64)
+    terms = table_flat[idx]
+    if table_t_flat is not None:
+        terms = np.where(a_is_short, terms, table_t_flat[idx])
+    return terms
+
+
+def cdr3_distance_block(a, b, params = None, table = None, integer = True):
+    """
+    Legacy tcrdist CDR3 distance between every pair in a rectangular block
+
+    Parameters
+    ----------
+    a : tuple
+        (codes, rev_codes, lens) as returned by encode_sequences
+    b : tuple
+        (codes, rev_codes, lens) as returned by encode_sequences
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    table : np.ndarray
+        optional precomputed distance_table(params)
+    integer : boolean
+        if False the float tcr_distances.weighted_cdr3_distance is returned
+        instead of its integer part (pairwise.tcrdist_cdr3_metric)
+
+    Returns
+    -------
+    dist : np.ndarray
+        (len(a) x len(b)) int64 array, dist[i,j] equals
+        pairwise.tcrdist_cdr3_metric(a[i], b[j]) for default params
+
+    Notes
+    -----
+    Follows tcr_distances.weighted_cdr3_distance term by term. With
+    params.align_cdr3s False the gap is placed at
+
+        gappos = min( 6, 3 + (lenshort-5)/2 )
+
+    otherwise the gap position that minimizes the distance is used.
+    """
+    if params is None:
+        params = DistanceParams()
+    if table is None:
+        table = distance_table(params)
+    _check_cdr3(a[0], a[2], params)
+    _check_cdr3(b[0], b[2], params)
+    return _cdr3_distance((a[0][:, None, :], a[1][:, None, :], a[2][:, None]),
+                          (b[0][None, :, :], b[1][None, :, :], b[2][None, :]),
+                          params,
+                          table,
+                          integer)
+
+
+def cdr3_distance_pairs(a, b, params = None, table = None, integer = True):
+    """
+    Legacy tcrdist CDR3 distance between a[k] and b[k] for every k
+
+    Parameters
+    ----------
+    a : tuple
+        (codes, rev_codes, lens) as returned by encode_sequences
+    b : tuple
+        (codes, rev_codes, lens) as returned by encode_sequences, with as
+        many sequences as a
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    table : np.ndarray
+        optional precomputed distance_table(params)
+    integer : boolean
+        see cdr3_distance_block
+
+    Returns
+    -------
+    dist : np.ndarray
+        (len(a), ) int64 array (float64 if integer is False)
+    """
+    if params is None:
+        params = DistanceParams()
+    if table is None:
+        table = distance_table(params)
+    _check_cdr3(a[0], a[2], params)
+    _check_cdr3(b[0], b[2], params)
+    return _cdr3_distance(a, b, params, table, integer)
+
+
+def _cdr3_distance(a, b, params, table, integer = True):
+    """
+    cdr3_distance_block() for (codes, rev_codes, lens) tuples a and b
+    that broadcast against each other (codes of shape (..., max_len))
+    """
+    a_codes, a_rev, a_lens = a
+    b_codes, b_rev, b_lens = b
+
+    table_flat = table.ravel()
+    table_t_flat = None if np.array_equal(table, table.T) else table.T.ravel()
+
+    a_is_short = a_lens <= b_lens
+    lenshort = np.minimum(a_lens, b_lens)
+    lendiff = np.abs(a_lens - b_lens)
+    ntrim = 3 if params.trim_cdr3s else 0
+    ctrim = 2 if params.trim_cdr3s else 0
+    max_len = min(a_codes.shape[-1], b_codes.shape[-1])
+
+    if not params.align_cdr3s:
+        gappos = np.minimum(6, 3 + (lenshort - 5) // 2)
+        remainder = lenshort - gappos
+        best_dist = np.zeros(lenshort.shape, dtype = np.float64)
+        for k in range(ntrim, min(6, max_len)):
+            terms = _pair_terms(table_flat, table_t_flat, a_codes[..., k], b_codes[..., k], a_is_short)
+            best_dist += np.where(k < gappos, terms, 0.0)
+        for k in range(ctrim, max_len):
+            terms = _pair_terms(table_flat, table_t_flat, a_rev[..., k], b_rev[..., k], a_is_short)
+            best_dist += np.where(k < remainder, terms, 0.0)
+    else:
+        # cumulative N-terminal (left) and C-terminal (right) sums, indexed by
+        # the number of aligned positions
+        left_cum = np.zeros((max_len + 1,) + lenshort.shape, dtype = np.float64)
+        right_cum = np.zeros((max_len + 1,) + lenshort.shape, dtype = np.float64)
+        for k in range(max_len):
+            if k >= ntrim:
+                left_cum[k + 1] = left_cum[k] + _pair_terms(table_flat, table_t_flat, a_codes[..., k], b_codes[..., k], a_is_short)
+            else:
+                left_cum[k + 1] = left_cum[k]
+            if k >= ctrim:
+                right_cum[k + 1] = right_cum[k] + _pair_terms(table_flat, table_t_flat, a_rev[..., k], b_rev[..., k], a_is_short)
+            else:
+                right_cum[k + 1] = right_cum[k]
+        min_gappos = np.full(lenshort.shape, 5)
+        max_gappos = lenshort - 1 - 4
+        while np.any(min_gappos > max_gappos):
+            shift = min_gappos > max_gappos
+            min_gappos = np.where(shift, min_gappos - 1, min_gappos)
+            max_gappos = np.where(shift, max_gappos + 1, max_gappos)
+        best_dist = np.full(lenshort.shape, np.inf)
+        for gappos in range(max_len + 1):
+            valid = (gappos >= min_gappos) & (gappos <= max_gappos)
+            if not np.any(valid):
+                continue
+            remainder = np.clip(lenshort - gappos, 0, max_len)
+            dist = left_cum[gappos] + np.take_along_axis(right_cum, remainder[None], axis = 0)[0]
+            best_dist = np.where(valid & (dist < best_dist), dist, best_dist)
+
+    dist = params.weight_cdr3_region * best_dist + lendiff * params.gap_penalty_cdr3_region
+    if not integer:
+        return dist
+    return dist.astype(np.int64)
+
+
+def _rows_per_block(n_cols, depth = 1):
+    return max(1, _BLOCK_ELEMENTS // max(1, n_cols * depth))
+
+
+def tcrdist_cdr3_pw(sequences, params = None):
+    """
+    Legacy tcrdist CDR3 distance between all pairs of sequences
+
+    Parameters
+    ----------
+    sequences : list
+        list of strings containing amino acid letters
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+
+    Returns
+    -------
+    dvec : np.ndarray, length n*(n - 1) / 2
+        int64 vector form of the pairwise distance matrix, identical to
+        pwseqdist.apply_pairwise_sq(sequences, pairwise.tcrdist_cdr3_metric).
+        Use scipy.distance.squareform to convert to a square matrix
+
+    Examples
+    --------
+    >>> tcrdist_cdr3_pw(['CALDNVLYF','CAASEHLYGSSGNKLIF'])
+    array([132])
+    """
+    if params is None:
+        params = DistanceParams()
+    table = distance_table(params)
+    codes, rev_codes, lens = encode_sequences(sequences)
+    depth = kernel_depth('tcrdist_cdr3', codes.shape[1], params)
+    return condensed_from_blocks(
+        n = len(lens),
+        block_func = lambda r0, r1: cdr3_distance_block(
+            (codes[r0:r1], rev_codes[r0:r1], lens[r0:r1]),
+            (codes[r0:], rev_codes[r0:], lens[r0:]),
+            params = params,
+            table = table),
+        depth = depth)
+
+
+def condensed_from_blocks(n, block_func, depth = 1, dtype = np.int64, block_rows = None):
+    """
+    Assemble a condensed distance vector from row blocks
+
+    Parameters
+    ----------
+    n : int
+        number of sequences
+    block_func : function
+        block_func(r0, r1) returns the (r1 - r0) x (n - r0) block of the
+        square distance matrix with rows r0:r1 and columns r0:n
+    depth : int
+        number of temporary arrays of block size held by block_func, used to
+        bound memory use
+    dtype : np.dtype
+        dtype of dvec
+    block_rows : int or None
+        fixed number of rows per block, by default chosen from depth
+
+    Returns
+    -------
+    dvec : np.ndarray, length n*(n - 1) / 2
+    """
+    dvec = np.zeros(n * (n - 1) // 2, dtype = dtype)
+    r0 = 0
+    while r0 < n:
+        if block_rows is None:
+            r1 = min(n, r0 + _rows_per_block(n - r0, depth))
+        else:
+            r1 = min(n, r0 + block_rows)
+        block = block_func(r0, r1)
+        for i in range(r0, r1):
+            start = i * (2 * n - i - 1) // 2
+            dvec[start:start + n - i - 1] = block[i - r0, i - r0 + 1:]
+        r0 = r1
+    return dvec
+
+
+def _check_equal_lengths(lens):
+    if len(lens) > 0 and np.any(lens != lens[0]):
+        raise ValueError("tcrdist_cdr1 requires aligned sequences of equal "
+                         "length (use imgt_aligned = True)")
+
+
+def blosum_distance_sum(a_codes, b_codes, table):
+    """
+    Float sum of tcr_distances.blosum_character_distance over the aligned
+    positions of every pair in a block (see blosum_distance_block)
+    """
+    n = len(alphabet)
+    table_flat = table.ravel()
+    dist = np.zeros((a_codes.shape[0], b_codes.shape[0]), dtype = np.float64)
+    for k in range(a_codes.shape[1]):
+        idx = a_codes[:, k].astype(np.int64)[:, None] * n + b_codes[:, k].astype(np.int64)[None, :]
+        dist += table_flat[idx]
+    return dist
+
+
+def blosum_distance_block(a_codes, b_codes, table):
+    """
+    tcr_distances.blosum_sequence_distance between every pair in a block
+
+    Parameters
+    ----------
+    a_codes : np.ndarray
+        (R x L) codes of aligned sequences as returned by encode_sequences
+    b_codes : np.ndarray
+        (C x L) codes of aligned sequences as returned by encode_sequences
+    table : np.ndarray
+        distance_table(params, gap_penalty = params.gap_penalty_v_region)
+
+    Returns
+    -------
+    dist : np.ndarray
+        (R x C) int64 array
+    """
+    return blosum_distance_sum(a_codes, b_codes, table).astype(np.int64)
+
+
+def tcrdist_cdr1_pw(sequences, params = None):
+    """
+    Legacy tcrdist CDR1/CDR2/CDR2.5 distance between all pairs of sequences
+
+    The distance is computed once for each pair of unique sequences, which
+    for V-gene derived regions is at most the number of V genes, and then
+    gathered into the full condensed vector.
+
+    Parameters
+    ----------
+    sequences : list
+        list of IMGT aligned strings of equal length
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+
+    Returns
+    -------
+    dvec : np.ndarray, length n*(n - 1) / 2
+        int64 vector form of the pairwise distance matrix, identical to
+        pwseqdist.apply_pairwise_sq(sequences, pairwise.tcrdist_cdr1_metric)
+    """
+    if params is None:
+        params = DistanceParams()
+    unique_seqs, inverse = np.unique(np.asarray(list(sequences), dtype = object).astype(str),
+                                     return_inverse = True)
+    codes, _, lens = encode_sequences(unique_seqs)
+    _check_equal_lengths(lens)
+    table = distance_table(params, gap_penalty = params.gap_penalty_v_region)
+    unique_pw = blosum_distance_block(codes, codes, table)
+    return condensed_from_blocks(
+        n = len(inverse),
+        block_func = lambda r0, r1: unique_pw[inverse[r0:r1, None], inverse[None, r0:]])
+
+
+# Cache of V-gene x V-gene distance tables, see v_region_table()
+_v_region_tables = {}
+
+
+def _params_key(params):
+    return (params.gap_penalty_v_region,
+            tuple(sorted(params.distance_matrix.items())))
+
+
+def v_region_table(organism,
+                   db_chain,
+                   cdr,
+                   params = None,
+                   db_file = "alphabeta_db.tsv",
+                   all_genes = None):
+    """
+    Distance between the IMGT aligned CDR loops of every pair of V genes
+
+    Tables are computed once per (db_file, organism, db_chain, cdr, params)
+    and cached for the life of the process.
+
+    Parameters
+    ----------
+    organism : string
+        "human" or "mouse"
+    db_chain : string
+        chain as recorded in the reference db (e.g. 'A' or 'B'). Note that
+        in gammadelta_db.tsv gamma is 'A' and delta is 'B'.
+    cdr : int
+        0 - CDR1, 1 - CDR2 and 2 - CDR2.5 (pMHC)
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    db_file : string
+        reference db file (e.g. "alphabeta_db.tsv")
+    all_genes : OrderedDict
+        optional repertoire_db.RefGeneSet(db_file).all_genes, to avoid
+        re-reading the reference db
+
+    Returns
+    -------
+    gene_index : dict
+        maps V gene name to row/column of table
+    cdr_seqs : list
+        aligned CDR sequence of each gene
+    table : np.ndarray
+        (n_genes x n_genes) int64 array, table[i,j] equals
+        pairwise.tcrdist_cdr1_metric(cdr_seqs[i], cdr_seqs[j])
+    """
+    if params is None:
+        params = DistanceParams()
+    key = (db_file, organism, db_chain, cdr, _params_key(params))
+    if key not in _v_region_tables:
+        if all_genes is None:
+            from . import repertoire_db
+            all_genes = repertoire_db.get_ref_gene_set(db_file).all_genes
+        genes = [g for g in all_genes[organism].values()
+                 if g.chain == db_chain and g.region == 'V' and g.cdrs]
+        gene_index = {g.id : i for i, g in enumerate(genes)}
+        cdr_seqs = [g.cdrs[cdr] for g in genes]
+        codes, _, lens = encode_sequences(cdr_seqs)
+        _check_equal_lengths(lens)
+        table = distance_table(params, gap_penalty = params.gap_penalty_v_region)
+        _v_region_tables[key] = (gene_index, cdr_seqs, blosum_distance_block(codes, codes, table))
+    return _v_region_tables[key]
+
+
+cdr3_metrics = ['tcrdist_cdr3']
+v_region_metrics = ['tcrdist_cdr1', 'tcrdist_cdr2', 'tcrdist_cdr2.5', 'tcrdist_pmhc']
+
+
+def region_kernel(sequences, metric, params = None):
+    """
+    Block function for one CDR region of a set of clones
+
+    Sequences are encoded once, after which the distances between any subset
+    of rows and any subset of columns can be computed as a block, without
+    computing the full matrix.
+
+    Parameters
+    ----------
+    sequences : list
+        list of strings, one per clone
+    metric : string
+        "tcrdist_cdr3" or one of the V-region metrics "tcrdist_cdr1",
+        "tcrdist_cdr2", "tcrdist_cdr2.5", "tcrdist_pmhc"
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+
+    Returns
+    -------
+    block : function
+        block(rows, cols) returns the (len(rows) x len(cols)) int64 array
+        of distances between sequences[rows] and sequences[cols], where
+        rows and cols are integer index arrays (or slices).
+        block(rows, cols, outer = False) returns the (len(rows), ) int64
+        array of distances between sequences[rows[k]] and sequences[cols[k]]
+    """
+    if params is None:
+        params = DistanceParams()
+    if metric in cdr3_metrics:
+        codes, rev_codes, lens = encode_sequences(sequences)
+        _check_cdr3(codes, lens, params)
+        table = distance_table(params)
+        def block(rows, cols, outer = True):
+            dist_func = cdr3_distance_block if outer else cdr3_distance_pairs
+            return dist_func((codes[rows], rev_codes[rows], lens[rows]),
+                             (codes[cols], rev_codes[cols], lens[cols]),
+                             params = params,
+                             table = table)
+    elif metric in v_region_metrics:
+        # V-region loops take few distinct values, score those once
+        unique_seqs, inverse = np.unique(np.asarray(list(sequences), dtype = object).astype(str),
+                                         return_inverse = True)
+        codes, _, lens = encode_sequences(unique_seqs)
+        _check_equal_lengths(lens)
+        table = distance_table(params, gap_penalty = params.gap_penalty_v_region)
+        unique_pw = blosum_distance_block(codes, codes, table)
+        def block(rows, cols, outer = True):
+            if outer:
+                return unique_pw[inverse[rows][:, None], inverse[cols][None, :]]
+            return unique_pw[inverse[rows], inverse[cols]]
+    else:
+        raise ValueError("pairwise_numpy: metric {} is not supported".format(metric))
+    return block
+
+
+def kernel_depth(metric, max_len, params = None):
+    """
+    Number of block size temporaries held by region_kernel(metric) blocks
+    for sequences of at most max_len residues (see condensed_from_blocks)
+    """
+    if params is None:
+        params = DistanceParams()
+    if metric in cdr3_metrics:
+        return 2 * (max_len + 1) if params.align_cdr3s else 4
+    return 1
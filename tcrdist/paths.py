@@ -47,3 +47,17 @@ def path_to_current_db_files(db_file=db_file):
     if not op.exists(db_files_dir):
         os.mkdir(db_files_dir)
     return db_files_dir
+
+def path_to_user_cache(subdir=None):
+    """
+    Directory for files tcrdist computes once and reuses across sessions and
+    processes: $TCRDIST_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/tcrdist
+    or ~/.cache/tcrdist. The directory is not created here.
+    """
+    base = os.environ.get('TCRDIST_CACHE_DIR')
+    if not base:
+        base = op.join(os.environ.get('XDG_CACHE_HOME') or op.join(op.expanduser('~'), '.cache'),
+                       'tcrdist')
+    if subdir is not None:
+        base = op.join(base, subdir)
+    return base
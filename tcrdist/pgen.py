@@ -2,13 +2,29 @@ import pandas as pd
 import numpy as np
 import os.path as op
 import os
+import collections
+import hashlib
+import json
+import logging
+import multiprocessing
+import sqlite3
 
 from tcrdist import olga
 import tcrdist.olga.load_model as load_model
 import tcrdist.olga.generation_probability as generation_probability
 import tcrdist.olga.generation_probability as pgen
 from tcrdist.olga.utils import nt2aa, determine_seq_type
-from tcrdist.paths import path_to_olga_default_models
+from tcrdist.paths import path_to_olga_default_models, path_to_user_cache
+
+logger = logging.getLogger('pgen.py')
+
+# In memory LRU cache of Pgens shared by all OlgaModel instances, keyed by
+# (OlgaModel.model_key(), CDR3, V mask, J mask)
+_pgen_lru = collections.OrderedDict()
+_PGEN_LRU_SIZE = 2 ** 20
+
+# OlgaModel used by the worker processes of compute_aa_cdr3_pgens_batch
+_worker_model = None
 
 
 class OlgaModel:
@@ -128,6 +144,20 @@ class OlgaModel:
         pgen_estimate = self.pgen_model.compute_aa_CDR3_pgen(CDR3_seq, V_usage_mask_in, J_usage_mask_in)
         return(pgen_estimate)
 
+    def model_key(self):
+        """
+        sha1 of recomb_type and the model files of chain_folder, used to key
+        cached Pgens
+        """
+        if getattr(self, '_model_key', None) is None:
+            h = hashlib.sha1(self.recomb_type.encode())
+            for f in ['model_params.txt', 'model_marginals.txt',
+                      'V_gene_CDR3_anchors.csv', 'J_gene_CDR3_anchors.csv']:
+                with open(op.join(path_to_olga_default_models, self.chain_folder, f), 'rb') as fh:
+                    h.update(fh.read())
+            self._model_key = h.hexdigest()
+        return self._model_key
+
     def compute_aa_cdr3_pgens(self, CDR3_seq, V_usage_mask_in = None, J_usage_mask_in = None):
         """
         function for computing many generation probabilities. The assumption is that
@@ -168,6 +198,102 @@ class OlgaModel:
         pgen_estimates = [self.compute_aa_cdr3_pgen(x,y,z) for x,y,z in input_tuples]
         return(pgen_estimates)
 
+    def compute_aa_cdr3_pgens_batch(self,
+                                    CDR3_seq,
+                                    V_usage_mask_in = None,
+                                    J_usage_mask_in = None,
+                                    processes = 1,
+                                    use_cache = True,
+                                    progress = False,
+                                    chunk_size = 500):
+        """
+        Same output as compute_aa_cdr3_pgens for whole repertoires.
+
+        Each distinct (CDR3, V mask, J mask) triple is computed once. Pgens
+        are looked up in an in-memory LRU cache and in an on-disk cache
+        (an sqlite file per model under paths.path_to_user_cache('pgen'),
+        keyed by model_key()) before being computed, optionally by a pool
+        of worker processes. On platforms that fork, workers share this
+        OlgaModel copy-on-write; otherwise each worker loads the model once.
+
+        Parameters
+        ----------
+        CDR3_seq : list of strings or None
+        V_usage_mask_in : list of strings, lists or None
+        J_usage_mask_in : list of strings, lists or None
+        processes : int
+            number of worker processes
+        use_cache : boolean
+            if False the LRU and disk caches are neither read nor written
+        progress : boolean
+            if True the number of computed Pgens is printed after every chunk
+        chunk_size : int
+            number of Pgens computed per task
+
+        Returns
+        -------
+        pgens : list
+            list of floats, in the order of CDR3_seq
+        """
+        l = len(CDR3_seq)
+        if V_usage_mask_in is None:
+            V_usage_mask_in = [None]*l
+        if J_usage_mask_in is None:
+            J_usage_mask_in = [None]*l
+        if len(V_usage_mask_in) != l or len(J_usage_mask_in) != l:
+            raise TypeError("len(CDR3_seq) must equal len(V_usage_mask_in) and len(J_usage_mask_in)")
+
+        input_tuples = list(zip(CDR3_seq, V_usage_mask_in, J_usage_mask_in))
+        keys = [_pgen_key(x) for x in input_tuples]
+        unique = collections.OrderedDict()
+        for key, x in zip(keys, input_tuples):
+            if key not in unique:
+                unique[key] = x
+
+        results = {}
+        if use_cache:
+            model_key = self.model_key()
+            for key in unique:
+                try:
+                    results[key] = _pgen_lru[(model_key, key)]
+                    _pgen_lru.move_to_end((model_key, key))
+                except KeyError:
+                    pass
+            results.update(_read_disk_cache(model_key, [k for k in unique if k not in results]))
+
+        todo = [k for k in unique if k not in results]
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        tasks = [[unique[k] for k in chunk] for chunk in chunks]
+        done = 0
+        if processes > 1 and len(tasks) > 1:
+            global _worker_model
+            _worker_model = self
+            with multiprocessing.Pool(processes = processes,
+                                      initializer = _init_worker,
+                                      initargs = (self.chain_folder, self.recomb_type)) as pool:
+                for chunk, pgens in zip(chunks, pool.imap(_compute_chunk, tasks)):
+                    results.update(zip(chunk, pgens))
+                    done += len(chunk)
+                    if progress:
+                        print("computed {} of {} Pgens".format(done, len(todo)))
+        else:
+            for chunk, task in zip(chunks, tasks):
+                results.update(zip(chunk, [self.compute_aa_cdr3_pgen(x,y,z) for x,y,z in task]))
+                done += len(chunk)
+                if progress:
+                    print("computed {} of {} Pgens".format(done, len(todo)))
+
+        if use_cache:
+            _write_disk_cache(model_key, {k : results[k] for k in todo})
+            for key in unique:
+                _pgen_lru[(model_key, key)] = results[key]
+                _pgen_lru.move_to_end((model_key, key))
+            while len(_pgen_lru) > _PGEN_LRU_SIZE:
+                _pgen_lru.popitem(last = False)
+
+        pgen_estimates = [results[key] for key in keys]
+        return(pgen_estimates)
+
 
 
     def _validate_recomb_type_arg(self):
@@ -212,6 +338,84 @@ class OlgaModel:
 
 
 
+def _mask_key(mask):
+    if mask is None:
+        return None
+    if isinstance(mask, str):
+        return mask
+    if isinstance(mask, (list, tuple)):
+        return list(mask)
+    return repr(mask)
+
+def _pgen_key(input_tuple):
+    """
+    JSON key of a (CDR3, V mask, J mask) triple
+    """
+    cdr3, v, j = input_tuple
+    return json.dumps([cdr3 if isinstance(cdr3, str) else repr(cdr3), _mask_key(v), _mask_key(j)])
+
+def _init_worker(chain_folder, recomb_type):
+    """
+    Load the OlgaModel once per worker process, unless it was inherited
+    from the parent process
+    """
+    global _worker_model
+    if _worker_model is None or \
+        (_worker_model.chain_folder, _worker_model.recomb_type) != (chain_folder, recomb_type):
+        _worker_model = OlgaModel(chain_folder = chain_folder, recomb_type = recomb_type)
+
+def _compute_chunk(task):
+    return [_worker_model.compute_aa_cdr3_pgen(x,y,z) for x,y,z in task]
+
+def _disk_cache_file(model_key):
+    return op.join(path_to_user_cache('pgen'), '{}.sqlite'.format(model_key))
+
+def _read_disk_cache(model_key, keys):
+    """
+    Pgens of keys found in the disk cache of model_key
+    """
+    found = {}
+    path = _disk_cache_file(model_key)
+    if len(keys) == 0 or not op.isfile(path):
+        return found
+    try:
+        with sqlite3.connect(path) as con:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = con.execute("SELECT key, pgen FROM pgen WHERE key IN ({})".format(",".join("?"*len(batch))),
+                                   batch)
+                found.update(rows.fetchall())
+    except sqlite3.Error as e:
+        logger.warning('Pgen cache {} could not be read: {}'.format(path, e))
+    return found
+
+def _write_disk_cache(model_key, pgens):
+    """
+    Add pgens (dict of key to Pgen) to the disk cache of model_key
+    """
+    if len(pgens) == 0:
+        return
+    path = _disk_cache_file(model_key)
+    try:
+        os.makedirs(op.dirname(path), exist_ok = True)
+        with sqlite3.connect(path, timeout = 60) as con:
+            con.execute("CREATE TABLE IF NOT EXISTS pgen (key TEXT PRIMARY KEY, pgen REAL)")
+            con.executemany("INSERT OR REPLACE INTO pgen VALUES (?, ?)", list(pgens.items()))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning('Pgens could not be cached in {}: {}'.format(path, e))
+
+def clear_pgen_cache():
+    """
+    Remove all cached Pgens (in memory and on disk)
+    """
+    _pgen_lru.clear()
+    cache = path_to_user_cache('pgen')
+    if op.isdir(cache):
+        for f in os.listdir(cache):
+            if f.endswith('.sqlite'):
+                os.remove(op.join(cache, f))
+
+
 
 
 
@@ -32,7 +32,9 @@ Example
 """
 
 from collections import Counter
+import multiprocessing
 import os
+import numpy as np
 import pandas as pd
 from .all_genes import all_genes
 
@@ -101,15 +103,205 @@ def get_10X_clones(organism,
 
     """
 
-    clonotype2tcrs, clonotype2barcodes = _read_tcr_data(organism,
-                                                       filtered_contig_annotations_csvfile,
-                                                       consensus_annotations_csvfile,
-                                                       include_gammadelta,
-                                                       allow_unknown_genes)
+    assert organism in ["mouse", "human"]
+
+    assert isinstance(filtered_contig_annotations_csvfile,str)
+    assert os.path.isfile(filtered_contig_annotations_csvfile)
 
-    df = _make_clones_df(organism, clonotype2tcrs, clonotype2barcodes )
+    assert isinstance(consensus_annotations_csvfile,str)
+    assert os.path.isfile(consensus_annotations_csvfile)
+
+    assert isinstance(include_gammadelta, bool)
+    assert isinstance(allow_unknown_genes, bool)
+
+    clone_sizes = _read_clone_sizes(filtered_contig_annotations_csvfile)
+    chains, clonotypes = _read_consensus_chains(organism, consensus_annotations_csvfile, allow_unknown_genes)
+    df = _make_clones_df_from_chains(chains, clonotypes, clone_sizes)
     return df
 
+
+def get_10X_clones_from_samples(organism,
+                                samples,
+                                include_gammadelta = False,
+                                allow_unknown_genes = False,
+                                processes = 1):
+    """
+    get_10X_clones() of several 10X samples, concatenated with a sample column
+
+    Parameters
+    ----------
+    organism : str
+        "mouse" or "human"
+    samples : dict
+        sample name -> (filtered_contig_annotations_csvfile, consensus_annotations_csvfile)
+    include_gammadelta : bool
+        Default is False
+    allow_unknown_genes : bool
+        Default is False
+    processes : int
+        number of samples parsed concurrently
+
+    Returns
+    -------
+    df : DataFrame
+        the columns of get_10X_clones() followed by 'sample'; clone_id is
+        only unique within a sample
+
+    Example
+    -------
+    >>> clones_df = preprocess_10X.get_10X_clones_from_samples(organism = 'human',
+                                       samples = {'pbmc1': (fca1, ca1), 'pbmc2': (fca2, ca2)},
+                                       processes = 2)
+    """
+    if not samples:
+        return pd.DataFrame(columns = _clone_columns + ['sample'])
+    jobs = [(organism, fca, ca, include_gammadelta, allow_unknown_genes) for fca, ca in samples.values()]
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            dfs = pool.starmap(get_10X_clones, jobs, chunksize = 1)
+    else:
+        dfs = [get_10X_clones(*job) for job in jobs]
+    for sample, df in zip(samples, dfs):
+        df['sample'] = sample
+    return pd.concat(dfs, ignore_index = True)
+
+
+# columns of the clones DataFrame of get_10X_clones()
+_clone_columns = ['clone_id', 'subject', 'count', 'v_a_gene', 'j_a_gene', 'v_b_gene',
+                  'j_b_gene', 'cdr3_a_aa', 'cdr3_a_nucseq', 'cdr3_b_aa', 'cdr3_b_nucseq',
+                  'alpha_umi', 'beta_umi', 'num_alphas', 'num_betas']
+
+
+def _read_clone_sizes(contig_annotations_csvfile):
+    """
+    Number of distinct barcodes of each raw_clonotype_id in the filtered
+    contig annotations (the clonotype2barcodes of _read_tcr_data(), counted)
+
+    Returns
+    -------
+    clone_sizes : pd.Series
+        indexed by clonotype id
+    """
+    contigs = pd.read_csv(contig_annotations_csvfile, usecols = ['barcode', 'raw_clonotype_id'])
+    contigs = contigs[contigs.raw_clonotype_id.notnull()]
+    return contigs.groupby('raw_clonotype_id', sort = False).barcode.nunique()
+
+
+def _normalize_gene_names(genes, expected_gene_names, region, gene_suffix = '*01'):
+    """
+    10X gene name -> all_genes name, for each distinct name in genes (see _read_tcr_data)
+
+    Returns
+    -------
+    names : dict
+    """
+    names = dict()
+    for g in pd.unique(genes):
+        name = g
+        if '*' not in name:
+            name += gene_suffix
+        if region == 'V' and 'DV' in name and name not in expected_gene_names:
+            name = name[:name.index('DV')]+'/'+name[name.index('DV'):]
+        names[g] = name
+    return names
+
+
+def _read_consensus_chains(organism, consensus_annotations_csvfile, allow_unknown_genes):
+    """
+    The productive alpha and beta chains of the clonotype consensus
+    annotations, one row per distinct (clonotype, chain, v, j, cdr3, cdr3_nt),
+    with the filtering and gene name handling of _read_tcr_data()
+
+    Returns
+    -------
+    chains : DataFrame
+        columns clonotype_id, ab, v_gene, j_gene, cdr3, cdr3_nt, umis in file
+        order
+    clonotypes : np.ndarray
+        the productive clonotypes in order of appearance
+    """
+    expected_gene_names = all_genes[organism].keys()
+
+    cons = pd.read_csv(consensus_annotations_csvfile)
+    if cons.productive.dtype == bool:
+        productive = cons.productive.values
+    else:
+        productive = np.array([x is True for x in cons.productive], dtype = bool)
+    cons = cons[productive]
+    clonotypes = pd.unique(cons.clonotype_id)
+
+    chain = cons.chain.astype(str)
+    ab = chain.str[2]
+    is_ab = (chain.str.startswith('TR') & ab.isin(['A', 'B'])).values
+    for _, l in cons[~is_ab].iterrows():
+        print('skipline:', consensus_annotations_csvfile, l['chain'], l['v_gene'], l['j_gene'])
+    cons = cons[is_ab]
+
+    v_names = _normalize_gene_names(cons.v_gene.values, expected_gene_names, 'V')
+    j_names = _normalize_gene_names(cons.j_gene.values, expected_gene_names, 'J')
+    chains = pd.DataFrame({'clonotype_id' : cons.clonotype_id.values,
+                           'ab' : ab[is_ab].values,
+                           'v_gene' : [v_names[g] for g in cons.v_gene.values],
+                           'j_gene' : [j_names[g] for g in cons.j_gene.values],
+                           'cdr3' : cons.cdr3.values,
+                           'cdr3_nt' : cons.cdr3_nt.str.lower().values,
+                           'umis' : cons.umis.astype(int).values})
+
+    known_v = np.array([v in expected_gene_names for v in chains.v_gene])
+    known_j = np.array([j in expected_gene_names for j in chains.j_gene])
+    for v in sorted(set(chains.v_gene[~known_v])):
+        print('unrecognized V gene:', organism, v)
+    for j in sorted(set(chains.j_gene[~known_j])):
+        print('unrecognized J gene:', organism, j)
+    if not allow_unknown_genes:
+        chains = chains[known_v & known_j]
+
+    chains = chains.drop_duplicates(['clonotype_id', 'ab', 'v_gene', 'j_gene', 'cdr3', 'cdr3_nt'])
+    return chains, clonotypes
+
+
+def _make_clones_df_from_chains(chains, clonotypes, clone_sizes):
+    """
+    _make_clones_df() from the chains and clonotypes of
+    _read_consensus_chains() and the clone sizes of _read_clone_sizes(),
+    with grouped DataFrame operations
+
+    Each clonotype with at least one alpha and one beta chain is paired
+    with its highest UMI alpha and beta chains (the first in the file
+    among ties, as Counter.most_common does).
+    """
+    assert pd.Index(clonotypes).isin(clone_sizes.index).all()
+
+    # stable, so ties keep file order
+    top = chains.sort_values('umis', ascending = False, kind = 'mergesort').\
+        drop_duplicates(['clonotype_id', 'ab'])
+    num = chains.groupby(['ab', 'clonotype_id']).size()
+    alpha = top[top.ab == 'A'].set_index('clonotype_id')
+    beta = top[top.ab == 'B'].set_index('clonotype_id')
+    clonotypes = [c for c in clonotypes if c in alpha.index and c in beta.index]
+    alpha = alpha.loc[clonotypes]
+    beta = beta.loc[clonotypes]
+
+    df = pd.DataFrame({'clone_id' : clonotypes,
+                       'subject' : 'UNK_S',
+                       'count' : clone_sizes.loc[clonotypes].values,
+                       'v_a_gene' : alpha.v_gene.values,
+                       'j_a_gene' : alpha.j_gene.values,
+                       'v_b_gene' : beta.v_gene.values,
+                       'j_b_gene' : beta.j_gene.values,
+                       'cdr3_a_aa' : alpha.cdr3.values,
+                       'cdr3_a_nucseq' : alpha.cdr3_nt.values,
+                       'cdr3_b_aa' : beta.cdr3.values,
+                       'cdr3_b_nucseq' : beta.cdr3_nt.values,
+                       'alpha_umi' : alpha.umis.astype(str).values,
+                       'beta_umi' : beta.umis.astype(str).values,
+                       'num_alphas' : num.loc['A'].loc[clonotypes].values if clonotypes else [],
+                       'num_betas' : num.loc['B'].loc[clonotypes].values if clonotypes else []},
+                      columns = _clone_columns)
+    # remove any TCR with a CDR shorter than 5
+    ind = (df.cdr3_b_aa.str.len() > 5) & (df.cdr3_a_aa.str.len() > 5)
+    return df[ind].copy()
+
 def _parse_csv_file( csvfile ):
     """
     Gets header and all lines as a list of dictionaries from a csv file.
@@ -150,7 +342,7 @@ def _parse_csv_file( csvfile ):
     """
     df = pd.read_csv(csvfile)
     header = df.columns.to_list()
-    all_info = df.to_dict('rows')
+    all_info = df.to_dict('records')
     return header, all_info
 
 
@@ -35,15 +35,31 @@ assigned name.
     v_b_genes, j_b_genes, v_b_genes_imgt, j_b_genes_imgt = preprocess_adaptive.\
     _get_adaptive_gene_names("example1.tsv", organism = "human")
 
+
+3. Preprocess large files or whole cohorts with bounded memory
+
+.. code-block:: python
+
+    from tcrdist import preprocess_adaptive
+
+    for cell_df in preprocess_adaptive.iter_immunoseq("example1.tsv", organism = 'human', chunksize = 100000):
+        cell_df = cell_df[cell_df.cdr3_b_aa != ""]
+
+    preprocess_adaptive.parse_immunoseq_files(["example1.tsv", "example2.tsv"], organism = 'human',
+                                              processes = 2, parquet_dir = "cohort_parquet")
+
 """
 
 
 from collections import namedtuple, Counter
+import csv
+import multiprocessing
+import os
 import numpy as np
 import pandas as pd
 from .all_genes import all_genes
 
-def parse_immunoseq(filename, organism, subject = None):
+def parse_immunoseq(filename, organism, subject = None, chunksize = 100000):
     """
     Creates a cell_df DataFrame compatible with tcrdist2 using
     an Adaptive Biotechnologies immunoSEQ file as the source.
@@ -57,6 +73,8 @@ def parse_immunoseq(filename, organism, subject = None):
         'human' or 'mouse'
     subject : str
         The subject associated with this file
+    chunksize : int
+        number of rows parsed at a time (see iter_immunoseq)
 
     Returns
     -------
@@ -78,83 +96,198 @@ def parse_immunoseq(filename, organism, subject = None):
     * vb_rep is the allele used to represent that gene family (e.g. *02 and *01 both are repressented as by *01)
     * vb_countreps is the gene level, ignoring allele, representative used for counting/
     """
+    chunks = list(iter_immunoseq(filename, organism, subject = subject, chunksize = chunksize))
+    if not chunks:
+        return pd.DataFrame(columns = cell_df_columns)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index = True)
+
+
+# the immunoSEQ columns iter_immunoseq reads
+_used_fields = ["nucleotide", "aminoAcid", "vMaxResolved", "vGeneName", "vGeneNameTies",
+                "jMaxResolved", "jGeneName", "jGeneNameTies", "vIndex", "jIndex"]
+
+cell_df_columns = ['id',
+                   'subject',
+                   'v_b_gene',
+                   'vb_countreps',
+                   'j_b_gene',
+                   'jb_countreps',
+                   'cdr3_b_aa',
+                   'cdr3_b_nucseq']
+
+
+def iter_immunoseq(filename, organism, subject = None, chunksize = 100000):
+    """
+    Parses an Adaptive Biotechnologies immunoSEQ file chunksize rows at a
+    time, yielding the rows of parse_immunoseq() as a sequence of cell_df
+    DataFrames. Only one chunk is held in memory at a time, whatever the
+    size of the file.
+
+    Parameters
+    ----------
+    filename : str
+        filename of .tab deliminited Adaptive Biotechnologies immunoSEQ file
+        with standard headers.
+    orgnanism : str
+        'human' or 'mouse'
+    subject : str
+        The subject associated with this file
+    chunksize : int
+        number of rows per chunk
+
+    Yields
+    ------
+    cell_df : DataFrame
+        columns cell_df_columns; id numbers the rows of the file from 0
+
+    Notes
+    -----
+    Gene names are normalized once per distinct name (see _imgt_gene_name)
+    rather than once per row.
+
+    Examples
+    --------
+    >>> for cell_df in iter_immunoseq("example1.tsv", organism = "human"):
+    ...     cell_df = cell_df[cell_df.cdr3_b_aa != ""]
+    """
     if subject is None:
         subject = str(filename.replace(".tsv", ""))
 
-    storage_list = list()
     with open(filename , "r") as fh:
         # First Line, We check the header against the namedtuple
         _validate_header_of_adaptive_immunoseq_file(header = fh.readline(),
                                                     adaptive = adaptive)
-        # Subsequent Lines
-        for i, line in enumerate(fh):
-            n = len(adaptive._fields)
-            # only take the first n elements
-            elements = line.strip().split("\t")[0:n]
-            # initialize adaptive named tuple
-            adapt = adaptive(*elements)
 
-            # get v_b_gene, vb_countreps names
-            v_b_gene, vb_countreps = _get_v_gene_attrs(adapt)
-            j_b_gene, jb_countreps = _get_j_gene_attrs(adapt)
+    # columns are taken by position, as the header may hold extra fields
+    usecols = {adaptive._fields.index(f) : f for f in _used_fields}
+    try:
+        reader = pd.read_csv(filename,
+                             sep = "\t",
+                             header = None,
+                             skiprows = 1,
+                             usecols = list(usecols),
+                             dtype = str,
+                             na_filter = False,
+                             quoting = csv.QUOTE_NONE,
+                             chunksize = chunksize)
+    except pd.errors.EmptyDataError:
+        # header only
+        return
+    start = 0
+    for chunk in reader:
+        # (with na_filter = False fields missing from short rows are "")
+        chunk = chunk.rename(columns = usecols)
+        yield _cell_df_from_chunk(chunk, organism, subject, start)
+        start += chunk.shape[0]
+
+
+def _cell_df_from_chunk(chunk, organism, subject, start):
+    """
+    cell_df of a DataFrame of immunoSEQ rows (the _used_fields columns, all
+    strings); start is the id of the first row
+    """
+    v_b_gene, vb_countreps = _get_gene_attrs_columns(chunk, "v")
+    j_b_gene, jb_countreps = _get_gene_attrs_columns(chunk, "j")
 
-            # _
-            # Adaptive's Gene Names Need to Match all_genes (IMGT Name)
-            #    TCRBV05-07*01 --- >  TRBV5-7*01
-            # The steps are:
-            # 1.  TCRB -> TRBC (e.g., TCRBV05-07*01 ->  TRBV05-7*01 )
-            # 2.  e.g., TRBV05-07*01 ->  TRBV05-7*01
-            # 3.  TRBV05-7*01 -> TRBV5-7*01
-            # 4.  If no allele is called, then we assign it '*01'
-            # 5.  There are some '-1' names not recognized
-            # (e.g., TRBV19-1*01 to TRBV19*01)
-            # Replace Adaptive's TCRB naming convention in favor of IMGT name
-            v_b_gene = v_b_gene.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
-            j_b_gene = j_b_gene.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BJ0","BJ")
-
-            vb_countreps = vb_countreps.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
-            jb_countreps = jb_countreps.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
+    cdr3_b_nucseq = _cdr3_nucseqs(chunk.nucleotide.values, chunk.aminoAcid.values,
+                                  chunk.vIndex.values, chunk.jIndex.values)
 
-            # Assign allele *01 to genes not resolved at the allele level
-            if v_b_gene.find('*0') == -1:
-                v_b_gene = v_b_gene + "*01"
-            if j_b_gene.find('*0') == -1:
-                j_b_gene = j_b_gene + "*01"
+    return pd.DataFrame({'id' : np.arange(start, start + chunk.shape[0]),
+                         'subject' : subject,
+                         'v_b_gene' : _map_gene_names(v_b_gene, organism, 'V', False),
+                         'vb_countreps' : _map_gene_names(vb_countreps, organism, 'V', True),
+                         'j_b_gene' : _map_gene_names(j_b_gene, organism, 'J', False),
+                         'jb_countreps' : _map_gene_names(jb_countreps, organism, 'J', True),
+                         'cdr3_b_aa' : chunk.aminoAcid.values,
+                         'cdr3_b_nucseq' : cdr3_b_nucseq},
+                        columns = cell_df_columns)
 
-            # TRBV19-1*01 to TRBV19*01
-            if v_b_gene not in all_genes[organism].keys():
-                v_b_gene = v_b_gene.replace("-1","")
-
-            if j_b_gene not in all_genes[organism].keys():
-                j_b_gene = j_b_gene.replace("-1","")
-
-            # get the primary amino acid sequence sequence
-            cdr3_b_aa = adapt.aminoAcid
-            cdr3_b_nucseq = _extract_cdr3_nucseq_from_adaptive(adapt)
-
-
-            storage_list.append( [i,
-                                  subject,
-                                  v_b_gene,
-                                  vb_countreps,
-                                  j_b_gene,
-                                  jb_countreps,
-                                  cdr3_b_aa,
-                                  cdr3_b_nucseq ])
-
-        immunoseq_cell_df = pd.DataFrame(storage_list, columns = ['id',
-                                                                  'subject',
-                                                                  'v_b_gene',
-                                                                  'vb_countreps',
-                                                                  'j_b_gene',
-                                                                  'jb_countreps',
-                                                                  'cdr3_b_aa',
-                                                                  'cdr3_b_nucseq'])
-        return immunoseq_cell_df
+
+def immunoseq_to_parquet(filename, path, organism, subject = None, chunksize = 100000):
+    """
+    Parses an Adaptive Biotechnologies immunoSEQ file chunk by chunk (see
+    iter_immunoseq) into a Parquet dataset, a directory holding one
+    part-NNNNN.parquet file per chunk, readable with pd.read_parquet(path).
+    Requires pyarrow or fastparquet.
+
+    Parameters
+    ----------
+    filename : str
+        filename of .tab deliminited Adaptive Biotechnologies immunoSEQ file
+    path : str
+        output directory, created if needed
+    orgnanism : str
+        'human' or 'mouse'
+    subject : str
+        The subject associated with this file
+    chunksize : int
+        number of rows per part file
+
+    Returns
+    -------
+    path : str
+    """
+    os.makedirs(path, exist_ok = True)
+    i = -1
+    for i, cell_df in enumerate(iter_immunoseq(filename, organism, subject = subject, chunksize = chunksize)):
+        cell_df.to_parquet(os.path.join(path, 'part-{:05d}.parquet'.format(i)), index = False)
+    if i < 0:
+        # no rows: one empty part, so that the dataset still has the columns
+        pd.DataFrame(columns = cell_df_columns).\
+            to_parquet(os.path.join(path, 'part-00000.parquet'), index = False)
+    return path
+
+
+def _parse_immunoseq_job(args):
+    """parse_immunoseq or immunoseq_to_parquet of one file, for multiprocessing.Pool.map"""
+    filename, organism, subject, chunksize, path = args
+    if path is None:
+        return parse_immunoseq(filename, organism, subject = subject, chunksize = chunksize)
+    return immunoseq_to_parquet(filename, path, organism, subject = subject, chunksize = chunksize)
+
+
+def parse_immunoseq_files(filenames, organism, subjects = None, processes = 1,
+                          parquet_dir = None, chunksize = 100000):
+    """
+    Parses the immunoSEQ files of a cohort, one file per worker process
+
+    Parameters
+    ----------
+    filenames : list
+        immunoSEQ files
+    orgnanism : str
+        'human' or 'mouse'
+    subjects : list
+        subject of each file, by default derived from the file names as in
+        parse_immunoseq
+    processes : int
+        number of files parsed concurrently
+    parquet_dir : str
+        if given, each file is written to the Parquet dataset
+        parquet_dir/<file name without extension> (see immunoseq_to_parquet)
+        instead of being returned, so memory use is bounded by processes
+        chunks
+    chunksize : int
+        number of rows parsed at a time
+
+    Returns
+    -------
+    results : list
+        cell_df DataFrames, or Parquet dataset paths if parquet_dir is given,
+        in the order of filenames
+    """
+    if subjects is None:
+        subjects = [None] * len(filenames)
+    paths = [None] * len(filenames)
+    if parquet_dir is not None:
+        paths = [os.path.join(parquet_dir, os.path.splitext(os.path.basename(f))[0]) for f in filenames]
+    jobs = [(f, organism, s, chunksize, p) for f, s, p in zip(filenames, subjects, paths)]
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            return pool.map(_parse_immunoseq_job, jobs, chunksize = 1)
+    return [_parse_immunoseq_job(job) for job in jobs]
 
 """
 These are the fields we expect to find in and Adaptive Biotechnologies
@@ -383,18 +516,49 @@ def _extract_cdr3_nucseq_from_adaptive(adapt):
     start of J gene.
 
     """
-    length_cdr3_nucseq = len(adapt.aminoAcid)*3
-    cys_residue    = int(adapt.vIndex)
-    start_J_gene   = int(adapt.jIndex)
+    return _cdr3_nucseq(adapt.nucleotide, adapt.aminoAcid, adapt.vIndex, adapt.jIndex)
 
-    length_partial_nuc = len(adapt.nucleotide[cys_residue:start_J_gene])
+
+def _cdr3_nucseq(nucleotide, aminoAcid, vIndex, jIndex):
+    """
+    _extract_cdr3_nucseq_from_adaptive() of the fields of one row
+    """
+    length_cdr3_nucseq = len(aminoAcid)*3
+    cys_residue    = int(vIndex)
+    start_J_gene   = int(jIndex)
+
+    length_partial_nuc = len(nucleotide[cys_residue:start_J_gene])
     remaining_length_nuc = length_cdr3_nucseq - length_partial_nuc
     end_index = start_J_gene + remaining_length_nuc
 
-    cdr3_nucseq = adapt.nucleotide[cys_residue:end_index]
+    cdr3_nucseq = nucleotide[cys_residue:end_index]
     return cdr3_nucseq
 
 
+def _cdr3_nucseqs(nucleotide, aminoAcid, vIndex, jIndex):
+    """
+    _cdr3_nucseq() of arrays of fields, with the slice bounds computed
+    for all rows at once
+
+    Returns
+    -------
+    cdr3_nucseqs : list
+    """
+    nuc_length = np.array([len(x) for x in nucleotide], dtype = np.int64)
+    length_cdr3_nucseq = 3*np.array([len(x) for x in aminoAcid], dtype = np.int64)
+    cys_residue = vIndex.astype(np.int64)
+    start_J_gene = jIndex.astype(np.int64)
+
+    def _bound(i):
+        # the index python slicing uses for i in a string of length nuc_length
+        return np.clip(np.where(i < 0, i + nuc_length, i), 0, nuc_length)
+
+    start = _bound(cys_residue)
+    length_partial_nuc = np.maximum(_bound(start_J_gene) - start, 0)
+    end_index = start_J_gene + length_cdr3_nucseq - length_partial_nuc
+    return [x[i:j] for x, i, j in zip(nucleotide, start.tolist(), _bound(end_index).tolist())]
+
+
 def _get_v_gene_attrs(adapt):
     """
     Returns v-gene attributes: Allele and Gene Name.
@@ -411,12 +575,12 @@ def _get_v_gene_attrs(adapt):
     vb_countreps : str
         the count representative used is the gene level, ignoring allele.
     """
-    if adapt.vGeneName is not "":
+    if adapt.vGeneName != "":
         v_b_gene     = adapt.vMaxResolved
         vb_countreps = adapt.vGeneName
     # if no unique vGeneName was assigned, check ties, and take the first
     # Adaptive output sorts them in ascending order (i.e. TCRBV06-01,TCRBV06-05,TCRBV06-06)
-    elif adapt.vGeneNameTies is not "":
+    elif adapt.vGeneNameTies != "":
         v_b_gene = adapt.vGeneNameTies.split(",")[0]
         vb_countreps   = adapt.vGeneNameTies.split(",")[0]
     else:
@@ -445,10 +609,10 @@ def _get_j_gene_attrs(adapt):
     -----
     Assign j_b_gene similar to above v_b gene
     """
-    if adapt.jGeneName is not "":
+    if adapt.jGeneName != "":
         j_b_gene = adapt.jMaxResolved
         jb_countreps  = adapt.jGeneName
-    elif adapt.jGeneNameTies is not "":
+    elif adapt.jGeneNameTies != "":
         j_b_gene = adapt.jGeneNameTies.split(",")[0]
         jb_countreps = adapt.jGeneNameTies.split(",")[0]
     else:
@@ -456,6 +620,99 @@ def _get_j_gene_attrs(adapt):
         jb_countreps = None
     return (j_b_gene, jb_countreps)
 
+def _get_gene_attrs_columns(chunk, vj):
+    """
+    _get_v_gene_attrs() / _get_j_gene_attrs() of every row of chunk at once
+
+    Parameters
+    ----------
+    chunk : DataFrame
+        immunoSEQ rows, with the columns of adaptive._fields read by iter_immunoseq
+    vj : str
+        'v' or 'j'
+
+    Returns
+    -------
+    gene : np.ndarray
+        object array, gene at highest possible level of resolution, None if unresolved
+    countreps : np.ndarray
+        object array, gene level name, None if unresolved
+    """
+    gene_name = chunk[vj + 'GeneName'].values
+    ties = chunk[vj + 'GeneNameTies'].values
+    has_gene_name = gene_name != ""
+    has_ties = ties != ""
+    first_ties = {t : t.split(",")[0] for t in pd.unique(ties)}
+    first_tie = np.array([first_ties[t] for t in ties], dtype = object)
+    gene = np.where(has_gene_name, chunk[vj + 'MaxResolved'].values,
+                    np.where(has_ties, first_tie, None))
+    countreps = np.where(has_gene_name, gene_name,
+                         np.where(has_ties, first_tie, None))
+    return gene, countreps
+
+
+# (name, organism, region, countrep) -> IMGT name, filled by _imgt_gene_name
+_imgt_gene_names = dict()
+
+def _imgt_gene_name(name, organism, region, countrep = False):
+    """
+    Adaptive's Gene Names Need to Match all_genes (IMGT Name)
+       TCRBV05-07*01 --- >  TRBV5-7*01
+    The steps are:
+    1.  TCRB -> TRBC (e.g., TCRBV05-07*01 ->  TRBV05-7*01 )
+    2.  e.g., TRBV05-07*01 ->  TRBV05-7*01
+    3.  TRBV05-7*01 -> TRBV5-7*01
+    4.  If no allele is called, then we assign it '*01'
+    5.  There are some '-1' names not recognized
+    (e.g., TRBV19-1*01 to TRBV19*01)
+
+    Count representatives (countrep = True) only go through steps 1-3.
+    Results are memoized, so each distinct name is converted once.
+
+    Parameters
+    ----------
+    name : str
+        Adaptive gene name, or None
+    organism : str
+        'human' or 'mouse'
+    region : str
+        'V' or 'J'
+    countrep : bool
+        name is a count representative (vGeneName / jGeneName)
+
+    Returns
+    -------
+    name : str
+        IMGT gene name, None if name is None
+    """
+    key = (name, organism, region, countrep)
+    if key in _imgt_gene_names:
+        return _imgt_gene_names[key]
+    imgt_name = name
+    if name is not None:
+        # count representatives of J genes have always gone through the V rules
+        family = "BV" if countrep else "B" + region
+        imgt_name = name.replace("TCRB", "TRB").\
+            replace("-0", "-").replace(family + "0", family)
+        if not countrep:
+            # Assign allele *01 to genes not resolved at the allele level
+            if imgt_name.find('*0') == -1:
+                imgt_name = imgt_name + "*01"
+            # TRBV19-1*01 to TRBV19*01
+            if imgt_name not in all_genes[organism].keys():
+                imgt_name = imgt_name.replace("-1","")
+    _imgt_gene_names[key] = imgt_name
+    return imgt_name
+
+
+def _map_gene_names(names, organism, region, countrep):
+    """
+    _imgt_gene_name() of every element of names, converting each distinct name once
+    """
+    table = {name : _imgt_gene_name(name, organism, region, countrep) for name in pd.unique(names)}
+    return [table[name] for name in names]
+
+
 def _get_adaptive_gene_names(filename, organism):
     """"
     Gets raw adaptive gene_names from an immunoseq file.
@@ -500,28 +757,8 @@ def _get_adaptive_gene_names(filename, organism):
             v_b_genes_raw.append(v_b_gene_raw)
             j_b_genes_raw.append(j_b_gene_raw)
 
-            v_b_gene = v_b_gene.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
-            j_b_gene = j_b_gene.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BJ0","BJ")
-
-            vb_countreps = vb_countreps.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
-            jb_countreps = jb_countreps.replace("TCRB", "TRB").\
-                replace("-0", "-").replace("BV0","BV")
-
-            # Assign allele *01 to genes not resolved at the allele level
-            if v_b_gene.find('*0') == -1:
-                v_b_gene = v_b_gene + "*01"
-            if j_b_gene.find('*0') == -1:
-                j_b_gene = j_b_gene + "*01"
-
-            # TRBV19-1*01 to TRBV19*01
-            if v_b_gene not in all_genes[organism].keys():
-                v_b_gene = v_b_gene.replace("-1","")
-
-            if j_b_gene not in all_genes[organism].keys():
-                j_b_gene = j_b_gene.replace("-1","")
+            v_b_gene = _imgt_gene_name(v_b_gene, organism, 'V')
+            j_b_gene = _imgt_gene_name(j_b_gene, organism, 'J')
 
             v_b_genes_imgt[v_b_gene_raw] = v_b_gene
             j_b_genes_imgt[j_b_gene_raw] = j_b_gene
@@ -22,6 +22,7 @@ Internal Functions
 # external package imports
 import pandas as pd
 import numpy as np
+import multiprocessing
 from functools import partial
 # from .blast import parse_unpaired_dna_sequence_blastn, get_qualstring
 # from .objects import TCRChain, TCRClone
@@ -49,7 +50,8 @@ __all__ = ['processNT',
            'getTCRID']
 
 
-def readPairedSequences(organism, paired_seqs_file, use_parasail = True, try_parasail = True):
+def readPairedSequences(organism, paired_seqs_file, use_parasail = True, try_parasail = True,
+                        processes = 1, prefilter_k = None, chunksize = 100):
     """Read a TSV of paired-chain TCR data.
     Can also accommodate unpaired data or cells with more than two chains
     (e.g. gamma1 and gamma2)
@@ -58,6 +60,14 @@ def readPairedSequences(organism, paired_seqs_file, use_parasail = True, try_par
     ----------
     organism : string "human" or "mouse"
     paired_seqs_file (MUST BE TAB DELIMITED .tsv flat file)
+    processes : int
+        number of worker processes the reads are assigned in (and, without
+        use_parasail, number of concurrent blastall shards, see blast.blast_batch)
+    prefilter_k : int or None
+        k-mer length of the parasail candidate gene prefilter
+        (see sail.GeneAssigner), None aligns every read to all genes
+    chunksize : int
+        rows sent to a worker at a time when processes > 1
 
     Returns
     -------
@@ -140,14 +150,19 @@ def readPairedSequences(organism, paired_seqs_file, use_parasail = True, try_par
 
     out = []
     for c in chains:
-        out.append(
-            raw.apply(lambda row: processNT(organism=organism,
-                                            chain=c.upper(),
-                                            nuc=row['%s_nucseq' % c],
-                                            quals=row['%s_quals' % c],
-                                            use_parasail=use_parasail,
-                                            try_parasail=try_parasail).to_series(),
-                      axis=1))
+        if use_parasail:
+            blast_hits = [None] * raw.shape[0]
+        else:
+            # one blastall run per region for the whole chain
+            blast_hits = blast.blast_batch(organism, c.upper(), list(raw['%s_nucseq' % c]), processes = processes)
+        args = [(organism, c.upper(), nuc, quals, use_parasail, try_parasail, prefilter_k, bh)
+                for nuc, quals, bh in zip(raw['%s_nucseq' % c], raw['%s_quals' % c], blast_hits)]
+        if processes > 1:
+            with multiprocessing.Pool(processes) as pool:
+                rows = pool.map(_processNT_series, args, chunksize = chunksize)
+        else:
+            rows = [_processNT_series(a) for a in args]
+        out.append(pd.DataFrame(rows, index = raw.index))
 
     otherCols = [c for c in raw.columns if c.find('nucseq') == -1 and c.find('quals') == -1]
     out = [raw[otherCols]] + out
@@ -282,7 +297,13 @@ def samplerProb(r, chain):
 ## -- ## copied directly from github (d9394fa9b7)
 
 
-def processNT(organism, chain, nuc, quals, use_parasail = True, try_parasail = True):
+def _processNT_series(args):
+    """processNT(*args) as a pd.Series, for multiprocessing.Pool.map"""
+    return processNT(*args).to_series()
+
+
+def processNT(organism, chain, nuc, quals, use_parasail = True, try_parasail = True, prefilter_k = None,
+              blast_hits = None):
     """Process one nucleotide TCR sequence (any chain).
 
     Parameters
@@ -293,6 +314,11 @@ def processNT(organism, chain, nuc, quals, use_parasail = True, try_parasail = T
     nuc : str
     quals : str
         Dot-separated list of integer scores
+    prefilter_k : int or None
+        k-mer length of the parasail candidate gene prefilter
+    blast_hits : dict or None
+        this sequence's entry of blast.blast_batch(), used instead of
+        running blastall for it
 
     Returns
     -------
@@ -312,7 +338,9 @@ def processNT(organism, chain, nuc, quals, use_parasail = True, try_parasail = T
                                                    hide_nucseq=False,
                                                    extended_cdr3=True,
                                                    return_all_good_hits=True,
-                                                   max_bit_score_delta_for_good_hits=50)
+                                                   max_bit_score_delta_for_good_hits=50,
+                                                   prefilter_k=prefilter_k,
+                                                   blast_hits=blast_hits)
     genes, evalues, status, all_good_hits_with_scores = res
     labels = ['v%s_gene', 'v%s_rep', 'v%s_mm', 'j%s_gene', 'j%s_rep', 'j%s_mm', 'cdr3%s_plus']
     tmp = {g:v for g, v in zip([lab % ch for lab in labels], genes)}
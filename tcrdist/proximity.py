@@ -1,3 +1,5 @@
+import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 
@@ -132,35 +134,82 @@ class TCRproximity():
             raise ValueError('Dist2Rep: cdrs value must be cdrs or all.')
 
 
-    def _calc_nn_scores(self):
+    def _calc_nn_scores(self, block_size=1 << 22):
         '''
         Calculate the NN-distance scores for all TCRs, in respect to the
         target epitope-specific TCRs only. For each TCR, only consider
         TCRs from other subjects (or subjects in other folds, if self.subjects_folds
         was provided) as neighbors. Calculation is made based on the nearest
         neighbors percentile, summing their weighted distances (by order rank).
-        '''
-        self.prox_df['nn_score'] = None
 
-        # Get indices of target epitope-specific TCRs
-        ind_only_epitope = self.prox_df.index[self.prox_df['epitope_group'] == self.target_epitope]
+        All TCRs of a subject share the same neighbor columns, so they are
+        scored together, a block of rows of the distance matrix at a time
+        (see _weighted_nbrdists).
 
-        # For each TCR (target epitope-specific and others), calc nn_score
-        for ind_TCR, row in self.prox_df.iterrows():
-            # Get distances to non-subject/training folds, target epitope-specific TCRs
+        :param block_size: int. approximate number of distances per block
+        '''
+        prox_df = self.prox_df
+        dist_matrix = np.asarray(self.dist_matrix)
+        labels = prox_df.index.values
+        is_epitope = (prox_df['epitope_group'] == self.target_epitope).values
+        subject_codes, subjects = pd.factorize(prox_df['subject'])
+        if (subject_codes < 0).any():
+            subjects = subjects.append(pd.Index([np.nan]))
+            subject_codes = np.where(subject_codes < 0, len(subjects) - 1, subject_codes)
+
+        nn_scores = np.empty(len(labels), dtype=object)
+        fold_columns = {}
+        for code, subject in enumerate(subjects):
+            positions = np.flatnonzero(subject_codes == code)
+            # Get target epitope-specific TCRs of non-subject/training folds
             if self.subjects_folds is None:
-                ind_non_subject = self.prox_df.index[self.prox_df['subject'] != row['subject']]  # Index hold out all data from that subject
+                columns = labels[is_epitope & (prox_df['subject'] != subject).values]  # hold out all data from that subject
             else:
-                subject_fold = self._find_subjects_fold(row['subject'])
-                subjects_in_other_folds = self._subjects_in_other_folds_to_list(subject_fold)
-                ind_non_subject = self.prox_df.index[self.prox_df['subject'].isin(subjects_in_other_folds)]  # Index use only data from that subject's training set
+                subject_fold = self._find_subjects_fold(subject)
+                if subject_fold not in fold_columns:
+                    subjects_in_other_folds = self._subjects_in_other_folds_to_list(subject_fold)
+                    fold_columns[subject_fold] = labels[is_epitope & prox_df['subject'].isin(subjects_in_other_folds).values]
+                columns = fold_columns[subject_fold]  # use only data from that subject's training set
+
+            rows_per_block = max(1, block_size // max(1, len(columns)))
+            for r0 in range(0, len(positions), rows_per_block):
+                block = positions[r0:r0 + rows_per_block]
+                distances = dist_matrix[np.ix_(labels[block], columns)]
+                nn_scores[block] = list(self._weighted_nbrdists(distances))
+
+        self.prox_df['nn_score'] = nn_scores
 
-            ind_epitope_non_subject = ind_only_epitope.intersection(ind_non_subject)
-            distances_ep_non_subject = self.dist_matrix[ind_TCR, ind_epitope_non_subject]  # Get Distances from the ith row, holding out subject
 
-            # Calculate weighted average nn-distance score to % of these TCRs
-            nn_score = self._sort_and_compute_weighted_nbrdist_from_distances(distances_ep_non_subject)
-            self.prox_df.loc[ind_TCR, 'nn_score'] = nn_score
+    def _weighted_nbrdists(self, distances):
+        '''
+        _sort_and_compute_weighted_nbrdist_from_distances of every row of a
+        block of distances: np.partition picks the nearest neighbors of all
+        rows at once, and their weighted distances are summed in rank order,
+        as for a single TCR, so the scores are identical.
+
+        :param distances: 2D np.ndarray. one row of distances per TCR
+        :return: np.ndarray of floats. The NN-distance scores of the TCRs
+        '''
+        n_dists = distances.shape[1]
+        if n_dists == 0:
+            raise ValueError('TCRproximity: no {} TCRs outside the held out subjects'.format(self.target_epitope))
+        if self.nn_percentile < 0:
+            n = int(max(1, min(n_dists, -1 * self.nn_percentile)))
+        else:
+            n = int(max(1, (self.nn_percentile * n_dists) / 100))
+        k = min(n, n_dists)
+        if k < n_dists:
+            distances = np.partition(distances, k - 1, axis=1)[:, :k]
+        nearest = np.sort(distances, axis=1).astype(np.float64)
+
+        total_wt = 0.0
+        nbrdist = np.zeros(nearest.shape[0])
+        for i in range(k):
+            wt = 1.0 - float(i) / n
+            total_wt += wt
+            nbrdist += wt * nearest[:, i]
+
+        return nbrdist / total_wt
 
 
     def _sort_and_compute_weighted_nbrdist_from_distances(self, dist_list):
@@ -0,0 +1,396 @@
+"""
+Persistent index of a reference clone set for nearest-neighbor search
+
+distances.nearestNeighborDistance() scores a query TCR against every
+reference TCR with distances.basicDistance(). A ReferenceIndex is built once
+per reference release (e.g. the output of mappers.vdjdb_to_tcrdist2), saved
+as a directory of .npy files and loaded via memory map. Queries return the
+same distances as distances.basicDistance() without scanning the whole
+reference:
+
+    * references are bucketed by V gene representatives and CDR3 length of
+      each chain
+    * the distance between a query and every bucket is bounded from below
+      by the exact V-region distance (from a precomputed gene x bucket
+      table) plus the CDR3 length difference gap penalty
+    * buckets are visited in order of their bound and the CDR3 distances
+      are only computed for buckets that can still be within the radius
+      (query_radius) or beat the current k-th nearest reference (query_knn)
+
+Example
+-------
+>>> index = ReferenceIndex.build(vdjdb_df, chains = 'AB', organism = 'human')
+>>> index.save('vdjdb_2019_index')
+>>> index = ReferenceIndex.load('vdjdb_2019_index')
+>>> ids, dists = index.query_radius(query_df.iloc[0], radius = 100)
+>>> d = index.nearest_neighbor_distance(query_df.iloc[0], neighborTopN = 5)
+
+"""
+import json
+import os
+import os.path as op
+
+import numpy as np
+import pandas as pd
+
+from .objects import DistanceParams
+from . import pairwise_numpy
+from . import v_region_cache
+
+# Number of references scored at a time by query_radius() and query_knn()
+_BATCH = 4096
+
+# Column names (legacy, tcrdist2) of the CDR3 and V genes of each chain
+_columns = {'A' : (('cdr3a', 'va_reps'), ('cdr3_a_aa', 'v_a_gene')),
+            'B' : (('cdr3b', 'vb_reps'), ('cdr3_b_aa', 'v_b_gene'))}
+
+_param_fields = ['gap_penalty_cdr3_region', 'weight_cdr3_region',
+                 'align_cdr3s', 'trim_cdr3s', 'scale_factor']
+
+
+def _chain_columns(columns, chain):
+    """
+    (cdr3 column, V genes column) of chain, legacy names (cdr3a, va_reps)
+    preferred over tcrdist2 names (cdr3_a_aa, v_a_gene)
+    """
+    for cdr3_col, v_col in _columns[chain]:
+        if cdr3_col in columns and v_col in columns:
+            return cdr3_col, v_col
+    raise KeyError("ReferenceIndex requires columns {} or {} for chain {}".format(
+        _columns[chain][0], _columns[chain][1], chain))
+
+
+def _reps(value):
+    """
+    V gene representatives of a clone, as in distances.basicDistance
+    """
+    return str(value).split(';')
+
+
+class ReferenceIndex:
+    """
+    Bucketed reference TCRs supporting radius and k-nearest neighbor queries
+    with distances.basicDistance() semantics
+
+    Attributes
+    ----------
+    chains : string
+        'A', 'B' or 'AB'
+    organism : string
+        "human" or "mouse"
+    params : objects.DistanceParams instance
+        parameters of the distance
+    ids : np.ndarray
+        identifier of every reference (index of the reference DataFrame) as
+        strings, in bucket order
+    order : np.ndarray
+        row of the reference DataFrame of every reference, in bucket order
+    arrays : dict
+        all other arrays of the index (see build), saved as .npy files
+    """
+    def __init__(self, chains, organism, params, ids, order, arrays):
+        self.chains = chains
+        self.organism = organism
+        self.params = params
+        self.ids = ids
+        self.order = order
+        self.arrays = arrays
+        self._table = arrays['distance_table']
+        self._gene_index = {c : {g : i for i, g in enumerate(arrays['v_ids_' + c])} for c in chains}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return 'ReferenceIndex(chains={}, organism={}, n={}, buckets={})'.format(
+            self.chains, self.organism, len(self), len(self.arrays['bucket_start']) - 1)
+
+    @classmethod
+    def build(cls, referenceTCRs, chains = 'AB', organism = None, params = None):
+        """
+        Build the index of a set of reference TCRs
+
+        Parameters
+        ----------
+        referenceTCRs : pd.DataFrame
+            reference clones with, for each chain, either the columns cdr3a
+            and va_reps (cdr3b and vb_reps) as used by distances.py or the
+            tcrdist2 columns cdr3_a_aa and v_a_gene (cdr3_b_aa and v_b_gene)
+            as returned by mappers.vdjdb_to_tcrdist2. The index is used as
+            reference identifier.
+        chains : string
+            E.g. use 'A' or 'B' or 'AB' for alpha-beta TCR analysis
+        organism : string
+            "human" or "mouse", by default referenceTCRs.organism
+        params : objects.DistanceParams instance
+            Default parameters loaded by instantiating td.objects.DistanceParams or use None.
+
+        Returns
+        -------
+        index : ReferenceIndex
+        """
+        if params is None:
+            params = DistanceParams()
+        if organism is None:
+            organism = referenceTCRs['organism'].iloc[0]
+        n = referenceTCRs.shape[0]
+        tables = v_region_cache.load_v_region_tables(organism, params)
+
+        arrays = {'distance_table' : pairwise_numpy.distance_table(params)}
+        bucket_keys = []
+        for c in chains:
+            cdr3_col, v_col = _chain_columns(referenceTCRs.columns, c)
+            v_ids, v_dists = tables[c]
+            gene_index = {g : i for i, g in enumerate(v_ids)}
+            # distinct sets of V gene representatives
+            repsets, repset_code = np.unique(referenceTCRs[v_col].astype(str).values, return_inverse = True)
+            repset_min = np.zeros((len(v_ids), len(repsets)))
+            for u, repset in enumerate(repsets):
+                genes = [gene_index[g] for g in _reps(repset)]
+                repset_min[:, u] = np.asarray(v_dists)[:, genes].min(axis = 1)
+            lens = referenceTCRs[cdr3_col].str.len().values.astype(np.int64)
+            arrays['v_ids_' + c] = np.asarray(v_ids, dtype = str)
+            arrays['v_dists_' + c] = np.asarray(v_dists, dtype = np.float64)
+            arrays['repset_min_' + c] = repset_min
+            arrays['repset_' + c] = repset_code.astype(np.int64)
+            arrays['cdr3_len_' + c] = lens
+            bucket_keys.extend([lens, repset_code])
+
+        # sort by bucket (np.lexsort sorts by the last key first)
+        order = np.lexsort(bucket_keys[::-1]) if len(bucket_keys) > 0 else np.arange(n)
+        for c in chains:
+            arrays['repset_' + c] = arrays['repset_' + c][order]
+            arrays['cdr3_len_' + c] = arrays['cdr3_len_' + c][order]
+        keys = np.stack([arrays['repset_' + c] for c in chains] + [arrays['cdr3_len_' + c] for c in chains], axis = 1)
+        new_bucket = np.ones(n, dtype = bool)
+        new_bucket[1:] = np.any(keys[1:] != keys[:-1], axis = 1)
+        starts = np.nonzero(new_bucket)[0]
+        arrays['bucket_start'] = np.append(starts, n).astype(np.int64)
+
+        for c in chains:
+            cdr3_col, v_col = _chain_columns(referenceTCRs.columns, c)
+            codes, rev_codes, lens = pairwise_numpy.encode_sequences(referenceTCRs[cdr3_col].values[order])
+            pairwise_numpy._check_cdr3(codes, lens, params)
+            arrays['cdr3_codes_' + c] = codes
+            arrays['cdr3_rev_codes_' + c] = rev_codes
+
+        ids = np.asarray(referenceTCRs.index.astype(str), dtype = str)[order]
+        return cls(chains, organism, params, ids, order.astype(np.int64), arrays)
+
+    def save(self, path):
+        """
+        Save the index as a directory of .npy files
+
+        Parameters
+        ----------
+        path : string
+            directory, created if it does not exist
+        """
+        os.makedirs(path, exist_ok = True)
+        meta = {'chains' : self.chains,
+                'organism' : self.organism,
+                'params' : {k : self.params[k] for k in _param_fields},
+                'arrays' : sorted(self.arrays.keys())}
+        np.save(op.join(path, 'ids.npy'), self.ids)
+        np.save(op.join(path, 'order.npy'), self.order)
+        for k, arr in self.arrays.items():
+            np.save(op.join(path, k + '.npy'), arr)
+        with open(op.join(path, 'index.json'), 'w') as fh:
+            json.dump(meta, fh)
+
+    @classmethod
+    def load(cls, path, mmap_mode = 'r'):
+        """
+        Load an index saved with save()
+
+        Parameters
+        ----------
+        path : string
+            directory written by save()
+        mmap_mode : string or None
+            passed to np.load, by default arrays are memory mapped read-only
+
+        Returns
+        -------
+        index : ReferenceIndex
+        """
+        with open(op.join(path, 'index.json')) as fh:
+            meta = json.load(fh)
+        params = DistanceParams()
+        for k, v in meta['params'].items():
+            params[k] = v
+        arrays = {k : np.load(op.join(path, k + '.npy'), mmap_mode = mmap_mode) for k in meta['arrays']}
+        return cls(meta['chains'],
+                   meta['organism'],
+                   params,
+                   np.load(op.join(path, 'ids.npy')),
+                   np.load(op.join(path, 'order.npy'), mmap_mode = mmap_mode),
+                   arrays)
+
+    def _query_terms(self, tcr):
+        """
+        Per chain V-region distance from tcr to every representative set and
+        encoded CDR3 of tcr
+        """
+        terms = {}
+        for c in self.chains:
+            cdr3_col, v_col = _chain_columns(tcr.index if isinstance(tcr, pd.Series) else tcr.keys(), c)
+            genes = [self._gene_index[c][g] for g in _reps(tcr[v_col])]
+            v_dist = np.asarray(self.arrays['repset_min_' + c])[genes].min(axis = 0)
+            codes, rev_codes, lens = pairwise_numpy.encode_sequences([tcr[cdr3_col]])
+            terms[c] = (v_dist, (codes, rev_codes, lens))
+        return terms
+
+    def _lower_bounds(self, terms):
+        """
+        Lower bound of the distance from the query to each bucket
+        """
+        starts = self.arrays['bucket_start'][:-1]
+        bound = np.zeros(len(starts))
+        for c in self.chains:
+            v_dist, (codes, rev_codes, lens) = terms[c]
+            lendiff = np.abs(self.arrays['cdr3_len_' + c][starts] - lens[0])
+            bound += v_dist[self.arrays['repset_' + c][starts]] + lendiff * self.params.gap_penalty_cdr3_region
+        return self.params.scale_factor * bound
+
+    def _distances(self, terms, idx):
+        """
+        distances.basicDistance from the query to the references idx
+        """
+        dist = np.zeros(len(idx))
+        for c in self.chains:
+            v_dist, query = terms[c]
+            ref = (self.arrays['cdr3_codes_' + c][idx, :],
+                   self.arrays['cdr3_rev_codes_' + c][idx, :],
+                   self.arrays['cdr3_len_' + c][idx])
+            dist += v_dist[self.arrays['repset_' + c][idx]]
+            # the single query broadcasts against the references
+            dist += pairwise_numpy.cdr3_distance_pairs(query, ref,
+                                                       params = self.params,
+                                                       table = self._table,
+                                                       integer = False)
+        return self.params.scale_factor * dist
+
+    def _bucket_batches(self, buckets):
+        """
+        Concatenated reference positions of buckets, in batches of about
+        _BATCH references
+        """
+        starts = self.arrays['bucket_start']
+        batch = []
+        size = 0
+        for b in buckets:
+            batch.append(np.arange(starts[b], starts[b + 1]))
+            size += starts[b + 1] - starts[b]
+            if size >= _BATCH:
+                yield batch
+                batch = []
+                size = 0
+        if batch:
+            yield batch
+
+    def query_radius(self, tcr, radius):
+        """
+        All references within radius of a query TCR
+
+        Parameters
+        ----------
+        tcr : pd.Series or dict
+            query clone with the columns used to build the index
+        radius : float
+            references with distance <= radius are returned
+
+        Returns
+        -------
+        ids : np.ndarray
+            identifiers of the references, sorted by distance
+        dists : np.ndarray
+            distances.basicDistance from tcr to each reference
+        """
+        terms = self._query_terms(tcr)
+        bound = self._lower_bounds(terms)
+        tol = 1e-9 * max(1.0, abs(radius))
+        buckets = np.nonzero(bound <= radius + tol)[0]
+        all_idx, all_dist = [np.zeros(0, dtype = np.int64)], [np.zeros(0)]
+        for batch in self._bucket_batches(buckets):
+            idx = np.concatenate(batch)
+            dist = self._distances(terms, idx)
+            keep = dist <= radius
+            all_idx.append(idx[keep])
+            all_dist.append(dist[keep])
+        idx = np.concatenate(all_idx)
+        dist = np.concatenate(all_dist)
+        s = np.argsort(dist, kind = 'stable')
+        return self.ids[idx[s]], dist[s]
+
+    def query_knn(self, tcr, k):
+        """
+        The k references nearest to a query TCR
+
+        Parameters
+        ----------
+        tcr : pd.Series or dict
+            query clone with the columns used to build the index
+        k : int
+            number of neighbors (at most the number of references)
+
+        Returns
+        -------
+        ids : np.ndarray
+            identifiers of the k nearest references, sorted by distance
+        dists : np.ndarray
+            distances.basicDistance from tcr to each reference
+        """
+        k = min(k, len(self))
+        terms = self._query_terms(tcr)
+        bound = self._lower_bounds(terms)
+        buckets = np.argsort(bound, kind = 'stable')
+        best_idx, best_dist = np.zeros(0, dtype = np.int64), np.zeros(0)
+        for batch in self._bucket_batches(buckets):
+            first = batch[0][0]
+            first_bucket = np.searchsorted(self.arrays['bucket_start'], first, side = 'right') - 1
+            if len(best_dist) == k and bound[first_bucket] > best_dist[-1]:
+                # buckets are visited in order of their bound
+                break
+            idx = np.concatenate(batch)
+            dist = self._distances(terms, idx)
+            best_idx = np.concatenate([best_idx, idx])
+            best_dist = np.concatenate([best_dist, dist])
+            s = np.argsort(best_dist, kind = 'stable')[:k]
+            best_idx, best_dist = best_idx[s], best_dist[s]
+        return self.ids[best_idx], best_dist
+
+    def nearest_neighbor_distance(self, tcr, neighborPctile = 10, neighborTopN = None, weighted = False):
+        """
+        distances.nearestNeighborDistance of tcr against the whole reference
+
+        Parameters
+        ----------
+        tcr : pd.Series or dict
+            query clone with the columns used to build the index
+        neighborPctile : float [0, 100]
+            Percentile of nearest neighbors to include from the references
+        neighborTopN : int
+            Number of nearest neighbors to include from the references
+            (neighborPctile is ignored when given)
+        weighted : bool
+            Compute a weighted nearest neighbor distance.
+
+        Returns
+        -------
+        d : float
+            Mean of the distances to the nearest neighbors.
+        """
+        if neighborTopN is None:
+            neighborTopN = np.round(len(self) * (neighborPctile/100.))
+        """Minimum is 1 neighbor and max is all neighbors"""
+        neighborTopN = min(max(1, int(neighborTopN)), len(self))
+
+        ids, allD = self.query_knn(tcr, neighborTopN)
+        if not weighted:
+            d = allD[:neighborTopN].mean()
+        else:
+            weights = 1. - np.arange(neighborTopN)/neighborTopN
+            d = np.sum(allD[:neighborTopN] * weights) / weights.sum()
+        return d
+
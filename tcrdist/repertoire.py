@@ -1,11 +1,14 @@
 import numpy as np
 import pandas as pd
 import scipy.spatial
+import scipy.sparse
 from scipy.cluster.hierarchy import linkage, dendrogram, fcluster
 import collections
+import concurrent.futures
 import json
 import warnings
 import pickle
+import os.path as op
 
 import parasail
 import pwseqdist
@@ -14,11 +17,17 @@ from . import repertoire_db
 from . import pgen
 from . import mappers
 from . import pairwise
+from . import pairwise_numpy
+from . import condensed
+from . import dedup
+from .objects import DistanceParams
+from .db_cache import LazyDict, load_cached
+from .paths import path_to_db, db_file
 
 # includes tools for use with explore.py
 #from paths import path_to_matrices
 #This replaces: from tcrdist.cdr3s_human import pb_cdrs
-pb_cdrs = repertoire_db.generate_pbr_cdr()
+pb_cdrs = LazyDict(lambda : load_cached('pb_cdrs', [op.join(path_to_db, db_file)], repertoire_db.generate_pbr_cdr))
 
 class TCRrep:
     """
@@ -44,13 +53,19 @@ class TCRrep:
     stored_tcrdist : list
         list containing all previously generated outputs of
         `TCRrep.compute_paired_tcrdist`
-    paired_tcrdist : ndarray
+    paired_tcrdist : ndarray or condensed.CondensedMatrix
         most recent output of :py:meth:`tcrdist.repertoire.TCRrep.compute_paired_tcrdist`
     paired_tcrdist_weights : dictionary
         CDR weights used to generate the most recent output of
         TCRrep.compute_paired_tcrdist`
     all_genes : dictionary
         dictionary of reference TCRs
+    storage : string
+        "dense" (default) stores pairwise matrices as square np.ndarrays.
+        "condensed" stores every *_aa_pw attribute and paired_tcrdist as a
+        condensed.CondensedMatrix (upper triangle vector in the smallest
+        integer dtype, usually uint16) with a matrix view supporting row
+        access and indexing.
 
     Methods
     -------
@@ -72,7 +87,8 @@ class TCRrep:
                  cell_df,
                  chains=['alpha', 'beta'],
                  organism = "human",
-                 db_file = "alphabeta_db.tsv"):
+                 db_file = "alphabeta_db.tsv",
+                 storage = "dense"):
         self.cell_df = cell_df
         self.chains = chains
         self.organism = organism
@@ -86,10 +102,13 @@ class TCRrep:
         self.project_id = "<Your TCR Repertoire Project>"
         self.all_genes = None
         self.imgt_aligned_status = None
+        self.db_file = db_file
+        self.storage = storage
 
         # VALIDATION OF INPUTS
         # check that chains are valid.
         self._validate_organism()
+        self._validate_storage()
         self._validate_chains()
         # check that  is a pd.DataFrame
         self._validate_cell_df()
@@ -127,7 +146,8 @@ class TCRrep:
         Returns an ordered dictionary of reference sequences
 
         """
-        self.all_genes = repertoire_db.RefGeneSet(db_file).all_genes
+        self.db_file = db_file
+        self.all_genes = repertoire_db.get_ref_gene_set(db_file).all_genes
 
     def _map_gene_to_reference_seq2(self,
                                     organism,
@@ -158,18 +178,34 @@ class TCRrep:
         return(aa_string)
 
 
-    def deduplicate(self):
+    def deduplicate(self, engine = 'hash'):
         """
-        With attribute self.index_col calls _deduplicate() and assigns
+        With attribute self.index_col calls dedup.deduplicate() and assigns
         result to attribute self.clone_df
+
+        Parameters
+        ----------
+        engine : string
+            'hash' (dedup.deduplicate(), which counts the cells dropped for
+            null index values in the same pass) or 'pandas' (the groupby of
+            _deduplicate()); both give the same clone_df
         """
-        self.clone_df = _deduplicate(self.cell_df, self.index_cols)
-        
+        n_cell = np.sum(self.cell_df['count'])
+        null_report = ""
+        if engine == 'hash':
+            self.clone_df, incomplete = dedup.deduplicate(self.cell_df, self.index_cols)
+            n_cells_lost = incomplete.count
+            nulls = incomplete.null_counts[incomplete.null_counts > 0]
+            null_report = " Null values per index column: " + ", ".join(f"{k}: {v}" for k, v in nulls.items()) + "."
+        elif engine == 'pandas':
+            self.clone_df = _deduplicate(self.cell_df, self.index_cols)
+            n_cells_lost = n_cell - np.sum(self.clone_df['count'])
+        else:
+            raise ValueError("engine must be 'hash' or 'pandas'")
+
         # check if any clones were lost due to missing information
-        if np.sum(self.cell_df['count']) != np.sum(self.clone_df['count']):
-            n_cells_lost = np.sum(self.cell_df['count']) - np.sum(self.clone_df['count'])
-            n_cell = np.sum(self.cell_df['count'])
-            warnings.warn(f"Not all cells/sequences could be grouped into clones. {n_cells_lost} of {n_cell} were not captured. This occurs when any of the values in the index columns are null or missing for a given sequence. To see entries with missing values use: tcrdist.repertoire.TCRrep.show_incomplete()\n")
+        if n_cells_lost != 0:
+            warnings.warn(f"Not all cells/sequences could be grouped into clones. {n_cells_lost} of {n_cell} were not captured. This occurs when any of the values in the index columns are null or missing for a given sequence.{null_report} To see entries with missing values use: tcrdist.repertoire.TCRrep.show_incomplete()\n")
         
         # if no clone id column provided thetrn create one as a sequence of numbers
         if "clone_id" not in self.clone_df:
@@ -312,11 +348,17 @@ class TCRrep:
                                  chain,
                                  cdr3_only = False,
                                  chain_folder = None,
-                                 recomb_type = None):
+                                 recomb_type = None,
+                                 processes = 1,
+                                 use_cache = True,
+                                 progress = False):
         """
         Infer the probability of generation using the Olga Code base
         (Sethna et al. 2018) updated to python 3 for use with tcrdist.
 
+        Distinct (cdr3, v gene, j gene) combinations are computed once and
+        cached (see pgen.OlgaModel.compute_aa_cdr3_pgens_batch).
+
         Parameters
         ----------
         chain : string
@@ -332,6 +374,13 @@ class TCRrep:
             (optional) 'VDJ' or 'VJ' specifying the OLGA recombination model.
             When None (which is recommended), the default folder is chosen based
             on the chain argument.
+        processes : int
+            (optional) number of worker processes computing Pgens
+        use_cache : boolean
+            (optional) if False, Pgens are neither read from nor written to
+            the in-memory and on-disk Pgen caches
+        progress : boolean
+            (optional) if True, print progress after every chunk of Pgens
 
         Returns
         -------
@@ -429,9 +478,12 @@ class TCRrep:
         my_olga_model = pgen.OlgaModel(chain_folder = chain_folder,
                                        recomb_type = recomb_type)
         # computes pgen from clone_df
-        olga_pgens = my_olga_model.compute_aa_cdr3_pgens(cdr3s,
-                                                         v_genes,
-                                                         j_genes)
+        olga_pgens = my_olga_model.compute_aa_cdr3_pgens_batch(cdr3s,
+                                                               v_genes,
+                                                               j_genes,
+                                                               processes = processes,
+                                                               use_cache = use_cache,
+                                                               progress = progress)
 
         if chain is "alpha":
             self.clone_df['cdr3_a_aa_pgen'] = pd.Series(olga_pgens)
@@ -453,6 +505,7 @@ class TCRrep:
                              processes = 2,
                              user_function = None,
                              to_matrix = True,
+                             engine = "pwseqdist",
                              **kwargs):
         """
         Computes pairwise distances for all regions on a given
@@ -479,6 +532,13 @@ class TCRrep:
             sure what you are doing; metric arg must be set to 'custom').
         to_matrix : boolean
             True will return pairwise distance as result as a 2D ndarray
+        engine : string
+            "pwseqdist" (default) applies the metric one pair at a time with
+            pwseqdist.apply_pairwise_sq. "numpy" uses the vectorized engine in
+            pairwise_numpy.py, which is only available for the legacy
+            "tcrdist_*" metrics and gives identical results. For the
+            cdr1, cdr2 and pmhc regions the distances are gathered from a
+            cached V-gene x V-gene table when the v gene column is present.
 
 
 
@@ -538,12 +598,22 @@ class TCRrep:
                 continue
 
             # COMPUTE PAIRWISE
+            # V-region loops are fully determined by the V gene, so look them up
+            if engine == "numpy" and metric in ["tcrdist_cdr1", "tcrdist_cdr2",
+                                                "tcrdist_cdr2.5", "tcrdist_pmhc"]:
+                pw = self._v_region_pw_by_gene_lookup(index_col = index_col)
+                if pw is not None:
+                    self._assign_pw_result(pw = pw, chain=chain, index_col=index_col)
+                    continue
+
             # If kwargs were passed use them, otherwise pass chain-sp. smat from above
             if ('matrix' in kwargs) or ("open" in kwargs):
                 pw = _compute_pairwise(sequences = sequences,
                                        metric = metric,
                                        processes = processes,
                                        user_function = user_function,
+                                       engine = engine,
+                                       to_matrix = self.storage == "dense",
                                        **kwargs)
             else:
                 # Pull the default substitution matrix from object attributes
@@ -552,11 +622,60 @@ class TCRrep:
                                        metric = metric,
                                        processes = processes,
                                        user_function = user_function,
+                                       engine = engine,
+                                       to_matrix = self.storage == "dense",
                                        **{'matrix' : smat})
 
             # ASSIGN RESULT
             self._assign_pw_result(pw = pw, chain=chain, index_col=index_col)
 
+    def _v_region_pw_by_gene_lookup(self, index_col):
+        """
+        Legacy tcrdist_cdr1 distances for a V-region loop (cdr1, cdr2 or pmhc)
+        gathered from pairwise_numpy.v_region_table() by V gene.
+
+        Parameters
+        ----------
+        index_col : string
+            [cdr2|cdr1|pmhc]_[a|b|g|d]_aa
+
+        Returns
+        -------
+        pw : np.ndarray or None
+            matrix of pairwise comparisons (condensed vector if
+            TCRrep.storage is "condensed"), or None if the clone_df lacks the
+            v gene column or the region sequences do not match the IMGT aligned
+            sequences of the reference db for those genes.
+        """
+        cdr = {'cdr1' : 0, 'cdr2' : 1, 'pmhc' : 2}[index_col.split('_')[0]]
+        gene_col = 'v_{}_gene'.format(index_col.split('_')[1])
+        if gene_col not in self.clone_df.columns:
+            return None
+        genes = self.clone_df[gene_col]
+        ref = self.all_genes[self.organism]
+        try:
+            db_chains = set(ref[g].chain for g in genes.unique())
+        except KeyError:
+            return None
+        if len(db_chains) != 1:
+            return None
+
+        gene_index, cdr_seqs, table = pairwise_numpy.v_region_table(organism = self.organism,
+                                                                    db_chain = db_chains.pop(),
+                                                                    cdr = cdr,
+                                                                    db_file = self.db_file,
+                                                                    all_genes = self.all_genes)
+        pairs = self.clone_df[[gene_col, index_col]].drop_duplicates()
+        for g, seq in zip(pairs[gene_col], pairs[index_col]):
+            if g not in gene_index or cdr_seqs[gene_index[g]] != seq:
+                return None
+        codes = genes.map(gene_index).values.astype(np.int64)
+        if self.storage == "condensed":
+            return pairwise_numpy.condensed_from_blocks(
+                n = len(codes),
+                block_func = lambda r0, r1: table[codes[r0:r1, None], codes[None, r0:]])
+        return table[np.ix_(codes, codes)]
+
     def compute_paired_tcrdist(self,
                                chains = ['alpha', 'beta'],
                                replacement_weights = {},
@@ -616,56 +735,135 @@ class TCRrep:
 
         """
         [self._validate_chain(c) for c in chains]
-        weights = {'cdr1_a_aa_pw':1,
-                   'cdr2_a_aa_pw':1,
-                   'cdr3_a_aa_pw':1,
-                   'pmhc_a_aa_pw':1,
-                   'cdr1_b_aa_pw':1,
-                   'cdr2_b_aa_pw':1,
-                   'cdr3_b_aa_pw':1,
-                   'pmhc_b_aa_pw':1,
-                   'cdr1_g_aa_pw':1,
-                   'cdr2_g_aa_pw':1,
-                   'cdr3_g_aa_pw':1,
-                   'pmhc_g_aa_pw':1,
-                   'cdr1_d_aa_pw':1,
-                   'cdr2_d_aa_pw':1,
-                   'cdr3_d_aa_pw':1,
-                   'pmhc_d_aa_pw':1}
-
-        for k in replacement_weights:
-            weights[k] = replacement_weights[k]
-
-        alpha_keys = [k for k in list(weights.keys()) if k.endswith("a_aa_pw")]
-        beta_keys  = [k for k in list(weights.keys()) if k.endswith("b_aa_pw")]
-        gamma_keys = [k for k in list(weights.keys()) if k.endswith("g_aa_pw")]
-        delta_keys = [k for k in list(weights.keys()) if k.endswith("d_aa_pw")]
-
-        full_keys = []
-        if 'alpha' in chains:
-            full_keys = full_keys + alpha_keys
-        if 'beta' in chains:
-            full_keys = full_keys + beta_keys
-        if 'gamma' in chains:
-            full_keys = full_keys + gamma_keys
-        if 'delta' in chains:
-            full_keys = full_keys + delta_keys
-
-        # initialize tcrdist matrix size
-        for k in full_keys:
-            try:
-                tcrdist = np.zeros(self.__dict__[k].shape)
-                break
-            except KeyError:
-                pass
+        weights, full_keys = _paired_tcrdist_weights(chains, replacement_weights)
+
+        if self.storage == "condensed":
+            present_keys = [k for k in full_keys if k in self.__dict__]
+            for k in full_keys:
+                if k not in self.__dict__:
+                    warnings.warn("tcrdist was calculated without: '{}' because pairwise distances haven't been computed for this region:".format(k))
+            tcrdist = condensed.weighted_sum([self.__dict__[k] for k in present_keys],
+                                             [weights[k] for k in present_keys])
+        else:
+            # initialize tcrdist matrix size
+            for k in full_keys:
+                try:
+                    tcrdist = np.zeros(self.__dict__[k].shape)
+                    break
+                except KeyError:
+                    pass
 
-        for k in full_keys:
-            try:
-                tcrdist = self.__dict__[k]*weights[k] + tcrdist
-            except KeyError:
-                warnings.warn("tcrdist was calculated without: '{}' because pairwise distances haven't been computed for this region:".format(k))
-                pass
+            for k in full_keys:
+                try:
+                    tcrdist = self.__dict__[k]*weights[k] + tcrdist
+                except KeyError:
+                    warnings.warn("tcrdist was calculated without: '{}' because pairwise distances haven't been computed for this region:".format(k))
+                    pass
+
+
+        self.paired_tcrdist = tcrdist
+        self.paired_tcrdist_weights = {k:weights[k] for k in full_keys}
+        r = {'paired_tcrdist' : tcrdist,
+            'paired_tcrdist_weights' : {k:weights[k] for k in full_keys}}
+        if store_result:
+            self.stored_tcrdist.append(r)
+        return(r)
+
+    def compute_paired_tcrdist_fused(self,
+                                     chains = ['alpha', 'beta'],
+                                     replacement_weights = {},
+                                     memmap_file = None,
+                                     block_rows = None,
+                                     store_result = False):
+        """
+        Computes the same paired tcrdist as compute_pairwise_all with the
+        legacy metrics ("tcrdist_cdr3" for the CDR3 and "tcrdist_cdr1"
+        elsewhere) followed by compute_paired_tcrdist, without computing
+        the per-region matrices.
+
+        The weighted sum over all regions is accumulated tile by tile (blocks
+        of rows of clones) directly into the output, so peak memory is
+        one output matrix plus one tile.
+
+        Parameters
+        ----------
+        chains : list
+            list of strings containing some combination of 'alpha', 'beta',
+            'gamma', and 'delta'
+        replacement_weights : dictionary
+            optional dictionary of the form {'cdr1_a_aa_pw':1, 'cdr2_a_aa_pw':1}
+            as in compute_paired_tcrdist.
+        memmap_file : string or None
+            optional .npy file that the output matrix is written to as a
+            memory map (np.lib.format.open_memmap) instead of held in RAM.
+            Ignored if TCRrep.storage is "condensed".
+        block_rows : int or None
+            number of clones per tile, chosen automatically when None
+        store_result : boolean
+            True will store results to
+            :py:attr:`TCRrep.stored_tcrdist`
+
+        Returns
+        -------
+        r : dictionary
+            a dictionary with keys paired_tcrdist points to a 2D
+            tcrdist np.ndarray (np.memmap if memmap_file is given, or
+            condensed.CondensedMatrix if TCRrep.storage is "condensed") and
+            paired_tcrdist_weights pointing to dictionary of weights.
+
+        Notes
+        -----
+        Region sequences are taken from TCRrep.clone_df, which must have
+        been generated with infer_cdrs_from_v_gene(imgt_aligned = True).
+        Per-region attributes (e.g. TCRrep.cdr3_a_aa_pw) are not set.
 
+        Example
+        -------
+        >>> tr.compute_paired_tcrdist_fused(chains = ['alpha', 'beta'],
+        ...                                 replacement_weights = {'cdr3_a_aa_pw': 3,
+        ...                                                        'cdr3_b_aa_pw': 3})
+        """
+        [self._validate_chain(c) for c in chains]
+        if not self.imgt_aligned_status:
+            raise ValueError("imgt_aligned must be set to True in tr.infer_cdrs_from_v_gene()")
+        weights, full_keys = _paired_tcrdist_weights(chains, replacement_weights)
+
+        kernels, depth = self._legacy_region_kernels(full_keys, weights)
+        n = self.clone_df.shape[0]
+
+        def tile(r0, r1):
+            # rows r0:r1 and columns r0:n, in the order of operations of
+            # compute_paired_tcrdist
+            acc = np.zeros((r1 - r0, n - r0))
+            for k, metric, block, w in kernels:
+                acc = block(slice(r0, r1), slice(r0, None))*w + acc
+            return acc
+
+        if self.storage == "condensed":
+            dvec = pairwise_numpy.condensed_from_blocks(n = n,
+                                                        block_func = tile,
+                                                        depth = depth + 1,
+                                                        dtype = np.float64,
+                                                        block_rows = block_rows)
+            tcrdist = condensed.CondensedMatrix(dvec, n = n)
+        else:
+            if memmap_file is None:
+                tcrdist = np.zeros((n, n))
+            else:
+                tcrdist = np.lib.format.open_memmap(memmap_file, mode = 'w+', dtype = np.float64, shape = (n, n))
+            r0 = 0
+            while r0 < n:
+                if block_rows is None:
+                    r1 = min(n, r0 + pairwise_numpy._rows_per_block(n - r0, depth + 1))
+                else:
+                    r1 = min(n, r0 + block_rows)
+                # upper triangle tile, mirrored into the lower triangle
+                block = tile(r0, r1)
+                tcrdist[r0:r1, r0:] = block
+                tcrdist[r1:, r0:r1] = block[:, r1 - r0:].T
+                r0 = r1
+            if memmap_file is not None:
+                tcrdist.flush()
 
         self.paired_tcrdist = tcrdist
         self.paired_tcrdist_weights = {k:weights[k] for k in full_keys}
@@ -675,6 +873,290 @@ class TCRrep:
             self.stored_tcrdist.append(r)
         return(r)
 
+    def _legacy_region_kernels(self, full_keys, weights, clone_df = None, metric = "tcrdist"):
+        """
+        pairwise_numpy.region_kernel() of each region with a non-zero weight,
+        using the legacy metrics ("tcrdist_cdr3" for the CDR3 and
+        "tcrdist_cdr1" elsewhere) unless a single metric is given
+
+        Parameters
+        ----------
+        full_keys : list
+            regions, e.g. ['cdr3_a_aa_pw', 'cdr1_a_aa_pw']
+        weights : dictionary
+            weight of each region
+        clone_df : DataFrame
+            clones to encode, by default TCRrep.clone_df
+        metric : string
+            "tcrdist" for the legacy metrics, or one of the "tcrdist_*"
+            metrics of compute_pairwise_all for every region
+
+        Returns
+        -------
+        kernels : list
+            list of (region, metric, block function, weight) tuples in the
+            order of full_keys
+        depth : int
+            largest pairwise_numpy.kernel_depth() of the kernels
+        """
+        if clone_df is None:
+            clone_df = self.clone_df
+        kernels = []
+        depth = 1
+        for k in full_keys:
+            index_col = k.replace('_pw', '')
+            if index_col not in clone_df.columns:
+                warnings.warn("tcrdist was calculated without: '{}' because {} is not in clone_df".format(k, index_col))
+                continue
+            if weights[k] == 0:
+                continue
+            if metric == "tcrdist":
+                region_metric = "tcrdist_cdr3" if k.startswith("cdr3") else "tcrdist_cdr1"
+            else:
+                region_metric = metric
+            sequences = clone_df[index_col].values
+            kernels.append((k, region_metric, pairwise_numpy.region_kernel(sequences, region_metric), weights[k]))
+            depth = max(depth, pairwise_numpy.kernel_depth(region_metric, max(len(x) for x in sequences)))
+        return kernels, depth
+
+    def compute_sparse_tcrdist(self,
+                               radius,
+                               chains = ['alpha', 'beta'],
+                               replacement_weights = {},
+                               block_rows = None):
+        """
+        Paired tcrdist of all pairs of clones within radius, as a sparse
+        matrix. Gives the same values as compute_paired_tcrdist_fused (and
+        compute_paired_tcrdist with the legacy metrics) without holding a
+        dense N x N matrix.
+
+        Pairs are screened with a cheap lower bound: the exact V-region
+        distances (looked up from a table of the distinct CDR1, CDR2 and
+        pMHC loops) plus the CDR3 length difference gap penalty. The CDR3
+        distances, the expensive part, are then computed one CDR3 at a time
+        only for the remaining pairs, which are dropped as soon as their
+        running sum exceeds the radius.
+
+        Parameters
+        ----------
+        radius : int or float
+            pairs with paired tcrdist <= radius are kept
+        chains : list
+            list of strings containing some combination of 'alpha', 'beta',
+            'gamma', and 'delta'
+        replacement_weights : dictionary
+            optional dictionary of the form {'cdr1_a_aa_pw':1, 'cdr2_a_aa_pw':1}
+            as in compute_paired_tcrdist. Weights must not be negative.
+        block_rows : int or None
+            number of clones screened at a time, chosen automatically when None
+
+        Returns
+        -------
+        sparse_tcrdist : scipy.sparse.csr_matrix
+            symmetric (N x N) float64 matrix. Every pair within the radius
+            is stored explicitly, including pairs at distance 0; the
+            diagonal is not stored. Also assigned to TCRrep.sparse_tcrdist.
+
+        Example
+        -------
+        >>> S = tr.compute_sparse_tcrdist(radius = 50)
+        >>> neighbors_of_clone_0 = S[0].indices
+        """
+        [self._validate_chain(c) for c in chains]
+        if not self.imgt_aligned_status:
+            raise ValueError("imgt_aligned must be set to True in tr.infer_cdrs_from_v_gene()")
+        weights, full_keys = _paired_tcrdist_weights(chains, replacement_weights)
+        if any(weights[k] < 0 for k in full_keys):
+            raise ValueError("compute_sparse_tcrdist requires non-negative replacement_weights")
+        kernels, depth = self._legacy_region_kernels(full_keys, weights)
+        params = DistanceParams()
+        # weighted sums are compared with a tolerance, the final filter is exact
+        tol = 1e-9 * max(1.0, abs(radius))
+
+        cdr3_lens = {}
+        for k, metric, block, w in kernels:
+            if metric == "tcrdist_cdr3":
+                cdr3_lens[k] = self.clone_df[k.replace('_pw', '')].str.len().values
+
+        n = self.clone_df.shape[0]
+        if block_rows is None:
+            block_rows = pairwise_numpy._rows_per_block(n, len(kernels) + 2)
+        all_i, all_j, all_d = [], [], []
+        for r0 in range(0, n, block_rows):
+            r1 = min(n, r0 + block_rows)
+            rows, cols = slice(r0, r1), slice(r0, None)
+            # lower bound for every pair of the tile
+            bound = np.zeros((r1 - r0, n - r0))
+            for k, metric, block, w in kernels:
+                if metric == "tcrdist_cdr3":
+                    lendiff = np.abs(cdr3_lens[k][rows, None] - cdr3_lens[k][None, cols])
+                    bound += w * np.floor(lendiff * params.gap_penalty_cdr3_region)
+                else:
+                    bound += w * block(rows, cols)
+            # upper triangle only
+            bound[np.tril_indices(r1 - r0, m = n - r0)] = np.inf
+            i, j = np.nonzero(bound <= radius + tol)
+            bound = bound[i, j]
+            i = i + r0
+            j = j + r0
+
+            # exact CDR3 distances with early abandon
+            exact = {}
+            for k, metric, block, w in kernels:
+                if metric != "tcrdist_cdr3":
+                    continue
+                lendiff = np.abs(cdr3_lens[k][i] - cdr3_lens[k][j])
+                d = block(i, j, outer = False)
+                bound = bound - w * np.floor(lendiff * params.gap_penalty_cdr3_region) + w * d
+                keep = bound <= radius + tol
+                i, j, bound, d = i[keep], j[keep], bound[keep], d[keep]
+                exact = {key : v[keep] for key, v in exact.items()}
+                exact[k] = d
+
+            # same order of operations as compute_paired_tcrdist
+            dist = np.zeros(len(i))
+            for k, metric, block, w in kernels:
+                d = exact[k] if k in exact else block(i, j, outer = False)
+                dist = d*w + dist
+            keep = dist <= radius
+            all_i.append(i[keep])
+            all_j.append(j[keep])
+            all_d.append(dist[keep])
+
+        i = np.concatenate(all_i + [np.zeros(0, dtype = np.int64)])
+        j = np.concatenate(all_j + [np.zeros(0, dtype = np.int64)])
+        d = np.concatenate(all_d + [np.zeros(0)])
+        sparse_tcrdist = scipy.sparse.csr_matrix((np.concatenate([d, d]),
+                                                  (np.concatenate([i, j]), np.concatenate([j, i]))),
+                                                 shape = (n, n))
+        self.sparse_tcrdist = sparse_tcrdist
+        return sparse_tcrdist
+
+    def compute_rect_distances(self,
+                               other,
+                               chains = None,
+                               weights = {},
+                               metric = "tcrdist",
+                               engine = "numpy",
+                               processes = 1,
+                               block_rows = None,
+                               return_regions = True):
+        """
+        Computes distances between every clone of TCRrep.clone_df (the query,
+        M clones) and every clone of another repertoire (the reference, N
+        clones) without computing an (M + N) x (M + N) matrix.
+
+        Parameters
+        ----------
+        other : TCRrep or DataFrame
+            reference repertoire, a TCRrep or a clone_df like DataFrame with
+            the [cdr3|cdr2|cdr1|pmhc]_[a|b|g|d]_aa columns
+        chains : list
+            list of strings containing some combination of 'alpha', 'beta',
+            'gamma', and 'delta', by default TCRrep.chains
+        weights : dictionary
+            optional dictionary of the form {'cdr1_a_aa_pw':1, 'cdr2_a_aa_pw':1}
+            as replacement_weights in compute_paired_tcrdist.
+        metric : string
+            "tcrdist" (default) uses "tcrdist_cdr3" for the CDR3 and
+            "tcrdist_cdr1" elsewhere, as in _tcrdist_legacy_method_alpha_beta.
+            Otherwise any metric of compute_pairwise_all ("nw", "hamming",
+            "hamming_aligned", "tcrdist_*") is used for every region, with the
+            substitution matrix of _get_smat.
+        engine : string
+            "numpy" (tcrdist metrics only, see pairwise_numpy.py) or
+            "pwseqdist"
+        processes : int
+            number of query blocks computed in parallel (threads) with the
+            numpy engine, or of pwseqdist worker processes
+        block_rows : int or None
+            number of query clones per block, chosen automatically when None
+        return_regions : boolean
+            if True the per-region matrices are returned as well
+
+        Returns
+        -------
+        r : dictionary
+            'paired_tcrdist' : (M x N) np.ndarray, weighted sum of the regions
+            'paired_tcrdist_weights' : dictionary of weights
+            and, if return_regions, one (M x N) np.ndarray per region (e.g.
+            'cdr3_b_aa_pw')
+
+        Example
+        -------
+        >>> r = tr_query.compute_rect_distances(tr_reference, chains = ['beta'])
+        >>> r['paired_tcrdist'].shape
+        (tr_query.clone_df.shape[0], tr_reference.clone_df.shape[0])
+        """
+        if chains is None:
+            chains = self.chains
+        [self._validate_chain(c) for c in chains]
+        other_df = other.clone_df if isinstance(other, TCRrep) else other
+        weights, full_keys = _paired_tcrdist_weights(chains, weights)
+        m = self.clone_df.shape[0]
+        n = other_df.shape[0]
+
+        regions = []
+        for k in full_keys:
+            index_col = k.replace('_pw', '')
+            if index_col not in self.clone_df.columns or index_col not in other_df.columns:
+                warnings.warn("tcrdist was calculated without: '{}' because {} is not in both clone_dfs".format(k, index_col))
+            elif return_regions or weights[k] != 0:
+                regions.append(k)
+        region_pw = {}
+
+        if engine == "numpy":
+            if metric != "tcrdist" and metric not in pairwise_numpy.cdr3_metrics + pairwise_numpy.v_region_metrics:
+                msg = 'repertoire.compute_rect_distances: metric %s is not supported by the numpy engine'
+                raise ValueError(msg % metric)
+            index_cols = [k.replace('_pw', '') for k in regions]
+            both_df = pd.concat([self.clone_df[index_cols], other_df[index_cols]], ignore_index = True)
+            kernels, depth = self._legacy_region_kernels(regions,
+                                                         {k : 1 for k in regions},
+                                                         clone_df = both_df,
+                                                         metric = metric)
+            cols = np.arange(m, m + n)
+            for k, region_metric, block, w in kernels:
+                region_pw[k] = np.zeros((m, n), dtype = np.int64)
+            if block_rows is None:
+                block_rows = pairwise_numpy._rows_per_block(n, depth)
+
+            def query_block(r0):
+                rows = np.arange(r0, min(m, r0 + block_rows))
+                for k, region_metric, block, w in kernels:
+                    region_pw[k][rows] = block(rows, cols)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers = processes) as executor:
+                list(executor.map(query_block, range(0, m, block_rows)))
+        elif engine == "pwseqdist":
+            for k in regions:
+                index_col = k.replace('_pw', '')
+                if metric == "tcrdist":
+                    region_metric = "tcrdist_cdr3" if k.startswith("cdr3") else "tcrdist_cdr1"
+                else:
+                    region_metric = metric
+                chain = {'a' : 'alpha', 'b' : 'beta', 'g' : 'gamma', 'd' : 'delta'}[index_col.split('_')[1]]
+                kwargs = {'matrix' : self._get_smat(chain = chain, index_col = index_col)}
+                region_pw[k] = pwseqdist.apply_pairwise_rect(list(self.clone_df[index_col].values),
+                                                             list(other_df[index_col].values),
+                                                             _metric_function(region_metric),
+                                                             ncpus = processes,
+                                                             **kwargs)
+        else:
+            raise ValueError('repertoire.compute_rect_distances: engine must be "pwseqdist" or "numpy"')
+
+        # same order of operations as compute_paired_tcrdist
+        tcrdist = np.zeros((m, n))
+        for k in full_keys:
+            if k in region_pw and weights[k] != 0:
+                tcrdist = region_pw[k]*weights[k] + tcrdist
+
+        r = {'paired_tcrdist' : tcrdist,
+             'paired_tcrdist_weights' : {k:weights[k] for k in full_keys}}
+        if return_regions:
+            r.update(region_pw)
+        return(r)
+
     def compute_pairwise(self,
                          chain,
                          metric = "nw",
@@ -749,7 +1231,10 @@ class TCRrep:
         -----
         https://docs.scipy.org/doc/scipy/reference/generated/scipy.cluster.hierarchy.fcluster.html
         """
-        compressed_dmat = scipy.spatial.distance.squareform(self.paired_tcrdist, force = "vector")
+        if isinstance(self.paired_tcrdist, condensed.CondensedMatrix):
+            compressed_dmat = self.paired_tcrdist.vec
+        else:
+            compressed_dmat = scipy.spatial.distance.squareform(self.paired_tcrdist, force = "vector")
         Z = linkage(compressed_dmat, method = "complete")
         cluster_index = fcluster(Z, t = t, criterion = criterion)
         assert len(cluster_index) == self.clone_df.shape[0]
@@ -856,7 +1341,7 @@ class TCRrep:
         warnings.warn("RUNNING sklearn.manifold.TSNE WHICH MAY TAKE A FEW MINUTES")
         from sklearn.manifold import TSNE
         if X is None:
-            X = self.paired_tcrdist        
+            X = np.asarray(self.paired_tcrdist)
         X_embedded = TSNE(n_components=n_components, metric ='precomputed', random_state = random_state).fit_transform(X)
         tsne_df = pd.DataFrame(X_embedded, columns = axis_names )
         assert(tsne_df.shape[0] == self.clone_df.shape[0])
@@ -866,7 +1351,7 @@ class TCRrep:
         warnings.warn("RUNNING sklearn.manifold.MDS WHICH MAY TAKE A FEW MINUTES")
         from sklearn.manifold import MDS
         if X is None:
-            X = self.paired_tcrdist     
+            X = np.asarray(self.paired_tcrdist)
         X_embedded_mds = MDS(n_components=n_components, dissimilarity=dissimilarity).fit_transform(X)
         mds_df = pd.DataFrame(X_embedded_mds, columns = axis_names)
         assert(mds_df.shape[0] == self.clone_df.shape[0])
@@ -876,6 +1361,10 @@ class TCRrep:
         if self.organism not in ["human", "mouse"]:
             raise ValueError("organism must be 'mouse' or 'human'")
 
+    def _validate_storage(self):
+        if self.storage not in ["dense", "condensed"]:
+            raise ValueError("TCRrep storage must be 'dense' or 'condensed'")
+
     def _validate_chains(self):
         """
         raise ValueError if invalid chains are passed to TCRrep __init__
@@ -1014,9 +1503,20 @@ class TCRrep:
         index_col : string
             [cdr3|cdr2|cdr1|pmhc]_[a|b|g|d]_aa_pw
 
+        Notes
+        -----
+        When TCRrep.storage is "condensed", pw (a square matrix or condensed
+        vector) is stored as a condensed.CondensedMatrix
+
         """
         self._validate_chain(chain = chain)
 
+        if self.storage == "condensed" and isinstance(pw, np.ndarray):
+            if pw.ndim == 1:
+                pw = condensed.CondensedMatrix(pw, n = self.clone_df.shape[0])
+            else:
+                pw = condensed.CondensedMatrix.from_square(pw)
+
         if chain == "alpha":
             if index_col.startswith("cdr3_a"):
                 self.cdr3_a_aa_pw = pw
@@ -1078,13 +1578,15 @@ class TCRrep:
         pickle.dump(self,  open(filename , "wb") )
         warnings.warn("all smats dropped because they are C objects that can't be pickled. reassign with _initialize_chain_specific_attributes()")
 
-    def _tcrdist_legacy_method_alpha_beta(self, processes = 1):
+    def _tcrdist_legacy_method_alpha_beta(self, processes = 1, engine = "pwseqdist"):
         """
         Runs the legacy tcrdist pairwise comparison
 
         Arguments
         ---------
         processes : int
+        engine : string
+            "pwseqdist" or "numpy", passed to compute_pairwise_all
 
 
         Notes
@@ -1104,39 +1606,47 @@ class TCRrep:
 
         self.compute_pairwise_all(chain = "alpha",                        # <11
                                  metric = 'tcrdist_cdr3',
+                                 engine = engine,
                                  compute_specific_region = 'cdr3_a_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr1_a_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr2_a_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'pmhc_a_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = 'tcrdist_cdr3',
+                                 engine = engine,
                                  #user_function = tcrdist_metric_align_cdr3s_false,
                                  compute_specific_region = 'cdr3_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr1_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr2_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'pmhc_b_aa',
                                  processes = processes)
 
-        distA = self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 1,
+        distA = _as_dense(self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 1,
                                                                 'cdr2_a_aa_pw': 1,
                                                                 'cdr1_a_aa_pw': 1,
                                                                 'pmhc_a_aa_pw': 1,
@@ -1144,9 +1654,9 @@ class TCRrep:
                                                                 'cdr2_b_aa_pw': 0,
                                                                 'cdr1_b_aa_pw': 0,
                                                                 'pmhc_b_aa_pw': 0},
-                                                                 chains = ["alpha", "beta"])['paired_tcrdist'].copy()
+                                                                 chains = ["alpha", "beta"])['paired_tcrdist'])
 
-        distB = self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 0,
+        distB = _as_dense(self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 0,
                                                                 'cdr2_a_aa_pw': 0,
                                                                 'cdr1_a_aa_pw': 0,
                                                                 'pmhc_a_aa_pw': 0,
@@ -1154,25 +1664,27 @@ class TCRrep:
                                                                 'cdr2_b_aa_pw': 1,
                                                                 'cdr1_b_aa_pw': 1,
                                                                 'pmhc_b_aa_pw': 1},
-                                                                chains = ["alpha", "beta"])['paired_tcrdist'].copy()
+                                                                chains = ["alpha", "beta"])['paired_tcrdist'])
 
         # Calling tr.compute_paired_tcrdist() computs the
         # the final paired chain TCR-distance which is stored as
         # tr.paired_tcrdist, which we confirm is simply the sum of distA and distB
         self.compute_paired_tcrdist()
-        assert np.all(((distA + distB) - self.paired_tcrdist) == 0)
+        assert np.all(((distA + distB) - _as_dense(self.paired_tcrdist, copy = False)) == 0)
 
         # tr.paired_tcrdist and distA, distB are np arrays, but we will want to work with as a pandas DataFrames
         self.dist_a = pd.DataFrame(distA, index = self.clone_df.clone_id, columns = self.clone_df.clone_id)
         self.dist_b = pd.DataFrame(distB, index = self.clone_df.clone_id, columns = self.clone_df.clone_id)
 
-    def _tcrdist_legacy_method_alpha(self, processes = 1):
+    def _tcrdist_legacy_method_alpha(self, processes = 1, engine = "pwseqdist"):
         """
         Runs the legacy tcrdist pairwise comparison
 
         Arguments
         ---------
         processes : int
+        engine : string
+            "pwseqdist" or "numpy", passed to compute_pairwise_all
 
 
         Notes
@@ -1192,43 +1704,49 @@ class TCRrep:
 
         self.compute_pairwise_all(chain = "alpha",                        # <11
                                     metric = 'tcrdist_cdr3',
+                                    engine = engine,
                                     compute_specific_region = 'cdr3_a_aa',
                                     processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                     metric = "tcrdist_cdr1",
+                                    engine = engine,
                                     compute_specific_region = 'cdr1_a_aa',
                                     processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                     metric = "tcrdist_cdr1",
+                                    engine = engine,
                                     compute_specific_region = 'cdr2_a_aa',
                                     processes = processes)
         self.compute_pairwise_all(chain = "alpha",                        # 11
                                     metric = "tcrdist_cdr1",
+                                    engine = engine,
                                     compute_specific_region = 'pmhc_a_aa',
                                     processes = processes)
 
-        distA = self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 1,
+        distA = _as_dense(self.compute_paired_tcrdist(replacement_weights= {'cdr3_a_aa_pw': 1,
                                                                 'cdr2_a_aa_pw': 1,
                                                                 'cdr1_a_aa_pw': 1,
                                                                 'pmhc_a_aa_pw': 1},
-                                                                chains = ["alpha"])['paired_tcrdist'].copy()
+                                                                chains = ["alpha"])['paired_tcrdist'])
                                                                         # Calling tr.compute_paired_tcrdist() computs the
         # the final paired chain TCR-distance which is stored as
         # tr.paired_tcrdist, which we confirm is simply the sum of distA and distB
         self.compute_paired_tcrdist()
-        assert np.all((distA - self.paired_tcrdist) == 0)
+        assert np.all((distA - _as_dense(self.paired_tcrdist, copy = False)) == 0)
 
         # tr.paired_tcrdist and distA, distB are np arrays, but we will want to work with as a pandas DataFrames
         self.dist_a = pd.DataFrame(distA, index = self.clone_df.clone_id, columns = self.clone_df.clone_id)
 
 
-    def _tcrdist_legacy_method_beta(self, processes = 1):
+    def _tcrdist_legacy_method_beta(self, processes = 1, engine = "pwseqdist"):
         """
         Runs the legacy tcrdist pairwise comparison
 
         Arguments
         ---------
         processes : int
+        engine : string
+            "pwseqdist" or "numpy", passed to compute_pairwise_all
 
 
         Notes
@@ -1248,44 +1766,50 @@ class TCRrep:
 
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = 'tcrdist_cdr3',
+                                 engine = engine,
                                  #user_function = tcrdist_metric_align_cdr3s_false,
                                  compute_specific_region = 'cdr3_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr1_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr2_b_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "beta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'pmhc_b_aa',
                                  processes = processes)
 
-        distB = self.compute_paired_tcrdist(replacement_weights= {
+        distB = _as_dense(self.compute_paired_tcrdist(replacement_weights= {
                                                                 'cdr3_b_aa_pw': 1,
                                                                 'cdr2_b_aa_pw': 1,
                                                                 'cdr1_b_aa_pw': 1,
                                                                 'pmhc_b_aa_pw': 1},
-                                                                chains = ["beta"])['paired_tcrdist'].copy()
+                                                                chains = ["beta"])['paired_tcrdist'])
 
         self.compute_paired_tcrdist()
-        assert np.all(((distB) - self.paired_tcrdist) == 0)
+        assert np.all(((distB) - _as_dense(self.paired_tcrdist, copy = False)) == 0)
 
         # tr.paired_tcrdist and distA, distB are np arrays, but we will want to work with as a pandas DataFrames
         self.dist_b = pd.DataFrame(distB, index = self.clone_df.clone_id, columns = self.clone_df.clone_id)
 
 
 
-    def _tcrdist_legacy_method_gamma_delta(self, processes = 1):
+    def _tcrdist_legacy_method_gamma_delta(self, processes = 1, engine = "pwseqdist"):
         """
         Runs the legacy tcrdist pairwise comparison gamma/delta
 
         Arguments
         ---------
         processes : int
+        engine : string
+            "pwseqdist" or "numpy", passed to compute_pairwise_all
 
 
         Notes
@@ -1299,38 +1823,46 @@ class TCRrep:
         """
         self.compute_pairwise_all(chain = "gamma",                        # <11
                                  metric = 'tcrdist_cdr3',
+                                 engine = engine,
                                  compute_specific_region = 'cdr3_g_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "gamma",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr1_g_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "gamma",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr2_g_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "gamma",                        # 11
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'pmhc_g_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "delta",                         # 12
                                  metric = 'tcrdist_cdr3',
+                                 engine = engine,
                                  compute_specific_region = 'cdr3_d_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "delta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr1_d_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "delta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'cdr2_d_aa',
                                  processes = processes)
         self.compute_pairwise_all(chain = "delta",                         # 12
                                  metric = "tcrdist_cdr1",
+                                 engine = engine,
                                  compute_specific_region = 'pmhc_d_aa',
                                  processes = processes)
 
-        distA = self.compute_paired_tcrdist(replacement_weights= {'cdr3_g_aa_pw': 1,
+        distA = _as_dense(self.compute_paired_tcrdist(replacement_weights= {'cdr3_g_aa_pw': 1,
                                                                 'cdr2_g_aa_pw': 1,
                                                                 'cdr1_g_aa_pw': 1,
                                                                 'pmhc_g_aa_pw': 1,
@@ -1338,9 +1870,9 @@ class TCRrep:
                                                                 'cdr2_d_aa_pw': 0,
                                                                 'cdr1_d_aa_pw': 0,
                                                                 'pmhc_d_aa_pw': 0},
-                                                                chains = ["gamma", "delta"])['paired_tcrdist'].copy()
+                                                                chains = ["gamma", "delta"])['paired_tcrdist'])
 
-        distB = self.compute_paired_tcrdist(replacement_weights= {'cdr3_g_aa_pw': 0,
+        distB = _as_dense(self.compute_paired_tcrdist(replacement_weights= {'cdr3_g_aa_pw': 0,
                                                                 'cdr2_g_aa_pw': 0,
                                                                 'cdr1_g_aa_pw': 0,
                                                                 'pmhc_g_aa_pw': 0,
@@ -1348,13 +1880,13 @@ class TCRrep:
                                                                 'cdr2_d_aa_pw': 1,
                                                                 'cdr1_d_aa_pw': 1,
                                                                 'pmhc_d_aa_pw': 1},
-                                                                chains = ["gamma", "delta"] )['paired_tcrdist'].copy()
+                                                                chains = ["gamma", "delta"] )['paired_tcrdist'])
 
         # Calling tr.compute_paired_tcrdist() computs the
         # the final paired chain TCR-distance which is stored as
         # tr.paired_tcrdist, which we confirm is simply the sum of distA and distB
         self.compute_paired_tcrdist(chains = ["gamma", "delta"])
-        assert np.all(((distA + distB) - self.paired_tcrdist) == 0)
+        assert np.all(((distA + distB) - _as_dense(self.paired_tcrdist, copy = False)) == 0)
 
         # tr.paired_tcrdist and distA, distB are np arrays, but we will want to work with as a pandas DataFrames
         self.dist_g = pd.DataFrame(distA, index = self.clone_df.clone_id, columns = self.clone_df.clone_id)
@@ -1444,7 +1976,12 @@ class TCRrep:
 
         for attr, ty in zip(all_attrs, all_types):
             x = getattr(self, attr)
-            if not isinstance(x, parasail.bindings_v2.Matrix):
+            if isinstance(x, condensed.CondensedMatrix):
+                # condensed storage is saved as its vector
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    hdf.put(attr, pd.DataFrame(x.vec), format='table')
+            elif not isinstance(x, parasail.bindings_v2.Matrix):
                 if isinstance(x, pd.core.frame.DataFrame):
                     with warnings.catch_warnings():
                         warnings.simplefilter("ignore")
@@ -1494,7 +2031,10 @@ class TCRrep:
         'meta_cols': None,
         'project_id': str,
         'all_genes': collections.OrderedDict,
-        'imgt_aligned_status': bool}
+        'imgt_aligned_status': bool,
+        'db_file': str,
+        'storage': str,
+        'sparse_tcrdist': None}
         attr_to_type.update({'cdr3_%s_aa_smat' % loci: parasail.bindings_v2.Matrix for loci in 'abgd'})
         attr_to_type.update({'cdr2_%s_aa_smat' % loci: parasail.bindings_v2.Matrix for loci in 'abgd'})
         attr_to_type.update({'cdr1_%s_aa_smat' % loci: parasail.bindings_v2.Matrix for loci in 'abgd'})
@@ -1511,6 +2051,7 @@ class TCRrep:
             # pull the metadata from cell_df
             metadata = store.get_storer('cell_df').attrs.metadata
             metadata = json.loads(metadata)
+            storage = metadata.get('storage', 'dense')
 
             for attr in metadata['attributes']:
                 try:
@@ -1526,7 +2067,10 @@ class TCRrep:
                 if attr_to_type[attr] is pd.core.frame.DataFrame:
                     setattr(self, attr, store[attr])
                 elif attr_to_type[attr] is np.ndarray:
-                    if 'pw' in attr:
+                    if storage == "condensed":
+                        tmp = store[attr].values
+                        setattr(self, attr, condensed.CondensedMatrix(np.squeeze(tmp, axis = 1)))
+                    elif 'pw' in attr:
                         tmp = store[attr].values
                         incoming = scipy.spatial.distance.squareform(np.squeeze(tmp),
                                                                      force='tomatrix',
@@ -1585,6 +2129,73 @@ def _map_gene_to_reference_seq(organism = "human",
     return aa_string
 
 
+def _paired_tcrdist_weights(chains, replacement_weights = {}):
+    """
+    Region weights used by TCRrep.compute_paired_tcrdist
+
+    Parameters
+    ----------
+    chains : list
+        list of strings containing some combination of 'alpha', 'beta',
+        'gamma', and 'delta'
+    replacement_weights : dictionary
+        optional dictionary of the form {'cdr1_a_aa_pw':1, 'cdr2_a_aa_pw':1}
+
+    Returns
+    -------
+    weights : dictionary
+        weight of every [cdr3|cdr2|cdr1|pmhc]_[a|b|g|d]_aa_pw region
+    full_keys : list
+        regions of the chains, in the order they are summed
+    """
+    weights = {'cdr1_a_aa_pw':1,
+               'cdr2_a_aa_pw':1,
+               'cdr3_a_aa_pw':1,
+               'pmhc_a_aa_pw':1,
+               'cdr1_b_aa_pw':1,
+               'cdr2_b_aa_pw':1,
+               'cdr3_b_aa_pw':1,
+               'pmhc_b_aa_pw':1,
+               'cdr1_g_aa_pw':1,
+               'cdr2_g_aa_pw':1,
+               'cdr3_g_aa_pw':1,
+               'pmhc_g_aa_pw':1,
+               'cdr1_d_aa_pw':1,
+               'cdr2_d_aa_pw':1,
+               'cdr3_d_aa_pw':1,
+               'pmhc_d_aa_pw':1}
+
+    for k in replacement_weights:
+        weights[k] = replacement_weights[k]
+
+    alpha_keys = [k for k in list(weights.keys()) if k.endswith("a_aa_pw")]
+    beta_keys  = [k for k in list(weights.keys()) if k.endswith("b_aa_pw")]
+    gamma_keys = [k for k in list(weights.keys()) if k.endswith("g_aa_pw")]
+    delta_keys = [k for k in list(weights.keys()) if k.endswith("d_aa_pw")]
+
+    full_keys = []
+    if 'alpha' in chains:
+        full_keys = full_keys + alpha_keys
+    if 'beta' in chains:
+        full_keys = full_keys + beta_keys
+    if 'gamma' in chains:
+        full_keys = full_keys + gamma_keys
+    if 'delta' in chains:
+        full_keys = full_keys + delta_keys
+    return weights, full_keys
+
+def _as_dense(x, copy = True):
+    """
+    Square np.ndarray of a pairwise result stored either as np.ndarray or as
+    condensed.CondensedMatrix (widened to int64 or float64 so sums of
+    matrices cannot overflow)
+    """
+    if isinstance(x, condensed.CondensedMatrix):
+        return x.toarray().astype(np.result_type(x.dtype, np.int64))
+    if copy:
+        return x.copy()
+    return x
+
 def _deduplicate(cell_df, index_cols):
     """
     Use index_cols to group by and group identical entries. The input DataFrame
@@ -1593,23 +2204,11 @@ def _deduplicate(cell_df, index_cols):
     clones = cell_df.groupby(index_cols)['count'].agg(np.sum).reset_index()
     return clones
 
-def _compute_pairwise(sequences, metric='nw', processes=2, user_function=None, **kwargs):
-    """Wrapper for pairwise.apply_pw_distance_metric_w_multiprocessing()
-
-    Parameters
-    ----------
-    sequences : list
-    metric : string
-    processes : int
-    user_function : function
-    **kwargs : keyword arguments passed to metric function
-
-    Returns
-    -------
-    pw_full_np : np.ndarray
-        matrix of pairwise comparisons"""
-    # processes = 1
-    
+def _metric_function(metric, user_function = None):
+    """
+    Distance function (s1, s2, **kwargs) used by the pwseqdist engine for
+    metric, or user_function if metric is not one of the named metrics
+    """
     if metric == 'nw':
         metric_func = pwseqdist.metrics.nw_metric
     elif metric == 'hamming':
@@ -1625,13 +2224,53 @@ def _compute_pairwise(sequences, metric='nw', processes=2, user_function=None, *
     else:
         msg = 'repertoire._compute_pairwise: metric %s is not supported'
         raise ValueError(msg % metric)
-    
+    return metric_func
+
+def _compute_pairwise(sequences, metric='nw', processes=2, user_function=None, engine='pwseqdist', to_matrix=True, **kwargs):
+    """Wrapper for pairwise.apply_pw_distance_metric_w_multiprocessing()
+
+    Parameters
+    ----------
+    sequences : list
+    metric : string
+    processes : int
+    user_function : function
+    engine : string
+        'pwseqdist' or 'numpy' (see pairwise_numpy.py, 'tcrdist_*' metrics only)
+    to_matrix : boolean
+        if False the condensed vector is returned without squareform
+    **kwargs : keyword arguments passed to metric function
+
+    Returns
+    -------
+    pw_full_np : np.ndarray
+        matrix of pairwise comparisons (or condensed vector)"""
+    # processes = 1
+
+    if engine == 'numpy':
+        if metric == 'tcrdist_cdr3':
+            dvec = pairwise_numpy.tcrdist_cdr3_pw(sequences.values)
+        elif metric in ['tcrdist_cdr1', 'tcrdist_cdr2', 'tcrdist_cdr2.5', 'tcrdist_pmhc']:
+            dvec = pairwise_numpy.tcrdist_cdr1_pw(sequences.values)
+        else:
+            msg = 'repertoire._compute_pairwise: metric %s is not supported by the numpy engine'
+            raise ValueError(msg % metric)
+        if not to_matrix:
+            return dvec
+        return scipy.spatial.distance.squareform(dvec)
+    elif engine != 'pwseqdist':
+        raise ValueError('repertoire._compute_pairwise: engine must be "pwseqdist" or "numpy"')
+
+    metric_func = _metric_function(metric, user_function)
+
     if metric in ['nw', 'hamming']:
         if not 'matrix' in kwargs:
             kwargs['matrix'] = 'blosum62'
 
     dvec = pwseqdist.apply_pairwise_sq(sequences.values, metric_func,
                                   ncpus=processes, **kwargs)
+    if not to_matrix:
+        return dvec
     """This may not be neccessary in all use cases of the distances.
     Consider returning the vector form."""
     pw_full_np = scipy.spatial.distance.squareform(dvec)
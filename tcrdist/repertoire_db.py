@@ -8,6 +8,7 @@ Contains the TCRGene class
 from .paths import path_to_db
 from collections import OrderedDict
 from . import translation
+from . import gene_snapshot
 import pandas as pd
 import os.path as op
 
@@ -63,14 +64,12 @@ class RefGeneSet:
             "alphabeta_db.tsv"
 
         """
-        db_file = op.join(path_to_db, self.db_file)
-        assert op.exists(db_file)
+        assert op.exists(op.join(path_to_db, self.db_file))
 
         all_genes = OrderedDict()
 
-        db_df = pd.read_csv(db_file, delimiter='\t')
-
-        for rowi, row in db_df.iterrows():
+        # rows come from the compiled snapshot of the db (parsed and translated once)
+        for row in gene_snapshot.gene_rows(self.db_file):
             try:
                 g = TCRGene( row )
             except:
@@ -82,6 +81,28 @@ class RefGeneSet:
         return(all_genes)
 
 
+_ref_gene_sets = {}
+
+def get_ref_gene_set(db_file = "alphabeta_db.tsv"):
+    """
+    Process-wide shared RefGeneSet for db_file, so that constructing many
+    TCRrep instances does not rebuild the gene library each time. Callers
+    must not modify the returned genes.
+
+    Parameters
+    ----------
+    db_file : string
+        "alphabeta_db.tsv" or "gammadelta_db.tsv"
+
+    Returns
+    -------
+    ref_gene_set : RefGeneSet
+    """
+    if db_file not in _ref_gene_sets:
+        _ref_gene_sets[db_file] = RefGeneSet(db_file)
+    return _ref_gene_sets[db_file]
+
+
 class TCRGene:
     """
     TCRGene is a class for holding information about a single TCR sequence representative
@@ -146,7 +167,10 @@ class TCRGene:
         self.cdr_columns_str = l['cdr_columns']
         self.frame    = l['frame']
         self.nucseq_offset = self.frame - 1 ## 0, 1 or 2 (0-indexed for python)
-        self.protseq = translation.get_translation( self.nucseq, self.frame )[0]
+        if 'protseq' in l: # precomputed by gene_snapshot
+            self.protseq = l['protseq']
+        else:
+            self.protseq = translation.get_translation( self.nucseq, self.frame )[0]
 
         if pd.isnull(l['cdrs']):
             self.cdrs = []
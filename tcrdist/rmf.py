@@ -1,5 +1,7 @@
 import os
 import sys
+import collections.abc
+import numpy as np
 import pandas as pd
 
 from . import util
@@ -7,6 +9,7 @@ from . import parse_tsv
 from .all_genes import all_genes
 from . import tcr_sampler
 from . import paths
+from . import nextgen_store
 
 def _get_amino_acid_consensus_character( counts ):
     topcount,topaa = max( ( (y,x) for x,y in counts.items() ) )
@@ -438,32 +441,10 @@ def _generate_read_motif_ng_tcrs_dict(chains,
         if not os.path.isfile(ng_logfile):
             raise OSError('WARNING::missing nextgen TCR chains file: {}'.format(ng_logfile))
 
-        counter=0
-        num_chains=0
-        ab_chains = {}
-
-        for line in open(ng_logfile,'r'):
-            counter+=1
-            if max_ng_lines and counter>max_ng_lines:break
-            l = line[:-1].split('\t')
-            if counter==1:
-                assert l==['v_reps','j_reps','cdr3','cdr3_nucseq']
-                continue
-            if not counter % 500000:
-                pass
-                #basic.Log(`counter`+' '+`num_chains`+' '+ng_logfile)
-            v_reps = set( ( util.get_mm1_rep( x, organism ) for x in l[0].split(',') ) ) ## mm1 reps
-            j_reps = l[1].split(',')
-            cdr3,cdr3_nucseq = l[2:4]
-
-            ## now add to the different places
-            for v_rep in v_reps:
-                for j_rep in j_reps:
-                    if v_rep not in ab_chains: ab_chains[v_rep] = {}
-                    if j_rep not in ab_chains[v_rep]: ab_chains[v_rep][j_rep] = []
-                    ab_chains[v_rep][j_rep].append( (cdr3, cdr3_nucseq ))
-
-            num_chains += 1
+        ## compiled once into a memory mapped store, see nextgen_store
+        store = nextgen_store.load_store(ng_logfile, organism)
+        ab_chains = store.tcrs(max_ng_lines)
+        num_chains = store.num_chains(max_ng_lines)
         sys.stdout.write('read {} {}-chains from {}\n'.format(num_chains,chain,ng_logfile))
         ng_tcrs[chain] = ab_chains
     return(ng_tcrs)
@@ -736,23 +717,25 @@ def generate_all_neighbors(clones_file,
     return(all_neighbors)
 
     #
-def generate_all_nbr_from_dataframe(dist_df, nbr_distance = 100.0):
+def generate_all_nbr_from_dataframe(dist_df, nbr_distance = 100.0, block_rows = None):
     """
     Given a distance matrix, return a list of index positions of all neighbors
     within a certain distance.
 
-
-
     Parameters
     ----------
     dist_df : DataFrame
-
-    nbr_distanace : float
+        or np.ndarray, or a scipy.sparse radius matrix such as
+        TCRrep.compute_sparse_tcrdist() returns (see neighbor_csr)
+    nbr_distance : float
+    block_rows : int or None
+        rows compared at a time, see neighbor_csr
 
     Returns
     -------
-    all_nbrs : list
-        list of lists
+    all_nbrs : NeighborLists
+        sequence of lists, the ith list holding the column positions
+        within nbr_distance of row i
 
     Examples
     --------
@@ -760,47 +743,113 @@ def generate_all_nbr_from_dataframe(dist_df, nbr_distance = 100.0):
     ...                   [2,0,3,1],
     ...                   [5,3,0,5],
     ...                   [1,1,5,0]])
-    >>> rmf.generate_all_nbr_from_dataframe(M,2)
-    [0, 1, 3], [0, 1, 3], [2], [0, 1, 3]]
+    >>> generate_all_nbr_from_dataframe(M,2)
+    [[0, 1, 3], [0, 1, 3], [2], [0, 1, 3]]
+    """
+    indptr, indices = neighbor_csr(dist_df, nbr_distance, block_rows = block_rows)
+    return NeighborLists(indptr, indices)
 
 
-    Notes
-    ----
-    Methods for iterating a DataFrame like a flat file
-    replace:
-        for line in open( distfile,'r'):
-    with:
-    option 1
-    x = distA.to_dict("record")
-    for r in x:
-        print(list(r.values()))
-
-    option 2
-    for index, row in distA.iterrows():
-        print(index, row.to_list())
+def neighbor_csr(dist, nbr_distance = 100.0, block_rows = None):
     """
-    N=0
-    all_nbrs = []
-    all_dists = []
-    for ind, row in dist_df.iterrows():
-        l = row.to_list()
-        clone_id = ind
-        index = len(all_dists)
-        #assert tcrs[ index ][-1]['clone_id'] == clone_id
-        dists = [ float(x) for x in l ]
-        if not N:
-            N = len(dists)
-        else:
-            assert N == len(dists)
+    Neighbors within nbr_distance of every row of a distance matrix, in
+    compressed sparse row form
 
-        nbrs = []
-        for ii,d in enumerate(dists):
-            if d <= nbr_distance:
-                nbrs.append( ii )
-        all_dists.append( dists )
-        all_nbrs.append( nbrs )
+    Dense matrices are compared with nbr_distance a block of rows at a time,
+    so neither the matrix nor a full boolean copy of it is ever held as
+    python objects.
 
-    return(all_nbrs)
+    Parameters
+    ----------
+    dist : DataFrame, np.ndarray or scipy.sparse matrix
+        A sparse matrix holds the pairs within some radius, which must be
+        at least nbr_distance; the diagonal, if not stored, counts as
+        distance 0 (as in TCRrep.compute_sparse_tcrdist).
+    nbr_distance : float
+    block_rows : int or None
+        rows compared at a time, by default about 4M matrix entries
+
+    Returns
+    -------
+    indptr : np.ndarray
+        int64, the neighbors of row i are indices[indptr[i]:indptr[i + 1]]
+    indices : np.ndarray
+        int64 column positions, increasing within each row
+    """
+    if hasattr(dist, 'tocsr'):
+        return _sparse_neighbor_csr(dist.tocsr(), nbr_distance)
+    if isinstance(dist, pd.DataFrame):
+        dist = dist.to_numpy()
+    n_rows, n_cols = dist.shape
+    if block_rows is None:
+        block_rows = max(1, (1 << 22) // max(1, n_cols))
+    counts = np.zeros(n_rows, dtype = np.int64)
+    all_indices = [np.zeros(0, dtype = np.int64)]
+    for r0 in range(0, n_rows, block_rows):
+        r1 = min(n_rows, r0 + block_rows)
+        i, j = np.nonzero(np.asarray(dist[r0:r1], dtype = np.float64) <= nbr_distance)
+        counts[r0:r1] = np.bincount(i, minlength = r1 - r0)
+        all_indices.append(j.astype(np.int64))
+    indptr = np.zeros(n_rows + 1, dtype = np.int64)
+    np.cumsum(counts, out = indptr[1:])
+    return indptr, np.concatenate(all_indices)
+
+
+def _sparse_neighbor_csr(S, nbr_distance):
+    n_rows, n_cols = S.shape
+    rows = np.repeat(np.arange(n_rows, dtype = np.int64), np.diff(S.indptr))
+    cols = S.indices.astype(np.int64)
+    keep = S.data <= nbr_distance
+    if nbr_distance >= 0:
+        # a diagonal entry that is not stored is distance 0
+        diag = np.arange(min(n_rows, n_cols), dtype = np.int64)
+        stored = np.zeros(len(diag), dtype = bool)
+        stored[rows[rows == cols]] = True
+        rows = np.concatenate([rows[keep], diag[~stored]])
+        cols = np.concatenate([cols[keep], diag[~stored]])
+    else:
+        rows, cols = rows[keep], cols[keep]
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_rows + 1, dtype = np.int64)
+    np.cumsum(np.bincount(rows, minlength = n_rows), out = indptr[1:])
+    return indptr, cols[order]
+
+
+class NeighborLists(collections.abc.Sequence):
+    """
+    Neighbor lists in compressed sparse row form, read as a list of lists
+
+    Parameters
+    ----------
+    indptr : np.ndarray
+        the neighbors of i are indices[indptr[i]:indptr[i + 1]]
+    indices : np.ndarray
+    """
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('NeighborLists index out of range')
+        return self.indices[self.indptr[i]:self.indptr[i + 1]].tolist()
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Sequence):
+            return len(self) == len(other) and all(a == list(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 ## make a v-gene logo
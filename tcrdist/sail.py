@@ -1,4 +1,6 @@
 
+import collections
+
 import numpy as np
 import parasail as ps
 
@@ -312,6 +314,55 @@ def _evalues_score_gap_tuple(ranked_scores):
     return(r)
 
 
+def _parasail_match(query_seq, hit_id, hit_seq, h_strand, result):
+    """
+    ParasailMatch for the alignment of query_seq to hit_seq
+
+    :param query_seq: string query sequence
+    :param hit_id: string id of the reference gene
+    :param hit_seq: string reference sequence, reverse complemented if h_strand is -1
+    :param h_strand: integer (1 or -1)
+    :param result: parasail result of a traceback alignment (e.g. ps.sw_trace) of query_seq and hit_seq
+    :return: ParasailMatch instance
+    """
+    result.get_traceback()
+    q_seq = result._traceback.query
+    h_seq = result._traceback.ref
+    comp  = result._traceback.comp
+    q_start = _q_start(q_seq=q_seq, query_seq=query_seq)
+    h_start = _h_start(h_seq=h_seq, hit_seq=hit_seq, h_strand=h_strand)
+    h_stop  = _h_stop(h_seq=h_seq, hit_seq=hit_seq, h_strand=h_strand)
+
+    # add q2hmap for the highest scoring alignment
+    q2hmap = _create_q2hmap(q_seq=q_seq,
+                            h_seq=h_seq,
+                            q_start=q_start,
+                            h_start=h_start,
+                            q_strand=1,
+                            h_strand=h_strand)
+
+    phony_evalue_must_update_function = _evalue_aproximation(result.score)
+
+    # bm2 is going to replace teh BlastMatch instance passed by parse_blast_alignments()
+    bm2 = ParasailMatch(query_id="tmp",
+                        hit_id=hit_id)
+    bm2.evalue = phony_evalue_must_update_function #! SHOULD UPDATE
+    bm2.identities = _identities(comp)        # percent identities out of 100
+    bm2.h_start    = h_start                  # 0-indexed
+    bm2.h_stop     = h_stop
+    bm2.h_strand   = h_strand
+    bm2.h_align    = h_seq
+    bm2.q_start    = h_start
+    bm2.q_stop     = h_stop
+    bm2.q_strand   = 1
+    bm2.q_align    = q_seq
+    bm2.middleseq  = comp
+    bm2.q2hmap     = q2hmap                    # q2hmap ## 0-indexed numbering wrt to fullseq
+    bm2.valid      = "True"                    # valid IF WHAT?
+    bm2.frame      = 'NA'
+    return(bm2)
+
+
 def _get_hit_parasail(vj,
                       all_genes,
                       organism,
@@ -371,59 +422,159 @@ def _get_hit_parasail(vj,
     scores = sorted(scores, key=lambda x: x['score'], reverse=True)
     id_score_evalue = [(s['hit_id'], s['score'], _evalue_aproximation(s['score'])) for s in scores]
 
-    # add alignment start positions for the highest scoring alignment
-    scores[0]["parasail_result"].get_traceback()
-    scores[0]["q_seq"]   = scores[0]["parasail_result"]._traceback.query
-    scores[0]["h_seq"]   = scores[0]["parasail_result"]._traceback.ref
-    scores[0]["comp"]    = scores[0]["parasail_result"]._traceback.comp
-    scores[0]["q_start"] = _q_start(q_seq=scores[0]["q_seq"],
-                                    query_seq=blast_seq)
-
-    scores[0]["q_stop"]  = _q_stop(q_seq=scores[0]["q_seq"],
-                                   query_seq=blast_seq)
-
-    scores[0]["h_start"] = _h_start(h_seq=scores[0]["h_seq"],
-                                    hit_seq=scores[0]["hit_seq"],
-                                    h_strand=scores[0]["h_strand"])
-
-    scores[0]["h_stop"]  = _h_stop(h_seq=scores[0]["h_seq"],
-                                   hit_seq=scores[0]["hit_seq"],
-                                   h_strand=scores[0]["h_strand"])
-
-    scores[0]["identities"] = _identities(scores[0]["comp"])
-
-    # add q2hmap for the highest scoring alignment
-    q2hmap = _create_q2hmap(q_seq=scores[0]["q_seq"],
-                            h_seq=scores[0]["h_seq"],
-                            q_start=scores[0]['q_start'],
-                            h_start=scores[0]['h_start'],
-                            q_strand=scores[0]['q_strand'],
-                            h_strand=scores[0]['h_strand'])
-
-    phony_evalue_must_update_function = _evalue_aproximation(scores[0]['score'])
-
-    # bm2 is going to replace teh BlastMatch instance passed by parse_blast_alignments()
-    # we only produce it for the top scoring hit scores[0], but the code is written,
-    # so that we could produce ParasailMatches in a loop
-    bm2 = ParasailMatch(query_id="tmp",
-                        hit_id=scores[0]['hit_id'])
-    bm2.evalue = phony_evalue_must_update_function #! SHOULD UPDATE
-    bm2.identities = scores[0]["identities"]  # percent identities out of 100
-    bm2.h_start    = scores[0]['h_start']     # 0-indexed
-    bm2.h_stop     = scores[0]['h_stop']
-    bm2.h_strand   = scores[0]['h_strand']
-    bm2.h_align    = scores[0]['h_seq']
-    bm2.q_start    = scores[0]['h_start']
-    bm2.q_stop     = scores[0]['h_stop']
-    bm2.q_strand   = scores[0]['q_strand']
-    bm2.q_align    = scores[0]['q_seq']
-    bm2.middleseq  = scores[0]['comp']
-    bm2.q2hmap     = q2hmap                    # q2hmap ## 0-indexed numbering wrt to fullseq
-    bm2.valid      = "True"                    # valid IF WHAT?
-    bm2.frame      = 'NA'
+    bm2 = _parasail_match(query_seq = blast_seq,
+                          hit_id = scores[0]['hit_id'],
+                          hit_seq = scores[0]['hit_seq'],
+                          h_strand = scores[0]['h_strand'],
+                          result = scores[0]['parasail_result'])
 
     # results are meant to mimic the outputs in prior functions from blast version:
         # hits = parse_blast_alignments( blast_tmpfile+'.blast', evalue_threshold, identity_threshold )
         # hits_scores = get_all_hits_with_evalues_and_scores( blast_tmpfile+'.blast' ) ## id,bitscore,evalue
     results = {"hits" : {"tmp": bm2}, "hits_scores" : id_score_evalue}
     return(results)
+
+
+_gene_assigners = {}
+
+class GeneAssigner:
+    """
+    V or J gene assignment of reads for one organism and chain, returning
+    the same results as _get_hit_parasail() with less work per read:
+
+    * references are scored with a score only striped Smith-Waterman
+      alignment against a profile of the read, built once per read;
+    * only the top scoring reference is aligned again with traceback;
+    * results are kept for the last cache_size distinct reads;
+    * optionally (k), only references sharing a k-mer with the read
+      (on either strand) are aligned at all.
+
+    Without k the hits and scores are exactly those of _get_hit_parasail().
+    With k the top hit is the same for any read that shares a k-mer with
+    it, but references sharing no k-mer are left out of "hits_scores"
+    (and hence of the good hits). If no reference shares a k-mer with the
+    read, all of them are aligned.
+
+    Parameters
+    ----------
+    organism : string
+        'human' or 'mouse'
+    ab : string
+        chain, e.g. 'A' or 'B'
+    vj : string
+        'V' or 'J'
+    all_genes : dict
+        all_genes[organism][id] -> TCR_Gene
+    k : int or None
+        k-mer length of the prefilter, None for no prefilter
+    cache_size : int
+        number of reads whose results are kept
+
+    Examples
+    --------
+    >>> ga = get_gene_assigner('human', 'B', 'J', all_genes)
+    >>> ga.get_hit(blast_seq)['hits']['tmp'].hit_id
+    'TRBJ2-7*01'
+    """
+    def __init__(self, organism, ab, vj, all_genes, k = None, cache_size = 100000):
+        ids = _get_ids_by_org_chain_region(organism=organism,
+                                           chain=ab,
+                                           region=vj,
+                                           d=all_genes)
+        # (id, hit_seq, strand) in the order _get_hit_parasail() aligns them,
+        # so that ties are ranked the same way
+        self.seqs = _get_sequence_tuples_from_ids(ids=ids,
+                                                  organism=organism,
+                                                  d=all_genes)
+        self._encoded = [seq.encode() for id, seq, strand in self.seqs]
+        self.matrix = ps.matrix_create("ACGT", 1, -3)
+        self.k = k
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._index = {}
+        if k is not None:
+            for i, (id, seq, strand) in enumerate(self.seqs):
+                for kmer in _kmers(seq, k):
+                    self._index.setdefault(kmer, []).append(i)
+
+    def candidates(self, blast_seq):
+        """
+        indices into self.seqs of the references to align to blast_seq
+        """
+        if self.k is None:
+            return list(range(len(self.seqs)))
+        hit = set()
+        for kmer in _kmers(blast_seq, self.k):
+            hit.update(self._index.get(kmer, ()))
+        if not hit:
+            return list(range(len(self.seqs)))
+        return sorted(hit)
+
+    def get_hit(self, blast_seq):
+        """
+        Parameters
+        ----------
+        blast_seq : string
+            nucleotide sequence of the read
+
+        Returns
+        -------
+        results : dict
+            {"hits" : {"tmp": ParasailMatch}, "hits_scores" : [(id,score,evalue),...]}
+            as returned by _get_hit_parasail()
+        """
+        if blast_seq in self._cache:
+            self._cache.move_to_end(blast_seq)
+            return self._cache[blast_seq]
+        profile = ps.profile_create_16(blast_seq, self.matrix)
+        scores = [(ps.sw_striped_profile_16(profile, self._encoded[i], 5, 2).score, i)
+                  for i in self.candidates(blast_seq)]
+        # sorted is stable, ties keep the order of self.seqs
+        scores = sorted(scores, key=lambda x: x[0], reverse=True)
+        evalues = {score: _evalue_aproximation(score) for score in set(x[0] for x in scores)}
+        id_score_evalue = [(self.seqs[i][0], score, evalues[score]) for score, i in scores]
+
+        hit_id, hit_seq, h_strand = self.seqs[scores[0][1]]
+        top = ps.sw_trace(s1=blast_seq, s2=hit_seq, extend=2, open=5, matrix=self.matrix)
+        bm2 = _parasail_match(query_seq=blast_seq,
+                              hit_id=hit_id,
+                              hit_seq=hit_seq,
+                              h_strand=h_strand,
+                              result=top)
+        results = {"hits" : {"tmp": bm2}, "hits_scores" : id_score_evalue}
+
+        self._cache[blast_seq] = results
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last = False)
+        return(results)
+
+
+def _kmers(seq, k):
+    """
+    set of the (lower case) k-mers of seq
+    """
+    seq = seq.lower()
+    return {seq[i:i+k] for i in range(len(seq) - k + 1)}
+
+
+def get_gene_assigner(organism, ab, vj, all_genes, k = None):
+    """
+    GeneAssigner for organism, ab and vj, shared by all calls in a process
+
+    Parameters
+    ----------
+    organism : string
+    ab : string
+    vj : string
+    all_genes : dict
+    k : int or None
+        k-mer length of the prefilter, None for no prefilter
+
+    Returns
+    -------
+    GeneAssigner
+    """
+    key = (organism, ab, vj, id(all_genes), k)
+    if key not in _gene_assigners:
+        _gene_assigners[key] = GeneAssigner(organism, ab, vj, all_genes, k = k)
+    return _gene_assigners[key]
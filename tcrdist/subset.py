@@ -13,7 +13,6 @@ from . import basic
 from . import logo_tools
 from . import mappers
 from . import paths
-from . import random
 from . import rmf
 from . import svg_basic
 from . import tcr_sampler
@@ -112,11 +111,16 @@ class TCRsubset():
         return mappers.generic_pandas_mapper(self.clone_df,
                                              mappers.TCRsubset_clone_df_to_TCRMotif_clone_df)
 
-    def find_motif(self):
+    def find_motif(self, processes = 1):
         """
         Create a TCRMotif_instance using subset organism, chains, and epitopes.
         runs TCRMotif.find_motif. Warning this can take 5-10 minutes per chain.
 
+        Parameters
+        ----------
+        processes : int
+            number of processes searching the motifs, see TCRMotif
+
         Returns
         -------
         motif_df : DataFrame
@@ -125,6 +129,7 @@ class TCRsubset():
                                       organism = self.organism,
                                       chains = self.chains,
                                       epitopes = self.epitopes)
+        TCRMotif_instance.processes = processes
         print("SEARCHING FOR MOTIFS, THIS CAN TAKE 5-10 minutes")
         TCRMotif_instance.find_cdr3_motifs()
         motif_df = TCRMotif_instance.motif_df.copy()
@@ -436,6 +441,7 @@ class TCRsubset():
             containing list of lists for each position i in the list,
             the ith list contains the index position of the tcrs
             within (nbr_dist) distance from the ith tcr
+            (rmf.NeighborLists, stored in compressed sparse row form)
 
         Assigns
         -------
@@ -473,7 +479,7 @@ class TCRsubset():
             else:
                 raise OSError("{} not loaded".format(dist_name))
 
-            # produces list of lists [[],[],...], length must equal dimensions of dist_df
+            # produces list of lists [[],[],...] (rmf.NeighborLists), length must equal dimensions of dist_df
             all_nbr = rmf.generate_all_nbr_from_dataframe(dist_df = dist_df, nbr_distance = nbr_dist)
 
             assert len(all_nbr) == dist_df.shape[0]
@@ -265,8 +265,37 @@ def weighted_cdr3_distance( seq1, seq2, params ):
     ##
     return  params.weight_cdr3_region * best_dist + lendiff * params.gap_penalty_cdr3_region
 
-def compute_all_v_region_distances(organism, params):
+def compute_all_v_region_distances(organism, params, use_cache = True):
+    """
+    Distance between the merged CDR1, CDR2 and CDR2.5 loops of every pair of
+    V genes (within each chain) of organism
+
+    Parameters
+    ----------
+    organism : string
+        "human" or "mouse"
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    use_cache : boolean
+        if True the tables are read from (or written to) the on-disk cache
+        managed by v_region_cache.py instead of being recomputed
+
+    Returns
+    -------
+    rep_dists : dict
+        nested dictionary rep_dists[id1][id2] of distances
+    """
     rep_dists = {}
+    if use_cache:
+        from . import v_region_cache
+        tables = v_region_cache.load_v_region_tables(organism, params)
+        for chain in 'AB':
+            ids, dists = tables[chain]
+            ids = ids.tolist()
+            for id, row in zip(ids, np.asarray(dists).tolist()):
+                rep_dists[id] = dict(zip(ids, row))
+        return rep_dists
+
     for chain in 'AB': # don't compute inter-chain distances
         repseqs = []
         for id, g in all_genes[organism].items():
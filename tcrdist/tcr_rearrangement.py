@@ -1,12 +1,14 @@
 import numpy as np
 import sys
+import types
 import os.path as op
 from operator import add
 import logging
 from glob import glob
 
-from .all_genes import all_genes
+from .all_genes import all_genes, db_file
 from .paths import path_to_current_db_files
+from .db_cache import LazyDict, load_cached
 from functools import reduce
 
 
@@ -197,19 +199,24 @@ def _process_probs_from_files():
 
     return all_trim_probs, all_trbd_nucseq, all_countrep_pseudoprobs, organism_chains_with_missing_probs
 
-"""Running this during package import seems like a mistake. Should wait until the processing module is specifically imported?"""
-all_trim_probs = {}
-all_countrep_pseudoprobs = {}
-all_trbd_nucseq = {}
-organism_chains_with_missing_probs = []
-
-try:
-    all_trim_probs, all_trbd_nucseq, all_countrep_pseudoprobs, organism_chains_with_missing_probs = _process_probs_from_files()
-except:
-    logger.warning('Unable to load db with tcr probs')
+def _load_probs():
+    try:
+        probs_files = glob(op.join(path_to_current_db_files(), 'probs_files_*', '*.txt'))
+        return load_cached( 'tcr_rearrangement', [db_file] + probs_files, _process_probs_from_files )
+    except ( OSError, ValueError, KeyError, IndexError, AssertionError, ZeroDivisionError ) as e:
+        ## missing, unreadable or malformed probs files
+        logger.warning('Unable to load db with tcr probs: {}'.format( e ))
+        return {}, {}, {}, []
+
+## built on first access (not at package import), and cached on disk across processes (see db_cache)
+_probs = LazyDict( lambda : dict( zip( [ 'all_trim_probs', 'all_trbd_nucseq', 'all_countrep_pseudoprobs',
+                                         'organism_chains_with_missing_probs' ], _load_probs() ) ) )
+all_trim_probs = LazyDict( lambda : _probs['all_trim_probs'] )
+all_countrep_pseudoprobs = LazyDict( lambda : _probs['all_countrep_pseudoprobs'] )
+all_trbd_nucseq = LazyDict( lambda : _probs['all_trbd_nucseq'] )
 
 def get_alpha_trim_probs( organism, v_trim, j_trim, vj_insert ):
-    if (organism, 'A') in organism_chains_with_missing_probs:
+    if (organism, 'A') in _probs['organism_chains_with_missing_probs']:
         return 1.0
     total_prob = 1.0
     for ( val, tag ) in zip( [v_trim, j_trim, vj_insert], ['A_v_trim', 'A_j_trim', 'A_vj_insert'] ):
@@ -220,7 +227,7 @@ def get_alpha_trim_probs( organism, v_trim, j_trim, vj_insert ):
     return total_prob
 
 def get_beta_trim_probs( organism, d_id, v_trim, d0_trim, d1_trim, j_trim, vd_insert, dj_insert ): ## work in progress
-    if (organism, 'B') in organism_chains_with_missing_probs:
+    if (organism, 'B') in _probs['organism_chains_with_missing_probs']:
         return 1.0
     assert d_id in all_trbd_nucseq[organism]
     dd = (d0_trim, d1_trim)
@@ -234,3 +241,12 @@ def get_beta_trim_probs( organism, d_id, v_trim, d0_trim, d1_trim, j_trim, vd_in
             return 0.0
         total_prob *= probs[val]
     return total_prob
+
+class _TCRRearrangementModule( types.ModuleType ):
+    ## organism_chains_with_missing_probs used to be a module level list
+    ## (a property of the module class, as a module level __getattr__ needs python 3.7)
+    @property
+    def organism_chains_with_missing_probs( self ):
+        return _probs[ 'organism_chains_with_missing_probs' ]
+
+sys.modules[ __name__ ].__class__ = _TCRRearrangementModule
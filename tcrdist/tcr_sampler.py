@@ -1,6 +1,7 @@
 import sys
 import logging
 import random
+import numpy as np
 
 from . import translation
 from . import cdr3s_human #debug
@@ -843,19 +844,298 @@ def sample_beta_sequences( organism, nsamples, v_gene, j_gene, force_aa_length =
         nsampled += 1
     return seqs
 
+## vectorized samplers #################################################################################
+
+_bases = np.frombuffer( b'acgt', dtype=np.uint8 )
+_base_codes = np.full( 256, 255, dtype=np.uint8 )
+_base_codes[ _bases ] = np.arange( 4 )
+_codon_aas = np.frombuffer( ''.join( genetic_code[ a+b+c ] for a in 'acgt' for b in 'acgt' for c in 'acgt' ).encode(),
+                            dtype=np.uint8 )
+_sampling_tables = {}
+
+def setup_sampling_arrays( organism, tag ):
+    """
+    Cumulative probability array and key array for trim_probs[tag], cached per (organism, tag)
+
+    Returns
+    -------
+    cum_probs : np.ndarray
+    keys : np.ndarray
+        1D for trim/insert counts, 2D (n, 2) for the beta d0/d1 trim pairs
+    """
+    key = ( organism, tag )
+    if key not in _sampling_tables:
+        probs = tcr_rearrangement.all_trim_probs[ organism ][ tag ]
+        cum_probs = np.cumsum( np.array( list( probs.values() ), dtype=float ) )
+        assert abs( 1-cum_probs[-1] )<1e-3 ## since we normalized already...
+        _sampling_tables[ key ] = ( cum_probs, np.array( list( probs.keys() ), dtype=int ) )
+    return _sampling_tables[ key ]
+
+def sample_from_sampling_arrays( arrays, rng, n ):
+    """
+    n independent draws from the distribution given by setup_sampling_arrays, the
+    vectorized equivalent of sample_from_random_sampling_list
+    """
+    cum_probs, keys = arrays
+    ix = np.minimum( np.searchsorted( cum_probs, rng.random_sample( n ) ), len(cum_probs)-1 )
+    return keys[ ix ]
+
+def _nuc_codes( nucseq ):
+    return _base_codes[ np.frombuffer( nucseq.encode(), dtype=np.uint8 ) ]
+
+def _assemble_cdr3s( segments, nsamples, no_stop_codons, include_annotation ):
+    """
+    Concatenate per-row segments into cdr3 nucleotide sequences, translate them, and
+    return the ( cdr3_nucseq, protseq [, cdr3_annotation] ) tuples for at most nsamples
+    rows without stop codons (if no_stop_codons). Every row must be in frame.
+
+    segments is a list of ( letter, codes, rows, starts, lengths ) where letter is the
+    annotation character ('V', 'N', 'D' or 'J'), codes is a 2D uint8 array of base codes
+    and row i of the segment is codes[ rows[i], starts[i]:starts[i]+lengths[i] ]
+    """
+    lengths = np.stack( [ x[4] for x in segments ], axis=1 )
+    if len(lengths) == 0:
+        return []
+    ends = np.cumsum( lengths, axis=1 )
+    total = ends[:,-1]
+    L = total.max()
+    pos = np.arange( L )
+    seg = np.zeros( ( len(total), L ), dtype=np.intp )
+    for k in range( len(segments)-1 ):
+        seg += pos[None,:] >= ends[:,k,None]
+
+    ## all sources flattened into one buffer, so that every base is a single gather
+    buf = np.concatenate( [ x[1].ravel() for x in segments ] )
+    buf_starts = np.cumsum( [0] + [ x[1].size for x in segments[:-1] ] )
+    offsets = np.stack( [ buf_start + rows*src.shape[1] + starts - ( ends[:,k] - seg_lengths )
+                          for k, ( buf_start, ( letter, src, rows, starts, seg_lengths ) )
+                          in enumerate( zip( buf_starts, segments ) ) ], axis=1 )
+    flat = np.take_along_axis( offsets, seg, axis=1 ) + pos[None,:]
+    in_seq = pos[None,:] < total[:,None]
+    codes = buf[ np.where( in_seq, flat, 0 ) ]
+
+    codons = codes[:, :L - L%3 ].reshape( len(total), -1, 3 ).astype( np.intp )
+    aas = _codon_aas[ 16*codons[:,:,0] + 4*codons[:,:,1] + codons[:,:,2] ]
+    aas[ ~in_seq[:, 2::3] ] = 0
+    keep = np.ones( len(total), dtype=bool )
+    if no_stop_codons:
+        keep = ~np.any( aas == ord('*'), axis=1 )
+    keep[ np.cumsum( keep ) > nsamples ] = False
+
+    nucseqs = np.where( in_seq, _bases[ codes ], 0 )[ keep ]
+    columns = [ np.ascontiguousarray( nucseqs ).view( 'S{}'.format( L ) )[:,0].astype( str ).tolist(),
+                np.ascontiguousarray( aas[ keep ] ).view( 'S{}'.format( aas.shape[1] ) )[:,0].astype( str ).tolist() ]
+    if include_annotation:
+        letters = np.frombuffer( ''.join( x[0] for x in segments ).encode(), dtype=np.uint8 )
+        annotations = np.where( in_seq, letters[ seg ], 0 )[ keep ]
+        columns.append( np.ascontiguousarray( annotations ).view( 'S{}'.format( L ) )[:,0].astype( str ).tolist() )
+    return list( zip( *columns ) )
+
+def _next_batch_size( nsamples, nsampled, ntries, max_tries ):
+    """
+    number of candidates to draw next, sized from the acceptance rate seen so far
+    """
+    needed = nsamples - nsampled
+    rate = max( nsampled, 1 ) / float( ntries ) if ntries else 0.05
+    return int( min( max_tries - ntries, 100000, max( 1000, 1.5 * needed / rate ) ) )
+
+def _candidates( mask, needed ):
+    """
+    indices of the first candidates passing mask, enough to give needed sequences after
+    stop codon filtering in most cases, and the number of draws they used up
+    """
+    ix = np.nonzero( mask )[0]
+    if len(ix) > 2*needed + 100:
+        ix = ix[ :2*needed + 100 ]
+        return ix, ix[-1] + 1
+    return ix, len(mask)
+
+def _default_rng( seed ):
+    ## seeded from the random module by default, so that random.seed() still makes runs reproducible
+    ## (RandomState rather than default_rng, which needs numpy >= 1.17)
+    return np.random.RandomState( random.getrandbits( 32 ) if seed is None else seed )
+
+def sample_alpha_sequences_batch( organism, nsamples, v_gene, j_gene, force_aa_length = 0,
+                                  in_frame_only = True, no_stop_codons = True,
+                                  max_tries = 100000000,
+                                  include_annotation = False,
+                                  seed = None ):
+    """
+    Vectorized version of sample_alpha_sequences: trims and inserts are drawn for whole
+    batches of candidate rearrangements and filtered with array operations.
+
+    Parameters
+    ----------
+    organism : str
+    nsamples : int
+    v_gene : str
+    j_gene : str
+    force_aa_length : int
+        if non-zero, only keep cdr3s of this many amino acids
+    in_frame_only : bool
+    no_stop_codons : bool
+    max_tries : int
+        maximum number of candidate rearrangements drawn
+    include_annotation : bool
+        add a 'V'/'N'/'J' string giving the source of each cdr3 base
+    seed : int or None
+        seed of the numpy RandomState; by default the seed is drawn from the random module
+
+    Returns
+    -------
+    seqs : list
+        list of ( cdr3_nucseq, protseq ) or ( cdr3_nucseq, protseq, cdr3_annotation ) tuples,
+        as returned by sample_alpha_sequences
+    """
+    rng = _default_rng( seed )
+
+    v_codes = _nuc_codes( get_v_cdr3_nucseq( organism, v_gene ) )[None,:]
+    j_codes = _nuc_codes( get_j_cdr3_nucseq( organism, j_gene ) )[None,:]
+    v_nucseq_len = v_codes.shape[1]
+    j_nucseq_len = j_codes.shape[1]
+
+    max_v_trim = min( 15, v_nucseq_len -3 )
+    max_j_trim = min( 15, j_nucseq_len -3 )
+
+    v_trim_arrays = setup_sampling_arrays( organism, 'A_v_trim' )
+    j_trim_arrays = setup_sampling_arrays( organism, 'A_j_trim' )
+    vj_insert_arrays = setup_sampling_arrays( organism, 'A_vj_insert' )
+
+    seqs = []
+    ntries = 0
+    while len(seqs) < nsamples and ntries < max_tries:
+        n = _next_batch_size( nsamples, len(seqs), ntries, max_tries )
+        vtrim = sample_from_sampling_arrays( v_trim_arrays, rng, n )
+        jtrim = sample_from_sampling_arrays( j_trim_arrays, rng, n )
+        n_insert = sample_from_sampling_arrays( vj_insert_arrays, rng, n )
+
+        cdr3_len = v_nucseq_len + j_nucseq_len + n_insert - ( vtrim + jtrim )
+        mask = ( vtrim <= max_v_trim ) & ( jtrim <= max_j_trim )
+        if in_frame_only: mask &= cdr3_len%3 == 0
+        if force_aa_length: mask &= cdr3_len//3 == force_aa_length
+        ix, n_used = _candidates( mask, nsamples - len(seqs) )
+        ntries += n_used
+        vtrim, jtrim, n_insert = vtrim[ix], jtrim[ix], n_insert[ix]
+        m = len(vtrim)
+        zeros = np.zeros( m, dtype=int )
+
+        inserts = rng.randint( 0, 4, ( m, max( 1, n_insert.max( initial=0 ) ) ), dtype=np.uint8 )
+        segments = [ ( 'V', v_codes, zeros, zeros, v_nucseq_len - vtrim ),
+                     ( 'N', inserts, np.arange( m ), zeros, n_insert ),
+                     ( 'J', j_codes, zeros, jtrim, j_nucseq_len - jtrim ) ]
+        seqs.extend( _assemble_cdr3s( segments, nsamples - len(seqs), no_stop_codons, include_annotation ) )
+        logger.debug('sample_alpha_sequences_batch: ntries: {} {} {} {} force_aa_length {}'.format(ntries,
+                                                                                                  len(seqs), v_gene,
+                                                                                                  j_gene, force_aa_length))
+    return seqs
+
+def sample_beta_sequences_batch( organism, nsamples, v_gene, j_gene, force_aa_length = 0,
+                                 in_frame_only = True,
+                                 no_stop_codons = True,
+                                 max_dj_insert = 10,
+                                 max_tries = 100000000,
+                                 include_annotation = False,
+                                 seed = None ):
+    """
+    Vectorized version of sample_beta_sequences, see sample_alpha_sequences_batch.
+
+    Returns
+    -------
+    seqs : list
+        list of ( cdr3_nucseq, protseq ) or ( cdr3_nucseq, protseq, cdr3_annotation ) tuples,
+        as returned by sample_beta_sequences
+    """
+    rng = _default_rng( seed )
+
+    v_codes = _nuc_codes( get_v_cdr3_nucseq( organism, v_gene ) )[None,:]
+    j_codes = _nuc_codes( get_j_cdr3_nucseq( organism, j_gene ) )[None,:]
+    v_nucseq_len = v_codes.shape[1]
+    j_nucseq_len = j_codes.shape[1]
+
+    max_v_trim = min( 15, v_nucseq_len -3 )
+    max_j_trim = min( 15, j_nucseq_len -3 )
+
+    v_trim_arrays = setup_sampling_arrays( organism, 'B_v_trim' )
+    j_trim_arrays = setup_sampling_arrays( organism, 'B_j_trim' )
+    vd_insert_arrays = setup_sampling_arrays( organism, 'B_vd_insert' )
+    dj_insert_arrays = setup_sampling_arrays( organism, 'B_dj_insert' )
+
+    dids = list(tcr_rearrangement.all_trbd_nucseq[organism].keys())
+    d_nucseqs = [ tcr_rearrangement.all_trbd_nucseq[organism][x] for x in dids ]
+    d_nucseq_lens = np.array( [ len(x) for x in d_nucseqs ] )
+    d_codes = np.zeros( ( len(dids), d_nucseq_lens.max() ), dtype=np.uint8 )
+    for i, x in enumerate( d_nucseqs ):
+        d_codes[ i, :len(x) ] = _nuc_codes( x )
+    d_trim_arrays = [ setup_sampling_arrays( organism, 'B_D{}_d01_trim'.format(x) ) for x in dids ]
+
+    jno = int( j_gene[4] )
+    assert jno in [1, 2]
+    if jno == 1:
+        allowed_dgenes = np.array( [ dids.index(1) ] )
+    else:
+        allowed_dgenes = np.arange( len(dids) )
+
+    seqs = []
+    ntries = 0
+    while len(seqs) < nsamples and ntries < max_tries:
+        n = _next_batch_size( nsamples, len(seqs), ntries, max_tries )
+        ## pick d segment
+        d_ix = allowed_dgenes[ rng.randint( 0, len(allowed_dgenes), n ) ]
+        d_nucseq_len = d_nucseq_lens[ d_ix ]
+
+        vtrim = sample_from_sampling_arrays( v_trim_arrays, rng, n )
+        jtrim = sample_from_sampling_arrays( j_trim_arrays, rng, n )
+        n_vd_insert = sample_from_sampling_arrays( vd_insert_arrays, rng, n )
+        n_dj_insert = sample_from_sampling_arrays( dj_insert_arrays, rng, n )
+        d01_trim = np.zeros( ( n, 2 ), dtype=int )
+        for i in np.unique( d_ix ):
+            rows = d_ix == i
+            d01_trim[ rows ] = sample_from_sampling_arrays( d_trim_arrays[i], rng, rows.sum() )
+        n_d0_trim, n_d1_trim = d01_trim[:,0], d01_trim[:,1]
+
+        cdr3_len = v_nucseq_len + j_nucseq_len + d_nucseq_len + n_vd_insert + n_dj_insert - \
+                   ( vtrim+jtrim+n_d0_trim+n_d1_trim )
+        mask = ( n_dj_insert <= max_dj_insert ) & ( vtrim <= max_v_trim ) & ( jtrim <= max_j_trim ) & \
+               ( n_d0_trim + n_d1_trim <= d_nucseq_len )
+        if in_frame_only: mask &= cdr3_len%3 == 0
+        if force_aa_length: mask &= cdr3_len//3 == force_aa_length
+        ix, n_used = _candidates( mask, nsamples - len(seqs) )
+        ntries += n_used
+        d_ix, vtrim, jtrim, n_vd_insert, n_dj_insert, n_d0_trim, n_d1_trim, d_nucseq_len = \
+            [ x[ix] for x in ( d_ix, vtrim, jtrim, n_vd_insert, n_dj_insert, n_d0_trim, n_d1_trim, d_nucseq_len ) ]
+        m = len(vtrim)
+        zeros = np.zeros( m, dtype=int )
+
+        vd_inserts = rng.randint( 0, 4, ( m, max( 1, n_vd_insert.max( initial=0 ) ) ), dtype=np.uint8 )
+        dj_inserts = rng.randint( 0, 4, ( m, max( 1, n_dj_insert.max( initial=0 ) ) ), dtype=np.uint8 )
+        segments = [ ( 'V', v_codes, zeros, zeros, v_nucseq_len - vtrim ),
+                     ( 'N', vd_inserts, np.arange( m ), zeros, n_vd_insert ),
+                     ( 'D', d_codes, d_ix, n_d0_trim, d_nucseq_len - n_d0_trim - n_d1_trim ),
+                     ( 'N', dj_inserts, np.arange( m ), zeros, n_dj_insert ),
+                     ( 'J', j_codes, zeros, jtrim, j_nucseq_len - jtrim ) ]
+        seqs.extend( _assemble_cdr3s( segments, nsamples - len(seqs), no_stop_codons, include_annotation ) )
+        logger.debug('sample_beta_sequences_batch: ntries: {} {} {} {} force_aa_length {}'.format(ntries,
+                                                                                                 len(seqs), v_gene,
+                                                                                                 j_gene, force_aa_length))
+    return seqs
+
 def sample_tcr_sequences( organism, nsamples, v_gene, j_gene,
                           force_aa_length = 0,
                           in_frame_only = True,
                           no_stop_codons = True,
                           max_tries = 100000000,
-                          include_annotation = False ):
+                          include_annotation = False,
+                          vectorized = True,
+                          seed = None ):
+    ## vectorized = False runs the original tcrdist1 per-draw sampler (seed is then ignored)
     ab = all_genes[organism][v_gene].chain
     assert ab in 'AB'
-    if ab == 'A':
-        return sample_alpha_sequences( organism, nsamples, v_gene, j_gene, force_aa_length = force_aa_length,
-                                       in_frame_only = in_frame_only, no_stop_codons = no_stop_codons,
-                                       max_tries = max_tries, include_annotation = include_annotation )
+    kwargs = dict( force_aa_length = force_aa_length, in_frame_only = in_frame_only,
+                   no_stop_codons = no_stop_codons, max_tries = max_tries,
+                   include_annotation = include_annotation )
+    if vectorized:
+        sampler = sample_alpha_sequences_batch if ab == 'A' else sample_beta_sequences_batch
+        kwargs['seed'] = seed
     else:
-        return sample_beta_sequences( organism, nsamples, v_gene, j_gene, force_aa_length = force_aa_length,
-                                      in_frame_only = in_frame_only, no_stop_codons = no_stop_codons,
-                                      max_tries = max_tries, include_annotation = include_annotation )
+        sampler = sample_alpha_sequences if ab == 'A' else sample_beta_sequences
+    return sampler( organism, nsamples, v_gene, j_gene, **kwargs )
@@ -0,0 +1,103 @@
+import os
+import stat
+import sys
+import pytest
+from tcrdist import blast
+
+def _report(query_id, seq):
+    """legacy blastall -p blastn report of seq, hit by a gene named after its length"""
+    if seq.startswith('n'):
+        return ('BLASTN 2.2.16 [Mar-25-2007]\n\nQuery= {}\n         ({} letters)\n\n'
+                ' ***** No hits found ******\n\n').format(query_id, len(seq))
+    hit_id = 'TRBV{}*01'.format(len(seq))
+    aln = seq[:20]
+    return ('BLASTN 2.2.16 [Mar-25-2007]\n\nQuery= {q}\n         ({n} letters)\n\n'
+            'Database: nucseq\n\n'
+            '                                                                 Score    E\n'
+            'Sequences producing significant alignments:                      (bits) Value\n\n'
+            '{h}                                                         40   1e-05\n'
+            'TRBV99*01                                                         30   0.005\n\n'
+            '>{h}\n          Length = 300\n\n'
+            ' Score = 40.1 bits (20), Expect = 1e-05\n'
+            ' Identities = 20/20 (100%)\n'
+            ' Strand = Plus / Plus\n\n\n'
+            'Query: 1   {a} 20\n'
+            '           ||||||||||||||||||||\n'
+            'Sbjct: 5   {a} 24\n\n\n'
+            '  Database: nucseq\n'
+            '  Number of letters in database: 9999\n\n').format(q = query_id, n = len(seq), h = hit_id, a = aln)
+
+fake_blastall = '''#!{python}
+import sys
+sys.path[:0] = [{tests!r}, {root!r}]
+from test_blast_batch import _report
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+records = open(args['-i']).read().split('>')[1:]
+with open(args['-o'], 'w') as out:
+    for r in records:
+        query_id, seq = r.split()
+        if not seq.startswith('x'): # dropped from the report
+            out.write(_report(query_id, seq))
+'''
+
+seqs = ['acgtacgtacgtacgtacgtacgtacg', 'acgt', 'ccgtacgtacgtacgtacgtacgtacgtac',
+        'nnnnnnnnnnnnnnnnnnnnnnnnnn', 'gcgtacgtacgtacgtacgtacgtacgtacgtacg']
+
+def test_iter_blast_reports_matches_single_query_parsing(tmp_path):
+    path = str(tmp_path / 'batch.blast')
+    with open(path, 'w') as out:
+        out.write(_report('q0', seqs[0]) + _report('q3', seqs[3]) + _report('q4', seqs[4]))
+    reports = list(blast.iter_blast_reports(path))
+    assert [q for q, lines in reports] == ['q0', 'q3', 'q4']
+    for (query_id, lines), seq in zip(reports, [seqs[0], seqs[3], seqs[4]]):
+        single = str(tmp_path / 'single.blast')
+        with open(single, 'w') as out:
+            out.write(_report('tmp', seq))
+        hits = blast.parse_blast_alignment_lines(lines, 1e-1, 20)
+        expected = blast.parse_blast_alignments(single, 1e-1, 20)
+        assert [vars(m)['q2hmap'] for m in hits[query_id]] == [vars(m)['q2hmap'] for m in expected['tmp']]
+        assert blast.get_all_hits_with_evalues_and_scores_lines(lines) == \
+            blast.get_all_hits_with_evalues_and_scores(single)
+
+def _fake_blast(tmp_path, monkeypatch):
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    exe = bindir / 'blastall'
+    tests = os.path.dirname(os.path.abspath(__file__))
+    exe.write_text(fake_blastall.format(python = sys.executable, tests = tests,
+                                        root = os.path.dirname(os.path.dirname(tests))))
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(blast, 'path_to_blast_executables', str(bindir))
+    monkeypatch.setattr(blast, 'get_blast_nucseq_database', lambda organism, chain, region: str(exe))
+    monkeypatch.chdir(tmp_path)
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_blast_batch_joins_hits_to_queries(tmp_path, monkeypatch, processes):
+    _fake_blast(tmp_path, monkeypatch)
+    r = blast.blast_batch('human', 'B', seqs, processes = processes)
+    assert r[1] is None
+    for seq, entry in zip(seqs, r):
+        if len(seq) <= 20:
+            continue
+        for vj in 'VJ':
+            hits, hits_scores = entry[vj]
+            if seq.startswith('n'):
+                assert hits_scores == []
+                assert list(hits.values()) == [[]]
+            else:
+                assert hits_scores == [('TRBV{}*01'.format(len(seq)), 40, 1e-05), ('TRBV99*01', 30, 0.005)]
+                (m,) = list(hits.values())[0]
+                assert m.hit_id == 'TRBV{}*01'.format(len(seq))
+                assert m.q2hmap[0] == (4, seq[0])
+    # temporary files are removed
+    assert os.listdir(str(tmp_path / 'tmp')) == []
+
+def test_query_missing_from_the_report_has_no_hits(tmp_path, monkeypatch):
+    _fake_blast(tmp_path, monkeypatch)
+    missing = 'x' * 25
+    r = blast.blast_batch('human', 'B', [seqs[0], missing])
+    assert r[1] == {}
+    genes, evalues, status = blast.parse_unpaired_dna_sequence_blastn('human', 'B', missing, '', False, True, False,
+                                                                       try_parasail = False, blast_hits = r[1])
+    assert status == ['no_VB_blast_hits', 'no_JB_blast_hits']
+    assert evalues == {'VB' : (1, 0), 'JB' : (1, 0)}
@@ -0,0 +1,88 @@
+import pytest
+import numpy as np
+import scipy.spatial
+from tcrdist import condensed
+from tcrdist.repertoire import TCRrep
+from tcrdist.tests.legacy_truth_values import test_df
+
+def _random_square(n, seed = 1, high = 300):
+    np.random.seed(seed)
+    vec = np.random.randint(0, high, size = n * (n - 1) // 2)
+    return scipy.spatial.distance.squareform(vec)
+
+def test_CondensedMatrix_indexing_matches_square_matrix():
+    x = _random_square(7)
+    cm = condensed.CondensedMatrix.from_square(x)
+    assert cm.dtype == np.uint16
+    assert cm.shape == (7, 7)
+    assert np.all(cm.toarray() == x)
+    assert np.all(cm[3] == x[3])
+    assert np.all(cm.row(-1) == x[-1])
+    assert cm[2, 5] == x[2, 5]
+    assert cm[4, 4] == 0
+    assert np.all(cm[1:4, [0, 6]] == x[1:4, [0, 6]])
+    assert np.all(cm[:, 2] == x[:, 2])
+    assert np.all(cm[[0, 1, 6], [6, 1, 0]] == x[[0, 1, 6], [6, 1, 0]])
+    with pytest.raises(IndexError):
+        cm[7]
+
+def test_n_from_condensed_raises_ValueError_on_invalid_length():
+    assert condensed.n_from_condensed(10) == 5
+    with pytest.raises(ValueError):
+        condensed.n_from_condensed(4)
+
+def test_weighted_sum_matches_dense_weighted_sum():
+    x = _random_square(20, seed = 1)
+    y = _random_square(20, seed = 2)
+    cx = condensed.CondensedMatrix.from_square(x)
+    cy = condensed.CondensedMatrix.from_square(y)
+    total = condensed.weighted_sum([cx, cy], [3, 1])
+    assert np.issubdtype(total.dtype, np.integer)
+    assert np.all(total.toarray() == 3 * x + y)
+    total = condensed.weighted_sum([cx, cy], [0.5, 1])
+    assert total.dtype == np.float64
+    assert np.allclose(total.toarray(), 0.5 * x + y)
+
+def test_weighted_sum_widens_dtype_on_overflow():
+    x = _random_square(10, high = 60000)
+    cx = condensed.CondensedMatrix.from_square(x)
+    assert cx.dtype == np.uint16
+    total = condensed.weighted_sum([cx, cx], [1, 1])
+    assert np.all(total.toarray() == 2 * x)
+
+def _legacy_tcrrep(storage):
+    tr = TCRrep(cell_df = test_df.iloc[0:60].copy(), organism = "mouse", storage = storage)
+    tr.infer_cdrs_from_v_gene(chain = 'alpha', imgt_aligned = True)
+    tr.infer_cdrs_from_v_gene(chain = 'beta',  imgt_aligned = True)
+    tr.index_cols = ['clone_id', 'cdr3_a_aa', 'cdr1_a_aa', 'cdr2_a_aa', 'pmhc_a_aa',
+                     'cdr3_b_aa', 'cdr1_b_aa', 'cdr2_b_aa', 'pmhc_b_aa',
+                     'v_a_gene', 'v_b_gene']
+    tr.deduplicate()
+    return tr
+
+@pytest.mark.parametrize("engine", ["pwseqdist", "numpy"])
+def test_condensed_storage_matches_dense_storage(engine):
+    dense = _legacy_tcrrep("dense")
+    dense._tcrdist_legacy_method_alpha_beta(processes = 1, engine = engine)
+    cond = _legacy_tcrrep("condensed")
+    cond._tcrdist_legacy_method_alpha_beta(processes = 1, engine = engine)
+    assert isinstance(cond.cdr3_b_aa_pw, condensed.CondensedMatrix)
+    assert isinstance(cond.cdr1_a_aa_pw, condensed.CondensedMatrix)
+    assert isinstance(cond.paired_tcrdist, condensed.CondensedMatrix)
+    assert cond.paired_tcrdist.dtype == np.uint16
+    assert np.all(cond.cdr3_b_aa_pw.toarray() == dense.cdr3_b_aa_pw)
+    assert np.all(cond.paired_tcrdist.toarray() == dense.paired_tcrdist)
+    assert np.all(cond.dist_a == dense.dist_a)
+
+def test_condensed_storage_generate_cluster_index():
+    dense = _legacy_tcrrep("dense")
+    dense._tcrdist_legacy_method_alpha_beta(processes = 1)
+    dense.generate_cluster_index(t = 100)
+    cond = _legacy_tcrrep("condensed")
+    cond._tcrdist_legacy_method_alpha_beta(processes = 1)
+    cond.generate_cluster_index(t = 100)
+    assert np.all(cond.clone_df['cluster_index'] == dense.clone_df['cluster_index'])
+
+def test_TCRrep_raises_ValueError_on_invalid_storage():
+    with pytest.raises(ValueError):
+        TCRrep(cell_df = test_df.iloc[0:10].copy(), organism = "mouse", storage = "sparse")
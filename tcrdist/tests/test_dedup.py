@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+from tcrdist import dedup
+from tcrdist.repertoire import TCRrep
+
+def _cell_df(n, seed = 0, null_fraction = 0.01):
+    rng = np.random.RandomState(seed)
+    d = {}
+    for col, size in [('subject', 3), ('v_b_gene', 40), ('j_b_gene', 13), ('cdr3_b_aa', 500)]:
+        values = np.array(['{}{}'.format(col[:4], j) for j in rng.permutation(size)], dtype = object)
+        d[col] = values[rng.randint(0, size, n)]
+        d[col][rng.random_sample(n) < null_fraction] = None
+    d['count'] = rng.randint(1, 5, n)
+    return pd.DataFrame(d)
+
+index_cols = ['subject', 'v_b_gene', 'j_b_gene', 'cdr3_b_aa']
+
+def test_deduplicate_matches_groupby():
+    df = _cell_df(20000)
+    clones, incomplete = dedup.deduplicate(df, index_cols)
+    pd.testing.assert_frame_equal(clones, df.groupby(index_cols)['count'].agg(np.sum).reset_index())
+    isnull = df[index_cols].isnull()
+    assert incomplete.rows == isnull.any(axis = 1).sum()
+    assert incomplete.count == df['count'][isnull.any(axis = 1)].sum()
+    assert incomplete.null_counts.tolist() == isnull.sum().tolist()
+
+def test_deduplicate_non_string_columns():
+    df = pd.DataFrame({'a' : [3, 1, 2, 1, np.NaN, 3], 'b' : ['x', 'y', 'x', 'y', 'z', 'x'],
+                       'count' : [1.5, 2, 3, np.NaN, 5, 1]})
+    clones, incomplete = dedup.deduplicate(df, ['a', 'b'])
+    pd.testing.assert_frame_equal(clones, df.groupby(['a', 'b'])['count'].agg(np.sum).reset_index())
+    assert (incomplete.rows, incomplete.count) == (1, 5)
+
+def test_group_keys_overflow_int64():
+    # the product of the column cardinalities exceeds 2**63
+    rng = np.random.RandomState(1)
+    df = pd.DataFrame({'c{}'.format(i) : rng.randint(0, 60000, 5000).astype(str) for i in range(5)})
+    df = pd.concat([df, df.iloc[:100]], ignore_index = True)
+    df['count'] = 1
+    clones, _ = dedup.deduplicate(df, list(df.columns[:5]))
+    pd.testing.assert_frame_equal(clones, df.groupby(list(df.columns[:5]))['count'].agg(np.sum).reset_index())
+    assert clones.shape[0] == 5000
+
+@pytest.mark.parametrize('chunksize', [1000, 7000, 50000])
+def test_deduplicate_chunks(chunksize):
+    df = _cell_df(20000)
+    chunks = (df.iloc[i:i + chunksize] for i in range(0, df.shape[0], chunksize))
+    clones, incomplete = dedup.deduplicate_chunks(chunks, index_cols)
+    expected, expected_incomplete = dedup.deduplicate(df, index_cols)
+    pd.testing.assert_frame_equal(clones, expected)
+    assert incomplete.rows == expected_incomplete.rows
+    assert incomplete.count == expected_incomplete.count
+    assert incomplete.null_counts.tolist() == expected_incomplete.null_counts.tolist()
+
+def test_TCRrep_deduplicate_engines_agree():
+    df = _cell_df(5000, null_fraction = 0)
+    clone_dfs = []
+    for engine in ['hash', 'pandas']:
+        tr = TCRrep(cell_df = df.copy(), organism = "human", chains = ["beta"])
+        tr.index_cols = index_cols
+        tr.deduplicate(engine = engine)
+        clone_dfs.append(tr.clone_df)
+    pd.testing.assert_frame_equal(*clone_dfs)
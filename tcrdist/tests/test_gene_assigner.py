@@ -0,0 +1,53 @@
+import os.path as op
+import pandas as pd
+import pytest
+import tcrdist as td
+from tcrdist import sail
+from tcrdist import processing
+from tcrdist.all_genes import all_genes
+
+pairseqs = op.join(td.__path__[0], 'datasets', 'test_human_pairseqs.tsv')
+raw = pd.read_csv(pairseqs, sep = '\t')
+
+def _same_hit(a, b):
+    assert a['hits_scores'] == b['hits_scores']
+    ma, mb = a['hits']['tmp'], b['hits']['tmp']
+    assert vars(ma) == vars(mb)
+
+@pytest.mark.parametrize('ab', ['A', 'B'])
+@pytest.mark.parametrize('vj', ['V', 'J'])
+def test_gene_assigner_matches_get_hit_parasail(ab, vj):
+    ga = sail.GeneAssigner('human', ab, vj, all_genes)
+    for nuc in raw['%s_nucseq' % ab.lower()][:5]:
+        _same_hit(ga.get_hit(nuc), sail._get_hit_parasail(vj, all_genes, 'human', ab, nuc))
+
+def test_gene_assigner_prefilter_keeps_top_hit():
+    exact = sail.GeneAssigner('human', 'B', 'V', all_genes)
+    prefiltered = sail.GeneAssigner('human', 'B', 'V', all_genes, k = 12)
+    for nuc in raw.b_nucseq:
+        assert len(prefiltered.candidates(nuc)) < len(exact.candidates(nuc))
+        a, b = exact.get_hit(nuc), prefiltered.get_hit(nuc)
+        assert a['hits']['tmp'].hit_id == b['hits']['tmp'].hit_id
+        assert a['hits_scores'][0] == b['hits_scores'][0]
+    # no shared k-mer, every reference is aligned
+    assert prefiltered.candidates('ACGT') == exact.candidates('ACGT')
+
+def test_gene_assigner_cache():
+    ga = sail.GeneAssigner('human', 'A', 'J', all_genes, cache_size = 2)
+    r = ga.get_hit(raw.a_nucseq[0])
+    assert ga.get_hit(raw.a_nucseq[0]) is r
+    ga.get_hit(raw.a_nucseq[1])
+    ga.get_hit(raw.a_nucseq[2])
+    assert len(ga._cache) == 2
+    assert raw.a_nucseq[0] not in ga._cache
+
+def test_get_gene_assigner_is_shared():
+    assert sail.get_gene_assigner('human', 'A', 'V', all_genes) is \
+        sail.get_gene_assigner('human', 'A', 'V', all_genes)
+    assert sail.get_gene_assigner('human', 'A', 'V', all_genes, k = 8) is not \
+        sail.get_gene_assigner('human', 'A', 'V', all_genes)
+
+def test_readPairedSequences_with_processes():
+    serial = processing.readPairedSequences('human', pairseqs)
+    parallel = processing.readPairedSequences('human', pairseqs, processes = 2, chunksize = 3)
+    pd.testing.assert_frame_equal(serial, parallel)
@@ -0,0 +1,83 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from tcrdist import gene_snapshot, repertoire_db, all_genes_db
+from tcrdist.paths import path_to_db
+from tcrdist.repertoire import TCRrep
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(gene_snapshot, '_snapshots', {})
+    monkeypatch.setattr(repertoire_db, '_ref_gene_sets', {})
+    return os.path.join(str(tmp_path), 'gene_db')
+
+def _parsed_ref_genes(db_file):
+    """RefGeneSet as built before the snapshot: pandas rows, translated one by one"""
+    all_genes = {}
+    for _, row in pd.read_csv(os.path.join(path_to_db, db_file), delimiter = '\t').iterrows():
+        g = repertoire_db.TCRGene(row)
+        all_genes.setdefault(g.organism, {})[g.id] = g
+    return all_genes
+
+def _attributes(g):
+    return {k : (None if isinstance(v, float) and np.isnan(v) else v) for k, v in g.__dict__.items()}
+
+@pytest.mark.parametrize("db_file", ["alphabeta_db.tsv", "gammadelta_db.tsv"])
+def test_snapshot_ref_genes_match_parsed_ref_genes(cache_dir, db_file):
+    expected = _parsed_ref_genes(db_file)
+    all_genes = repertoire_db.RefGeneSet(db_file).all_genes
+    assert os.listdir(cache_dir) == [os.path.basename(gene_snapshot.snapshot_path(db_file))]
+    assert list(all_genes) == list(expected)
+    for organism in expected:
+        assert list(all_genes[organism]) == list(expected[organism])
+        for id, g in expected[organism].items():
+            assert _attributes(all_genes[organism][id]) == _attributes(g)
+
+def test_snapshot_is_memory_mapped_and_versioned(cache_dir):
+    path = gene_snapshot.snapshot_path("alphabeta_db.tsv")
+    assert '.v{}.'.format(gene_snapshot.SNAPSHOT_VERSION) in os.path.basename(path)
+    snapshot = gene_snapshot.load_snapshot("alphabeta_db.tsv")
+    assert isinstance(snapshot, np.memmap)
+    assert list(snapshot.dtype.names) == gene_snapshot.fields
+    rows = gene_snapshot.gene_rows("alphabeta_db.tsv")
+    row = [r for r in rows if r['id'] == 'TRBV19*01' and r['organism'] == 'human'][0]
+    assert row['protseq'].startswith('DGGITQSPKYLFRKEGQNVTLSCEQNLNHDAMYWYRQ')
+    assert row['rep'] == 'TRBV19*01'
+    assert [r['cdrs'] for r in rows if r['region'] == 'D'] == [None] * 5
+
+def test_all_genes_db_keeps_identity_reps(cache_dir):
+    all_genes = all_genes_db.all_genes_db("gammadelta_db.tsv")
+    for genes in all_genes.values():
+        for id, g in genes.items():
+            assert g.rep == g.mm1_rep == id
+
+def test_TCRrep_instances_share_ref_gene_set(cache_dir):
+    tr1 = TCRrep(cell_df = pd.DataFrame(), organism = "human", chains = ["beta"])
+    tr2 = TCRrep(cell_df = pd.DataFrame(), organism = "human", chains = ["beta"])
+    assert tr1.all_genes is tr2.all_genes
+    assert tr1.all_genes is repertoire_db.get_ref_gene_set("alphabeta_db.tsv").all_genes
+
+def test_unwritable_cache_keeps_snapshot_in_memory(tmp_path, monkeypatch):
+    # a path below a file can never be created
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(blocker / 'cache'))
+    monkeypatch.setattr(gene_snapshot, '_snapshots', {})
+    monkeypatch.setattr(repertoire_db, '_ref_gene_sets', {})
+    snapshot = gene_snapshot.load_snapshot("alphabeta_db.tsv")
+    assert not isinstance(snapshot, np.memmap)
+    assert list(snapshot.dtype.names) == gene_snapshot.fields
+    tr = TCRrep(cell_df = pd.DataFrame(), organism = "human", chains = ["beta"])
+    assert 'TRBV19*01' in tr.all_genes['human']
+
+def test_snapshot_path_depends_on_version_and_builder_code(cache_dir, monkeypatch):
+    path = gene_snapshot.snapshot_path("alphabeta_db.tsv")
+    builder_modules = gene_snapshot._builder_modules
+    monkeypatch.setattr(gene_snapshot, '_builder_modules', builder_modules[:-1])
+    assert gene_snapshot.snapshot_path("alphabeta_db.tsv") != path
+    monkeypatch.setattr(gene_snapshot, '_builder_modules', builder_modules)
+    assert gene_snapshot.snapshot_path("alphabeta_db.tsv") == path
+    monkeypatch.setattr(gene_snapshot, '__version__', 'other')
+    assert gene_snapshot.snapshot_path("alphabeta_db.tsv") != path
@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+import importlib
+import subprocess
+import pytest
+from tcrdist import db_cache
+
+# generous relative to the ~0.2 s measured with a warm os cache, so slow CI
+# machines pass while a regression to eager db parsing (~10 s) fails
+IMPORT_TIME_BUDGET_SECONDS = 2.0
+
+heavy_modules = ['matplotlib', 'seaborn', 'numba', 'statsmodels', 'sklearn', 'fishersapi', 'pandas', 'scipy']
+
+def _run(code, cache_dir):
+    env = dict(os.environ, TCRDIST_CACHE_DIR = str(cache_dir))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env = env,
+                          stdout = subprocess.PIPE, stderr = subprocess.PIPE, universal_newlines = True, check = True)
+
+def test_import_tcrdist_within_budget_and_without_heavy_modules(tmp_path):
+    code = ("import sys, time; t = time.time(); import tcrdist; t = time.time() - t; "
+            "print(','.join(m for m in {} if m in sys.modules) or '-', t)").format(heavy_modules)
+    r = _run(code, tmp_path)
+    loaded, seconds = r.stdout.split()
+    assert loaded == '-'
+    if sys.version_info >= (3, 7):
+        # -X importtime is ignored by python 3.6, which only has the wall time
+        cumulative = [int(m.group(1)) for m in re.finditer(r'import time:\s+\d+ \|\s+(\d+) \| tcrdist\s*$', r.stderr, re.M)]
+        assert len(cumulative) == 1
+        seconds = cumulative[0] / 1e6
+    assert float(seconds) < IMPORT_TIME_BUDGET_SECONDS
+    # nothing is parsed at import time
+    assert not os.path.exists(os.path.join(str(tmp_path), 'db'))
+
+def test_lazy_submodules_and_attributes_resolve(tmp_path):
+    code = "import tcrdist as td; print(td.all_genes.loaded, td.objects.__name__, td.processNT.__module__, td.TCRChain.__name__)"
+    assert _run(code, tmp_path).stdout.split() == ['False', 'tcrdist.objects', 'tcrdist.processing', 'TCRChain']
+
+def test_cached_gene_tables_match_freshly_built_tables(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path))
+    all_genes_module = importlib.import_module('tcrdist.all_genes')
+    sources = [all_genes_module.db_file]
+    first = db_cache.load_cached('all_genes', sources, all_genes_module._build_all_genes)
+    assert len(os.listdir(os.path.join(str(tmp_path), 'db'))) == 1
+    def not_called():
+        raise AssertionError('table should be read from the cache')
+    not_called.__module__ = all_genes_module.__name__
+    second = db_cache.load_cached('all_genes', sources, not_called)
+    assert set(first) == set(second) == {'human', 'mouse'}
+    for organism in first:
+        for id, g in first[organism].items():
+            assert second[organism][id].__dict__ == g.__dict__
+    db_cache.clear_db_cache()
+    assert os.listdir(os.path.join(str(tmp_path), 'db')) == []
+
+def test_lazy_dict_loads_once():
+    calls = []
+    d = db_cache.LazyDict(lambda : calls.append(1) or {'a': 1})
+    assert not d.loaded and calls == []
+    assert d['a'] == 1 and 'a' in d and list(d) == ['a'] and len(d) == 1
+    assert calls == [1]
+    import pickle
+    assert pickle.loads(pickle.dumps(d)) == {'a': 1}
@@ -154,4 +154,43 @@ def test_validate_gene_names_2():
     r = mixcr._validate_gene_names(  series = df['v_d_gene'], 
                                     chain = 'delta', 
                                     organism = 'human')
-    assert np.all(r == pd.Series([True,True,False,False,False]))               
\ No newline at end of file
+    assert np.all(r == pd.Series([True,True,False,False,False]))               
+
+
+def test_clean_mixcr_gene_hits_matches_per_value_functions():
+    s = pd.Series(['TRAV29DV5*00(45),TRDV2*00(40)', 'TRAV38-2DV8*00(10)', 'TRDD3*00(45)',
+                   'TRDV1*01', '', np.NaN, 'TRAV38-1*00(3),TRAV29DV5*00(2)'], index = range(10, 17))
+    expected = s.apply(mixcr._take_top_mixcr_gene_hit).\
+        apply(mixcr._allele_00_to_01).\
+        apply(mixcr._change_TRAVDV_to_TRAVdashDV)
+    pd.testing.assert_series_equal(mixcr._clean_mixcr_gene_hits(s), expected)
+    assert mixcr._clean_mixcr_gene_hits(pd.Series([np.NaN, np.NaN])).isnull().all()
+
+
+def test_remove_entries_with_invalid_cdr3():
+    df = pd.DataFrame({'cdr3_d_aa': ['CASSF', 'CA*SF', '', 'CAS_F']})
+    r = mixcr.remove_entries_with_invalid_cdr3(df, chain = 'delta')
+    assert r.cdr3_d_aa.tolist() == ['CASSF', '']
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_mixcr_dir_to_tcrdist2(tmp_path, processes):
+    import shutil
+    sources = [os.path.join('tcrdist','test_files_compact', f) for f in
+               ['SRR5130260.1.test.fastq.output.clns.txt', 'SRR5130255.1.test.fastq.output.clns.txt']]
+    for i in range(3):
+        shutil.copy(sources[i % 2], str(tmp_path / 'S{}.clns.txt'.format(i)))
+    df = mixcr.mixcr_dir_to_tcrdist2(str(tmp_path), chain = "delta", organism = "human", processes = processes)
+    expected = [mixcr.mixcr_to_tcrdist2(chain = "delta", organism = "human", clones_fn = sources[i % 2]).\
+                assign(subject = 'S{}'.format(i)) for i in range(3)]
+    pd.testing.assert_frame_equal(df, pd.concat(expected, ignore_index = True))
+
+
+def test_mixcr_dir_to_tcrdist2_to_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    fn = os.path.join('tcrdist','test_files_compact','SRR5130260.1.test.fastq.output.clns.txt')
+    out = mixcr.mixcr_dir_to_tcrdist2([fn, fn], chain = "delta", organism = "human",
+                                      subjects = ['a', 'b'], parquet_dir = str(tmp_path / 'pq'))
+    assert out == [str(tmp_path / 'pq' / 'a.parquet'), str(tmp_path / 'pq' / 'b.parquet')]
+    df = mixcr.mixcr_dir_to_tcrdist2([fn, fn], chain = "delta", organism = "human", subjects = ['a', 'b'])
+    pd.testing.assert_frame_equal(pd.concat([pd.read_parquet(f) for f in out], ignore_index = True), df)
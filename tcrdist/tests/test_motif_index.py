@@ -0,0 +1,79 @@
+import random
+import pandas as pd
+import pytest
+from tcrdist import tcr_sampler
+from tcrdist.all_genes import all_genes
+from tcrdist.motif_index import MotifIndex, RegexMotifIndex, popcount
+from tcrdist.find_cdr3_motifs_in_tcrdist2 import find_cdr3_motif
+
+_tokens = ['^', '$', '.', '[A-Z]', '[DE]', '[KR]', '[ST]', '[^C]', 'C', 'A', 'S', 'G', 'F', 'W', 'Y', 'Q']
+
+def _random_seqs(rng, n):
+    return [''.join(rng.choice('CASGFWYQDEKRST') for _ in range(rng.randint(0, 18))) for _ in range(n)]
+
+def test_MotifIndex_matches_regex():
+    rng = random.Random(0)
+    seqs = _random_seqs(rng, 300)
+    index, regex_index = MotifIndex(seqs), RegexMotifIndex(seqs)
+    for _ in range(3000):
+        motif = [rng.choice(_tokens) for _ in range(rng.randint(0, 6))]
+        within = rng.getrandbits(len(seqs)) if rng.random() < 0.5 else None
+        bits = index.matches(motif, within)
+        assert bits == regex_index.matches(motif, within), motif
+        assert index.indices(bits) == regex_index.indices(bits)
+        assert popcount(bits) == len(index.indices(bits))
+
+def test_MotifIndex_rejects_multi_residue_tokens():
+    with pytest.raises(ValueError):
+        MotifIndex(['CASSF']).matches(['^', 'CA'])
+
+def _synthetic_tcrs(n, n_ng, seed = 0):
+    """all_tcrs and ng_tcrs of random mouse TCRs, half of them with a WGG motif"""
+    rng = random.Random(seed)
+    g = all_genes['mouse']
+    genes = {ab : ([k for k in sorted(g) if k.startswith('TR{}V'.format(ab)) and k.endswith('*01')][:4],
+                   [k for k in sorted(g) if k.startswith('TR{}J'.format(ab)) and k.endswith('*01')][:3])
+             for ab in 'AB'}
+    def sample(v, j, k):
+        return [protseq for _, protseq, _ in tcr_sampler.sample_tcr_sequences(
+            'mouse', k, v, j, in_frame_only = True, no_stop_codons = True,
+            max_tries = 100000, include_annotation = True)]
+    tcrs = []
+    for i in range(n):
+        row = {}
+        for ab in 'AB':
+            v, j = rng.choice(genes[ab][0]), rng.choice(genes[ab][1])
+            cdr3 = sample(v, j, 1)[0]
+            if i % 2 == 0 and len(cdr3) > 8:
+                cdr3 = cdr3[:4] + 'WGG' + cdr3[7:]
+            row[ab] = (v, j, cdr3, g[v].rep, g[j].rep)
+        a, b = row['A'], row['B']
+        tcrs.append((a[0], a[1], b[0], b[1], a[2], b[2], a[2], b[2], a[3], a[4], b[3], b[4]))
+    ng_tcrs = {ab : {} for ab in 'AB'}
+    for ab in 'AB':
+        for v in genes[ab][0]:
+            for j in genes[ab][1]:
+                ng_tcrs[ab].setdefault(g[v].rep, {})[g[j].rep] = [(s, '') for s in sample(v, j, n_ng)]
+    return {'PA' : tcrs}, ng_tcrs
+
+@pytest.mark.parametrize('pseudocount', [0.0, 0.5])
+def test_find_cdr3_motif_engines_agree(pseudocount):
+    random.seed(1)
+    all_tcrs, ng_tcrs = _synthetic_tcrs(40, 20)
+    kwargs = dict(organism = 'mouse', epitopes = ['PA'], chains = ['B'], all_tcrs = all_tcrs,
+                  ng_tcrs = ng_tcrs, nsamples = 5, min_count = 5, constant_seed = True,
+                  pseudocount = pseudocount)
+    bitset = find_cdr3_motif(engine = 'bitset', **kwargs)
+    regex = find_cdr3_motif(engine = 'regex', **kwargs)
+    assert bitset.shape[0] > 0
+    pd.testing.assert_frame_equal(bitset, regex)
+
+def test_find_cdr3_motif_processes_agree():
+    random.seed(1)
+    all_tcrs, ng_tcrs = _synthetic_tcrs(40, 20)
+    kwargs = dict(organism = 'mouse', epitopes = ['PA'], chains = ['A', 'B'], all_tcrs = all_tcrs,
+                  ng_tcrs = ng_tcrs, nsamples = 5, min_count = 5, constant_seed = True)
+    serial = find_cdr3_motif(**kwargs)
+    parallel = find_cdr3_motif(processes = 2, **kwargs)
+    assert serial.ab.nunique() == 2
+    pd.testing.assert_frame_equal(serial, parallel)
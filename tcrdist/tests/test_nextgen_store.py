@@ -0,0 +1,102 @@
+import os
+import pickle
+import random
+import types
+import numpy as np
+import pytest
+from tcrdist import nextgen_store, rmf, util, cdr3_motif
+from tcrdist.all_genes import all_genes
+from tcrdist.cdr3_motif import TCRMotif
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(nextgen_store, '_stores', {})
+    return os.path.join(str(tmp_path / 'cache'), 'nextgen')
+
+def _write_nextgen(path, organism, chain, n, seed = 0):
+    rng = random.Random(seed)
+    genes = all_genes[organism]
+    vs = sorted(k for k in genes if k.startswith('TR{}V'.format(chain)))
+    js = sorted(k for k in genes if k.startswith('TR{}J'.format(chain)))[:6]
+    with open(path, 'w') as fh:
+        fh.write('v_reps\tj_reps\tcdr3\tcdr3_nucseq\n')
+        for i in range(n):
+            v_field = ','.join(rng.sample(vs, rng.randint(1, 3)))
+            j_field = ','.join(rng.choice(js) for _ in range(rng.randint(1, 2)))
+            cdr3 = 'CAS' + ''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(rng.randint(0, 12))) + 'F'
+            fh.write('{}\t{}\t{}\t{}\n'.format(v_field, j_field, cdr3, 'tgt' * len(cdr3)))
+    return path
+
+def _parsed_nextgen(ng_logfile, organism, max_ng_lines):
+    """the next-gen dict as read line by line before the store"""
+    counter = 0
+    ab_chains = {}
+    for line in open(ng_logfile, 'r'):
+        counter += 1
+        l = line[:-1].split('\t')
+        if counter == 1:
+            continue
+        if max_ng_lines and counter > max_ng_lines:
+            break
+        v_reps = set( ( util.get_mm1_rep(x, organism) for x in l[0].split(',') ) )
+        for v_rep in v_reps:
+            for j_rep in l[1].split(','):
+                ab_chains.setdefault(v_rep, {}).setdefault(j_rep, []).append( (l[2], l[3]) )
+    return ab_chains
+
+def _as_lists(ab_chains):
+    return {v : {j : list(seqs) for j, seqs in d.items()} for v, d in ab_chains.items()}
+
+@pytest.mark.parametrize('max_ng_lines', [None, 0, 1, 2, 500, 5000000])
+def test_store_matches_parsed_file(tmp_path, cache_dir, max_ng_lines):
+    fn = _write_nextgen(str(tmp_path / 'new_nextgen_chains_mouse_B.tsv'), 'mouse', 'B', 2000)
+    store = nextgen_store.load_store(fn, 'mouse')
+    ab_chains = store.tcrs(max_ng_lines)
+    assert _as_lists(ab_chains) == _parsed_nextgen(fn, 'mouse', max_ng_lines)
+    # views sample as the lists do
+    for v in ab_chains:
+        for j, seqs in ab_chains[v].items():
+            random.seed(1)
+            x = random.sample(seqs, min(25, len(seqs)))
+            random.seed(1)
+            assert x == random.sample(list(seqs), min(25, len(seqs)))
+
+def test_store_is_compiled_once_and_memory_mapped(tmp_path, cache_dir):
+    fn = _write_nextgen(str(tmp_path / 'new_nextgen_chains_human_A.tsv'), 'human', 'A', 300)
+    store = nextgen_store.load_store(fn, 'human')
+    assert os.listdir(cache_dir) == [os.path.basename(nextgen_store.store_path(fn, 'human'))]
+    assert isinstance(store.cdr3_chars, np.memmap)
+    assert nextgen_store.load_store(fn, 'human') is store
+    assert store.num_chains() == 300 and store.num_chains(101) == 100
+    # pickles as a reference to the same files
+    clone = pickle.loads(pickle.dumps(store.tcrs()))
+    assert _as_lists(clone) == _as_lists(store.tcrs())
+    assert next(iter(next(iter(clone.values())).values())).store is store
+
+def test_TCRMotif_and_rmf_read_the_store(tmp_path, cache_dir, monkeypatch):
+    for chain in 'AB':
+        _write_nextgen(str(tmp_path / 'new_nextgen_chains_mouse_{}.tsv'.format(chain)), 'mouse', chain, 500, seed = 2)
+    monkeypatch.setattr(cdr3_motif, 'path_to_current_db_files', lambda : str(tmp_path))
+    motif = types.SimpleNamespace()
+    ng_tcrs = TCRMotif.generate_ng_tcrs(motif, chains = ['A', 'B'], organism = 'mouse', max_ng_lines = 400)
+    rmf_ng_tcrs = rmf._generate_read_motif_ng_tcrs_dict(['A', 'B'], organism = 'mouse', ng_path = str(tmp_path),
+                                                        max_ng_lines = 400)
+    for chain in 'AB':
+        expected = _parsed_nextgen(str(tmp_path / 'new_nextgen_chains_mouse_{}.tsv'.format(chain)), 'mouse', 400)
+        assert _as_lists(ng_tcrs[chain]) == expected
+        assert _as_lists(rmf_ng_tcrs[chain]) == expected
+
+def test_unwritable_cache_keeps_store_in_memory(tmp_path, monkeypatch):
+    # a path below a file can never be created
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(blocker / 'cache'))
+    monkeypatch.setattr(nextgen_store, '_stores', {})
+    fn = _write_nextgen(str(tmp_path / 'new_nextgen_chains_mouse_B.tsv'), 'mouse', 'B', 500)
+    store = nextgen_store.load_store(fn, 'mouse')
+    assert not store.mapped and not isinstance(store.cdr3_chars, np.memmap)
+    assert nextgen_store.load_store(fn, 'mouse') is store
+    assert _as_lists(store.tcrs(100)) == _parsed_nextgen(fn, 'mouse', 100)
+    clone = pickle.loads(pickle.dumps(store.tcrs()))
+    assert _as_lists(clone) == _as_lists(store.tcrs())
@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+from tcrdist import pgen
+from tcrdist.tests.test_pgen import human_b, human_a
+
+cdr3s = list(human_b.cdr3_b_aa[:20]) + list(human_a.cdr3_a_aa) + \
+    ['C', 'CA', 'CASSLGQGAEQFF', 'CASSXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXEQYF', 'CAVRDSNYQLIW']
+
+@pytest.fixture(scope = "module", params = [('human_T_beta', 'VDJ'), ('human_T_alpha', 'VJ')])
+def pgen_model(request):
+    chain_folder, recomb_type = request.param
+    return pgen.OlgaModel(chain_folder = chain_folder, recomb_type = recomb_type).pgen_model
+
+def _current_Pi_V(m, CDR3_seq, V_in):
+    """per allele Pi array as built by the original (unstacked) OLGA loop"""
+    a = m.max_nt_to_aa_alignment_left(CDR3_seq, m.cutV_genomic_CDR3_segs[V_in])
+    current_Pi_V = np.zeros((4, len(CDR3_seq)*3))
+    if a > 0:
+        current_Pi_V[:, :a] = m.PVdelV_nt_pos_vec[V_in][:, :a]
+        for pos in range(1, a, 3):
+            current_Pi_V[:, pos] = m.PVdelV_2nd_nt_pos_per_aa_vec[V_in][CDR3_seq[pos//3]][:, pos]
+    return current_Pi_V
+
+def _current_Pi_J(m, CDR3_seq, J_in):
+    a = m.max_nt_to_aa_alignment_right(CDR3_seq, m.cutJ_genomic_CDR3_segs[J_in])
+    current_Pi_J = np.zeros((4, len(CDR3_seq)*3))
+    if a > 0:
+        current_Pi_J[:, -a:] = m.PJdelJ_nt_pos_vec[J_in][:, -a:]
+        for pos in range(-2, -a-1, -3):
+            current_Pi_J[:, pos] = m.PJdelJ_2nd_nt_pos_per_aa_vec[J_in][CDR3_seq[pos//3]][:, pos]
+    return current_Pi_J
+
+def test_stacked_alignments_match_per_allele_alignments(pgen_model):
+    m = pgen_model
+    V = np.arange(len(m.cutV_genomic_CDR3_segs))
+    J = np.arange(len(m.cutJ_genomic_CDR3_segs))
+    for s in cdr3s:
+        expected_V = [m.max_nt_to_aa_alignment_left(s, seg) for seg in m.cutV_genomic_CDR3_segs]
+        expected_J = [m.max_nt_to_aa_alignment_right(s, seg) for seg in m.cutJ_genomic_CDR3_segs]
+        assert m.max_nt_to_aa_alignments(s, V, 'left').tolist() == expected_V
+        assert m.max_nt_to_aa_alignments(s, J, 'right').tolist() == expected_J
+
+def test_stacked_Pi_arrays_match_per_allele_Pi_arrays(pgen_model):
+    m = pgen_model
+    V = np.array(m.d_V_usage_mask)
+    J = np.array(m.d_J_usage_mask)
+    for s in cdr3s:
+        Pi_V_stack, _ = m.genomic_Pi_stack(s, V, 'left')
+        Pi_J_stack, _ = m.genomic_Pi_stack(s, J, 'right')
+        assert np.array_equal(Pi_V_stack, np.array([_current_Pi_V(m, s, V_in) for V_in in V]))
+        assert np.array_equal(Pi_J_stack, np.array([_current_Pi_J(m, s, J_in) for J_in in J]))
+
+def test_usage_mask_out_of_range_is_skipped(pgen_model, capsys):
+    m = pgen_model
+    s = 'CASSLGQGAEQFF'
+    V = m.d_V_usage_mask[:3]
+    Pi_V_stack, alignments = m.genomic_Pi_stack(s, m._check_usage_mask(V + [10**6], 'left'), 'left')
+    assert "out of allowed range" in capsys.readouterr().out
+    assert len(alignments) == 3
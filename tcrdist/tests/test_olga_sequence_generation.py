@@ -0,0 +1,51 @@
+import os.path as op
+import pytest
+import numpy as np
+import tcrdist.olga.load_model as load_model
+import tcrdist.olga.sequence_generation as seq_gen
+from tcrdist.olga.utils import nt2aa
+from tcrdist.paths import path_to_olga_default_models
+
+def _seq_gen_model(chain_folder, recomb_type):
+    path = op.join(path_to_olga_default_models, chain_folder)
+    genomic_data = getattr(load_model, 'GenomicData' + recomb_type)()
+    genomic_data.load_igor_genomic_data(op.join(path, 'model_params.txt'),
+                                        op.join(path, 'V_gene_CDR3_anchors.csv'),
+                                        op.join(path, 'J_gene_CDR3_anchors.csv'))
+    generative_model = getattr(load_model, 'GenerativeModel' + recomb_type)()
+    generative_model.load_and_process_igor_model(op.join(path, 'model_marginals.txt'))
+    return getattr(seq_gen, 'SequenceGeneration' + recomb_type)(generative_model, genomic_data)
+
+@pytest.fixture(scope = "module", params = [('human_T_beta', 'VDJ'), ('human_T_alpha', 'VJ')])
+def seq_gen_model(request):
+    return _seq_gen_model(*request.param)
+
+def test_gen_rnd_prod_CDR3_batch_is_productive(seq_gen_model):
+    seqs = seq_gen_model.gen_rnd_prod_CDR3_batch(2000, seed = 1)
+    assert len(seqs) == 2000
+    for ntseq, aaseq, V, J in seqs:
+        assert nt2aa(ntseq) == aaseq
+        assert len(ntseq) == 3*len(aaseq)
+        assert '*' not in aaseq and aaseq[0] == 'C' and aaseq[-1] in 'FVW'
+        assert len(seq_gen_model.cutV_genomic_CDR3_segs[V]) > 0
+        assert len(seq_gen_model.cutJ_genomic_CDR3_segs[J]) > 0
+
+def test_gen_rnd_prod_CDR3_batch_is_reproducible(seq_gen_model):
+    first = seq_gen_model.gen_rnd_prod_CDR3_batch(300, seed = 7)
+    assert first == seq_gen_model.gen_rnd_prod_CDR3_batch(300, seed = 7)
+    assert first != seq_gen_model.gen_rnd_prod_CDR3_batch(300, seed = 8)
+    assert first[:100] == seq_gen_model.gen_rnd_prod_CDR3_batch(100, seed = 7)
+
+def test_gen_rnd_prod_CDR3_batch_in_parallel(seq_gen_model):
+    seqs = seq_gen_model.gen_rnd_prod_CDR3_batch(301, seed = 3, processes = 2)
+    assert len(seqs) == 301
+    assert seqs == seq_gen_model.gen_rnd_prod_CDR3_batch(301, seed = 3, processes = 2)
+
+def test_gen_rnd_prod_CDR3_batch_matches_gen_rnd_prod_CDR3_distribution(seq_gen_model):
+    np.random.seed(0)
+    single = [seq_gen_model.gen_rnd_prod_CDR3() for i in range(3000)]
+    batch = seq_gen_model.gen_rnd_prod_CDR3_batch(3000, seed = 0)
+    single_len = np.array([len(x[1]) for x in single])
+    batch_len = np.array([len(x[1]) for x in batch])
+    assert abs(single_len.mean() - batch_len.mean()) < 0.3
+    assert abs(np.mean([x[1][:4] == 'CASS' for x in single]) - np.mean([x[1][:4] == 'CASS' for x in batch])) < 0.05
@@ -0,0 +1,198 @@
+import itertools
+import random
+import pytest
+import numpy as np
+import pandas as pd
+from tcrdist import pairwise
+from tcrdist import pairwise_numpy
+from tcrdist import tcr_distances
+from tcrdist import objects
+from tcrdist.repertoire import TCRrep
+from tcrdist.tests.legacy_truth_values import test_df
+
+def _random_cdr3s(n, seed = 1):
+    random.seed(seed)
+    return [pairwise.get_random_amino_acid(random.randint(6, 20)) for _ in range(n)]
+
+def test_tcrdist_cdr3_pw_matches_example():
+    dvec = pairwise_numpy.tcrdist_cdr3_pw(['CALDNVLYF','CAASEHLYGSSGNKLIF'])
+    assert dvec.tolist() == [132]
+
+def test_tcrdist_cdr3_pw_matches_tcrdist_cdr3_metric():
+    seqs = _random_cdr3s(100)
+    expected = [pairwise.tcrdist_cdr3_metric(a, b) for a, b in itertools.combinations(seqs, 2)]
+    assert pairwise_numpy.tcrdist_cdr3_pw(seqs).tolist() == expected
+
+@pytest.mark.parametrize("config_string", ["align_cdr3s:True",
+                                           "trim_cdr3s:False",
+                                           "align_cdr3s:True,trim_cdr3s:False,weight_cdr3_region:2.5"])
+def test_tcrdist_cdr3_pw_matches_weighted_cdr3_distance_with_params(config_string):
+    params = objects.DistanceParams(config_string)
+    seqs = _random_cdr3s(60, seed = 2)
+    expected = [int(tcr_distances.weighted_cdr3_distance(a, b, params)) for a, b in itertools.combinations(seqs, 2)]
+    assert pairwise_numpy.tcrdist_cdr3_pw(seqs, params = params).tolist() == expected
+
+def test_tcrdist_cdr3_pw_raises_ValueError_on_short_cdr3():
+    with pytest.raises(ValueError):
+        pairwise_numpy.tcrdist_cdr3_pw(['CASS', 'CASSLGQAYEQYF'])
+
+def test_tcrdist_cdr3_pw_raises_ValueError_on_unknown_character():
+    with pytest.raises(ValueError):
+        pairwise_numpy.tcrdist_cdr3_pw(['CASSLGXAYEQYF', 'CASSLGQAYEQYF'])
+    with pytest.raises(ValueError):
+        pairwise_numpy.tcrdist_cdr3_pw(['CASSLG.AYEQYF', 'CASSLGQAYEQYF'])
+
+def test_compute_pairwise_all_numpy_engine_matches_pwseqdist_engine():
+    tr = TCRrep(cell_df = test_df.iloc[0:50].copy(), organism = "mouse")
+    tr.index_cols = ['clone_id', 'cdr3_a_aa', 'cdr3_b_aa']
+    tr.deduplicate()
+    tr.imgt_aligned_status = True
+    tr.compute_pairwise_all(chain = "beta",
+                            metric = "tcrdist_cdr3",
+                            compute_specific_region = "cdr3_b_aa",
+                            processes = 1)
+    expected = tr.cdr3_b_aa_pw.copy()
+    tr.compute_pairwise_all(chain = "beta",
+                            metric = "tcrdist_cdr3",
+                            compute_specific_region = "cdr3_b_aa",
+                            processes = 1,
+                            engine = "numpy")
+    assert np.all(tr.cdr3_b_aa_pw == expected)
+
+def test_compute_pairwise_all_numpy_engine_raises_ValueError_on_unsupported_metric():
+    tr = TCRrep(cell_df = test_df.iloc[0:10].copy(), organism = "mouse")
+    tr.index_cols = ['clone_id', 'cdr3_a_aa', 'cdr3_b_aa']
+    tr.deduplicate()
+    with pytest.raises(ValueError):
+        tr.compute_pairwise_all(chain = "beta",
+                                metric = "nw",
+                                compute_specific_region = "cdr3_b_aa",
+                                processes = 1,
+                                engine = "numpy")
+
+def test_tcrdist_cdr1_pw_matches_tcrdist_cdr1_metric():
+    seqs = ['TSG......FNG', 'VVL.....DGLK', 'TSG......FNG', 'DRG......SQS', 'NSA.*....FQY']
+    expected = [pairwise.tcrdist_cdr1_metric(a, b) for a, b in itertools.combinations(seqs, 2)]
+    assert pairwise_numpy.tcrdist_cdr1_pw(seqs).tolist() == expected
+
+def test_v_region_table_matches_tcrdist_cdr1_metric():
+    gene_index, cdr_seqs, table = pairwise_numpy.v_region_table(organism = "mouse",
+                                                                db_chain = "B",
+                                                                cdr = 2)
+    assert table.shape == (len(cdr_seqs), len(cdr_seqs))
+    for i, j in [(0, 1), (3, 10), (5, 5), (len(cdr_seqs) - 1, 2)]:
+        assert table[i, j] == pairwise.tcrdist_cdr1_metric(cdr_seqs[i], cdr_seqs[j])
+
+def test_tcrdist_legacy_method_alpha_beta_numpy_engine_matches_pwseqdist_engine():
+    tr = TCRrep(cell_df = test_df.iloc[0:60].copy(), organism = "mouse")
+    tr.infer_cdrs_from_v_gene(chain = 'alpha', imgt_aligned = True)
+    tr.infer_cdrs_from_v_gene(chain = 'beta',  imgt_aligned = True)
+    tr.index_cols = ['clone_id', 'cdr3_a_aa', 'cdr1_a_aa', 'cdr2_a_aa', 'pmhc_a_aa',
+                     'cdr3_b_aa', 'cdr1_b_aa', 'cdr2_b_aa', 'pmhc_b_aa',
+                     'v_a_gene', 'v_b_gene']
+    tr.deduplicate()
+    tr._tcrdist_legacy_method_alpha_beta(processes = 1)
+    expected = tr.paired_tcrdist.copy()
+    tr._tcrdist_legacy_method_alpha_beta(processes = 1, engine = "numpy")
+    assert np.all(tr.paired_tcrdist == expected)
+
+def _legacy_alpha_beta_tcrrep(n = 60, storage = "dense"):
+    tr = TCRrep(cell_df = test_df.iloc[0:n].copy(), organism = "mouse", storage = storage)
+    tr.infer_cdrs_from_v_gene(chain = 'alpha', imgt_aligned = True)
+    tr.infer_cdrs_from_v_gene(chain = 'beta',  imgt_aligned = True)
+    tr.index_cols = ['clone_id', 'cdr3_a_aa', 'cdr1_a_aa', 'cdr2_a_aa', 'pmhc_a_aa',
+                     'cdr3_b_aa', 'cdr1_b_aa', 'cdr2_b_aa', 'pmhc_b_aa',
+                     'v_a_gene', 'v_b_gene']
+    tr.deduplicate()
+    return tr
+
+@pytest.mark.parametrize("replacement_weights", [{},
+                                                 {'cdr3_a_aa_pw': 3, 'cdr3_b_aa_pw': 3, 'pmhc_b_aa_pw': 0},
+                                                 {'cdr3_b_aa_pw': 2.5, 'cdr1_a_aa_pw': 0.5}])
+def test_compute_paired_tcrdist_fused_matches_compute_paired_tcrdist(replacement_weights):
+    tr = _legacy_alpha_beta_tcrrep()
+    for chain in ['alpha', 'beta']:
+        tr.compute_pairwise_all(chain = chain, metric = 'tcrdist_cdr3',
+                                compute_specific_region = 'cdr3_{}_aa'.format(chain[0]), processes = 1)
+        for region in ['cdr1', 'cdr2', 'pmhc']:
+            tr.compute_pairwise_all(chain = chain, metric = 'tcrdist_cdr1',
+                                    compute_specific_region = '{}_{}_aa'.format(region, chain[0]), processes = 1)
+    expected = tr.compute_paired_tcrdist(replacement_weights = replacement_weights)
+    fused = tr.compute_paired_tcrdist_fused(replacement_weights = replacement_weights, block_rows = 7)
+    assert fused['paired_tcrdist_weights'] == expected['paired_tcrdist_weights']
+    assert fused['paired_tcrdist'].dtype == expected['paired_tcrdist'].dtype
+    assert np.all(fused['paired_tcrdist'] == expected['paired_tcrdist'])
+    assert np.all(tr.paired_tcrdist == expected['paired_tcrdist'])
+
+def test_compute_paired_tcrdist_fused_memmap_and_condensed(tmp_path):
+    tr = _legacy_alpha_beta_tcrrep()
+    expected = tr.compute_paired_tcrdist_fused()['paired_tcrdist']
+    out = tr.compute_paired_tcrdist_fused(memmap_file = str(tmp_path / 'paired_tcrdist.npy'))['paired_tcrdist']
+    assert isinstance(out, np.memmap)
+    assert np.all(np.load(str(tmp_path / 'paired_tcrdist.npy')) == expected)
+    tr = _legacy_alpha_beta_tcrrep(storage = "condensed")
+    out = tr.compute_paired_tcrdist_fused(block_rows = 5)['paired_tcrdist']
+    assert np.all(out.toarray() == expected)
+
+@pytest.mark.parametrize("radius,replacement_weights", [(50, {}),
+                                                        (120, {'cdr3_a_aa_pw': 3, 'cdr3_b_aa_pw': 3}),
+                                                        (90.5, {'cdr3_b_aa_pw': 2.5, 'cdr1_a_aa_pw': 0.5})])
+def test_compute_sparse_tcrdist_matches_dense_within_radius(radius, replacement_weights):
+    tr = _legacy_alpha_beta_tcrrep(n = 200)
+    dense = tr.compute_paired_tcrdist_fused(replacement_weights = replacement_weights)['paired_tcrdist']
+    S = tr.compute_sparse_tcrdist(radius = radius,
+                                  replacement_weights = replacement_weights,
+                                  block_rows = 17)
+    assert S.shape == dense.shape
+    expected = (dense <= radius)
+    np.fill_diagonal(expected, False)
+    rows, cols = np.nonzero(expected)
+    assert S.nnz == expected.sum()
+    assert np.all(np.asarray(S[rows, cols]).ravel() == dense[rows, cols])
+    assert (S != S.T).nnz == 0
+
+def test_compute_sparse_tcrdist_raises_ValueError_on_negative_weight():
+    tr = _legacy_alpha_beta_tcrrep(n = 10)
+    with pytest.raises(ValueError):
+        tr.compute_sparse_tcrdist(radius = 50, replacement_weights = {'cdr3_a_aa_pw': -1})
+
+def _query_reference_tcrreps():
+    query = _legacy_alpha_beta_tcrrep(n = 40)
+    reference = TCRrep(cell_df = test_df.iloc[40:130].copy(), organism = "mouse")
+    reference.infer_cdrs_from_v_gene(chain = 'alpha', imgt_aligned = True)
+    reference.infer_cdrs_from_v_gene(chain = 'beta',  imgt_aligned = True)
+    reference.index_cols = query.index_cols
+    reference.deduplicate()
+    both = _legacy_alpha_beta_tcrrep(n = 10)
+    both.clone_df = pd.concat([query.clone_df, reference.clone_df], ignore_index = True)
+    return query, reference, both
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_compute_rect_distances_matches_square_tcrdist(processes):
+    query, reference, both = _query_reference_tcrreps()
+    m = query.clone_df.shape[0]
+    weights = {'cdr3_a_aa_pw': 3, 'cdr3_b_aa_pw': 3}
+    expected = both.compute_paired_tcrdist_fused(replacement_weights = weights)['paired_tcrdist'][:m, m:]
+    r = query.compute_rect_distances(reference, weights = weights, processes = processes, block_rows = 7)
+    assert r['paired_tcrdist'].shape == (m, reference.clone_df.shape[0])
+    assert np.all(r['paired_tcrdist'] == expected)
+    assert r['paired_tcrdist_weights']['cdr3_b_aa_pw'] == 3
+    both.compute_pairwise_all(chain = "beta", metric = "tcrdist_cdr3",
+                              compute_specific_region = "cdr3_b_aa", processes = 1)
+    assert np.all(r['cdr3_b_aa_pw'] == both.cdr3_b_aa_pw[:m, m:])
+
+def test_compute_rect_distances_pwseqdist_engine():
+    query, reference, both = _query_reference_tcrreps()
+    m = query.clone_df.shape[0]
+    r = query.compute_rect_distances(reference.clone_df, chains = ['beta'], engine = "pwseqdist")
+    expected = query.compute_rect_distances(reference, chains = ['beta'])
+    assert np.all(r['paired_tcrdist'] == expected['paired_tcrdist'])
+    r = query.compute_rect_distances(reference, chains = ['beta'], metric = "nw",
+                                     engine = "pwseqdist", weights = {'cdr1_b_aa_pw': 0,
+                                                                      'cdr2_b_aa_pw': 0,
+                                                                      'pmhc_b_aa_pw': 0})
+    both.compute_pairwise_all(chain = "beta", metric = "nw",
+                              compute_specific_region = "cdr3_b_aa", processes = 1)
+    assert np.all(r['paired_tcrdist'] == both.cdr3_b_aa_pw[:m, m:])
+    with pytest.raises(ValueError):
+        query.compute_rect_distances(reference, metric = "nw")
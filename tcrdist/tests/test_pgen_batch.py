@@ -0,0 +1,59 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from tcrdist import pgen
+from tcrdist.repertoire import TCRrep
+from tcrdist.tests.test_pgen import human_b
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path))
+    pgen._pgen_lru.clear()
+    yield os.path.join(str(tmp_path), 'pgen')
+    pgen._pgen_lru.clear()
+
+@pytest.fixture(scope = "module")
+def beta_model():
+    return pgen.OlgaModel(chain_folder = 'human_T_beta', recomb_type = "VDJ")
+
+def test_batch_pgens_match_sequential_with_duplicates(cache_dir, beta_model):
+    df = pd.concat([human_b.iloc[:20], human_b.iloc[:20]]).reset_index(drop = True)
+    r = beta_model.compute_aa_cdr3_pgens_batch(df.cdr3_b_aa, df.v_b_gene, df.j_b_gene, use_cache = False)
+    assert np.allclose(r, df.cdr3_b_aa_pgen_vj)
+    assert r[:20] == r[20:]
+    assert not os.path.exists(cache_dir)
+
+def test_batch_pgens_in_parallel_preserve_order(cache_dir, beta_model):
+    df = human_b.iloc[:30]
+    r = beta_model.compute_aa_cdr3_pgens_batch(df.cdr3_b_aa, None, None,
+                                               processes = 2, chunk_size = 7, use_cache = False)
+    assert np.allclose(r, df.cdr3_b_aa_pgen_naive)
+
+def test_batch_pgens_are_read_from_disk_cache(cache_dir, beta_model):
+    df = human_b.iloc[:10]
+    first = beta_model.compute_aa_cdr3_pgens_batch(df.cdr3_b_aa, df.v_b_gene, df.j_b_gene)
+    assert os.listdir(cache_dir) == ['{}.sqlite'.format(beta_model.model_key())]
+    pgen._pgen_lru.clear()
+    # a cache hit never calls the model
+    beta_model.compute_aa_cdr3_pgen = None
+    try:
+        second = beta_model.compute_aa_cdr3_pgens_batch(df.cdr3_b_aa, df.v_b_gene, df.j_b_gene)
+    finally:
+        del beta_model.compute_aa_cdr3_pgen
+    assert second == first
+    assert np.allclose(second, df.cdr3_b_aa_pgen_vj)
+    pgen.clear_pgen_cache()
+    assert os.listdir(cache_dir) == []
+
+def test_model_key_depends_on_model():
+    alpha = pgen.OlgaModel(chain_folder = 'human_T_alpha', recomb_type = "VJ")
+    beta = pgen.OlgaModel(chain_folder = 'human_T_beta', recomb_type = "VDJ")
+    assert alpha.model_key() != beta.model_key()
+
+def test_TCRrep_infer_olga_aa_cdr3_pgens_with_processes(cache_dir):
+    tr = TCRrep(cell_df = human_b.iloc[:20].copy(), organism = "human", chains = ["beta"])
+    tr.clone_df = tr.cell_df
+    r = tr.infer_olga_aa_cdr3_pgens(chain = "beta", processes = 2)
+    assert np.allclose(r, human_b.cdr3_b_aa_pgen_vj.iloc[:20])
+    assert np.allclose(tr.clone_df.cdr3_b_aa_pgen, human_b.cdr3_b_aa_pgen_vj.iloc[:20])
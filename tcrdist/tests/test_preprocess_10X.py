@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+from tcrdist import preprocess_10X
+
+_cdr3s = ['CAVRDSNYQLIW', 'CASSPLAGYAADTQYF', 'CATSDPGQGGYEQYF', 'CAGQASQGNLIF', 'CASS']
+_chains = {'TRA' : (['TRAV1-2', 'TRAV12-1*01', 'TRAV14DV4', 'TRAVX'], ['TRAJ33', 'TRAJ42*01', 'TRAJ12']),
+           'TRB' : (['TRBV5-1*01', 'TRBV28', 'TRBV19'], ['TRBJ2-3*01', 'TRBJ2-7', 'TRBJ1-2']),
+           'TRG' : (['TRGV9'], ['TRGJP'])}
+
+def _write_10X(prefix, n_clonotypes):
+    """consensus and filtered contig annotations with deterministic but irregular content"""
+    consensus, contigs = [], []
+    for i in range(n_clonotypes):
+        clonotype = 'clonotype{}'.format(i + 1)
+        for k in range(1 + (i * 7) % 4):
+            ch = ['TRA', 'TRB', 'TRG', 'TRB', 'TRA'][(i + k * 3) % 5]
+            vs, js = _chains[ch]
+            # a repeated chain now and then
+            s = (i * 13 + k * 5) % 11 if k < 3 else (i * 13 + 5) % 11
+            consensus.append(dict(clonotype_id = clonotype, chain = ch, v_gene = vs[s % len(vs)],
+                                  j_gene = js[s % len(js)], productive = (i + k) % 6 != 0,
+                                  cdr3 = _cdr3s[s % len(_cdr3s)], cdr3_nt = 'TGTGCC' * (4 + s),
+                                  umis = 1 + (i * k + s) % 4))
+        for b in range(1 + i % 3):
+            contigs.append(dict(barcode = 'BC{}-{}'.format(i, b), raw_clonotype_id = clonotype, productive = True))
+            contigs.append(dict(barcode = 'BC{}-{}'.format(i, b), raw_clonotype_id = clonotype, productive = True))
+        contigs.append(dict(barcode = 'BCX{}'.format(i), raw_clonotype_id = None, productive = False))
+    ca, fca = prefix + '_consensus_annotations.csv', prefix + '_filtered_contig_annotations.csv'
+    pd.DataFrame(consensus).to_csv(ca, index = False)
+    pd.DataFrame(contigs).to_csv(fca, index = False)
+    return fca, ca
+
+@pytest.fixture
+def files_10X(tmp_path):
+    return _write_10X(str(tmp_path / 'sample'), 200)
+
+@pytest.mark.parametrize('allow_unknown_genes', [False, True])
+def test_get_10X_clones_matches_dict_implementation(files_10X, allow_unknown_genes):
+    fca, ca = files_10X
+    df = preprocess_10X.get_10X_clones('human', fca, ca, allow_unknown_genes = allow_unknown_genes)
+    clonotype2tcrs, clonotype2barcodes = preprocess_10X._read_tcr_data('human', fca, ca, False, allow_unknown_genes)
+    expected = preprocess_10X._make_clones_df('human', clonotype2tcrs, clonotype2barcodes)
+    assert df.shape[0] > 20
+    assert df.v_a_gene.str.contains('/DV').any()
+    pd.testing.assert_frame_equal(df, expected)
+
+def test_get_10X_clones_from_samples(tmp_path):
+    samples = {s : _write_10X(str(tmp_path / s), n) for s, n in [('s1', 50), ('s2', 120), ('s3', 80)]}
+    for processes in [1, 2]:
+        df = preprocess_10X.get_10X_clones_from_samples('human', samples, processes = processes)
+        assert df.columns[-1] == 'sample'
+        expected = [preprocess_10X.get_10X_clones('human', *samples[s]).assign(sample = s) for s in samples]
+        pd.testing.assert_frame_equal(df, pd.concat(expected, ignore_index = True))
+    df = preprocess_10X.get_10X_clones_from_samples('human', {})
+    assert df.shape[0] == 0
+    assert list(df.columns) == list(expected[0].columns)
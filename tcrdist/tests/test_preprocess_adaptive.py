@@ -0,0 +1,106 @@
+import os
+import pandas as pd
+import pytest
+from tcrdist import preprocess_adaptive
+
+_rows = [
+    dict(nucleotide = 'CTGCTGCTGAGTCGCCCAGACCCTGCTGTGTTCCTCTGTGCCAGCAGTTTATCCTGGTACAACACCGGGGAGCTGTTTTTTGGAGAAGGC',
+         aminoAcid = 'CASSLSWYNTGELFF', vIndex = '33', jIndex = '60',
+         vMaxResolved = 'TCRBV27-01*01', vGeneName = 'TCRBV27-01',
+         jMaxResolved = 'TCRBJ02-02*01', jGeneName = 'TCRBJ02-02'),
+    dict(nucleotide = 'ATCCAGCCCTCAGAACCCAGGGACTCAGCTGTGTACTTCTGTGCCAGCAGCTTAGGACAGACCAACACTGAAGCTTTCTTTGGACAAGGC',
+         aminoAcid = 'CASSLGQTNTEAFF', vIndex = '39', jIndex = '62',
+         vMaxResolved = 'TCRBV12', vGeneNameTies = 'TCRBV12-03,TCRBV12-04',
+         jMaxResolved = 'TCRBJ01-01*01', jGeneName = 'TCRBJ01-01'),
+    dict(nucleotide = 'GGCTGCTGTCGGCTGCTCCCTCCCAGACATCTGTGTACTTCTGTGCCAGTAGTATAGCGGGGGGCGAGCAGTACTTCGGGCCG',
+         aminoAcid = 'CASSIAGGEQYF', vIndex = '36', jIndex = '55',
+         vMaxResolved = 'TCRBV19-01', vGeneName = 'TCRBV19-01',
+         jMaxResolved = 'TCRBJ02-07*01', jGeneName = 'TCRBJ02-07'),
+    dict(nucleotide = 'GGCTGCTGTCGGCTGCTCCCTCCCAGACATCTGTGTACTTCTG', aminoAcid = '', vIndex = '-1', jIndex = '55',
+         vMaxResolved = 'TCRBV06', vGeneNameTies = 'TCRBV06-01,TCRBV06-05',
+         jMaxResolved = 'TCRBJ02', jGeneNameTies = 'TCRBJ02-01,TCRBJ02-07')]
+
+# v_b_gene, vb_countreps, j_b_gene, jb_countreps, cdr3_b_aa, cdr3_b_nucseq
+_expected = [
+    ['TRBV27*01', 'TRBV27-1', 'TRBJ2-2*01', 'TRBJ02-2', 'CASSLSWYNTGELFF', 'CTCTGTGCCAGCAGTTTATCCTGGTACAACACCGGGGAGCTGTTT'],
+    ['TRBV12-3*01', 'TRBV12-3', 'TRBJ1-1*01', 'TRBJ01-1', 'CASSLGQTNTEAFF', 'TGTGCCAGCAGCTTAGGACAGACCAACACTGAAGCTTTCTTT'],
+    ['TRBV19*01', 'TRBV19-1', 'TRBJ2-7*01', 'TRBJ02-7', 'CASSIAGGEQYF', 'ACTTCTGTGCCAGTAGTATAGCGGGGGGCGAGCAGT'],
+    ['TRBV6-1*01', 'TRBV6-1', 'TRBJ2-1*01', 'TRBJ02-1', '', 'G']]
+
+def _write_immunoseq(path, n):
+    fields = preprocess_adaptive.adaptive._fields
+    with open(path, 'w') as fh:
+        fh.write('\t'.join(fields) + '\textra (x)\n')
+        for i in range(n):
+            row = dict.fromkeys(fields, '')
+            row.update(_rows[i % len(_rows)], count = str(i + 1), jFunction = 'null')
+            fh.write('\t'.join(row[f] for f in fields) + '\t0\n')
+    return path
+
+@pytest.fixture
+def immunoseq_file(tmp_path):
+    return _write_immunoseq(str(tmp_path / 'subject1.tsv'), 10)
+
+def test_parse_immunoseq(immunoseq_file):
+    df = preprocess_adaptive.parse_immunoseq(immunoseq_file, organism = 'human')
+    assert list(df.columns) == preprocess_adaptive.cell_df_columns
+    assert df.id.tolist() == list(range(10))
+    assert (df.subject == immunoseq_file.replace('.tsv', '')).all()
+    assert df.iloc[:, 2:].values.tolist() == [_expected[i % 4] for i in range(10)]
+
+def test_iter_immunoseq_chunks(immunoseq_file):
+    chunks = list(preprocess_adaptive.iter_immunoseq(immunoseq_file, 'human', subject = 'S1', chunksize = 3))
+    assert [c.shape[0] for c in chunks] == [3, 3, 3, 1]
+    df = pd.concat(chunks, ignore_index = True)
+    expected = preprocess_adaptive.parse_immunoseq(immunoseq_file, 'human', subject = 'S1')
+    pd.testing.assert_frame_equal(df, expected)
+
+def test_cdr3_nucseqs_match_per_row_slicing():
+    nuc = pd.Series(['ACGTACGTAC', 'ACG', '', 'ACGTACGTACGTACGT']).values
+    aa = pd.Series(['CA', 'CASS', '', 'C']).values
+    for vIndex, jIndex in [('2', '5'), ('-1', '8'), ('-20', '30'), ('7', '3'), ('40', '-4')]:
+        vi = pd.Series([vIndex] * 4).values
+        ji = pd.Series([jIndex] * 4).values
+        assert preprocess_adaptive._cdr3_nucseqs(nuc, aa, vi, ji) == \
+            [preprocess_adaptive._cdr3_nucseq(*r) for r in zip(nuc, aa, vi, ji)]
+
+def test_invalid_header_raises(tmp_path):
+    path = str(tmp_path / 'bad.tsv')
+    with open(path, 'w') as fh:
+        fh.write('nucleotide\tcdr3\n')
+    with pytest.raises(ValueError):
+        list(preprocess_adaptive.iter_immunoseq(path, 'human'))
+
+def test_parse_immunoseq_files_in_parallel(tmp_path):
+    files = [_write_immunoseq(str(tmp_path / 's{}.tsv'.format(i)), 5 + i) for i in range(3)]
+    results = preprocess_adaptive.parse_immunoseq_files(files, 'human', subjects = ['a', 'b', 'c'], processes = 2)
+    for f, s, df in zip(files, ['a', 'b', 'c'], results):
+        pd.testing.assert_frame_equal(df, preprocess_adaptive.parse_immunoseq(f, 'human', subject = s))
+
+def test_immunoseq_to_parquet(tmp_path, immunoseq_file):
+    pytest.importorskip('pyarrow')
+    out = preprocess_adaptive.parse_immunoseq_files([immunoseq_file], 'human', chunksize = 4,
+                                                    parquet_dir = str(tmp_path / 'parquet'))
+    assert out == [str(tmp_path / 'parquet' / 'subject1')]
+    assert sorted(os.listdir(out[0])) == ['part-00000.parquet', 'part-00001.parquet', 'part-00002.parquet']
+    pd.testing.assert_frame_equal(pd.read_parquet(out[0]), preprocess_adaptive.parse_immunoseq(immunoseq_file, 'human'))
+
+def test_header_only_file_parses_to_empty_cell_df(tmp_path):
+    empty = _write_immunoseq(str(tmp_path / 'empty.tsv'), 0)
+    assert list(preprocess_adaptive.iter_immunoseq(empty, 'human')) == []
+    df = preprocess_adaptive.parse_immunoseq(empty, 'human')
+    assert df.shape[0] == 0
+    assert list(df.columns) == preprocess_adaptive.cell_df_columns
+    files = [empty, _write_immunoseq(str(tmp_path / 's1.tsv'), 5)]
+    for processes in [1, 2]:
+        results = preprocess_adaptive.parse_immunoseq_files(files, 'human', processes = processes)
+        assert [r.shape[0] for r in results] == [0, 5]
+        assert list(results[0].columns) == preprocess_adaptive.cell_df_columns
+
+def test_header_only_file_to_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    empty = _write_immunoseq(str(tmp_path / 'empty.tsv'), 0)
+    out = preprocess_adaptive.parse_immunoseq_files([empty], 'human', parquet_dir = str(tmp_path / 'parquet'))
+    df = pd.read_parquet(out[0])
+    assert df.shape[0] == 0
+    assert list(df.columns) == preprocess_adaptive.cell_df_columns
@@ -1,4 +1,6 @@
 import unittest
+import types
+import pytest
 import os.path as op
 import inspect
 import pandas as pd
@@ -199,5 +201,40 @@ class test_proximity(unittest.TestCase):
 
         assert round(res['auc'], 7) == 0.8582996
 
+def _legacy_nn_scores(prox):
+    """nn_score computed one TCR at a time, as before the vectorized _calc_nn_scores"""
+    prox_df = prox.prox_df
+    ind_only_epitope = prox_df.index[prox_df['epitope_group'] == prox.target_epitope]
+    scores = {}
+    for ind_TCR, row in prox_df.iterrows():
+        if prox.subjects_folds is None:
+            ind_non_subject = prox_df.index[prox_df['subject'] != row['subject']]
+        else:
+            subject_fold = prox._find_subjects_fold(row['subject'])
+            ind_non_subject = prox_df.index[prox_df['subject'].isin(prox._subjects_in_other_folds_to_list(subject_fold))]
+        distances = prox.dist_matrix[ind_TCR, ind_only_epitope.intersection(ind_non_subject)]
+        scores[ind_TCR] = prox._sort_and_compute_weighted_nbrdist_from_distances(distances)
+    return pd.Series(scores)
+
+def _fake_tcrrep(n, dtype, seed = 0):
+    rng = np.random.RandomState(seed)
+    clone_df = pd.DataFrame({'epitope' : rng.choice(['M1', 'BMLF', 'NP', 'PA'], n),
+                             'subject' : rng.choice(['s1', 's2', 's3', 's4', 's5', None], n)})
+    x = rng.randint(0, 200, size = (n, n))
+    return types.SimpleNamespace(clone_df = clone_df, cdr3_b_aa_pw = np.minimum(x, x.T).astype(dtype))
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float32, np.float64])
+@pytest.mark.parametrize('nn_percentile', [10, 50, 150, -1, -7, -1000])
+@pytest.mark.parametrize('subjects_folds', [None, {0 : ['s1', 's2'], 1 : ['s3'], 2 : ['s4', 's5']}])
+def test_vectorized_nn_scores_match_legacy(dtype, nn_percentile, subjects_folds):
+    tr = _fake_tcrrep(300, dtype)
+    prox = TCRproximity(tr, 'M1', ['BMLF', 'NP'], nn_percentile, chain = 'beta', cdrs = 'cdr3',
+                        subjects_folds = subjects_folds)
+    expected = _legacy_nn_scores(prox)
+    assert prox.prox_df['nn_score'].tolist() == expected[prox.prox_df.index].tolist()
+    # small blocks give the same scores
+    prox._calc_nn_scores(block_size = 50)
+    assert prox.prox_df['nn_score'].tolist() == expected[prox.prox_df.index].tolist()
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+from tcrdist import distances
+from tcrdist import tcr_distances
+from tcrdist.objects import DistanceParams
+from tcrdist.reference_index import ReferenceIndex
+from tcrdist.tests.legacy_truth_values import test_df
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path / 'cache'))
+
+def _clones():
+    df = test_df[['cdr3_a_aa', 'v_a_gene', 'cdr3_b_aa', 'v_b_gene']].copy()
+    df['organism'] = 'mouse'
+    df = df.rename(columns = {'cdr3_a_aa' : 'cdr3a', 'v_a_gene' : 'va_reps',
+                              'cdr3_b_aa' : 'cdr3b', 'v_b_gene' : 'vb_reps'})
+    df.index = ['clone{}'.format(i) for i in range(df.shape[0])]
+    return df
+
+def _expected(chains, tcr, references):
+    params = DistanceParams()
+    VRegionDists = tcr_distances.compute_all_v_region_distances(organism = 'mouse', params = params)
+    return np.array([distances.basicDistance(chains, tcr, references.iloc[i], VRegionDists = VRegionDists, params = params)
+                     for i in range(references.shape[0])])
+
+@pytest.mark.parametrize("chains", ['A', 'B', 'AB'])
+def test_ReferenceIndex_queries_match_basicDistance(cache_dir, chains):
+    clones = _clones()
+    references = clones.iloc[20:]
+    index = ReferenceIndex.build(references, chains = chains)
+    for q in range(3):
+        tcr = clones.iloc[q]
+        expected = _expected(chains, tcr, references)
+        radius = np.sort(expected)[25]
+        ids, dists = index.query_radius(tcr, radius = radius)
+        assert set(ids) == set(references.index[expected <= radius])
+        assert np.all(dists == expected[references.index.get_indexer(ids)])
+        ids, dists = index.query_knn(tcr, k = 7)
+        assert np.all(dists == np.sort(expected)[:7])
+        assert np.all(expected[references.index.get_indexer(ids)] == dists)
+        for weighted in [False, True]:
+            allD = np.sort(expected)[:5]
+            weights = 1. - np.arange(5)/5
+            d = allD.mean() if not weighted else np.sum(allD * weights) / weights.sum()
+            assert np.isclose(index.nearest_neighbor_distance(tcr, neighborTopN = 5, weighted = weighted), d)
+
+def test_ReferenceIndex_save_and_load(cache_dir, tmp_path):
+    clones = _clones()
+    # tcrdist2 column names, e.g. from mappers.vdjdb_to_tcrdist2
+    references = test_df.iloc[20:].copy()
+    index = ReferenceIndex.build(references, chains = 'AB', organism = 'mouse')
+    index.save(str(tmp_path / 'index'))
+    loaded = ReferenceIndex.load(str(tmp_path / 'index'))
+    assert isinstance(loaded.arrays['cdr3_codes_A'], np.memmap)
+    assert len(loaded) == len(index)
+    for q in range(3):
+        ids, dists = index.query_knn(clones.iloc[q], k = 10)
+        loaded_ids, loaded_dists = loaded.query_knn(clones.iloc[q], k = 10)
+        assert np.all(ids == loaded_ids)
+        assert np.all(dists == loaded_dists)
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse
+from tcrdist import rmf
+
+def _legacy_nbrs(dist_df, nbr_distance):
+    """neighbor lists as built row by row before neighbor_csr"""
+    all_nbrs = []
+    for ind, row in dist_df.iterrows():
+        all_nbrs.append([ii for ii, d in enumerate(float(x) for x in row.to_list()) if d <= nbr_distance])
+    return all_nbrs
+
+def _dist_df(n, seed = 0):
+    rng = np.random.RandomState(seed)
+    x = rng.randint(0, 300, size = (n, n))
+    x = np.minimum(x, x.T)
+    np.fill_diagonal(x, 0)
+    return pd.DataFrame(x)
+
+@pytest.mark.parametrize('block_rows', [None, 1, 7, 1000])
+@pytest.mark.parametrize('nbr_distance', [-1, 0, 50, 100.0, 1000])
+def test_neighbor_lists_match_legacy(block_rows, nbr_distance):
+    df = _dist_df(120)
+    all_nbrs = rmf.generate_all_nbr_from_dataframe(df, nbr_distance, block_rows = block_rows)
+    expected = _legacy_nbrs(df, nbr_distance)
+    assert all_nbrs == expected
+    assert list(all_nbrs) == expected
+    assert all_nbrs[-1] == expected[-1] and all_nbrs[3:5] == expected[3:5]
+    assert all_nbrs.indptr[-1] == len(all_nbrs.indices) == sum(len(x) for x in expected)
+
+def test_neighbor_csr_from_sparse_radius_matrix():
+    df = _dist_df(80, seed = 1)
+    x = df.values.astype(float)
+    i, j = np.nonzero(np.triu(x <= 120, k = 1))
+    # as TCRrep.compute_sparse_tcrdist: pairs within the radius, diagonal not stored
+    S = scipy.sparse.csr_matrix((np.concatenate([x[i, j], x[j, i]]),
+                                 (np.concatenate([i, j]), np.concatenate([j, i]))), shape = x.shape)
+    for nbr_distance in [0, 60, 120]:
+        indptr, indices = rmf.neighbor_csr(S, nbr_distance)
+        assert rmf.NeighborLists(indptr, indices) == _legacy_nbrs(df, nbr_distance)
@@ -0,0 +1,67 @@
+import random
+import collections
+import pytest
+import numpy as np
+from tcrdist import tcr_sampler
+from tcrdist.genetic_code import genetic_code
+
+genes = [('human', 'TRAV12-2*01', 'TRAJ42*01'),
+         ('human', 'TRBV19*01', 'TRBJ2-7*01'),
+         ('human', 'TRBV19*01', 'TRBJ1-2*01'),
+         ('mouse', 'TRBV13-1*01', 'TRBJ2-3*01')]
+
+def _translate(nucseq):
+    return ''.join(genetic_code[nucseq[3*i:3*i+3]] for i in range(len(nucseq)//3))
+
+@pytest.mark.parametrize("organism,v_gene,j_gene", genes)
+def test_batch_sampler_returns_productive_annotated_cdr3s(organism, v_gene, j_gene):
+    seqs = tcr_sampler.sample_tcr_sequences(organism, 2000, v_gene, j_gene, include_annotation = True, seed = 1)
+    v_nucseq = tcr_sampler.get_v_cdr3_nucseq(organism, v_gene)
+    j_nucseq = tcr_sampler.get_j_cdr3_nucseq(organism, j_gene)
+    assert len(seqs) == 2000
+    for nucseq, protseq, annotation in seqs:
+        assert len(nucseq) % 3 == 0
+        assert len(annotation) == len(nucseq)
+        assert protseq == _translate(nucseq)
+        assert '*' not in protseq
+        nv = annotation.count('V')
+        nj = annotation.count('J')
+        assert nucseq[:nv] == v_nucseq[:nv]
+        assert nucseq[len(nucseq)-nj:] == j_nucseq[len(j_nucseq)-nj:]
+
+@pytest.mark.parametrize("organism,v_gene,j_gene", genes)
+def test_batch_sampler_forced_length_and_out_of_frame(organism, v_gene, j_gene):
+    seqs = tcr_sampler.sample_tcr_sequences(organism, 500, v_gene, j_gene, force_aa_length = 13, seed = 2)
+    assert len(seqs) == 500
+    assert all(len(protseq) == 13 for _, protseq in seqs)
+    seqs = tcr_sampler.sample_tcr_sequences(organism, 3000, v_gene, j_gene, in_frame_only = False,
+                                            no_stop_codons = False, seed = 3)
+    assert {len(nucseq) % 3 for nucseq, _ in seqs} == {0, 1, 2}
+    assert all(protseq == _translate(nucseq) for nucseq, protseq in seqs)
+
+def test_batch_sampler_is_seeded():
+    a = tcr_sampler.sample_tcr_sequences('human', 100, 'TRBV19*01', 'TRBJ2-7*01', seed = 7)
+    assert a == tcr_sampler.sample_tcr_sequences('human', 100, 'TRBV19*01', 'TRBJ2-7*01', seed = 7)
+    random.seed(1)
+    b = tcr_sampler.sample_tcr_sequences('human', 100, 'TRBV19*01', 'TRBJ2-7*01')
+    random.seed(1)
+    assert b == tcr_sampler.sample_tcr_sequences('human', 100, 'TRBV19*01', 'TRBJ2-7*01')
+
+def test_batch_sampler_respects_max_tries():
+    assert tcr_sampler.sample_tcr_sequences('human', 5, 'TRBV19*01', 'TRBJ2-7*01',
+                                            force_aa_length = 40, max_tries = 5000) == []
+
+@pytest.mark.parametrize("organism,v_gene,j_gene", genes[:2])
+def test_batch_sampler_matches_per_draw_sampler_distribution(organism, v_gene, j_gene):
+    random.seed(1)
+    n = 20000
+    a = tcr_sampler.sample_tcr_sequences(organism, n, v_gene, j_gene, include_annotation = True,
+                                         vectorized = False)
+    b = tcr_sampler.sample_tcr_sequences(organism, n, v_gene, j_gene, include_annotation = True, seed = 1)
+    for stat in [lambda x: len(x[1]), lambda x: x[2].count('N'), lambda x: x[2].count('V')]:
+        ca = collections.Counter(stat(x) for x in a)
+        cb = collections.Counter(stat(x) for x in b)
+        keys = sorted(set(ca) | set(cb))
+        pa = np.array([ca[k] for k in keys]) / n
+        pb = np.array([cb[k] for k in keys]) / n
+        assert np.abs(pa - pb).max() < 0.02
@@ -0,0 +1,39 @@
+import os
+import pytest
+import numpy as np
+from tcrdist import tcr_distances
+from tcrdist import v_region_cache
+from tcrdist.objects import DistanceParams
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('TCRDIST_CACHE_DIR', str(tmp_path))
+    return v_region_cache.cache_dir()
+
+@pytest.mark.parametrize("config_string", [None, "gap_penalty_v_region:3,weight_v_region:2"])
+def test_cached_v_region_distances_match_uncached(cache_dir, config_string):
+    params = DistanceParams(config_string)
+    expected = tcr_distances.compute_all_v_region_distances('human', params, use_cache = False)
+    first = tcr_distances.compute_all_v_region_distances('human', params)
+    second = tcr_distances.compute_all_v_region_distances('human', params)
+    assert first == expected
+    assert second == expected
+    assert list(second.keys()) == list(expected.keys())
+
+def test_load_v_region_tables_returns_memory_map_when_cached(cache_dir):
+    v_region_cache.load_v_region_tables('mouse')
+    tables = v_region_cache.load_v_region_tables('mouse')
+    ids, dists = tables['B']
+    assert isinstance(dists, np.memmap)
+    assert dists.shape == (len(ids), len(ids))
+
+def test_cache_key_depends_on_params():
+    assert v_region_cache.cache_key('human') == v_region_cache.cache_key('human', DistanceParams())
+    assert v_region_cache.cache_key('human') != v_region_cache.cache_key('mouse')
+    assert v_region_cache.cache_key('human') != v_region_cache.cache_key('human', DistanceParams("gap_penalty_v_region:3"))
+
+def test_prewarm_and_clear(cache_dir):
+    v_region_cache.prewarm(organisms = ['human'])
+    assert len(os.listdir(cache_dir)) == 4
+    v_region_cache.clear()
+    assert not os.path.exists(cache_dir)
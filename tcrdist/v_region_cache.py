@@ -0,0 +1,197 @@
+"""
+Persistent on-disk cache of V-region distance tables
+
+tcr_distances.compute_all_v_region_distances() scores every pair of V genes
+of an organism, which is repeated by every call to distances.basicDistance,
+computeBasicPWDistances and nearestNeighborDistance made without
+VRegionDists, and again in every worker process. Here the tables are
+computed once, stored as .npy files under a user cache directory and loaded
+via memory map, so all processes on a node share one copy.
+
+Files are content addressed: the name is a hash of the organism, the checksum
+of the reference db file and the DistanceParams fields that enter the V-region
+distance (weight_v_region, gap_penalty_v_region and distance_matrix).
+
+The tables live in the v_region/ subdirectory of paths.path_to_user_cache()
+($TCRDIST_CACHE_DIR, $XDG_CACHE_HOME/tcrdist or ~/.cache/tcrdist).
+
+"""
+import hashlib
+import logging
+import os
+import os.path as op
+import shutil
+import tempfile
+
+import numpy as np
+
+from .objects import DistanceParams
+from .paths import path_to_db, db_file, path_to_user_cache
+from . import pairwise_numpy
+
+logger = logging.getLogger('v_region_cache.py')
+
+_db_checksums = {}
+
+
+def cache_dir():
+    """
+    Returns
+    -------
+    path : string
+        directory holding the cached V-region tables
+    """
+    return path_to_user_cache('v_region')
+
+
+def _db_checksum(path):
+    """
+    sha1 of the reference db file, memoized on (path, mtime, size)
+    """
+    st = os.stat(path)
+    memo_key = (path, st.st_mtime, st.st_size)
+    if memo_key not in _db_checksums:
+        h = hashlib.sha1()
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                h.update(chunk)
+        _db_checksums[memo_key] = h.hexdigest()
+    return _db_checksums[memo_key]
+
+
+def cache_key(organism, params = None, db_path = None):
+    """
+    Content address of the V-region tables for organism and params
+
+    Parameters
+    ----------
+    organism : string
+        "human" or "mouse"
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+    db_path : string
+        path to the reference db file, by default the file all_genes.py
+        reads (paths.db_file)
+
+    Returns
+    -------
+    key : string
+        hex digest
+    """
+    if params is None:
+        params = DistanceParams()
+    if db_path is None:
+        db_path = op.join(path_to_db, db_file)
+    h = hashlib.sha1()
+    h.update(repr((organism,
+                   _db_checksum(db_path),
+                   float(params.weight_v_region),
+                   float(params.gap_penalty_v_region),
+                   tuple(sorted(params.distance_matrix.items())))).encode())
+    return h.hexdigest()
+
+
+def _compute_tables(organism, params):
+    """
+    Same distances as tcr_distances.compute_all_v_region_distances, computed
+    with the vectorized lookup table of pairwise_numpy.
+    """
+    from .all_genes import all_genes
+    table = pairwise_numpy.distance_table(params, gap_penalty = params.gap_penalty_v_region)
+    tables = {}
+    for chain in 'AB': # don't compute inter-chain distances
+        ids = []
+        loopseqs = []
+        for id, g in all_genes[organism].items():
+            if g.chain == chain and g.region == 'V':
+                ids.append(id)
+                # blosum_sequence_distance skips the ' ' between loops
+                loopseqs.append(''.join(g.cdrs[:-1]))
+        codes, _, _ = pairwise_numpy.encode_sequences(loopseqs)
+        dists = params.weight_v_region * pairwise_numpy.blosum_distance_sum(codes, codes, table)
+        tables[chain] = (np.array(ids, dtype = str), dists)
+    return tables
+
+
+def _save_atomic(path, arr):
+    """
+    np.save to a temporary file in the cache directory then rename, so
+    concurrent processes never see a partially written file
+    """
+    fd, tmp = tempfile.mkstemp(dir = op.dirname(path), suffix = '.npy.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            np.save(fh, arr)
+        os.replace(tmp, path)
+    except:
+        if op.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_v_region_tables(organism, params = None):
+    """
+    V-region distance tables for organism, from the cache when present.
+
+    Parameters
+    ----------
+    organism : string
+        "human" or "mouse"
+    params : objects.DistanceParams instance
+        class containing default parameters for alignment scoring.
+
+    Returns
+    -------
+    tables : dict
+        maps chain ('A' or 'B') to a tuple (ids, dists), where ids is an
+        array of V gene ids and dists a read-only memory mapped
+        (n_genes x n_genes) float64 array
+    """
+    if params is None:
+        params = DistanceParams()
+    key = cache_key(organism, params)
+    paths = {chain : (op.join(cache_dir(), '{}_{}_ids.npy'.format(key, chain)),
+                      op.join(cache_dir(), '{}_{}_dists.npy'.format(key, chain))) for chain in 'AB'}
+    try:
+        return {chain : (np.load(ids_path), np.load(dists_path, mmap_mode = 'r'))
+                for chain, (ids_path, dists_path) in paths.items()}
+    except (IOError, ValueError):
+        pass
+
+    tables = _compute_tables(organism, params)
+    try:
+        os.makedirs(cache_dir(), exist_ok = True)
+        for chain, (ids, dists) in tables.items():
+            ids_path, dists_path = paths[chain]
+            _save_atomic(ids_path, ids)
+            _save_atomic(dists_path, dists)
+    except OSError as e:
+        logger.warning('V-region distances could not be cached in {}: {}'.format(cache_dir(), e))
+    return tables
+
+
+def prewarm(organisms = ('human', 'mouse'), params = None):
+    """
+    Compute and store the V-region tables ahead of time (e.g. before
+    starting a pool of workers)
+
+    Parameters
+    ----------
+    organisms : list
+        organisms to cache
+    params : objects.DistanceParams instance or list of instances
+        parameters to cache, defaults to DistanceParams()
+    """
+    if params is None or isinstance(params, dict):
+        params = [params]
+    for organism in organisms:
+        for p in params:
+            load_v_region_tables(organism, p)
+
+
+def clear():
+    """
+    Remove all cached V-region tables
+    """
+    if op.isdir(cache_dir()):
+        shutil.rmtree(cache_dir())